@@ -27,7 +27,7 @@ from rucio.common.schema import validate_schema
 from rucio.db.sqla.constants import DIDType
 
 
-def list_dids(scope, filters, type='collection', ignore_case=False, limit=None, offset=None, long=False, recursive=False):
+def list_dids(scope, filters, type='collection', ignore_case=False, limit=None, offset=None, long=False, recursive=False, marker=None):
     """
     List dids in a scope.
 
@@ -39,10 +39,11 @@ def list_dids(scope, filters, type='collection', ignore_case=False, limit=None,
     :param offset: Offset number.
     :param long: Long format option to display more information for each DID.
     :param recursive: Recursively list DIDs content.
+    :param marker: Name of the last DID of the previous page, the DIDs are listed after it.
     """
     validate_schema(name='did_filters', obj=filters)
     return did.list_dids(scope=scope, filters=filters, type=type, ignore_case=ignore_case,
-                         limit=limit, offset=offset, long=long, recursive=recursive)
+                         limit=limit, offset=offset, long=long, recursive=recursive, marker=marker)
 
 
 def add_did(scope, name, type, issuer, account=None, statuses={}, meta={}, rules=[], lifetime=None, dids=[], rse=None):
@@ -259,6 +260,16 @@ def get_metadata(scope, name):
     return did.get_metadata(scope=scope, name=name)
 
 
+def get_metadata_bulk(dids):
+    """
+    Get the metadata of a list of data identifiers.
+
+    :param dids: A list of dids [{'scope': scope, 'name': name}, ...].
+    """
+    validate_schema(name='dids', obj=dids)
+    return did.get_metadata_bulk(dids=dids)
+
+
 def get_did_meta(scope, name):
     """
     Get all metadata for a given did
@@ -0,0 +1,35 @@
+# Copyright 2019 CERN for the benefit of the ATLAS collaboration.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# PY3K COMPATIBLE
+
+from rucio.api import permission
+from rucio.common import exception
+from rucio.db.sqla.session import PROFILER
+
+
+def get_sql_profile(issuer=None):
+    """
+    Return the SQL profile of the process.
+
+    :param issuer: The issuer account.
+    :returns: Dictionary {functions: {name: stats}, endpoints: {name: stats}, slowest: [stats], n_plus_one: [patterns]}
+    """
+
+    kwargs = {'issuer': issuer}
+    if not permission.has_permission(issuer=issuer, action='get_sql_profile', kwargs=kwargs):
+        raise exception.AccessDenied('%s cannot get the SQL profile' % issuer)
+    if not PROFILER:
+        raise exception.ConfigNotFound('The SQL profiling is not enabled, set [database] profile = True')
+    return PROFILER.dump()
@@ -55,7 +55,7 @@ class DIDClient(BaseClient):
         super(DIDClient, self).__init__(rucio_host, auth_host, account, ca_cert,
                                         auth_type, creds, timeout, user_agent)
 
-    def list_dids(self, scope, filters, type='collection', long=False, recursive=False):
+    def list_dids(self, scope, filters, type='collection', long=False, recursive=False, page_size=None):
         """
         List all data identifiers in a scope which match a given pattern.
 
@@ -64,6 +64,8 @@ class DIDClient(BaseClient):
         :param type: The type of the did: 'all'(container, dataset or file)|'collection'(dataset or container)|'dataset'|'container'|'file'
         :param long: Long format option to display more information for each DID.
         :param recursive: Recursively list DIDs content.
+        :param page_size: If set, the DIDs are listed by pages of this size, sorted by name, each page being
+                          a short request resumed after the last DID of the previous one. Not supported with recursive.
         """
         path = '/'.join([self.DIDS_BASEURL, quote_plus(scope), 'dids', 'search'])
         payload = {}
@@ -78,6 +80,9 @@ class DIDClient(BaseClient):
         payload['type'] = type
         payload['recursive'] = recursive
 
+        if page_size:
+            return self.__list_dids_pages(path, payload, page_size, long)
+
         url = build_url(choice(self.list_hosts), path=path, params=payload)
 
         r = self._send_request(url, type='GET')
@@ -88,6 +93,30 @@ class DIDClient(BaseClient):
             exc_cls, exc_msg = self._get_exception(headers=r.headers, status_code=r.status_code, data=r.content)
             raise exc_cls(exc_msg)
 
+    def __list_dids_pages(self, path, payload, page_size, long):
+        """
+        Generator listing the DIDs of a search page by page.
+
+        :param path: The path of the search.
+        :param payload: The parameters of the search.
+        :param page_size: The number of DIDs per page.
+        :param long: Long format option, the DIDs are dictionaries.
+        """
+        payload = dict(payload, limit=page_size)
+        while True:
+            url = build_url(choice(self.list_hosts), path=path, params=payload)
+            r = self._send_request(url, type='GET')
+            if r.status_code != codes.ok:
+                exc_cls, exc_msg = self._get_exception(headers=r.headers, status_code=r.status_code, data=r.content)
+                raise exc_cls(exc_msg)
+            nb_dids = 0
+            for did in self._load_json_data(r):
+                nb_dids += 1
+                payload['marker'] = did['name'] if long else did
+                yield did
+            if nb_dids < page_size:
+                break
+
     def add_did(self, scope, name, type, statuses=None, meta=None, rules=None, lifetime=None, dids=None, rse=None):
         """
         Add data identifier for a dataset or container.
@@ -407,6 +436,21 @@ class DIDClient(BaseClient):
             exc_cls, exc_msg = self._get_exception(headers=r.headers, status_code=r.status_code, data=r.content)
             raise exc_cls(exc_msg)
 
+    def get_metadata_bulk(self, dids):
+        """
+        Bulk get data identifier metadata. The data identifiers which do not exist are skipped.
+
+        :param dids: A list of dids [{'scope': scope, 'name': name}, ...].
+        """
+        path = '/'.join([self.DIDS_BASEURL, 'bulkmeta'])
+        url = build_url(choice(self.list_hosts), path=path)
+        r = self._send_request(url, type='POST', data=dumps({'dids': dids}), stream=True)
+        if r.status_code == codes.ok:
+            return self._load_json_data(r)
+        else:
+            exc_cls, exc_msg = self._get_exception(headers=r.headers, status_code=r.status_code, data=r.content)
+            raise exc_cls(exc_msg)
+
     def set_metadata(self, scope, name, key, value, recursive=False):
         """
         Set data identifier metadata
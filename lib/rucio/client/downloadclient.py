@@ -34,15 +34,21 @@ import signal
 import time
 
 try:
-    from Queue import Queue, Empty, deque
+    from Queue import Queue, Empty
 except ImportError:
-    from queue import Queue, Empty, deque
-from threading import Thread
+    from queue import Queue, Empty
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+from concurrent.futures import ProcessPoolExecutor
+from threading import Condition, Thread
 
 from rucio.client.client import Client
 from rucio.common.exception import (InputValidationError, NoFilesDownloaded, NotAllFilesDownloaded, RSENotFound, RucioException)
 from rucio.common.pcache import Pcache
-from rucio.common.utils import adler32, md5, detect_client_location, generate_uuid, parse_replicas_from_string, send_trace, sizefmt, execute, parse_replicas_from_file
+from rucio.common.constants import SUPPORTED_PROTOCOLS
+from rucio.common.utils import adler32, md5, checksums, detect_client_location, generate_uuid, iter_replicas_metalink, parse_replica_json, send_trace, sizefmt, execute
 from rucio.rse import rsemanager as rsemgr
 from rucio import version
 
@@ -112,15 +118,139 @@ class BaseExtractionTool:
         return False
 
 
+class EndpointScheduler(object):
+    """
+    Limits the number of concurrent transfers per storage endpoint (scheme://host:port of the PFN)
+    and orders the sources of a file by the throughput observed on their endpoints.
+    """
+
+    def __init__(self, max_per_endpoint=0):
+        """
+        :param max_per_endpoint: maximum number of concurrent transfers per endpoint. None or 0 means unlimited
+        """
+        self.max_per_endpoint = max_per_endpoint
+        self.condition = Condition()
+        self.endpoints = {}
+        self.first_start = None
+        self.last_end = None
+
+    @staticmethod
+    def get_endpoint(source):
+        """
+        Returns the endpoint of a source
+
+        :param source: dictionary with the pfn and the rse of the source
+
+        :returns: the endpoint as string, e.g., root://eosatlas.cern.ch:1094
+        """
+        parsed = urlparse(source['pfn'])
+        if parsed.netloc:
+            return '%s://%s' % (parsed.scheme, parsed.netloc)
+        return '%s://%s' % (parsed.scheme, source.get('rse'))
+
+    def order_sources(self, sources):
+        """
+        Orders the sources within each (domain, priority) group of the server: first those whose endpoint
+        has a free transfer slot, then by observed throughput. The endpoints without observation come first
+        in their group, and the order of the server is kept for equal ones.
+
+        :param sources: list of source dictionaries, in the order of the server
+
+        :returns: the ordered list of sources
+        """
+        groups = {}
+        for source in sources:
+            groups.setdefault((source.get('domain'), source.get('priority')), len(groups))
+        with self.condition:
+            def key(source):
+                group = groups[(source.get('domain'), source.get('priority'))]
+                stats = self.endpoints.get(self.get_endpoint(source))
+                if stats is None:
+                    return (group, False, -float('inf'))
+                saturated = bool(self.max_per_endpoint) and stats['active'] >= self.max_per_endpoint
+                throughput = stats['throughput'] if stats['throughput'] is not None else float('inf')
+                return (group, saturated, -throughput)
+            return sorted(sources, key=key)
+
+    def acquire(self, endpoint):
+        """
+        Waits for a free transfer slot on the endpoint and takes it
+
+        :param endpoint: the endpoint as string
+        """
+        with self.condition:
+            stats = self.__get_stats(endpoint)
+            while self.max_per_endpoint and stats['active'] >= self.max_per_endpoint:
+                self.condition.wait()
+            stats['active'] += 1
+            if self.first_start is None:
+                self.first_start = time.time()
+
+    def release(self, endpoint, success, size=None, duration=None):
+        """
+        Frees the transfer slot on the endpoint and updates its throughput
+
+        :param endpoint: the endpoint as string
+        :param success: True if the transfer succeeded
+        :param size: number of bytes transferred
+        :param duration: duration of the transfer in seconds
+        """
+        with self.condition:
+            stats = self.__get_stats(endpoint)
+            stats['active'] -= 1
+            self.last_end = time.time()
+            if success:
+                stats['files'] += 1
+                stats['bytes'] += size or 0
+                stats['seconds'] += duration or 0
+                if size and duration:
+                    throughput = size / duration
+                    # exponential moving average, to follow the load of the endpoint
+                    stats['throughput'] = throughput if stats['throughput'] is None else 0.7 * stats['throughput'] + 0.3 * throughput
+            else:
+                stats['failures'] += 1
+                stats['throughput'] = 0.5 * stats['throughput'] if stats['throughput'] is not None else 0.
+            self.condition.notify_all()
+
+    def get_stats(self):
+        """
+        Returns the aggregate throughput statistics
+
+        :returns: dictionary with the number of files and bytes transferred, the wall clock seconds between the
+                  first transfer start and the last transfer end, the throughput in bytes per second, and the same
+                  statistics per endpoint in 'endpoints'
+        """
+        with self.condition:
+            endpoints = dict((endpoint, dict(stats)) for endpoint, stats in self.endpoints.items())
+            seconds = (self.last_end - self.first_start) if self.first_start is not None and self.last_end is not None else 0.
+        total_bytes = sum(stats['bytes'] for stats in endpoints.values())
+        return {'files': sum(stats['files'] for stats in endpoints.values()),
+                'bytes': total_bytes,
+                'failures': sum(stats['failures'] for stats in endpoints.values()),
+                'seconds': seconds,
+                'throughput': total_bytes / seconds if seconds else None,
+                'endpoints': endpoints}
+
+    def __get_stats(self, endpoint):
+        stats = self.endpoints.get(endpoint)
+        if stats is None:
+            stats = self.endpoints[endpoint] = {'active': 0, 'files': 0, 'bytes': 0, 'seconds': 0., 'failures': 0, 'throughput': None}
+        return stats
+
+
 class DownloadClient:
 
-    def __init__(self, client=None, logger=None, tracing=True, check_admin=False, check_pcache=False):
+    def __init__(self, client=None, logger=None, tracing=True, check_admin=False, check_pcache=False,
+                 max_threads=5, max_downloads_per_endpoint=0, checksum_processes=0):
         """
         Initialises the basic settings for an DownloadClient object
 
         :param client: Optional: rucio.client.client.Client object. If None, a new object will be created.
         :param external_traces: Optional: reference to a list where traces can be added
         :param logger: Optional: logging.Logger object to use for downloads. If None nothing will be logged.
+        :param max_threads: Optional: upper limit of the number of download threads.
+        :param max_downloads_per_endpoint: Optional: maximum number of concurrent downloads from one storage endpoint. 0 means unlimited.
+        :param checksum_processes: Optional: number of processes validating the checksums of the downloaded files. 0 validates them in the download threads.
         """
         if not logger:
             logger = logging.getLogger('%s.null' % __name__)
@@ -158,6 +288,11 @@ class DownloadClient:
         self.use_cea_threshold = 10
         self.extraction_tools = []
 
+        self.max_threads = max_threads
+        self.scheduler = EndpointScheduler(max_downloads_per_endpoint)
+        self.checksum_processes = checksum_processes
+        self.checksum_pool = None
+
         # unzip <archive_file_path> <did_name> -d <dest_dir_path>
         extract_args = '%(archive_file_path)s %(file_to_extract)s -d %(dest_dir_path)s'
         self.extraction_tools.append(BaseExtractionTool('unzip', '-v', extract_args, logger))
@@ -227,13 +362,7 @@ class DownloadClient:
 
             input_items.append(item)
 
-        num_files_in = len(input_items)
         output_items = self._download_multithreaded(input_items, num_threads, trace_custom_fields, traces_copy_out)
-        num_files_out = len(output_items)
-
-        if num_files_in != num_files_out:
-            raise RucioException('%d items were in the input queue but only %d are in the output queue' % (num_files_in, num_files_out))
-
         return self._check_output(output_items)
 
     def download_dids(self, items, num_threads=2, trace_custom_fields={}, traces_copy_out=None):
@@ -276,16 +405,11 @@ class DownloadClient:
         logger.info('Getting sources of DIDs')
         # if one item wants to resolve archives we enable it for all items
         resolve_archives = not all(item.get('no_resolve_archives') for item in merged_items)
-        merged_items_with_sources = self._get_sources(merged_items, resolve_archives=resolve_archives)
-        input_items = self._prepare_items_for_download(did_to_options, merged_items_with_sources, resolve_archives=resolve_archives)
+        # the sources are resolved while the first files are downloaded
+        file_items = self._get_sources(merged_items, resolve_archives=resolve_archives)
+        input_items = self._prepare_items_for_download(did_to_options, file_items, resolve_archives=resolve_archives)
 
-        num_files_in = len(input_items)
         output_items = self._download_multithreaded(input_items, num_threads, trace_custom_fields, traces_copy_out)
-        num_files_out = len(output_items)
-
-        if num_files_in != num_files_out:
-            raise RucioException('%d items were in the input queue but only %d are in the output queue' % (num_files_in, num_files_out))
-
         return self._check_output(output_items)
 
     def download_from_metalink_file(self, item, metalink_file_path, num_threads=2, trace_custom_fields={}, traces_copy_out=None):
@@ -311,86 +435,141 @@ class DownloadClient:
         logger = self.logger
 
         logger.info('Getting sources from metalink file')
-        metalinks = parse_replicas_from_file(metalink_file_path)
-
         trace_custom_fields['uuid'] = generate_uuid()
 
         did_to_options = {}
         item.setdefault('destinations', set()).add((item['base_dir'], item['no_subdir']))
-        for metalink in metalinks:
-            did_to_options[metalink['did']] = item
 
-        metalinks = [metalinks]
-        input_items = self._prepare_items_for_download(did_to_options, metalinks)
+        def metalinks():
+            for metalink in iter_replicas_metalink(metalink_file_path):
+                did_to_options[metalink['did']] = item
+                yield metalink
 
-        num_files_in = len(input_items)
-        output_items = self._download_multithreaded(input_items, num_threads, trace_custom_fields, traces_copy_out)
-        num_files_out = len(output_items)
-
-        if num_files_in != num_files_out:
-            raise RucioException('%d items were in the input queue but only %d are in the output queue' % (num_files_in, num_files_out))
+        input_items = self._prepare_items_for_download(did_to_options, metalinks())
 
+        output_items = self._download_multithreaded(input_items, num_threads, trace_custom_fields, traces_copy_out)
         return self._check_output(output_items)
 
     def _download_multithreaded(self, input_items, num_threads, trace_custom_fields={}, traces_copy_out=None):
         """
         Starts an appropriate number of threads to download items from the input list.
+        The input items are fed to the threads as they come, so that a generator
+        resolving the sources lets the first downloads start before all the sources are known.
         (This function is meant to be used as class internal only)
 
-        :param input_items: list containing the input items to download
+        :param input_items: list or iterable containing the input items to download
         :param num_threads: suggestion of how many threads should be started
         :param trace_custom_fields: Custom key value pairs to send with the traces
         :param traces_copy_out: reference to an external list, where the traces should be uploaded
 
         :returns: list with output items as dictionaries
+
+        :raises RucioException: if not all the input items ended up in the output queue
         """
         logger = self.logger
 
-        num_files = len(input_items)
-        nlimit = 5
+        nlimit = self.max_threads
         num_threads = max(1, num_threads)
-        num_threads = min(num_files, num_threads, nlimit)
+        num_threads = min(num_threads, nlimit)
+        if isinstance(input_items, list):
+            num_threads = min(len(input_items), num_threads)
 
-        input_queue = Queue()
+        # bounded, so that the sources are not resolved much faster than the files are downloaded
+        input_queue = Queue(maxsize=max(1, num_threads) * 100)
         output_queue = Queue()
-        input_queue.queue = deque(input_items)
+        feeder = {'num_files': 0, 'error': None, 'stop': False}
+
+        def feed():
+            try:
+                for item in input_items:
+                    if feeder['stop']:
+                        break
+                    input_queue.put(item)
+                    feeder['num_files'] += 1
+            except Exception as error:
+                feeder['error'] = error
+                # stop the download threads: drop the queued items, only the started downloads are finished
+                while True:
+                    try:
+                        input_queue.get_nowait()
+                    except Empty:
+                        break
+            finally:
+                # one end marker per download thread
+                for _ in range(max(1, num_threads)):
+                    input_queue.put(None)
+
+        if self.checksum_processes:
+            self.checksum_pool = ProcessPoolExecutor(max_workers=self.checksum_processes)
+
+        feeder_thread = Thread(target=feed)
+        feeder_thread.daemon = True
+        feeder_thread.start()
 
         if num_threads < 2:
-            logger.info('Using main thread to download %d file(s)' % num_files)
+            logger.info('Using main thread to download the file(s)')
             self._download_worker(input_queue, output_queue, trace_custom_fields, traces_copy_out, '')
-            return list(output_queue.queue)
-
-        logger.info('Using %d threads to download %d files' % (num_threads, num_files))
-        threads = []
-        for thread_num in range(1, num_threads + 1):
-            log_prefix = 'Thread %s/%s: ' % (thread_num, num_threads)
-            kwargs = {'input_queue': input_queue,
-                      'output_queue': output_queue,
-                      'trace_custom_fields': trace_custom_fields,
-                      'traces_copy_out': traces_copy_out,
-                      'log_prefix': log_prefix}
+        else:
+            logger.info('Using %d threads to download the files' % num_threads)
+            threads = []
+            for thread_num in range(1, num_threads + 1):
+                log_prefix = 'Thread %s/%s: ' % (thread_num, num_threads)
+                kwargs = {'input_queue': input_queue,
+                          'output_queue': output_queue,
+                          'trace_custom_fields': trace_custom_fields,
+                          'traces_copy_out': traces_copy_out,
+                          'log_prefix': log_prefix}
+                try:
+                    thread = Thread(target=self._download_worker, kwargs=kwargs)
+                    thread.start()
+                    threads.append(thread)
+                except Exception as error:
+                    logger.warning('Failed to start thread %d' % thread_num)
+                    logger.debug(error)
+
+            if not threads:
+                logger.warning('No thread could be started, using main thread to download the file(s)')
+                self._download_worker(input_queue, output_queue, trace_custom_fields, traces_copy_out, '')
+
             try:
-                thread = Thread(target=self._download_worker, kwargs=kwargs)
-                thread.start()
-                threads.append(thread)
-            except Exception as error:
-                logger.warning('Failed to start thread %d' % thread_num)
-                logger.debug(error)
+                logger.debug('Waiting for threads to finish')
+                for thread in threads:
+                    thread.join()
+            except KeyboardInterrupt:
+                logger.warning('You pressed Ctrl+C! Exiting gracefully')
+                for thread in threads:
+                    thread.kill_received = True
 
-        try:
-            logger.debug('Waiting for threads to finish')
-            for thread in threads:
-                thread.join()
-        except KeyboardInterrupt:
-            logger.warning('You pressed Ctrl+C! Exiting gracefully')
-            for thread in threads:
-                thread.kill_received = True
-        return list(output_queue.queue)
+        # the download threads may have stopped before the end marker: unblock the feeder
+        feeder['stop'] = True
+        while feeder_thread.is_alive():
+            try:
+                input_queue.get_nowait()
+            except Empty:
+                feeder_thread.join(0.1)
+
+        if self.checksum_pool:
+            self.checksum_pool.shutdown()
+            self.checksum_pool = None
+
+        stats = self.scheduler.get_stats()
+        if stats['throughput']:
+            logger.info('Downloaded %s in %s seconds = %s MBps' % (sizefmt(stats['bytes'], self.is_human_readable), round(stats['seconds'], 2), round(stats['throughput'] * 1e-6, 2)))
+
+        if feeder['error'] is not None:
+            raise feeder['error']
+
+        output_items = list(output_queue.queue)
+        num_files_in = feeder['num_files']
+        num_files_out = len(output_items)
+        if num_files_in != num_files_out:
+            raise RucioException('%d items were in the input queue but only %d are in the output queue' % (num_files_in, num_files_out))
+        return output_items
 
     def _download_worker(self, input_queue, output_queue, trace_custom_fields, traces_copy_out, log_prefix):
         """
-        This function runs as long as there are items in the input queue,
-        downloads them and stores the output in the output queue.
+        This function runs until it gets the end marker None from the input queue,
+        downloads the items and stores the output in the output queue.
         (This function is meant to be used as class internal only)
 
         :param input_queue: queue containing the input items to download
@@ -403,9 +582,8 @@ class DownloadClient:
 
         logger.debug('%sStart processing queued downloads' % log_prefix)
         while True:
-            try:
-                item = input_queue.get_nowait()
-            except Empty:
+            item = input_queue.get()
+            if item is None:
                 break
             try:
                 trace = copy.deepcopy(self.trace_tpl)
@@ -513,7 +691,8 @@ class DownloadClient:
             else:
                 logger.info('File not found in pcache.')
 
-        # try different PFNs until one succeeded
+        # try different PFNs until one succeeded, the best endpoints first
+        sources = self.scheduler.order_sources(sources)
         temp_file_path = item['temp_file_path']
         success = False
         i = 0
@@ -555,6 +734,9 @@ class DownloadClient:
                     logger.debug('%sDeleting existing temporary file: %s' % (log_prefix, temp_file_path))
                     os.unlink(temp_file_path)
 
+                # wait for a free transfer slot on the storage endpoint
+                endpoint = self.scheduler.get_endpoint(source)
+                self.scheduler.acquire(endpoint)
                 start_time = time.time()
 
                 try:
@@ -565,25 +747,31 @@ class DownloadClient:
                     trace['clientState'] = str(type(error).__name__)
 
                 end_time = time.time()
-
-                if success and not item.get('merged_options', {}).get('ignore_checksum', False):
-                    rucio_checksum = item.get('adler32')
-                    local_checksum = None
-                    if rucio_checksum is None:
-                        rucio_checksum = item.get('md5')
+                try:
+                    if success and not item.get('merged_options', {}).get('ignore_checksum', False):
+                        # The checksums calculated by the protocol while receiving the file spare reading it again
+                        local_checksums = getattr(protocol, 'received_checksums', {}).pop(temp_file_path, {})
+                        rucio_checksum = item.get('adler32')
+                        local_checksum = None
                         if rucio_checksum is None:
-                            logger.warning('%sNo remote checksum available. Skipping validation.' % log_prefix)
+                            rucio_checksum = item.get('md5')
+                            if rucio_checksum is None:
+                                logger.warning('%sNo remote checksum available. Skipping validation.' % log_prefix)
+                            else:
+                                local_checksum = local_checksums.get('md5') or self._local_checksum(temp_file_path, 'md5')
                         else:
-                            local_checksum = md5(temp_file_path)
-                    else:
-                        local_checksum = adler32(temp_file_path)
+                            local_checksum = local_checksums.get('adler32') or self._local_checksum(temp_file_path, 'adler32')
+
+                        if rucio_checksum != local_checksum:
+                            success = False
+                            os.unlink(temp_file_path)
+                            logger.warning('%sChecksum validation failed for file: %s' % (log_prefix, did_str))
+                            logger.debug('Local checksum: %s, Rucio checksum: %s' % (local_checksum, rucio_checksum))
+                            trace['clientState'] = 'FAIL_VALIDATE'
+                finally:
+                    # the throughput of the endpoint only counts the transfers whose file is valid
+                    self.scheduler.release(endpoint, success, item.get('bytes'), end_time - start_time)
 
-                    if rucio_checksum != local_checksum:
-                        success = False
-                        os.unlink(temp_file_path)
-                        logger.warning('%sChecksum validation failed for file: %s' % (log_prefix, did_str))
-                        logger.debug('Local checksum: %s, Rucio checksum: %s' % (local_checksum, rucio_checksum))
-                        trace['clientState'] = 'FAIL_VALIDATE'
                 if not success:
                     logger.warning('%sDownload attempt failed. Try %s/%s' % (log_prefix, attempt, retries))
                     self._send_trace(trace)
@@ -660,6 +848,29 @@ class DownloadClient:
 
         return item
 
+    def _local_checksum(self, file_path, algorithm):
+        """
+        Calculates the checksum of a downloaded file, in the checksum process pool if there is one.
+        (This function is meant to be used as class internal only)
+
+        :param file_path: path to the file
+        :param algorithm: adler32 or md5
+
+        :returns: the checksum as hexadecimal string
+        """
+        if self.checksum_pool:
+            return self.checksum_pool.submit(checksums, file_path, (algorithm, )).result()[algorithm]
+        return adler32(file_path) if algorithm == 'adler32' else md5(file_path)
+
+    def get_download_stats(self):
+        """
+        Returns the aggregate throughput statistics of the downloads done by this client.
+
+        :returns: dictionary with the number of files, bytes and failures, the wall clock seconds, the throughput
+                  in bytes per second, and the same statistics per storage endpoint in 'endpoints'
+        """
+        return self.scheduler.get_stats()
+
     def download_aria2c(self, items, trace_custom_fields={}, filters={}):
         """
         Uses aria2c to download the items with given DIDs. This function can also download datasets and wildcarded DIDs.
@@ -701,8 +912,8 @@ class DownloadClient:
         self.logger.debug('num_unmerged_items=%d; num_dids=%d; num_merged_items=%d' % (len(items), len(did_to_options), len(merged_items)))
 
         logger.info('Getting sources of DIDs')
-        merged_items_with_sources = self._get_sources(merged_items)
-        input_items = self._prepare_items_for_download(did_to_options, merged_items_with_sources, resolve_archives=False)
+        file_items = self._get_sources(merged_items)
+        input_items = list(self._prepare_items_for_download(did_to_options, file_items, resolve_archives=False))
 
         try:
             output_items = self._download_items_aria2c(input_items, aria_rpc, rpc_auth, trace_custom_fields)
@@ -1045,19 +1256,21 @@ class DownloadClient:
 
     def _get_sources(self, merged_items, resolve_archives=True):
         """
-        Get sources (PFNs) of the DIDs.
+        Get sources (PFNs) of the DIDs. The replicas are read from the JSON stream of
+        list_replicas and each file is yielded as soon as it is returned by the server.
 
         :param merged_items: list of dictionaries. Each dictionary describes a bunch of DIDs to download
 
-        :returns: list of list of dictionaries.
+        :returns: generator of dictionaries. Each dictionary describes a file with its sources.
         """
         logger = self.logger
-        merged_items_with_sources = []
         for item in merged_items:
-            # since we're using metalink we need to explicitly give all schemes
+            # explicitly give all schemes to get all the sources, like for a metalink
             schemes = item.get('force_scheme')
             if schemes:
                 schemes = schemes if isinstance(schemes, list) else [schemes]
+            else:
+                schemes = SUPPORTED_PROTOCOLS
             logger.debug('schemes: %s' % schemes)
 
             # extend RSE expression to exclude tape RSEs for non-admin accounts
@@ -1069,35 +1282,40 @@ class DownloadClient:
             # get PFNs of files and datasets
             logger.debug('num DIDs for list_replicas call: %d' % len(item['dids']))
 
-            metalink_str = self.client.list_replicas(item['dids'],
-                                                     schemes=schemes,
-                                                     rse_expression=rse_expression,
-                                                     client_location=self.client_location,
-                                                     resolve_archives=resolve_archives,
-                                                     resolve_parents=True,
-                                                     metalink=True)
-            file_items = parse_replicas_from_string(metalink_str)
-            logger.debug('num resolved files: %s' % len(file_items))
+            replicas = self.client.list_replicas(item['dids'],
+                                                 schemes=schemes,
+                                                 rse_expression=rse_expression,
+                                                 client_location=self.client_location,
+                                                 resolve_archives=resolve_archives,
+                                                 resolve_parents=True)
+            # an empty result is returned as an empty string instead of an empty stream
+            file_items = (parse_replica_json(replica) for replica in replicas if isinstance(replica, dict))
 
             nrandom = item.get('nrandom')
             if nrandom:
+                # the random selection needs all the files of the DIDs
+                file_items = list(file_items)
                 logger.info('Selecting %d random replicas from DID(s): %s' % (nrandom, item['dids']))
                 random.shuffle(file_items)
                 file_items = file_items[0:nrandom]
-                merged_items_with_sources.append(file_items)
-            else:
-                merged_items_with_sources.append(file_items)
-        return merged_items_with_sources
 
-    def _prepare_items_for_download(self, did_to_options, merged_items_with_sources, resolve_archives=True):
+            num_files = 0
+            for file_item in file_items:
+                num_files += 1
+                yield file_item
+            logger.debug('num resolved files: %s' % num_files)
+
+    def _prepare_items_for_download(self, did_to_options, file_items, resolve_archives=True):
         """
-        Optimises the amount of files to download
+        Optimises the amount of files to download. The files which cannot be extracted from
+        an archive are yielded as soon as they are prepared, the archives are chosen and
+        yielded once all the files are known.
         (This function is meant to be used as class internal only)
 
         :param did_to_options: dictionary that maps each input DID to some input options
-        :param merged_items_with_sources: list of dictionaries. Each dictionary describes a bunch of DIDs to download
+        :param file_items: iterable of dictionaries. Each dictionary describes a file with its sources
 
-        :returns: list of dictionaries. Each dictionary describes an element to download
+        :returns: generator of dictionaries. Each dictionary describes an element to download
 
         :raises InputValidationError: if the given input is not valid or incomplete
         """
@@ -1112,7 +1330,7 @@ class DownloadClient:
         # maps file item IDs (fiid) to the file item object
         fiid_to_file_item = {}
 
-        # list of all file item objects
+        # list of the file item objects with client_extract archive sources
         all_file_items = []
 
         # cea -> client_extract archives to avoid confusion with archives that dont need explicit extraction
@@ -1125,125 +1343,130 @@ class DownloadClient:
         all_input_dids = set(did_to_options.keys())
         all_dest_file_paths = set()
 
-        # get replicas for every file of the given dids
-        logger.debug('num list_replicas calls: %d' % len(merged_items_with_sources))
-        for file_items in merged_items_with_sources:
-            all_file_items.extend(file_items)
-            for file_item in file_items:
-                # parent_dids contains all parents, so we take the intersection with the input dids
-                dataset_did_strs = file_item.setdefault('parent_dids', set())
-                dataset_did_strs.intersection_update(all_input_dids)
-
-                file_did_str = file_item['did']
-                file_did_scope, file_did_name = self._split_did_str(file_did_str)
-                file_item['scope'] = file_did_scope
-                file_item['name'] = file_did_name
-
-                logger.debug('Queueing file: %s' % file_did_str)
-                logger.debug('real parents: %s' % dataset_did_strs)
-                logger.debug('options: %s' % did_to_options)
-
-                # prepare destinations:
-                # if datasets were given: prepare the destination paths for each dataset
-                options = None
-                dest_file_paths = file_item.get('dest_file_paths', set())
-                for dataset_did_str in dataset_did_strs:
-                    options = did_to_options.get(dataset_did_str)
-                    if not options:
-                        logger.error('No input options available for %s' % dataset_did_str)
-                        continue
+        # prepare every file as it comes: the files without client_extract archive sources
+        # are ready for download, the others wait for all the files to choose the archives
+        for file_item in file_items:
+            # parent_dids contains all parents, so we take the intersection with the input dids
+            dataset_did_strs = file_item.setdefault('parent_dids', set())
+            dataset_did_strs.intersection_update(all_input_dids)
+
+            file_did_str = file_item['did']
+            file_did_scope, file_did_name = self._split_did_str(file_did_str)
+            file_item['scope'] = file_did_scope
+            file_item['name'] = file_did_name
+
+            logger.debug('Queueing file: %s' % file_did_str)
+            logger.debug('real parents: %s' % dataset_did_strs)
+            logger.debug('options: %s' % did_to_options)
+
+            # prepare destinations:
+            # if datasets were given: prepare the destination paths for each dataset
+            options = None
+            dest_file_paths = file_item.get('dest_file_paths', set())
+            for dataset_did_str in dataset_did_strs:
+                options = did_to_options.get(dataset_did_str)
+                if not options:
+                    logger.error('No input options available for %s' % dataset_did_str)
+                    continue
 
-                    destinations = options['destinations']
-                    dataset_scope, dataset_name = self._split_did_str(dataset_did_str)
-                    paths = [os.path.join(self._prepare_dest_dir(dest[0], dataset_name, file_did_name, dest[1]), file_did_name) for dest in destinations]
-                    if any(path in all_dest_file_paths for path in paths):
-                        raise RucioException("Multiple file items with same destination file path")
+                destinations = options['destinations']
+                dataset_scope, dataset_name = self._split_did_str(dataset_did_str)
+                paths = [os.path.join(self._prepare_dest_dir(dest[0], dataset_name, file_did_name, dest[1]), file_did_name) for dest in destinations]
+                if any(path in all_dest_file_paths for path in paths):
+                    raise RucioException("Multiple file items with same destination file path")
+
+                all_dest_file_paths.update(paths)
+                dest_file_paths.update(paths)
+
+                # workaround: just take any given dataset for the traces and the output
+                file_item.setdefault('dataset_scope', dataset_scope)
+                file_item.setdefault('dataset_name', dataset_name)
+
+            # if no datasets were given only prepare the given destination paths
+            if len(dataset_did_strs) == 0:
+                options = did_to_options.get(file_did_str)
+                if not options:
+                    logger.error('No input options available for %s' % file_did_str)
+                    yield file_item
+                    continue
+                destinations = options['destinations']
+                paths = [os.path.join(self._prepare_dest_dir(dest[0], file_did_scope, file_did_name, dest[1]), file_did_name) for dest in destinations]
+                if any(path in all_dest_file_paths for path in paths):
+                    raise RucioException("Multiple file items with same destination file path")
+                all_dest_file_paths.update(paths)
+                dest_file_paths.update(paths)
+
+            if options is None:
+                yield file_item
+                continue
+            file_item['merged_options'] = options
+            file_item['dest_file_paths'] = list(dest_file_paths)
+            file_item['temp_file_path'] = '%s.part' % file_item['dest_file_paths'][0]
 
-                    all_dest_file_paths.update(paths)
-                    dest_file_paths.update(paths)
+            # the file did str ist not an unique key for this dict because multiple calls of list_replicas
+            # could result in the same DID multiple times. So we're using the id of the dictionary objects
+            fiid = id(file_item)
+            fiid_to_file_item[fiid] = file_item
 
-                    # workaround: just take any given dataset for the traces and the output
-                    file_item.setdefault('dataset_scope', dataset_scope)
-                    file_item.setdefault('dataset_name', dataset_name)
+            if not resolve_archives:
+                yield file_item
+            else:
+                min_cea_priority = None
+                num_non_cea_sources = 0
+                cea_ids = []
+                sources = []
+                # go through sources and check how many (non-)cea sources there are,
+                # index cea sources, or remove cea sources if there is no extraction tool
+                for source in file_item['sources']:
+                    is_cea = source.get('client_extract', False)
+                    if is_cea and (len(self.extraction_tools) > 0):
+                        priority = int(source['priority'])
+                        if min_cea_priority is None or priority < min_cea_priority:
+                            min_cea_priority = priority
+
+                        # workaround since we dont have the archive DID use the part behind the last slash of the PFN
+                        # this doesn't respect the scope of the archive DID!!!
+                        # and we trust that client_extract==True sources dont have any parameters at the end of the PFN
+                        cea_id = source['pfn'].split('/')
+                        cea_id = cea_id[-1] if len(cea_id[-1]) > 0 else cea_id[-2]
+                        cea_ids.append(cea_id)
+
+                        sources.append(source)
+                    elif not is_cea:
+                        num_non_cea_sources += 1
+                        sources.append(source)
+                    else:
+                        # no extraction tool
+                        logger.debug('client_extract=True; ignoring source: %s' % source['pfn'])
 
-                # if no datasets were given only prepare the given destination paths
-                if len(dataset_did_strs) == 0:
-                    options = did_to_options.get(file_did_str)
-                    if not options:
-                        logger.error('No input options available for %s' % file_did_str)
-                        continue
-                    destinations = options['destinations']
-                    paths = [os.path.join(self._prepare_dest_dir(dest[0], file_did_scope, file_did_name, dest[1]), file_did_name) for dest in destinations]
-                    if any(path in all_dest_file_paths for path in paths):
-                        raise RucioException("Multiple file items with same destination file path")
-                    all_dest_file_paths.update(paths)
-                    dest_file_paths.update(paths)
-
-                if options is None:
-                    continue
-                file_item['merged_options'] = options
-                file_item['dest_file_paths'] = list(dest_file_paths)
-                file_item['temp_file_path'] = '%s.part' % file_item['dest_file_paths'][0]
-
-                # the file did str ist not an unique key for this dict because multiple calls of list_replicas
-                # could result in the same DID multiple times. So we're using the id of the dictionary objects
-                fiid = id(file_item)
-                fiid_to_file_item[fiid] = file_item
-
-                if resolve_archives:
-                    min_cea_priority = None
-                    num_non_cea_sources = 0
-                    cea_ids = []
-                    sources = []
-                    # go through sources and check how many (non-)cea sources there are,
-                    # index cea sources, or remove cea sources if there is no extraction tool
-                    for source in file_item['sources']:
-                        is_cea = source.get('client_extract', False)
-                        if is_cea and (len(self.extraction_tools) > 0):
-                            priority = int(source['priority'])
-                            if min_cea_priority is None or priority < min_cea_priority:
-                                min_cea_priority = priority
-
-                            # workaround since we dont have the archive DID use the part behind the last slash of the PFN
-                            # this doesn't respect the scope of the archive DID!!!
-                            # and we trust that client_extract==True sources dont have any parameters at the end of the PFN
-                            cea_id = source['pfn'].split('/')
-                            cea_id = cea_id[-1] if len(cea_id[-1]) > 0 else cea_id[-2]
-                            cea_ids.append(cea_id)
-
-                            sources.append(source)
-                        elif not is_cea:
-                            num_non_cea_sources += 1
-                            sources.append(source)
-                        else:
-                            # no extraction tool
-                            logger.debug('client_extract=True; ignoring source: %s' % source['pfn'])
+                logger.debug('Prepared sources: num_sources=%d/%d; num_non_cea_sources=%d; num_cea_ids=%d'
+                             % (len(sources), len(file_item['sources']), num_non_cea_sources, len(cea_ids)))
 
-                    logger.debug('Prepared sources: num_sources=%d/%d; num_non_cea_sources=%d; num_cea_ids=%d'
-                                 % (len(sources), len(file_item['sources']), num_non_cea_sources, len(cea_ids)))
+                file_item['sources'] = sources
 
-                    file_item['sources'] = sources
+                # if there are no cea sources we are done for this item
+                if min_cea_priority is None:
+                    yield file_item
+                    continue
 
-                    # if there are no cea sources we are done for this item
-                    if min_cea_priority is None:
-                        continue
-                    # decide if file item belongs to the pure or mixed map
-                    # if no non-archive src exists or the highest prio src is an archive src we put it in the pure map
-                    elif num_non_cea_sources == 0 or min_cea_priority == 1:
-                        logger.debug('Adding fiid to cea pure map: '
-                                     'num_non_cea_sources=%d; min_cea_priority=%d; num_cea_sources=%d'
-                                     % (num_non_cea_sources, min_cea_priority, len(cea_ids)))
-                        for cea_id in cea_ids:
-                            cea_id_pure_to_fiids.setdefault(cea_id, set()).add(fiid)
-                            file_item.setdefault('cea_ids_pure', set()).add(cea_id)
-                    # if there are non-archive sources and archive sources we put it in the mixed map
-                    elif len(cea_ids) > 0:
-                        logger.debug('Adding fiid to cea mixed map: '
-                                     'num_non_cea_sources=%d; min_cea_priority=%d; num_cea_sources=%d'
-                                     % (num_non_cea_sources, min_cea_priority, len(cea_ids)))
-                        for cea_id in cea_ids:
-                            cea_id_mixed_to_fiids.setdefault(cea_id, set()).add(fiid)
-                            file_item.setdefault('cea_ids_mixed', set()).add(cea_id)
+                all_file_items.append(file_item)
+                # decide if file item belongs to the pure or mixed map
+                # if no non-archive src exists or the highest prio src is an archive src we put it in the pure map
+                if num_non_cea_sources == 0 or min_cea_priority == 1:
+                    logger.debug('Adding fiid to cea pure map: '
+                                 'num_non_cea_sources=%d; min_cea_priority=%d; num_cea_sources=%d'
+                                 % (num_non_cea_sources, min_cea_priority, len(cea_ids)))
+                    for cea_id in cea_ids:
+                        cea_id_pure_to_fiids.setdefault(cea_id, set()).add(fiid)
+                        file_item.setdefault('cea_ids_pure', set()).add(cea_id)
+                # if there are non-archive sources and archive sources we put it in the mixed map
+                elif len(cea_ids) > 0:
+                    logger.debug('Adding fiid to cea mixed map: '
+                                 'num_non_cea_sources=%d; min_cea_priority=%d; num_cea_sources=%d'
+                                 % (num_non_cea_sources, min_cea_priority, len(cea_ids)))
+                    for cea_id in cea_ids:
+                        cea_id_mixed_to_fiids.setdefault(cea_id, set()).add(fiid)
+                        file_item.setdefault('cea_ids_mixed', set()).add(cea_id)
 
         # put all archives from the mixed list into the pure list if they meet
         # certain conditions, e.g., an archive that is already in the pure list
@@ -1311,7 +1534,6 @@ class DownloadClient:
                         cea_id_pure_to_fiids[cea_id_pure_other].discard(fiid_pure)
                         cea_ids_pure.discard(cea_id_pure_other)
 
-        download_packs = []
         cea_id_to_pack = {}
         for file_item in all_file_items:
             cea_ids = file_item.get('cea_ids_pure', set())
@@ -1331,12 +1553,12 @@ class DownloadClient:
                             'archive_items': []
                             }
                     cea_id_to_pack[cea_id] = pack
-                    download_packs.append(pack)
                 file_item.pop('sources')
                 pack['archive_items'].append(file_item)
             else:
-                download_packs.append(file_item)
-        return download_packs
+                yield file_item
+        for pack in cea_id_to_pack.values():
+            yield pack
 
     def _split_did_str(self, did_str):
         """
@@ -32,23 +32,31 @@ import socket
 import logging
 import time
 
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore
+
 from rucio.client.client import Client
 from rucio.common.exception import (RucioException, RSEBlacklisted, DataIdentifierAlreadyExists,
                                     DataIdentifierNotFound, NoFilesUploaded, NotAllFilesUploaded,
                                     ResourceTemporaryUnavailable, ServiceUnavailable, InputValidationError)
-from rucio.common.utils import adler32, execute, generate_uuid, md5, send_trace
+from rucio.common.utils import checksums, checksums_of_files, chunks, execute, generate_uuid, send_trace
 from rucio.rse import rsemanager as rsemgr
 from rucio import version
 
 
 class UploadClient:
 
-    def __init__(self, _client=None, logger=None, tracing=True):
+    def __init__(self, _client=None, logger=None, tracing=True, checksum_threads=4,
+                 upload_threads=4, uploads_per_rse=2, registration_chunk_size=100):
         """
         Initialises the basic settings for an UploadClient object
 
         :param _client:     - Optional: rucio.client.client.Client object. If None, a new object will be created.
         :param logger:      - logging.Logger object to use for uploads. If None nothing will be logged.
+        :param checksum_threads: - Optional: number of files checksummed in parallel.
+        :param upload_threads: - Optional: number of files uploaded in parallel by a pipelined upload.
+        :param uploads_per_rse: - Optional: maximum number of concurrent uploads to one RSE by a pipelined upload.
+        :param registration_chunk_size: - Optional: number of files registered together by a pipelined upload.
         """
         if not logger:
             logger = logging.getLogger('%s.null' % __name__)
@@ -57,6 +65,10 @@ class UploadClient:
         self.logger = logger
         self.client = _client if _client else Client()
         self.tracing = tracing
+        self.checksum_threads = checksum_threads
+        self.upload_threads = upload_threads
+        self.uploads_per_rse = uploads_per_rse
+        self.registration_chunk_size = registration_chunk_size
         if not self.tracing:
             logger.debug('Tracing is turned off.')
         self.default_file_scope = 'user.' + self.client.account
@@ -68,7 +80,7 @@ class UploadClient:
         self.trace['eventType'] = 'upload'
         self.trace['eventVersion'] = version.RUCIO_VERSION[0]
 
-    def upload(self, items, summary_file_path=None):
+    def upload(self, items, summary_file_path=None, pipelined=False):
         """
         :param items: List of dictionaries. Each dictionary describing a file to upload. Keys:
             path                  - path of the file that will be uploaded
@@ -85,6 +97,7 @@ class UploadClient:
             transfer_timeout      - Optional: time after the upload will be aborted
             guid                  - Optional: guid of the file
         :param summary_file_path: Optional: a path where a summary in form of a json file will be stored
+        :param pipelined: Optional: if True, the files are uploaded in parallel and registered by chunks with bulk calls
 
         :returns: 0 on success
 
@@ -93,8 +106,6 @@ class UploadClient:
         :raises NoFilesUploaded: if no files were successfully uploaded
         :raises NotAllFilesUploaded: if not all files were successfully uploaded
         """
-        logger = self.logger
-
         self.trace['uuid'] = generate_uuid()
 
         # check given sources, resolve dirs into files, and collect meta infos
@@ -127,131 +138,12 @@ class UploadClient:
 
         # clear this set again to ensure that we only try to register datasets once
         registered_dataset_dids = set()
-        num_succeeded = 0
-        summary = []
-
-        for file in files:
-            basename = file['basename']
-            logger.info('Preparing upload for file %s' % basename)
-
-            no_register = file.get('no_register')
-            register_after_upload = file.get('register_after_upload') and not no_register
-            pfn = file.get('pfn')
-            force_scheme = file.get('force_scheme')
-            delete_existing = False
-
-            self.trace['scope'] = file['did_scope']
-            self.trace['datasetScope'] = file.get('dataset_scope', '')
-            self.trace['dataset'] = file.get('dataset_name', '')
-            self.trace['remoteSite'] = rse
-            self.trace['filesize'] = file['bytes']
-
-            file_did = {'scope': file['did_scope'], 'name': file['did_name']}
-            dataset_did_str = file.get('dataset_did_str')
-
-            rse = file['rse']
-            rse_settings = self.rses[rse]
-            rse_sign_service = rse_settings.get('sign_url', None)
-            is_deterministic = rse_settings.get('deterministic', True)
-            if not is_deterministic and not pfn:
-                logger.error('PFN has to be defined for NON-DETERMINISTIC RSE.')
-                continue
-            if pfn and is_deterministic:
-                logger.warning('Upload with given pfn implies that no_register is True, except non-deterministic RSEs')
-                no_register = True
-
-            if not no_register and not register_after_upload:
-                self._register_file(file, registered_dataset_dids)
-
-            # if register_after_upload, file should be overwritten if it is not registered
-            # otherwise if file already exists on RSE we're done
-            if register_after_upload:
-                if rsemgr.exists(rse_settings, pfn if pfn else file_did):
-                    try:
-                        self.client.get_did(file['did_scope'], file['did_name'])
-                        logger.info('File already registered. Skipping upload.')
-                        continue
-                    except DataIdentifierNotFound:
-                        logger.info('File already exists on RSE. Previous left overs will be overwritten.')
-                        delete_existing = True
-            elif not is_deterministic and not no_register:
-                if rsemgr.exists(rse_settings, pfn):
-                    logger.info('File already exists on RSE with given pfn. Skipping upload. Existing replica has to be removed first.')
-                    continue
-                elif rsemgr.exists(rse_settings, file_did):
-                    logger.info('File already exists on RSE with different pfn. Skipping upload.')
-                    continue
-            else:
-                if rsemgr.exists(rse_settings, pfn if pfn else file_did):
-                    logger.info('File already exists on RSE. Skipping upload')
-                    continue
-            protocols = rsemgr.get_protocols_ordered(rse_settings=rse_settings, operation='write', scheme=force_scheme)
-            protocols.reverse()
-            success = False
-            state_reason = ''
-            while not success and len(protocols):
-                protocol = protocols.pop()
-                cur_scheme = protocol['scheme']
-                logger.info('Trying upload with %s to %s' % (cur_scheme, rse))
-                lfn = {}
-                lfn['filename'] = basename
-                lfn['scope'] = file['did_scope']
-                lfn['name'] = file['did_name']
-                lfn['adler32'] = file['adler32']
-                lfn['filesize'] = file['bytes']
-
-                sign_service = None
-                if cur_scheme == 'https':
-                    sign_service = rse_sign_service
-
-                self.trace['protocol'] = cur_scheme
-                self.trace['transferStart'] = time.time()
-                try:
-                    state = rsemgr.upload(rse_settings=rse_settings,
-                                          lfns=lfn,
-                                          source_dir=file['dirname'],
-                                          force_scheme=cur_scheme,
-                                          force_pfn=pfn,
-                                          transfer_timeout=file.get('transfer_timeout'),
-                                          delete_existing=delete_existing,
-                                          sign_service=sign_service)
-                    success = state['success']
-                    file['upload_result'] = state
-                except (ServiceUnavailable, ResourceTemporaryUnavailable) as error:
-                    logger.warning('Upload attempt failed')
-                    logger.debug('Exception: %s' % str(error))
-                    state_reason = str(error)
-
-            if success:
-                num_succeeded += 1
-                self.trace['transferEnd'] = time.time()
-                self.trace['clientState'] = 'DONE'
-                file['state'] = 'A'
-                logger.info('Successfully uploaded file %s' % basename)
-                self._send_trace(self.trace)
-
-                if summary_file_path:
-                    summary.append(copy.deepcopy(file))
-
-                if not no_register:
-                    if register_after_upload:
-                        self._register_file(file, registered_dataset_dids)
-                    replica_for_api = self._convert_file_for_api(file)
-                    if not self.client.update_replicas_states(rse, files=[replica_for_api]):
-                        logger.warning('Failed to update replica state')
-
-                # add file to dataset if needed
-                if dataset_did_str and not no_register:
-                    try:
-                        self.client.attach_dids(file['dataset_scope'], file['dataset_name'], [file_did])
-                    except Exception as error:
-                        logger.warning('Failed to attach file to the dataset')
-                        logger.debug(error)
-            else:
-                self.trace['clientState'] = 'FAILED'
-                self.trace['stateReason'] = state_reason
-                self._send_trace(self.trace)
-                logger.error('Failed to upload file %s' % basename)
+        if pipelined:
+            uploaded_files = self._upload_pipelined(files, registered_dataset_dids)
+        else:
+            uploaded_files = self._upload_sequential(files, registered_dataset_dids)
+        num_succeeded = len(uploaded_files)
+        summary = uploaded_files
 
         if summary_file_path:
             final_summary = {}
@@ -276,6 +168,309 @@ class UploadClient:
             raise NotAllFilesUploaded()
         return 0
 
+    def _upload_sequential(self, files, registered_dataset_dids):
+        """
+        Uploads and registers the files one after another.
+        (This function is meant to be used as class internal only)
+
+        :param files: list of dictionaries describing the files to upload
+        :param registered_dataset_dids: set of dataset dids that were already registered
+
+        :returns: list of the successfully uploaded files
+        """
+        logger = self.logger
+        uploaded_files = []
+        for file in files:
+            logger.info('Preparing upload for file %s' % file['basename'])
+            no_register = self._check_no_register(file)
+            if no_register is None:
+                continue
+            register_after_upload = file.get('register_after_upload') and not no_register
+
+            if not no_register and not register_after_upload:
+                self._register_file(file, registered_dataset_dids)
+
+            if not self._upload_item(file, no_register, register_after_upload):
+                continue
+            uploaded_files.append(copy.deepcopy(file))
+
+            if not no_register:
+                if register_after_upload:
+                    self._register_file(file, registered_dataset_dids)
+                replica_for_api = self._convert_file_for_api(file)
+                if not self.client.update_replicas_states(file['rse'], files=[replica_for_api]):
+                    logger.warning('Failed to update replica state')
+
+            # add file to dataset if needed
+            if file.get('dataset_did_str') and not no_register:
+                try:
+                    self.client.attach_dids(file['dataset_scope'], file['dataset_name'], [{'scope': file['did_scope'], 'name': file['did_name']}])
+                except Exception as error:
+                    logger.warning('Failed to attach file to the dataset')
+                    logger.debug(error)
+        return uploaded_files
+
+    def _upload_pipelined(self, files, registered_dataset_dids):
+        """
+        Uploads the files by chunks: the files of a chunk are registered with bulk calls,
+        uploaded in parallel with a limited number of concurrent uploads per RSE, and their
+        replica states and dataset attachments are updated with bulk calls at the end of the chunk.
+        (This function is meant to be used as class internal only)
+
+        :param files: list of dictionaries describing the files to upload
+        :param registered_dataset_dids: set of dataset dids that were already registered
+
+        :returns: list of the successfully uploaded files
+        """
+        logger = self.logger
+        rse_semaphores = dict((rse, BoundedSemaphore(self.uploads_per_rse)) for rse in set(file['rse'] for file in files))
+
+        def upload_item(file, no_register, register_after_upload):
+            with rse_semaphores[file['rse']]:
+                return self._upload_item(file, no_register, register_after_upload)
+
+        uploaded_files = []
+        with ThreadPoolExecutor(max_workers=max(1, self.upload_threads)) as executor:
+            for chunk in chunks(files, self.registration_chunk_size):
+                logger.info('Preparing upload for %d files' % len(chunk))
+                chunk_files = []
+                for file in chunk:
+                    no_register = self._check_no_register(file)
+                    if no_register is not None:
+                        chunk_files.append((file, no_register, file.get('register_after_upload') and not no_register))
+
+                self._register_files([file for file, no_register, register_after_upload in chunk_files
+                                      if not no_register and not register_after_upload], registered_dataset_dids)
+
+                futures = [(executor.submit(upload_item, *chunk_file), chunk_file) for chunk_file in chunk_files]
+                chunk_uploaded = []
+                for future, chunk_file in futures:
+                    try:
+                        success = future.result()
+                    except Exception as error:
+                        logger.error('Failed to upload file %s' % chunk_file[0]['basename'])
+                        logger.debug(error)
+                        success = False
+                    if success:
+                        uploaded_files.append(copy.deepcopy(chunk_file[0]))
+                        chunk_uploaded.append(chunk_file)
+
+                self._register_files([file for file, no_register, register_after_upload in chunk_uploaded if register_after_upload], registered_dataset_dids)
+                self._finish_registration([file for file, no_register, register_after_upload in chunk_uploaded if not no_register])
+        return uploaded_files
+
+    def _check_no_register(self, file):
+        """
+        Checks the PFN of a file against the RSE.
+        (This function is meant to be used as class internal only)
+
+        :param file: dictionary describing the file
+
+        :returns: None if the file cannot be uploaded, otherwise whether the file must not be registered
+        """
+        logger = self.logger
+        no_register = file.get('no_register')
+        is_deterministic = self.rses[file['rse']].get('deterministic', True)
+        if not is_deterministic and not file.get('pfn'):
+            logger.error('PFN has to be defined for NON-DETERMINISTIC RSE.')
+            return None
+        if file.get('pfn') and is_deterministic:
+            logger.warning('Upload with given pfn implies that no_register is True, except non-deterministic RSEs')
+            no_register = True
+        return bool(no_register)
+
+    def _upload_item(self, file, no_register, register_after_upload):
+        """
+        Uploads a file to its RSE, unless it exists already there, and sends the trace.
+        (This function is meant to be used as class internal only)
+
+        :param file: dictionary describing the file
+        :param no_register: True if the file is not registered in the rucio catalogue
+        :param register_after_upload: True if the file is registered after the upload
+
+        :returns: True if the file was uploaded, otherwise False
+        """
+        logger = self.logger
+        basename = file['basename']
+        pfn = file.get('pfn')
+        force_scheme = file.get('force_scheme')
+        delete_existing = False
+
+        rse = file['rse']
+        rse_settings = self.rses[rse]
+        rse_sign_service = rse_settings.get('sign_url', None)
+        is_deterministic = rse_settings.get('deterministic', True)
+
+        trace = copy.deepcopy(self.trace)
+        trace['scope'] = file['did_scope']
+        trace['datasetScope'] = file.get('dataset_scope', '')
+        trace['dataset'] = file.get('dataset_name', '')
+        trace['remoteSite'] = rse
+        trace['filesize'] = file['bytes']
+
+        file_did = {'scope': file['did_scope'], 'name': file['did_name']}
+
+        # if register_after_upload, file should be overwritten if it is not registered
+        # otherwise if file already exists on RSE we're done
+        if register_after_upload:
+            if rsemgr.exists(rse_settings, pfn if pfn else file_did):
+                try:
+                    self.client.get_did(file['did_scope'], file['did_name'])
+                    logger.info('File already registered. Skipping upload.')
+                    return False
+                except DataIdentifierNotFound:
+                    logger.info('File already exists on RSE. Previous left overs will be overwritten.')
+                    delete_existing = True
+        elif not is_deterministic and not no_register:
+            if rsemgr.exists(rse_settings, pfn):
+                logger.info('File already exists on RSE with given pfn. Skipping upload. Existing replica has to be removed first.')
+                return False
+            elif rsemgr.exists(rse_settings, file_did):
+                logger.info('File already exists on RSE with different pfn. Skipping upload.')
+                return False
+        else:
+            if rsemgr.exists(rse_settings, pfn if pfn else file_did):
+                logger.info('File already exists on RSE. Skipping upload')
+                return False
+        protocols = rsemgr.get_protocols_ordered(rse_settings=rse_settings, operation='write', scheme=force_scheme)
+        protocols.reverse()
+        success = False
+        state_reason = ''
+        while not success and len(protocols):
+            protocol = protocols.pop()
+            cur_scheme = protocol['scheme']
+            logger.info('Trying upload with %s to %s' % (cur_scheme, rse))
+            lfn = {}
+            lfn['filename'] = basename
+            lfn['scope'] = file['did_scope']
+            lfn['name'] = file['did_name']
+            lfn['adler32'] = file['adler32']
+            lfn['filesize'] = file['bytes']
+
+            sign_service = None
+            if cur_scheme == 'https':
+                sign_service = rse_sign_service
+
+            trace['protocol'] = cur_scheme
+            trace['transferStart'] = time.time()
+            try:
+                state = rsemgr.upload(rse_settings=rse_settings,
+                                      lfns=lfn,
+                                      source_dir=file['dirname'],
+                                      force_scheme=cur_scheme,
+                                      force_pfn=pfn,
+                                      transfer_timeout=file.get('transfer_timeout'),
+                                      delete_existing=delete_existing,
+                                      sign_service=sign_service)
+                success = state['success']
+                file['upload_result'] = state
+            except (ServiceUnavailable, ResourceTemporaryUnavailable) as error:
+                logger.warning('Upload attempt failed')
+                logger.debug('Exception: %s' % str(error))
+                state_reason = str(error)
+
+        if success:
+            trace['transferEnd'] = time.time()
+            trace['clientState'] = 'DONE'
+            file['state'] = 'A'
+            logger.info('Successfully uploaded file %s' % basename)
+            self._send_trace(trace)
+        else:
+            trace['clientState'] = 'FAILED'
+            trace['stateReason'] = state_reason
+            self._send_trace(trace)
+            logger.error('Failed to upload file %s' % basename)
+        return success
+
+    def _register_files(self, files, registered_dataset_dids):
+        """
+        Registers the given files in Rucio with bulk calls, like _register_file does for one file.
+        (This function is meant to be used as class internal only)
+
+        :param files: list of dictionaries describing the files
+        :param registered_dataset_dids: set of dataset dids that were already registered
+
+        :raises DataIdentifierAlreadyExists: if a file DID is already registered and the checksums do not match
+        """
+        logger = self.logger
+        if not files:
+            return
+        logger.debug('Registering %d files' % len(files))
+        for file in files:
+            dataset_did_str = file.get('dataset_did_str')
+            if dataset_did_str and dataset_did_str not in registered_dataset_dids:
+                self._register_dataset(file, registered_dataset_dids)
+
+        # one call for the file DIDs which exist already, one for the RSEs of their replicas
+        file_dids = [{'scope': file['did_scope'], 'name': file['did_name']} for file in files]
+        existing_files = {}
+        for meta in self.client.get_metadata_bulk(file_dids):
+            existing_files['%s:%s' % (meta['scope'], meta['name'])] = meta
+        existing_rses = {}
+        if existing_files:
+            existing_dids = [{'scope': meta['scope'], 'name': meta['name']} for meta in existing_files.values()]
+            for replica in self.client.list_replicas(existing_dids, all_states=True):
+                # an empty result is returned as an empty string
+                if isinstance(replica, dict):
+                    existing_rses['%s:%s' % (replica['scope'], replica['name'])] = replica['rses']
+
+        new_replicas = {}
+        new_rules = {}
+        for file in files:
+            rse = file['rse']
+            file_did_str = '%s:%s' % (file['did_scope'], file['did_name'])
+            existing_file = existing_files.get(file_did_str)
+            if existing_file is not None:
+                logger.info('File DID %s already exists' % file_did_str)
+                # if the remote checksum is different this did must not be used
+                logger.debug('local checksum: %s, remote checksum: %s' % (file['adler32'], existing_file['adler32']))
+                if existing_file['adler32'] != file['adler32']:
+                    logger.error('Local checksum %s does not match remote checksum %s' % (file['adler32'], existing_file['adler32']))
+                    raise DataIdentifierAlreadyExists
+                # add file to rse if it is not registered yet
+                if rse in existing_rses.get(file_did_str, {}):
+                    continue
+            elif not file.get('dataset_did_str'):
+                # only need to add rules for files if no dataset is given
+                new_rules.setdefault((rse, file.get('lifetime')), {})[file_did_str] = {'scope': file['did_scope'], 'name': file['did_name']}
+            new_replicas.setdefault(rse, {})[file_did_str] = self._convert_file_for_api(file)
+
+        for rse, replicas in new_replicas.items():
+            self.client.add_replicas(rse=rse, files=list(replicas.values()))
+            logger.info('Successfully added %d replicas in Rucio catalogue at %s' % (len(replicas), rse))
+        for (rse, lifetime), dids in new_rules.items():
+            self.client.add_replication_rule(list(dids.values()), copies=1, rse_expression=rse, lifetime=lifetime)
+            logger.info('Successfully added %d replication rules at %s' % (len(dids), rse))
+
+    def _finish_registration(self, files):
+        """
+        Marks the replicas of the uploaded files as available and attaches the files
+        to their datasets with bulk calls.
+        (This function is meant to be used as class internal only)
+
+        :param files: list of dictionaries describing the uploaded files
+        """
+        logger = self.logger
+        replicas = {}
+        attachments = {}
+        for file in files:
+            replicas.setdefault(file['rse'], []).append(self._convert_file_for_api(file))
+            if file.get('dataset_did_str'):
+                attachments.setdefault((file['dataset_scope'], file['dataset_name']), []).append({'scope': file['did_scope'], 'name': file['did_name']})
+
+        for rse, rse_replicas in replicas.items():
+            if not self.client.update_replicas_states(rse, files=rse_replicas):
+                logger.warning('Failed to update replica state')
+
+        if not attachments:
+            return
+        try:
+            self.client.attach_dids_to_dids([{'scope': scope, 'name': name, 'dids': dids} for (scope, name), dids in attachments.items()],
+                                            ignore_duplicate=True)
+        except Exception as error:
+            logger.warning('Failed to attach files to the datasets')
+            logger.debug(error)
+
     def _register_file(self, file, registered_dataset_dids):
         """
         Registers the given file in Rucio. Creates a dataset if
@@ -294,19 +489,7 @@ class UploadClient:
         dataset_did_str = file.get('dataset_did_str')
         # register a dataset if we need to
         if dataset_did_str and dataset_did_str not in registered_dataset_dids:
-            registered_dataset_dids.add(dataset_did_str)
-            try:
-                logger.debug('Trying to create dataset: %s' % dataset_did_str)
-                self.client.add_dataset(scope=file['dataset_scope'],
-                                        name=file['dataset_name'],
-                                        rules=[{'account': self.client.account,
-                                                'copies': 1,
-                                                'rse_expression': rse,
-                                                'grouping': 'DATASET',
-                                                'lifetime': file.get('lifetime')}])
-                logger.info('Successfully created dataset %s' % dataset_did_str)
-            except DataIdentifierAlreadyExists:
-                logger.debug('Dataset %s already exists' % dataset_did_str)
+            self._register_dataset(file, registered_dataset_dids)
         else:
             logger.debug('Skipping dataset registration')
 
@@ -339,6 +522,30 @@ class UploadClient:
                 self.client.add_replication_rule([file_did], copies=1, rse_expression=rse, lifetime=file.get('lifetime'))
                 logger.info('Successfully added replication rule at %s' % rse)
 
+    def _register_dataset(self, file, registered_dataset_dids):
+        """
+        Creates the dataset of the given file with a replication rule on the RSE of the file.
+        (This function is meant to be used as class internal only)
+
+        :param file: dictionary describing the file
+        :param registered_dataset_dids: set of dataset dids that were already registered
+        """
+        logger = self.logger
+        dataset_did_str = file['dataset_did_str']
+        registered_dataset_dids.add(dataset_did_str)
+        try:
+            logger.debug('Trying to create dataset: %s' % dataset_did_str)
+            self.client.add_dataset(scope=file['dataset_scope'],
+                                    name=file['dataset_name'],
+                                    rules=[{'account': self.client.account,
+                                            'copies': 1,
+                                            'rse_expression': file['rse'],
+                                            'grouping': 'DATASET',
+                                            'lifetime': file.get('lifetime')}])
+            logger.info('Successfully created dataset %s' % dataset_did_str)
+        except DataIdentifierAlreadyExists:
+            logger.debug('Dataset %s already exists' % dataset_did_str)
+
     def _get_file_guid(self, file):
         """
         Get the guid of a file, trying different strategies
@@ -365,7 +572,7 @@ class UploadClient:
             guid = generate_uuid()
         return guid
 
-    def _collect_file_info(self, filepath, item):
+    def _collect_file_info(self, filepath, item, file_checksums=None):
         """
         Collects infos (e.g. size, checksums, etc.) about the file and
         returns them as a dictionary
@@ -373,6 +580,7 @@ class UploadClient:
 
         :param filepath: path where the file is stored
         :param item: input options for the given file
+        :param file_checksums: adler32 and md5 checksums of the file if already calculated
 
         :returns: a dictionary containing all collected info and the input options
         """
@@ -381,9 +589,11 @@ class UploadClient:
         new_item['dirname'] = os.path.dirname(filepath)
         new_item['basename'] = os.path.basename(filepath)
 
+        if not file_checksums:
+            file_checksums = checksums(filepath, ('adler32', 'md5'))
         new_item['bytes'] = os.stat(filepath).st_size
-        new_item['adler32'] = adler32(filepath)
-        new_item['md5'] = md5(filepath)
+        new_item['adler32'] = file_checksums['adler32']
+        new_item['md5'] = file_checksums['md5']
         new_item['meta'] = {'guid': self._get_file_guid(new_item)}
         new_item['state'] = 'C'
         if not new_item.get('did_scope'):
@@ -407,6 +617,7 @@ class UploadClient:
         """
         logger = self.logger
         files = []
+        paths = []
         for item in items:
             path = item.get('path')
             pfn = item.get('pfn')
@@ -422,18 +633,21 @@ class UploadClient:
             if os.path.isdir(path):
                 dname, subdirs, fnames = next(os.walk(path))
                 for fname in fnames:
-                    file = self._collect_file_info(os.path.join(dname, fname), item)
-                    files.append(file)
+                    paths.append((os.path.join(dname, fname), item))
                 if not len(fnames) and not len(subdirs):
                     logger.warning('Skipping %s because it is empty.' % dname)
                 elif not len(fnames):
                     logger.warning('Skipping %s because it has no files in it. Subdirectories are not supported.' % dname)
             elif os.path.isfile(path):
-                file = self._collect_file_info(path, item)
-                files.append(file)
+                paths.append((path, item))
             else:
                 logger.warning('No such file or directory: %s' % path)
 
+        # The files are read once for both checksums, several files at a time
+        file_checksums = checksums_of_files(set(path for path, _ in paths), ('adler32', 'md5'), threads=self.checksum_threads)
+        for path, item in paths:
+            files.append(self._collect_file_info(path, item, file_checksums[path]))
+
         if not len(files):
             raise InputValidationError('No valid input files given')
 
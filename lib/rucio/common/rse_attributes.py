@@ -17,18 +17,7 @@ methods to get closeness between sites
 import logging
 import traceback
 
-from dogpile.cache import make_region
-from dogpile.cache.api import NoValue
-
-from rucio.core import rse as rse_core
-
-REGION = make_region().configure('dogpile.cache.memcached',
-                                 expiration_time=3600,
-                                 arguments={'url': "127.0.0.1:11211", 'distributed_lock': True})
-
-# for local test
-# REGION = make_region().configure('dogpile.cache.memory',
-#                                  expiration_time=3600)
+from rucio.core.rse_cache import get_rse_snapshot
 
 
 def get_rse_attributes(rse_id, session=None):
@@ -42,12 +31,9 @@ def get_rse_attributes(rse_id, session=None):
     :returns: A dictionary with RSE attributes for a RSE.
     """
 
-    result = REGION.get(rse_id)
-    if isinstance(result, NoValue):
-        try:
-            result = None
-            result = rse_core.list_rse_attributes(None, rse_id=rse_id, session=session)
-            REGION.set(rse_id, result)
-        except:
-            logging.warning("Failed to get RSE %s attributes, error: %s" % (rse_id, traceback.format_exc()))
+    result = None
+    try:
+        result = get_rse_snapshot(session=session).list_rse_attributes(rse_id)
+    except:
+        logging.warning("Failed to get RSE %s attributes, error: %s" % (rse_id, traceback.format_exc()))
     return result
@@ -45,6 +45,7 @@ import threading
 import time
 import zlib
 
+from concurrent.futures import ThreadPoolExecutor
 from getpass import getuser
 from logging import getLogger, Formatter
 from logging.handlers import RotatingFileHandler
@@ -170,6 +171,20 @@ def generate_uuid_bytes():
     return uuid().bytes
 
 
+# Number of buckets the work of the daemons is partitioned into, see rucio.core.work_lease
+WORK_BUCKETS = 1024
+
+
+def work_bucket(key):
+    """
+    Return the work bucket of a key, the same in all the processes.
+
+    :param key: The key as a string, e.g. a DID name.
+    :returns: The bucket number, from 0 to WORK_BUCKETS - 1.
+    """
+    return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:8], 16) % WORK_BUCKETS
+
+
 def clean_headers(msg):
     invalid_characters = ['\n', '\r']
     for c in invalid_characters:
@@ -177,28 +192,97 @@ def clean_headers(msg):
     return msg
 
 
-def adler32(file):
-    """
-    An Adler-32 checksum is obtained by calculating two 16-bit checksums A and B and concatenating their bits into a 32-bit integer. A is the sum of all bytes in the stream plus one, and B is the sum of the individual values of A from each step.
+CHECKSUM_CHUNK_SIZE = 4 * 1024 * 1024
 
-    :returns: Hexified string, padded to 8 values.
+
+class ChecksumCalculator(object):
     """
+    Incremental calculation of several checksums in a single pass over a stream of bytes,
+    e.g. to checksum the bytes of a download as they arrive instead of reading the file again.
+    The algorithms are adler32 and the ones of hashlib, e.g. md5 or sha256.
+    """
+
+    def __init__(self, algorithms=('adler32', 'md5')):
+        """
+        :param algorithms: The names of the checksum algorithms.
+        """
+        # adler starting value is _not_ 0
+        self.__adler32 = 1 if 'adler32' in algorithms else None
+        self.__hashes = dict((algorithm, hashlib.new(algorithm)) for algorithm in algorithms if algorithm != 'adler32')
+
+    def update(self, data):
+        """
+        Add bytes to the checksums.
 
-    # adler starting value is _not_ 0
-    adler = 1
+        :param data: The bytes, or any object supporting the buffer protocol.
+        """
+        if self.__adler32 is not None:
+            self.__adler32 = zlib.adler32(data, self.__adler32)
+        for hash_object in self.__hashes.values():
+            hash_object.update(data)
 
+    def hexdigests(self):
+        """
+        Return the checksums of the bytes added so far.
+
+        :returns: Dictionary {algorithm: hexadecimal checksum}, the adler32 being padded to 8 digits.
+        """
+        checksums = dict((algorithm, hash_object.hexdigest()) for algorithm, hash_object in self.__hashes.items())
+        if self.__adler32 is not None:
+            # backflip on 32bit
+            checksums['adler32'] = str('%08x' % (self.__adler32 & 0xffffffff))
+        return checksums
+
+
+def checksums(file, algorithms=('adler32', 'md5')):
+    """
+    Calculate several checksums of a file in a single pass, reading it by chunks of CHECKSUM_CHUNK_SIZE bytes
+    into the same buffer.
+
+    :param file: The path of the file.
+    :param algorithms: The names of the checksum algorithms.
+    :returns: Dictionary {algorithm: hexadecimal checksum}.
+    """
+    calculator = ChecksumCalculator(algorithms)
+    buffer = bytearray(CHECKSUM_CHUNK_SIZE)
+    view = memoryview(buffer)
     try:
-        with open(file, 'rb') as openFile:
-            for line in openFile:
-                adler = zlib.adler32(line, adler)
+        with open(file, 'rb', buffering=0) as open_file:
+            while True:
+                size = open_file.readinto(buffer)
+                if not size:
+                    break
+                calculator.update(view[:size])
     except Exception as e:
-        raise Exception('FATAL - could not get Adler32 checksum of file %s - %s' % (file, e))
+        names = {'adler32': 'Adler32', 'md5': 'MD5'}
+        raise Exception('FATAL - could not get %s checksum of file %s - %s' % ('/'.join(names.get(algorithm, algorithm) for algorithm in algorithms), file, e))
+    return calculator.hexdigests()
+
 
-    # backflip on 32bit
-    if adler < 0:
-        adler = adler + 2 ** 32
+def checksums_of_files(files, algorithms=('adler32', 'md5'), threads=4):
+    """
+    Calculate several checksums of files, in parallel over a pool of threads.
+    The checksum algorithms release the GIL, so the files are read and checksummed concurrently.
+
+    :param files: The paths of the files.
+    :param algorithms: The names of the checksum algorithms.
+    :param threads: The number of threads.
+    :returns: Dictionary {path: {algorithm: hexadecimal checksum}}.
+    """
+    files = list(files)
+    if threads <= 1 or len(files) <= 1:
+        return dict((file, checksums(file, algorithms)) for file in files)
+    with ThreadPoolExecutor(max_workers=min(threads, len(files))) as executor:
+        return dict(zip(files, executor.map(lambda file: checksums(file, algorithms), files)))
+
+
+def adler32(file):
+    """
+    An Adler-32 checksum is obtained by calculating two 16-bit checksums A and B and concatenating their bits into a 32-bit integer. A is the sum of all bytes in the stream plus one, and B is the sum of the individual values of A from each step.
 
-    return str('%08x' % adler)
+    :returns: Hexified string, padded to 8 values.
+    """
+    return checksums(file, ('adler32', ))['adler32']
 
 
 def md5(file):
@@ -208,14 +292,7 @@ def md5(file):
     :param string: file name
     :returns: string of 32 hexadecimal digits
     """
-    hash_md5 = hashlib.md5()
-    try:
-        with open(file, "rb") as f:
-            list(map(hash_md5.update, iter(lambda: f.read(4096), b"")))
-    except Exception as e:
-        raise Exception('FATAL - could not get MD5 checksum of file %s - %s' % (file, e))
-
-    return hash_md5.hexdigest()
+    return checksums(file, ('md5', ))['md5']
 
 
 def str_to_date(string):
@@ -869,6 +946,10 @@ def parse_did_filter_from_string(input_string):
     return filters, type
 
 
+# metalink namespace
+METALINK_NS = '{urn:ietf:params:xml:ns:metalink}'
+
+
 def parse_replicas_from_file(path):
     """
     Parses the output of list_replicas from a json or metalink file
@@ -920,51 +1001,104 @@ def parse_replicas_metalink(root):
 
     :returns: a list with a dictionary for each file
     """
-    files = []
+    # loop over all <file> tags of the metalink string
+    return [__parse_metalink_file(file_tag_obj) for file_tag_obj in root.findall(METALINK_NS + 'file')]
+
+
+def iter_replicas_metalink(source):
+    """
+    Parses a metalink document incrementally and yields the dictionary of each
+    file as soon as its <file> tag is complete, without building the whole tree.
 
-    # metalink namespace
-    ns = '{urn:ietf:params:xml:ns:metalink}'
+    :param source: the path or the file object of the metalink document
+
+    :returns: a generator of dictionaries describing a file with its replicas, see parse_replicas_metalink
+    """
+    root = None
+    try:
+        for event, element in ElementTree.iterparse(source, events=('start', 'end')):
+            if root is None:
+                root = element
+            elif event == 'end' and element.tag == METALINK_NS + 'file':
+                yield __parse_metalink_file(element)
+                # drop the parsed <file> tags to keep the memory constant
+                root.clear()
+    except ElementTree.ParseError as xml_err:
+        raise MetalinkJsonParsingError(source, xml_err, 'not attempted')
+
+
+def parse_replica_json(replica):
+    """
+    Transforms a replica of the JSON output of list_replicas into a
+    dictionary describing the file with its replicas, as returned by
+    parse_replicas_metalink. The sources are ordered like in the metalink.
+
+    :param replica: the dictionary of the replica
+
+    :returns: a dictionary describing the file with its replicas
+    """
+    pfns = replica.get('pfns') or {}
+    sources = []
+    for pfn in sorted(pfns, key=lambda pfn: (pfns[pfn]['domain'], pfns[pfn]['priority'], pfns[pfn]['rse'], pfns[pfn]['client_extract'])):
+        sources.append({'rse': pfns[pfn]['rse'],
+                        'domain': pfns[pfn]['domain'],
+                        'priority': pfns[pfn]['priority'],
+                        'client_extract': pfns[pfn]['client_extract'],
+                        'pfn': pfn})
+    return {'did': '%s:%s' % (replica['scope'], replica['name']),
+            'adler32': replica.get('adler32'),
+            'md5': replica.get('md5'),
+            'bytes': replica.get('bytes'),
+            'parent_dids': set(replica.get('parents') or []),
+            'sources': sources}
+
+
+def __parse_metalink_file(file_tag_obj):
+    """
+    Transforms a <file> tag of a metalink into a dictionary describing the file with its replicas.
+
+    :param file_tag_obj: the <file> node
+
+    :returns: a dictionary describing the file with its replicas
+    """
+    ns = METALINK_NS
     str_to_bool = {'true': True, 'True': True, 'false': False, 'False': False}
 
-    # loop over all <file> tags of the metalink string
-    for file_tag_obj in root.findall(ns + 'file'):
-        # search for identity-tag
-        identity_tag_obj = file_tag_obj.find(ns + 'identity')
-        if not ElementTree.iselement(identity_tag_obj):
-            raise InputValidationError('Failed to locate identity-tag inside %s' % ElementTree.tostring(file_tag_obj))
-
-        cur_file = {'did': identity_tag_obj.text,
-                    'adler32': None,
-                    'md5': None,
-                    'sources': []}
-
-        parent_dids = set()
-        parent_dids_tag_obj = file_tag_obj.find(ns + 'parents')
-        if ElementTree.iselement(parent_dids_tag_obj):
-            for did_tag_obj in parent_dids_tag_obj.findall(ns + 'did'):
-                parent_dids.add(did_tag_obj.text)
-        cur_file['parent_dids'] = parent_dids
-
-        size_tag_obj = file_tag_obj.find(ns + 'size')
-        cur_file['bytes'] = int(size_tag_obj.text) if ElementTree.iselement(size_tag_obj) else None
-
-        for hash_tag_obj in file_tag_obj.findall(ns + 'hash'):
-            hash_type = hash_tag_obj.get('type')
-            if hash_type:
-                cur_file[hash_type] = hash_tag_obj.text
-
-        for url_tag_obj in file_tag_obj.findall(ns + 'url'):
-            key_rename_map = {'location': 'rse'}
-            src = {}
-            for k, v in url_tag_obj.items():
-                k = key_rename_map.get(k, k)
-                src[k] = str_to_bool.get(v, v)
-            src['pfn'] = url_tag_obj.text
-            cur_file['sources'].append(src)
-
-        files.append(cur_file)
-
-    return files
+    # search for identity-tag
+    identity_tag_obj = file_tag_obj.find(ns + 'identity')
+    if not ElementTree.iselement(identity_tag_obj):
+        raise InputValidationError('Failed to locate identity-tag inside %s' % ElementTree.tostring(file_tag_obj))
+
+    cur_file = {'did': identity_tag_obj.text,
+                'adler32': None,
+                'md5': None,
+                'sources': []}
+
+    parent_dids = set()
+    parent_dids_tag_obj = file_tag_obj.find(ns + 'parents')
+    if ElementTree.iselement(parent_dids_tag_obj):
+        for did_tag_obj in parent_dids_tag_obj.findall(ns + 'did'):
+            parent_dids.add(did_tag_obj.text)
+    cur_file['parent_dids'] = parent_dids
+
+    size_tag_obj = file_tag_obj.find(ns + 'size')
+    cur_file['bytes'] = int(size_tag_obj.text) if ElementTree.iselement(size_tag_obj) else None
+
+    for hash_tag_obj in file_tag_obj.findall(ns + 'hash'):
+        hash_type = hash_tag_obj.get('type')
+        if hash_type:
+            cur_file[hash_type] = hash_tag_obj.text
+
+    for url_tag_obj in file_tag_obj.findall(ns + 'url'):
+        key_rename_map = {'location': 'rse'}
+        src = {}
+        for k, v in url_tag_obj.items():
+            k = key_rename_map.get(k, k)
+            src[k] = str_to_bool.get(v, v)
+        src['pfn'] = url_tag_obj.text
+        cur_file['sources'].append(src)
+
+    return cur_file
 
 
 def get_thread_with_periodic_running_function(interval, action, graceful_stop):
@@ -1312,6 +1312,29 @@ def get_metadata(scope, name, session=None):
         raise exception.DataIdentifierNotFound("Data identifier '%(scope)s:%(name)s' not found" % locals())
 
 
+@stream_session
+def get_metadata_bulk(dids, session=None):
+    """
+    Get the metadata of a list of data identifiers.
+    The data identifiers which do not exist are skipped.
+
+    :param dids: A list of dids [{'scope': scope, 'name': name}, ...].
+    :param session: The database session in use.
+    :returns: A generator of dictionaries with the data identifier columns.
+    """
+    for chunk in chunks(dids, 100):
+        condition = or_(*[and_(models.DataIdentifier.scope == did['scope'],
+                               models.DataIdentifier.name == did['name']) for did in chunk])
+        query = session.query(models.DataIdentifier).\
+            with_hint(models.DataIdentifier, "INDEX(DIDS DIDS_PK)", 'oracle').\
+            filter(condition)
+        for row in query:
+            d = {}
+            for column in row.__table__.columns:
+                d[column.name] = getattr(row, column.name)
+            yield d
+
+
 @read_session
 def get_did_meta(scope, name, session=None):
     """
@@ -1506,33 +1529,16 @@ def set_status(scope, name, session=None, **kwargs):
                 rucio.core.rule.generate_rule_notifications(rule=rule, session=session)
 
 
-@stream_session
-def list_dids(scope, filters, type='collection', ignore_case=False, limit=None,
-              offset=None, long=False, recursive=False, session=None):
+def __filter_dids(query, filters, type, session):
     """
-    Search data identifiers
+    Apply the type and the attribute filters of a DID search to a query on the dids table.
 
-    :param scope: the scope name.
+    :param query: The query on models.DataIdentifier.
     :param filters: dictionary of attributes by which the results should be filtered.
     :param type: the type of the did: all(container, dataset, file), collection(dataset or container), dataset, container, file.
-    :param ignore_case: ignore case distinctions.
-    :param limit: limit number.
-    :param offset: offset number.
-    :param long: Long format option to display more information for each DID.
     :param session: The database session in use.
-    :param recursive: Recursively list DIDs content.
+    :returns: The filtered query.
     """
-    types = ['all', 'collection', 'container', 'dataset', 'file']
-    if type not in types:
-        raise exception.UnsupportedOperation("Valid type are: %(types)s" % locals())
-
-    query = session.query(models.DataIdentifier.scope,
-                          models.DataIdentifier.name,
-                          models.DataIdentifier.did_type,
-                          models.DataIdentifier.bytes,
-                          models.DataIdentifier.length).\
-        filter(models.DataIdentifier.scope == scope)
-
     # Exclude suppressed dids
     query = query.filter(models.DataIdentifier.suppressed != true())
 
@@ -1587,6 +1593,46 @@ def list_dids(scope, filters, type='collection', ignore_case=False, limit=None,
             query = query.filter(models.DataIdentifier.length == v)
         else:
             query = query.filter(getattr(models.DataIdentifier, k) == v)
+    return query
+
+
+@stream_session
+def list_dids(scope, filters, type='collection', ignore_case=False, limit=None,
+              offset=None, long=False, recursive=False, marker=None, session=None):
+    """
+    Search data identifiers
+
+    The DIDs of the scope are streamed by batches of [api] list_dids_batch rows with a server-side cursor.
+    With a limit or a marker, they are sorted by name so that the listing can be resumed after
+    the last DID of the previous page (keyset pagination).
+    In recursive mode, the content of the matching collections is expanded breadth-first:
+    one query per level of the hierarchy and per batch of parent collections.
+
+    :param scope: the scope name.
+    :param filters: dictionary of attributes by which the results should be filtered.
+    :param type: the type of the did: all(container, dataset, file), collection(dataset or container), dataset, container, file.
+    :param ignore_case: ignore case distinctions.
+    :param limit: limit number.
+    :param offset: offset number.
+    :param long: Long format option to display more information for each DID.
+    :param session: The database session in use.
+    :param recursive: Recursively list DIDs content.
+    :param marker: Name of the last DID of the previous page, the DIDs are listed after it.
+    """
+    types = ['all', 'collection', 'container', 'dataset', 'file']
+    if type not in types:
+        raise exception.UnsupportedOperation("Valid type are: %(types)s" % locals())
+    if recursive and marker:
+        raise exception.UnsupportedOperation("The pagination with a marker is not supported for the recursive listing")
+
+    batch = int(config_get('api', 'list_dids_batch', raise_exception=False, default=1000))
+    query = session.query(models.DataIdentifier.scope,
+                          models.DataIdentifier.name,
+                          models.DataIdentifier.did_type,
+                          models.DataIdentifier.bytes,
+                          models.DataIdentifier.length).\
+        filter(models.DataIdentifier.scope == scope)
+    query = __filter_dids(query, filters, type, session)
 
     if 'name' in filters:
         if '*' in filters['name']:
@@ -1596,33 +1642,66 @@ def list_dids(scope, filters, type='collection', ignore_case=False, limit=None,
             query = query.\
                 with_hint(models.DataIdentifier, "INDEX(DIDS DIDS_PK)", 'oracle')
 
-    if limit:
+    if marker:
+        query = query.filter(models.DataIdentifier.name > marker)
+    if limit or marker:
+        query = query.order_by(models.DataIdentifier.name)
+    if limit and not recursive:
         query = query.limit(limit)
 
-    if recursive:
-        # Get attachted DIDs and save in list because query has to be finished before starting a new one in the recursion
-        collections_content = []
-        parent_scope = scope
-        for scope, name, did_type, bytes, length in query.yield_per(100):
-            if (did_type == DIDType.CONTAINER or did_type == DIDType.DATASET):
-                collections_content += [did for did in list_content(scope=scope, name=name)]
-
-        # List DIDs again to use filter
-        for did in collections_content:
-            filters['name'] = did['name']
-            for result in list_dids(scope=did['scope'], filters=filters, recursive=True, type=type, limit=limit, offset=offset, long=long, session=session):
-                yield result
-
-    if long:
-        for scope, name, did_type, bytes, length in query.yield_per(5):
-            yield {'scope': scope,
-                   'name': name,
-                   'did_type': str(did_type),
-                   'bytes': bytes,
-                   'length': length}
-    else:
-        for scope, name, did_type, bytes, length in query.yield_per(5):
-            yield name
+    def format_did(scope, name, did_type, bytes, length):
+        if long:
+            return {'scope': scope,
+                    'name': name,
+                    'did_type': str(did_type),
+                    'bytes': bytes,
+                    'length': length}
+        return name
+
+    nb_dids = 0
+    collections = []
+    for scope, name, did_type, bytes, length in query.yield_per(batch):
+        if recursive and did_type in (DIDType.CONTAINER, DIDType.DATASET):
+            collections.append((scope, name))
+        yield format_did(scope, name, did_type, bytes, length)
+        nb_dids += 1
+        if recursive and limit and nb_dids >= limit:
+            return
+
+    if not recursive:
+        return
+
+    # The content of the collections is filtered like the DIDs of the scope, except for their name
+    content_filters = dict((k, v) for k, v in filters.items() if k != 'name')
+    seen = set(collections)
+    while collections:
+        children = []
+        for chunk in chunks(collections, 100):
+            query = session.query(models.DataIdentifier.scope,
+                                  models.DataIdentifier.name,
+                                  models.DataIdentifier.did_type,
+                                  models.DataIdentifier.bytes,
+                                  models.DataIdentifier.length).\
+                join(models.DataIdentifierAssociation,
+                     and_(models.DataIdentifierAssociation.child_scope == models.DataIdentifier.scope,
+                          models.DataIdentifierAssociation.child_name == models.DataIdentifier.name)).\
+                filter(or_(*[and_(models.DataIdentifierAssociation.scope == parent_scope,
+                                  models.DataIdentifierAssociation.name == parent_name)
+                             for parent_scope, parent_name in chunk])).\
+                with_hint(models.DataIdentifierAssociation, "INDEX(CONTENTS CONTENTS_PK)", 'oracle')
+            query = __filter_dids(query, content_filters, type, session)
+            for scope, name, did_type, bytes, length in query.yield_per(batch):
+                if (scope, name) in seen:
+                    # Attached to several collections of the hierarchy
+                    continue
+                seen.add((scope, name))
+                if did_type in (DIDType.CONTAINER, DIDType.DATASET):
+                    children.append((scope, name))
+                yield format_did(scope, name, did_type, bytes, length)
+                nb_dids += 1
+                if limit and nb_dids >= limit:
+                    return
+        collections = children
 
 
 @read_session
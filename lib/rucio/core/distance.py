@@ -17,6 +17,7 @@ from sqlalchemy.exc import DatabaseError, IntegrityError
 from sqlalchemy.orm import aliased
 
 from rucio.common import exception
+from rucio.core.rse import bump_rse_version
 from rucio.db.sqla.models import Distance, RSE
 from rucio.db.sqla.session import transactional_session, read_session
 
@@ -44,6 +45,7 @@ def add_distance(src_rse_id, dest_rse_id, ranking=None, agis_distance=None, geoi
         new_distance = Distance(src_rse_id=src_rse_id, dest_rse_id=dest_rse_id, ranking=ranking, agis_distance=agis_distance, geoip_distance=geoip_distance,
                                 active=active, submitted=submitted, finished=finished, failed=failed, transfer_speed=transfer_speed)
         new_distance.save(session=session)
+        bump_rse_version(['distances'], session=session)
     except IntegrityError:
         raise exception.Duplicate('Distance from %s to %s already exists!' % (src_rse_id, dest_rse_id))
     except DatabaseError as error:
@@ -117,6 +119,7 @@ def delete_distances(src_rse_id=None, dest_rse_id=None, session=None):
             query = query.filter(Distance.dest_rse_id == dest_rse_id)
 
         query.delete()
+        bump_rse_version(['distances'], session=session)
     except IntegrityError as error:
         raise exception.RucioException(error.args)
 
@@ -142,6 +145,7 @@ def update_distances(src_rse_id=None, dest_rse_id=None, parameters=None, session
         if dest_rse_id:
             query = query.filter(Distance.dest_rse_id == dest_rse_id)
         query.update(params)
+        bump_rse_version(['distances'], session=session)
     except IntegrityError as error:
         raise exception.RucioException(error.args)
 
@@ -23,14 +23,14 @@ from sqlalchemy.exc import DatabaseError
 from sqlalchemy.sql.expression import and_, or_
 
 import rucio.core.rule
-import rucio.core.did
 
 from rucio.common.config import config_get
 from rucio.common.exception import RSENotFound
+from rucio.common.utils import chunks
 from rucio.core.lifetime_exception import define_eol
 from rucio.core.rse import get_rse_name, get_rse_id
 from rucio.db.sqla import models
-from rucio.db.sqla.constants import LockState, RuleState, RuleGrouping, DIDType, RuleNotification
+from rucio.db.sqla.constants import LockState, RuleState, RuleGrouping, RuleNotification
 from rucio.db.sqla.session import read_session, transactional_session, stream_session
 
 logging.basicConfig(stream=sys.stdout,
@@ -293,36 +293,59 @@ def successful_transfer(scope, name, rse_id, nowait, session=None):
     :param session:  DB Session.
     """
 
-    locks = session.query(models.ReplicaLock).with_for_update(nowait=nowait).filter_by(scope=scope, name=name, rse_id=rse_id)
-    for lock in locks:
-        if lock.state == LockState.OK:
-            continue
-        logging.debug('Marking lock %s:%s for rule %s on rse %s as OK' % (lock.scope, lock.name, str(lock.rule_id), str(lock.rse_id)))
-        # Update the rule counters
-        rule = session.query(models.ReplicationRule).with_for_update(nowait=nowait).filter_by(id=lock.rule_id).one()
-        logging.debug('Updating rule counters for rule %s [%d/%d/%d]' % (str(rule.id), rule.locks_ok_cnt, rule.locks_replicating_cnt, rule.locks_stuck_cnt))
+    successful_transfers(replicas=[{'scope': scope, 'name': name, 'rse_id': rse_id}], nowait=nowait, session=session)
 
-        if lock.state == LockState.REPLICATING:
-            rule.locks_replicating_cnt -= 1
-        elif lock.state == LockState.STUCK:
-            rule.locks_stuck_cnt -= 1
-        rule.locks_ok_cnt += 1
-        lock.state = LockState.OK
-        logging.debug('Finished updating rule counters for rule %s [%d/%d/%d]' % (str(rule.id), rule.locks_ok_cnt, rule.locks_replicating_cnt, rule.locks_stuck_cnt))
 
-        # Insert UpdatedCollectionReplica
-        if rule.did_type == DIDType.DATASET:
-            models.UpdatedCollectionReplica(scope=rule.scope,
-                                            name=rule.name,
-                                            did_type=rule.did_type,
-                                            rse_id=rse_id).save(flush=False, session=session)
-        elif rule.did_type == DIDType.CONTAINER:
-            # Resolve to all child datasets
-            for dataset in rucio.core.did.list_child_datasets(scope=rule.scope, name=rule.name, session=session):
-                models.UpdatedCollectionReplica(scope=dataset['scope'],
-                                                name=dataset['name'],
-                                                did_type=dataset['type'],
-                                                rse_id=rse_id).save(flush=False, session=session)
+@transactional_session
+def successful_transfers(replicas, nowait, session=None):
+    """
+    Update the state of all replica locks because of successful transfers.
+
+    The locks and the affected rules are selected for update in bulk, the counter changes
+    are aggregated per rule, and each rule is updated and written to the history once.
+
+    :param replicas: List of dictionaries with the scope, name and rse_id of the transferred files.
+    :param nowait:   Nowait parameter for the for_update queries.
+    :param session:  DB Session.
+    """
+
+    # Select the locks which are not OK yet, and aggregate the counter changes per rule
+    lock_clauses, deltas = [], {}
+    for chunk in chunks(replicas, 100):
+        query = session.query(models.ReplicaLock.scope, models.ReplicaLock.name, models.ReplicaLock.rse_id, models.ReplicaLock.rule_id, models.ReplicaLock.state).\
+            with_for_update(nowait=nowait).\
+            filter(models.ReplicaLock.state != LockState.OK).\
+            filter(or_(*[and_(models.ReplicaLock.scope == replica['scope'],
+                              models.ReplicaLock.name == replica['name'],
+                              models.ReplicaLock.rse_id == replica['rse_id']) for replica in chunk]))
+        for lock_scope, lock_name, lock_rse_id, rule_id, state in query:
+            logging.debug('Marking lock %s:%s for rule %s on rse %s as OK' % (lock_scope, lock_name, str(rule_id), str(lock_rse_id)))
+            lock_clauses.append(and_(models.ReplicaLock.scope == lock_scope,
+                                     models.ReplicaLock.name == lock_name,
+                                     models.ReplicaLock.rse_id == lock_rse_id,
+                                     models.ReplicaLock.rule_id == rule_id))
+            delta = deltas.setdefault(rule_id, {'ok': 0, 'replicating': 0, 'stuck': 0})
+            delta['ok'] += 1
+            if state == LockState.REPLICATING:
+                delta['replicating'] += 1
+            elif state == LockState.STUCK:
+                delta['stuck'] += 1
+
+    for chunk in chunks(lock_clauses, 100):
+        session.query(models.ReplicaLock).filter(or_(*chunk)).update({'state': LockState.OK}, synchronize_session=False)
+
+    rules = []
+    for chunk in chunks(list(deltas), 1000):
+        rules.extend(session.query(models.ReplicationRule).with_for_update(nowait=nowait).filter(models.ReplicationRule.id.in_(chunk)).all())
+
+    for rule in rules:
+        delta = deltas[rule.id]
+        logging.debug('Updating rule counters for rule %s [%d/%d/%d]' % (str(rule.id), rule.locks_ok_cnt, rule.locks_replicating_cnt, rule.locks_stuck_cnt))
+        replicating_locks_before = rule.locks_replicating_cnt
+        rule.locks_replicating_cnt -= delta['replicating']
+        rule.locks_stuck_cnt -= delta['stuck']
+        rule.locks_ok_cnt += delta['ok']
+        logging.debug('Finished updating rule counters for rule %s [%d/%d/%d]' % (str(rule.id), rule.locks_ok_cnt, rule.locks_replicating_cnt, rule.locks_stuck_cnt))
 
         # Update the rule state
         if rule.state == RuleState.SUSPENDED:
@@ -337,17 +360,17 @@ def successful_transfer(scope, name, rse_id, nowait, session=None):
                 for ds_lock in ds_locks:
                     ds_lock.state = LockState.OK
                 session.flush()
-            rucio.core.rule.generate_rule_notifications(rule=rule, replicating_locks_before=rule.locks_replicating_cnt + 1, session=session)
+            rucio.core.rule.generate_rule_notifications(rule=rule, replicating_locks_before=replicating_locks_before, session=session)
             if rule.notification == RuleNotification.YES:
                 rucio.core.rule.generate_email_for_rule_ok_notification(rule=rule, session=session)
             # Try to release potential parent rules
             rucio.core.rule.release_parent_rule(child_rule_id=rule.id, session=session)
         elif rule.locks_replicating_cnt > 0 and rule.state == RuleState.REPLICATING and rule.notification == RuleNotification.PROGRESS:
-            rucio.core.rule.generate_rule_notifications(rule=rule, replicating_locks_before=rule.locks_replicating_cnt + 1, session=session)
+            rucio.core.rule.generate_rule_notifications(rule=rule, replicating_locks_before=replicating_locks_before, session=session)
 
-        # Insert rule history
-        rucio.core.rule.insert_rule_history(rule=rule, recent=True, longterm=False, session=session)
-        session.flush()
+    session.flush()
+    # Insert rule history
+    rucio.core.rule.insert_rules_history(rules=rules, recent=True, longterm=False, session=session)
 
 
 @transactional_session
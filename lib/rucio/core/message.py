@@ -29,6 +29,7 @@ from sqlalchemy.sql.expression import bindparam, text
 
 
 from rucio.common.exception import InvalidObject, RucioException
+from rucio.core.work_lease import bucket_filter
 from rucio.db.sqla.models import Message, MessageHistory
 from rucio.db.sqla.session import transactional_session
 
@@ -60,7 +61,7 @@ def add_message(event_type, payload, session=None):
 
 @transactional_session
 def retrieve_messages(bulk=1000, thread=None, total_threads=None, event_type=None,
-                      lock=False, session=None):
+                      lock=False, buckets=None, session=None):
     """
     Retrieve up to $bulk messages.
 
@@ -69,6 +70,7 @@ def retrieve_messages(bulk=1000, thread=None, total_threads=None, event_type=Non
     :param total_threads: Maximum number of threads as an integer.
     :param event_type: Return only specified event_type. If None, returns everything except email.
     :param lock: Select exclusively some rows.
+    :param buckets: List of (first, last) work bucket ranges leased by the caller, used instead of thread and total_threads.
     :param session: The database session to use.
 
     :returns messages: List of dictionaries {id, created_at, event_type, payload}
@@ -76,7 +78,9 @@ def retrieve_messages(bulk=1000, thread=None, total_threads=None, event_type=Non
     messages = []
     try:
         subquery = session.query(Message.id)
-        if total_threads and (total_threads - 1) > 0:
+        if buckets is not None:
+            subquery = subquery.filter(bucket_filter(Message.bucket, buckets))
+        elif total_threads and (total_threads - 1) > 0:
             if session.bind.dialect.name == 'oracle':
                 bindparams = [bindparam('thread_number', thread), bindparam('total_threads', total_threads - 1)]
                 subquery = subquery.filter(text('ORA_HASH(id, :total_threads) = :thread_number', bindparams=bindparams))
@@ -30,9 +30,9 @@
 
 from __future__ import print_function
 from collections import defaultdict
-from copy import deepcopy
 from curses.ascii import isprint
 from datetime import datetime, timedelta
+from itertools import islice
 from json import dumps
 from re import match
 from six import string_types
@@ -62,6 +62,9 @@ from rucio.db.sqla.session import (read_session, stream_session, transactional_s
                                    DEFAULT_SCHEMA_NAME, get_engine)
 from rucio.rse import rsemanager as rsemgr
 
+# Number of replica rows for which the PFNs are built together in list_replicas
+LIST_REPLICAS_CHUNK_SIZE = 1000
+
 
 @read_session
 def get_bad_replicas_summary(rse_expression=None, from_date=None, to_date=None, session=None):
@@ -752,6 +755,213 @@ def _list_replicas_for_files(file_clause, state_clause, files, rse_clause, sessi
             {'scope': scope, 'name': name} in files and files.remove({'scope': scope, 'name': name})
 
 
+def _get_rse_pfn_context(rse, domain, schemes, client_location, sign_urls, session):
+    """
+    Resolve everything needed to build the PFNs of the replicas of one RSE.
+    This is done once per RSE and call of _list_replicas, not once per replica.
+
+    :param rse: The RSE name.
+    :param domain: The network domain selected for this RSE, either 'wan', 'lan' or 'all'.
+    :param schemes: A list of schemes to filter the replicas.
+    :param client_location: Client location dictionary for PFN modification {'ip', 'fqdn', 'site'}.
+    :param sign_urls: If set, the signing service of the RSE is resolved.
+    :param session: The database session in use.
+    :returns: Dictionary with the protocols [(domain, protocol, priority)], the root proxy and the signing service of the RSE.
+    """
+    rse_info = rsemgr.get_rse_info(rse, session=session)
+
+    # assign scheme priorities, and don't forget to exclude disabled protocols
+    # 0 in RSE protocol definition = disabled, 1 = highest priority
+    rse_info['priority_wan'] = {p['scheme']: p['domains']['wan']['read'] for p in rse_info['protocols'] if p['domains']['wan']['read'] > 0}
+    rse_info['priority_lan'] = {p['scheme']: p['domains']['lan']['read'] for p in rse_info['protocols'] if p['domains']['lan']['read'] > 0}
+
+    rse_schemes = list(schemes or [])
+    if not rse_schemes:
+        try:
+            if domain == 'all':
+                rse_schemes.append(rsemgr.select_protocol(rse_settings=rse_info,
+                                                          operation='read',
+                                                          domain='wan')['scheme'])
+                rse_schemes.append(rsemgr.select_protocol(rse_settings=rse_info,
+                                                          operation='read',
+                                                          domain='lan')['scheme'])
+            else:
+                rse_schemes.append(rsemgr.select_protocol(rse_settings=rse_info,
+                                                          operation='read',
+                                                          domain=domain)['scheme'])
+        except exception.RSEProtocolNotSupported:
+            pass  # no need to be verbose
+        except Exception:
+            print(format_exc())
+
+    protocols = []
+    for s in rse_schemes:
+        try:
+            if domain == 'all':
+                protocols.append(('lan', rsemgr.create_protocol(rse_settings=rse_info,
+                                                                operation='read',
+                                                                scheme=s,
+                                                                domain='lan'),
+                                  rse_info['priority_lan'][s]))
+                protocols.append(('wan', rsemgr.create_protocol(rse_settings=rse_info,
+                                                                operation='read',
+                                                                scheme=s,
+                                                                domain='wan'),
+                                  rse_info['priority_wan'][s]))
+            else:
+                protocols.append((domain, rsemgr.create_protocol(rse_settings=rse_info,
+                                                                 operation='read',
+                                                                 scheme=s,
+                                                                 domain=domain),
+                                  rse_info['priority_%s' % domain][s]))
+        except exception.RSEProtocolNotSupported:
+            pass  # no need to be verbose
+        except Exception:
+            print(format_exc())
+
+    context = {'protocols': protocols, 'root_proxy_internal': None, 'sign_url': None}
+
+    # server side root proxy handling if location is set.
+    # cannot be pushed into protocols because we need to lookup rse attributes.
+    # ultra-conservative implementation.
+    if domain == 'wan' and client_location and 'site' in client_location and client_location['site'] \
+       and [p for p in protocols if p[1].attributes['scheme'] == 'root']:
+
+        # is the RSE site-configured?
+        rse_site_attr = get_rse_attribute('site', rse_info['id'], session=session)
+        replica_site = ['']
+        if isinstance(rse_site_attr, list) and rse_site_attr:
+            replica_site = rse_site_attr[0]
+
+        # does it match with the client? if not, it's an outgoing connection
+        # therefore the internal proxy must be prepended
+        if client_location['site'] != replica_site:
+            context['root_proxy_internal'] = config_get('root-proxy-internal',    # section
+                                                        client_location['site'],  # option
+                                                        default='',               # empty string to circumvent exception
+                                                        session=session)
+
+    # do we need to sign the URLs?
+    if sign_urls and [p for p in protocols if p[1].attributes['scheme'] == 'https']:
+        service = get_rse_attribute('sign_url', rse_id=rse_info['id'], session=session)
+        if service and isinstance(service, list):
+            context['sign_url'] = service[0]
+
+    # the space token of the srm protocols is handed over to the file
+    for tmp_domain, protocol, priority in protocols:
+        if protocol.attributes['scheme'] == 'srm':
+            try:
+                context['space_token'] = protocol.attributes['extended_attributes']['space_token']
+            except KeyError:
+                context['space_token'] = None
+
+    return context
+
+
+def _bulk_lfns2pfns(protocol, lfns):
+    """
+    Translate a list of LFNs into PFNs with a single call to the protocol.
+    If the bulk translation fails, the LFNs are translated one by one so that
+    a single broken replica does not cost the PFNs of the others.
+
+    :param protocol: The protocol instance.
+    :param lfns: List of dictionaries with scope, name and path.
+    :returns: Dictionary {'scope:name': pfn}.
+    """
+    try:
+        return protocol.lfns2pfns(lfns=lfns)
+    except Exception:
+        pfns = {}
+        for lfn in lfns:
+            try:
+                pfns.update(protocol.lfns2pfns(lfns=lfn))
+            except Exception:
+                # never end up here
+                print(format_exc())
+        return pfns
+
+
+def _build_pfns_for_replicas(replicas, rse_domain, schemes, client_location, sign_urls, signature_lifetime,
+                             rse_context, pfns_cache, session):
+    """
+    Build the PFNs of a chunk of replica rows.
+    The rows are grouped by RSE, so that each protocol translates all the LFNs of its RSE in one call.
+
+    :param replicas: List of replica rows (scope, name, bytes, md5, adler32, path, state, rse, rse_type, volatile).
+    :param rse_domain: Function returning the network domain to use for a RSE name.
+    :param schemes: A list of schemes to filter the replicas.
+    :param client_location: Client location dictionary for PFN modification {'ip', 'fqdn', 'site'}.
+    :param sign_urls: If set, will sign the PFNs if necessary.
+    :param signature_lifetime: If supported, in seconds, restrict the lifetime of the signed PFN.
+    :param rse_context: Dictionary {rse: context} of the already resolved RSEs, completed in place.
+    :param pfns_cache: Dictionary of the already computed deterministic paths, completed in place.
+    :param session: The database session in use.
+    :returns: Dictionary {(scope, name, rse): [(pfn, domain, priority, client_extract)]}.
+    """
+    lfns_per_rse = defaultdict(list)
+    for scope, name, bytes, md5, adler32, path, state, rse, rse_type, volatile in replicas:
+        if rse:
+            lfns_per_rse[rse].append({'scope': scope, 'name': name, 'path': path})
+
+    pfns = defaultdict(list)
+    for rse, lfns in lfns_per_rse.items():
+        if rse not in rse_context:
+            rse_context[rse] = _get_rse_pfn_context(rse=rse, domain=rse_domain(rse), schemes=schemes,
+                                                    client_location=client_location, sign_urls=sign_urls,
+                                                    session=session)
+        context = rse_context[rse]
+
+        for tmp_domain, protocol, priority in context['protocols']:
+            protocol_lfns = lfns
+            if 'determinism_type' in protocol.attributes:  # PFN is cachable
+                protocol_lfns = []
+                for lfn in lfns:
+                    key = '%s:%s:%s' % (protocol.attributes['determinism_type'], lfn['scope'], lfn['name'])
+                    if key not in pfns_cache:
+                        pfns_cache[key] = protocol._get_path(lfn['scope'], lfn['name'])
+                    protocol_lfns.append({'scope': lfn['scope'], 'name': lfn['name'], 'path': pfns_cache[key]})
+
+            protocol_pfns = _bulk_lfns2pfns(protocol, protocol_lfns)
+            scheme = protocol.attributes['scheme']
+            for lfn in protocol_lfns:
+                pfn = protocol_pfns.get('%s:%s' % (lfn['scope'], lfn['name']))
+                if pfn is None or isinstance(pfn, Exception):
+                    continue
+
+                if context['root_proxy_internal'] and scheme == 'root':
+                    pfn = 'root://' + context['root_proxy_internal'] + '//' + pfn
+
+                if context['sign_url'] and scheme == 'https':
+                    pfn = get_signed_url(service=context['sign_url'], operation='read', url=pfn, lifetime=signature_lifetime)
+
+                # PFNs don't have concepts, therefore quickly encapsulate in a tuple
+                # ('pfn', 'domain', 'priority', 'client_extract')
+                pfns[(lfn['scope'], lfn['name'], rse)].append((pfn, tmp_domain, priority, False))
+    return pfns
+
+
+def _iter_replicas_with_pfns(replicas, show_pfns, chunk_size=LIST_REPLICAS_CHUNK_SIZE, **kwargs):
+    """
+    Iterate over replica rows in chunks and attach the PFNs, built in bulk per chunk, to each row.
+
+    :param replicas: Iterable of replica rows.
+    :param show_pfns: If not set, no PFN is built.
+    :param chunk_size: Number of rows per chunk.
+    :param kwargs: Parameters passed to :py:func:`_build_pfns_for_replicas`.
+    :returns: Generator of tuples (replica row, list of PFN tuples).
+    """
+    replicas = iter(replicas)
+    while True:
+        chunk = list(islice(replicas, chunk_size))
+        if not chunk:
+            break
+        pfns = {}
+        if show_pfns:
+            pfns = _build_pfns_for_replicas(replicas=chunk, **kwargs)
+        for replica in chunk:
+            yield replica, pfns.get((replica[0], replica[1], replica[7]), [])
+
+
 def _list_replicas(dataset_clause, file_clause, state_clause, show_pfns,
                    schemes, files, rse_clause, rse_expression, client_location, domain,
                    sign_urls, signature_lifetime, constituents, resolve_parents,
@@ -762,7 +972,7 @@ def _list_replicas(dataset_clause, file_clause, state_clause, show_pfns,
 
     # we need to retain knowledge of the original domain selection by the user
     # in case we have to loop over replicas with a potential outgoing proxy
-    original_domain = deepcopy(domain)
+    original_domain = domain
 
     # find all RSEs local to the client's location in autoselect mode (i.e., when domain is None)
     local_rses = []
@@ -773,15 +983,24 @@ def _list_replicas(dataset_clause, file_clause, state_clause, show_pfns,
             except Exception:
                 pass  # do not hard fail if site cannot be resolved or is empty
 
-    file, tmp_protocols, rse_info, pfns_cache = {}, {}, {}, {}
+    def rse_domain(rse):
+        # select the lan door in autoselect mode, otherwise use the wan door
+        if original_domain is None:
+            if local_rses and rse in local_rses:
+                return 'lan'
+            return 'wan'
+        return original_domain
+
+    file, rse_context, pfns_cache = {}, {}, {}
 
     for replicas in filter(None, files):
-        for scope, name, bytes, md5, adler32, path, state, rse, rse_type, volatile in replicas:
+        replicas = _iter_replicas_with_pfns(replicas=replicas, show_pfns=show_pfns, rse_domain=rse_domain, schemes=schemes,
+                                            client_location=client_location, sign_urls=sign_urls,
+                                            signature_lifetime=signature_lifetime, rse_context=rse_context,
+                                            pfns_cache=pfns_cache, session=session)
+        for (scope, name, bytes, md5, adler32, path, state, rse, rse_type, volatile), replica_pfns in replicas:
             pfns = []
 
-            # reset the domain selection to original user's choice (as this could get overwritten each iteration)
-            domain = deepcopy(original_domain)
-
             # if the file is a constituent, find the available archives and add them to the list of possible PFNs
             # taking into account the original rse_expression
             if '%s:%s' % (scope, name) in constituents:
@@ -870,127 +1089,9 @@ def _list_replicas(dataset_clause, file_clause, state_clause, show_pfns,
                         pfns.append((pfn, 'zip', priority, client_extract, archive[archive_pfn]))
 
             if show_pfns and rse:
-                if rse not in rse_info:
-                    rse_info[rse] = rsemgr.get_rse_info(rse, session=session)
-
-                # assign scheme priorities, and don't forget to exclude disabled protocols
-                # 0 in RSE protocol definition = disabled, 1 = highest priority
-                rse_info[rse]['priority_wan'] = {p['scheme']: p['domains']['wan']['read'] for p in rse_info[rse]['protocols'] if p['domains']['wan']['read'] > 0}
-                rse_info[rse]['priority_lan'] = {p['scheme']: p['domains']['lan']['read'] for p in rse_info[rse]['protocols'] if p['domains']['lan']['read'] > 0}
-
-                # select the lan door in autoselect mode, otherwise use the wan door
-                if domain is None:
-                    domain = 'wan'
-                    if local_rses and rse in local_rses:
-                        domain = 'lan'
-
-                if rse not in tmp_protocols:
-
-                    rse_schemes = schemes or []
-                    if not rse_schemes:
-                        try:
-                            if domain == 'all':
-                                rse_schemes.append(rsemgr.select_protocol(rse_settings=rse_info[rse],
-                                                                          operation='read',
-                                                                          domain='wan')['scheme'])
-                                rse_schemes.append(rsemgr.select_protocol(rse_settings=rse_info[rse],
-                                                                          operation='read',
-                                                                          domain='lan')['scheme'])
-                            else:
-                                rse_schemes.append(rsemgr.select_protocol(rse_settings=rse_info[rse],
-                                                                          operation='read',
-                                                                          domain=domain)['scheme'])
-                        except exception.RSEProtocolNotSupported:
-                            pass  # no need to be verbose
-                        except Exception:
-                            print(format_exc())
-
-                    protocols = []
-                    for s in rse_schemes:
-                        try:
-                            if domain == 'all':
-                                protocols.append(('lan', rsemgr.create_protocol(rse_settings=rse_info[rse],
-                                                                                operation='read',
-                                                                                scheme=s,
-                                                                                domain='lan'),
-                                                  rse_info[rse]['priority_lan'][s]))
-                                protocols.append(('wan', rsemgr.create_protocol(rse_settings=rse_info[rse],
-                                                                                operation='read',
-                                                                                scheme=s,
-                                                                                domain='wan'),
-                                                  rse_info[rse]['priority_wan'][s]))
-                            else:
-                                protocols.append((domain, rsemgr.create_protocol(rse_settings=rse_info[rse],
-                                                                                 operation='read',
-                                                                                 scheme=s,
-                                                                                 domain=domain),
-                                                  rse_info[rse]['priority_%s' % domain][s]))
-                        except exception.RSEProtocolNotSupported:
-                            pass  # no need to be verbose
-                        except Exception:
-                            print(format_exc())
-
-                    tmp_protocols[rse] = protocols
-
-                # get pfns
-                for tmp_protocol in tmp_protocols[rse]:
-                    protocol = tmp_protocol[1]
-                    if 'determinism_type' in protocol.attributes:  # PFN is cachable
-                        try:
-                            path = pfns_cache['%s:%s:%s' % (protocol.attributes['determinism_type'], scope, name)]
-                        except KeyError:  # No cache entry scope:name found for this protocol
-                            path = protocol._get_path(scope, name)
-                            pfns_cache['%s:%s:%s' % (protocol.attributes['determinism_type'], scope, name)] = path
-
-                    try:
-                        pfn = protocol.lfns2pfns(lfns={'scope': scope,
-                                                       'name': name,
-                                                       'path': path}).\
-                            values()[0]
-
-                        # server side root proxy handling if location is set.
-                        # cannot be pushed into protocols because we need to lookup rse attributes.
-                        # ultra-conservative implementation.
-                        if domain == 'wan' and protocol.attributes['scheme'] == 'root' and client_location:
-
-                            if 'site' in client_location and client_location['site']:
-
-                                # is the RSE site-configured?
-                                rse_site_attr = get_rse_attribute('site', rse_info[rse]['id'], session=session)
-                                replica_site = ['']
-                                if isinstance(rse_site_attr, list) and rse_site_attr:
-                                    replica_site = rse_site_attr[0]
-
-                                # does it match with the client? if not, it's an outgoing connection
-                                # therefore the internal proxy must be prepended
-                                if client_location['site'] != replica_site:
-                                    root_proxy_internal = config_get('root-proxy-internal',    # section
-                                                                     client_location['site'],  # option
-                                                                     default='',               # empty string to circumvent exception
-                                                                     session=session)
-                                    if root_proxy_internal:
-                                        pfn = 'root://' + root_proxy_internal + '//' + pfn
-
-                        # do we need to sign the URLs?
-                        if sign_urls and protocol.attributes['scheme'] == 'https':
-                            service = get_rse_attribute('sign_url',
-                                                        rse_id=rse_info[rse]['id'],
-                                                        session=session)
-                            if service and isinstance(service, list):
-                                pfn = get_signed_url(service=service[0], operation='read', url=pfn, lifetime=signature_lifetime)
-
-                        # PFNs don't have concepts, therefore quickly encapsulate in a tuple
-                        # ('pfn', 'domain', 'priority', 'client_extract')
-                        pfns.append((pfn, tmp_protocol[0], tmp_protocol[2], False))
-                    except Exception:
-                        # never end up here
-                        print(format_exc())
-
-                    if protocol.attributes['scheme'] == 'srm':
-                        try:
-                            file['space_token'] = protocol.attributes['extended_attributes']['space_token']
-                        except KeyError:
-                            file['space_token'] = None
+                pfns.extend(replica_pfns)
+                if 'space_token' in rse_context[rse]:
+                    file['space_token'] = rse_context[rse]['space_token']
 
             if 'scope' in file and 'name' in file:
                 if file['scope'] == scope and file['name'] == name:
@@ -1374,19 +1475,12 @@ def delete_replicas(rse, files, ignore_availability=True, session=None):
                                                      'for deleting' % rse)
 
     replica_condition, parent_condition, did_condition = [], [], []
-    clt_replica_condition, dst_replica_condition = [], []
+    clt_replica_condition = []
     incomplete_condition, messages, archive_contents_condition = [], [], []
     for file in files:
         replica_condition.append(and_(models.RSEFileAssociation.scope == file['scope'],
                                       models.RSEFileAssociation.name == file['name']))
 
-        dst_replica_condition.\
-            append(and_(models.DataIdentifierAssociation.child_scope == file['scope'],
-                        models.DataIdentifierAssociation.child_name == file['name'],
-                        exists(select([1]).prefix_with("/*+ INDEX(COLLECTION_REPLICAS COLLECTION_REPLICAS_PK) */", dialect='oracle')).where(and_(models.CollectionReplica.scope == models.DataIdentifierAssociation.scope,
-                                                                                                                                                 models.CollectionReplica.name == models.DataIdentifierAssociation.name,
-                                                                                                                                                 models.CollectionReplica.rse_id == replica_rse.id))))
-
         parent_condition.append(and_(models.DataIdentifierAssociation.child_scope == file['scope'],
                                      models.DataIdentifierAssociation.child_name == file['name'],
                                      ~exists(select([1]).prefix_with("/*+ INDEX(DIDS DIDS_PK) */", dialect='oracle')).where(and_(models.DataIdentifier.scope == file['scope'],
@@ -1407,30 +1501,23 @@ def delete_replicas(rse, files, ignore_availability=True, session=None):
                                                ~exists(select([1]).prefix_with("/*+ INDEX(REPLICAS REPLICAS_PK) */", dialect='oracle')).where(and_(models.RSEFileAssociation.scope == file['scope'], models.RSEFileAssociation.name == file['name']))))
 
     delta, bytes, rowcount = 0, 0, 0
+    available_deltas = {}
     for chunk in chunks(replica_condition, 10):
-        for (scope, name, rse_id, replica_bytes) in session.query(models.RSEFileAssociation.scope, models.RSEFileAssociation.name, models.RSEFileAssociation.rse_id, models.RSEFileAssociation.bytes).\
+        for (scope, name, rse_id, replica_bytes, state) in session.query(models.RSEFileAssociation.scope, models.RSEFileAssociation.name, models.RSEFileAssociation.rse_id,
+                                                                         models.RSEFileAssociation.bytes, models.RSEFileAssociation.state).\
                 with_hint(models.RSEFileAssociation, "INDEX(REPLICAS REPLICAS_PK)", 'oracle').filter(models.RSEFileAssociation.rse_id == replica_rse.id).filter(or_(*chunk)):
             bytes += replica_bytes
             delta += 1
+            if state == ReplicaState.AVAILABLE:
+                available_deltas[(scope, name)] = (-1, -replica_bytes)
 
         rowcount += session.query(models.RSEFileAssociation).filter(models.RSEFileAssociation.rse_id == replica_rse.id).filter(or_(*chunk)).delete(synchronize_session=False)
 
     if rowcount != len(files):
         raise exception.ReplicaNotFound("One or several replicas don't exist.")
 
-    # Get all collection_replicas at RSE, insert them into UpdatedCollectionReplica
-    if dst_replica_condition:
-        for chunk in chunks(dst_replica_condition, 10):
-            query = session.query(models.DataIdentifierAssociation.scope, models.DataIdentifierAssociation.name).\
-                filter(or_(*chunk)).\
-                distinct()
-
-            for parent_scope, parent_name in query:
-                models.UpdatedCollectionReplica(scope=parent_scope,
-                                                name=parent_name,
-                                                did_type=DIDType.DATASET,
-                                                rse_id=replica_rse.id).\
-                    save(session=session, flush=False)
+    # Queue the changes of the collection replicas at the RSE
+    __add_collection_replica_deltas(rse_id=replica_rse.id, deltas=available_deltas, session=session)
 
     # Delete did from the content for the last did
     while parent_condition:
@@ -1645,6 +1732,11 @@ def list_and_mark_unlocked_replicas(limit, bytes=None, rse_id=None, delay_second
     """
     List RSE File replicas with no locks.
 
+    The candidates are read in tombstone order with the tombstone index. For each batch of
+    candidates, their other available replicas are counted with one query on the primary key
+    of the replicas, the requests of the candidates with a single other replica are fetched with
+    one query, and the selected replicas are marked by primary key.
+
     :param limit:              Number of replicas returned.
     :param bytes:              The amount of needed bytes.
     :param rse_id:             The rse_id.
@@ -1655,13 +1747,12 @@ def list_and_mark_unlocked_replicas(limit, bytes=None, rse_id=None, delay_second
     """
 
     none_value = None  # Hack to get pep8 happy...
-    subquery = session.query(models.RSEFileAssociation.scope,
-                             models.RSEFileAssociation.name,
-                             models.RSEFileAssociation.path,
-                             models.RSEFileAssociation.bytes,
-                             models.RSEFileAssociation.tombstone,
-                             models.RSEFileAssociation.state,
-                             models.RSEFileAssociation.rse_id).\
+    query = session.query(models.RSEFileAssociation.scope,
+                          models.RSEFileAssociation.name,
+                          models.RSEFileAssociation.path,
+                          models.RSEFileAssociation.bytes,
+                          models.RSEFileAssociation.tombstone,
+                          models.RSEFileAssociation.state).\
         with_hint(models.RSEFileAssociation, "INDEX_RS_ASC(replicas REPLICAS_TOMBSTONE_IDX)  NO_INDEX_FFS(replicas REPLICAS_TOMBSTONE_IDX)", 'oracle').\
         with_for_update(skip_locked=True).\
         filter(models.RSEFileAssociation.tombstone < datetime.utcnow()).\
@@ -1669,71 +1760,126 @@ def list_and_mark_unlocked_replicas(limit, bytes=None, rse_id=None, delay_second
         filter(case([(models.RSEFileAssociation.tombstone != none_value, models.RSEFileAssociation.rse_id), ]) == rse_id).\
         filter(or_(models.RSEFileAssociation.state.in_((ReplicaState.AVAILABLE, ReplicaState.UNAVAILABLE, ReplicaState.BAD)),
                    and_(models.RSEFileAssociation.state == ReplicaState.BEING_DELETED, models.RSEFileAssociation.updated_at < datetime.utcnow() - timedelta(seconds=delay_seconds)))).\
-        order_by(models.RSEFileAssociation.tombstone).subquery()
-    query = session.query(subquery.c.scope,
-                          subquery.c.name,
-                          subquery.c.path,
-                          subquery.c.bytes,
-                          subquery.c.tombstone,
-                          subquery.c.state,
-                          func.count(models.RSEFileAssociation.scope)).\
-        join(models.RSEFileAssociation, and_(models.RSEFileAssociation.scope == subquery.c.scope,
-                                             models.RSEFileAssociation.name == subquery.c.name,
-                                             models.RSEFileAssociation.rse_id != subquery.c.rse_id,
-                                             models.RSEFileAssociation.state == ReplicaState.AVAILABLE)).\
-        group_by(subquery.c.scope, subquery.c.name, subquery.c.path, subquery.c.bytes, subquery.c.tombstone, subquery.c.state).\
-        order_by(subquery.c.tombstone)
+        order_by(models.RSEFileAssociation.tombstone)
 
     needed_space = bytes
     total_bytes, total_files = 0, 0
     rows = []
-    replica_clause = []
-    for (scope, name, path, bytes, tombstone, state, cnt) in query.yield_per(1000):
-        # Check if more than one replica is available
-        if cnt > 1:
-            if state != ReplicaState.UNAVAILABLE:
+    candidates = iter(query.yield_per(1000))
+    done = False
+    while not done:
+        batch = list(islice(candidates, 1000))
+        if not batch:
+            break
+        done = len(batch) < 1000
+
+        copies = __count_available_copies([(scope, name) for scope, name, _, _, _, _ in batch], rse_id=rse_id, session=session)
+        requested = __list_requested_files([(scope, name) for scope, name, _, _, _, _ in batch if copies.get((scope, name)) == 1], session=session)
+
+        for (scope, name, path, bytes, tombstone, state) in batch:
+            cnt = copies.get((scope, name), 0)
+            # Keep the replicas without other available copy, and the ones with a single other copy if there are some requests
+            if cnt == 0 or (cnt == 1 and (scope, name) in requested):
+                continue
+
+            if cnt == 1 or state != ReplicaState.UNAVAILABLE:
                 total_bytes += bytes
                 if tombstone != OBSOLETE and needed_space is not None and total_bytes > needed_space:
+                    done = True
                     break
 
                 total_files += 1
                 if total_files > limit:
+                    done = True
                     break
 
             rows.append({'scope': scope, 'name': name, 'path': path,
                          'bytes': bytes, 'tombstone': tombstone,
                          'state': state})
-            replica_clause.append(and_(models.RSEFileAssociation.scope == scope,
-                                       models.RSEFileAssociation.name == name,
-                                       models.RSEFileAssociation.rse_id == rse_id))
-        else:
-            # If this is the last replica, check if there are some requests
-            request_cnt = session.query(func.count()).\
-                with_hint(models.Request, "INDEX(requests REQUESTS_SCOPE_NAME_RSE_IDX)", 'oracle').\
-                filter(and_(models.Request.scope == scope,
-                            models.Request.name == name)).one()
 
-            if request_cnt[0] == 0:
-                total_bytes += bytes
-                if tombstone != OBSOLETE and needed_space is not None and total_bytes > needed_space:
-                    break
+    __mark_being_deleted([(row['scope'], row['name']) for row in rows], rse_id=rse_id, session=session)
 
-                total_files += 1
-                if total_files > limit:
-                    break
+    # Queue the changes of the collection replicas for the replicas leaving the AVAILABLE state
+    __add_collection_replica_deltas(rse_id=rse_id,
+                                    deltas=dict(((row['scope'], row['name']), (-1, -row['bytes'])) for row in rows if row['state'] == ReplicaState.AVAILABLE),
+                                    session=session)
+    return rows
 
-                rows.append({'scope': scope, 'name': name, 'path': path,
-                             'bytes': bytes, 'tombstone': tombstone,
-                             'state': state})
 
-                replica_clause.append(and_(models.RSEFileAssociation.scope == scope,
-                                           models.RSEFileAssociation.name == name,
-                                           models.RSEFileAssociation.rse_id == rse_id))
-    for chunk in chunks(replica_clause, 100):
-        session.query(models.RSEFileAssociation).filter(or_(*chunk)).\
-            update({'updated_at': datetime.utcnow(), 'state': ReplicaState.BEING_DELETED}, synchronize_session=False)
+def __group_names_by_scope(files, chunk_size=1000):
+    """
+    Group (scope, name) pairs into (scope, names) chunks for IN filters on the primary keys.
 
-    return rows
+    :param files: List of (scope, name) pairs.
+    :param chunk_size: Maximum number of names per chunk.
+    :returns: Generator of (scope, list of names).
+    """
+    names_by_scope = defaultdict(list)
+    for scope, name in files:
+        names_by_scope[scope].append(name)
+    for scope, names in names_by_scope.items():
+        for chunk in chunks(names, chunk_size):
+            yield scope, chunk
+
+
+def __count_available_copies(files, rse_id, session=None):
+    """
+    Count the available replicas of files on the other RSEs.
+
+    :param files: List of (scope, name) pairs.
+    :param rse_id: The RSE id of the candidate replicas.
+    :param session: The database session in use.
+    :returns: Dictionary {(scope, name): number of available replicas on other RSEs}.
+    """
+    copies = {}
+    for scope, names in __group_names_by_scope(files):
+        query = session.query(models.RSEFileAssociation.scope,
+                              models.RSEFileAssociation.name,
+                              func.count()).\
+            with_hint(models.RSEFileAssociation, "INDEX(replicas REPLICAS_PK)", 'oracle').\
+            filter(models.RSEFileAssociation.scope == scope).\
+            filter(models.RSEFileAssociation.name.in_(names)).\
+            filter(models.RSEFileAssociation.rse_id != rse_id).\
+            filter(models.RSEFileAssociation.state == ReplicaState.AVAILABLE).\
+            group_by(models.RSEFileAssociation.scope, models.RSEFileAssociation.name)
+        for file_scope, file_name, cnt in query:
+            copies[(file_scope, file_name)] = cnt
+    return copies
+
+
+def __list_requested_files(files, session=None):
+    """
+    List the files with requests.
+
+    :param files: List of (scope, name) pairs.
+    :param session: The database session in use.
+    :returns: Set of the (scope, name) pairs with requests.
+    """
+    requested = set()
+    for scope, names in __group_names_by_scope(files):
+        query = session.query(models.Request.scope, models.Request.name).\
+            with_hint(models.Request, "INDEX(requests REQUESTS_SCOPE_NAME_RSE_IDX)", 'oracle').\
+            filter(models.Request.scope == scope).\
+            filter(models.Request.name.in_(names)).\
+            distinct()
+        requested.update((file_scope, file_name) for file_scope, file_name in query)
+    return requested
+
+
+def __mark_being_deleted(files, rse_id, session=None):
+    """
+    Mark replicas of a RSE as being deleted.
+
+    :param files: List of (scope, name) pairs.
+    :param rse_id: The RSE id.
+    :param session: The database session in use.
+    """
+    for scope, names in __group_names_by_scope(files):
+        session.query(models.RSEFileAssociation).\
+            filter(models.RSEFileAssociation.scope == scope).\
+            filter(models.RSEFileAssociation.name.in_(names)).\
+            filter(models.RSEFileAssociation.rse_id == rse_id).\
+            update({'updated_at': datetime.utcnow(), 'state': ReplicaState.BEING_DELETED}, synchronize_session=False)
 
 
 @read_session
@@ -1763,6 +1909,7 @@ def update_replicas_states(replicas, nowait=False, session=None):
     :param session:  The database session in use.
     """
     rse_ids = {}
+    available_replicas, available_deltas = [], {}
     for replica in replicas:
         if 'rse_id' not in replica:
             if replica['rse'] not in rse_ids:
@@ -1770,9 +1917,13 @@ def update_replicas_states(replicas, nowait=False, session=None):
             replica['rse_id'] = rse_ids[replica['rse']]
 
         query = session.query(models.RSEFileAssociation).filter_by(rse_id=replica['rse_id'], scope=replica['scope'], name=replica['name'])
+        old_state, replica_bytes = None, None
         try:
+            state_query = query.with_entities(models.RSEFileAssociation.state, models.RSEFileAssociation.bytes)
             if nowait:
-                query.with_for_update(nowait=True).one()
+                old_state, replica_bytes = state_query.with_for_update(nowait=True).one()
+            else:
+                old_state, replica_bytes = state_query.first() or (None, None)
         except NoResultFound:
             # remember scope, name and rse_id
             raise exception.ReplicaNotFound("No row found for scope: %s name: %s rse_id: %s" % (replica['scope'], replica['name'], replica['rse_id']))
@@ -1790,7 +1941,7 @@ def update_replicas_states(replicas, nowait=False, session=None):
             query = query.filter(not_(stmt))
             values['tombstone'] = OBSOLETE
         elif replica['state'] == ReplicaState.AVAILABLE:
-            rucio.core.lock.successful_transfer(scope=replica['scope'], name=replica['name'], rse_id=replica['rse_id'], nowait=nowait, session=session)
+            available_replicas.append(replica)
         elif replica['state'] == ReplicaState.UNAVAILABLE:
             rucio.core.lock.failed_transfer(scope=replica['scope'], name=replica['name'], rse_id=replica['rse_id'],
                                             error_message=replica.get('error_message', None),
@@ -1807,9 +1958,62 @@ def update_replicas_states(replicas, nowait=False, session=None):
             if 'rse' not in replica:
                 replica['rse'] = get_rse_name(rse_id=replica['rse_id'], session=session)
             raise exception.UnsupportedOperation('State %(state)s for replica %(scope)s:%(name)s on %(rse)s cannot be updated' % replica)
+
+        if old_state != replica['state'] and ReplicaState.AVAILABLE in (old_state, replica['state']):
+            sign = 1 if replica['state'] == ReplicaState.AVAILABLE else -1
+            available_deltas.setdefault(replica['rse_id'], {})[(replica['scope'], replica['name'])] = (sign, sign * (replica_bytes or 0))
+
+    # Update the locks and the rules of all the transferred replicas at once
+    if available_replicas:
+        rucio.core.lock.successful_transfers(replicas=available_replicas, nowait=nowait, session=session)
+
+    # Queue the changes of the collection replicas
+    for rse_id, deltas in available_deltas.items():
+        __add_collection_replica_deltas(rse_id=rse_id, deltas=deltas, session=session)
     return True
 
 
+@transactional_session
+def __add_collection_replica_deltas(rse_id, deltas, session=None):
+    """
+    Queue the changes of the available replicas of the datasets containing some files at a RSE.
+
+    An update request carrying the change of available replicas and bytes is added for every
+    dataset with a collection replica at the RSE, so that abacus does not need to recount the dataset.
+
+    :param rse_id:  The RSE id.
+    :param deltas:  Dictionary {(scope, name): (available replicas delta, available bytes delta)} of the files.
+    :param session: The database session in use.
+    """
+    dataset_deltas = {}
+    collection_replica_exists = exists(select([1]).prefix_with("/*+ INDEX(COLLECTION_REPLICAS COLLECTION_REPLICAS_PK) */", dialect='oracle')).\
+        where(and_(models.CollectionReplica.scope == models.DataIdentifierAssociation.scope,
+                   models.CollectionReplica.name == models.DataIdentifierAssociation.name,
+                   models.CollectionReplica.rse_id == rse_id))
+    file_condition = [and_(models.DataIdentifierAssociation.child_scope == scope,
+                           models.DataIdentifierAssociation.child_name == name) for scope, name in deltas]
+    for chunk in chunks(file_condition, 10):
+        query = session.query(models.DataIdentifierAssociation.scope,
+                              models.DataIdentifierAssociation.name,
+                              models.DataIdentifierAssociation.child_scope,
+                              models.DataIdentifierAssociation.child_name).\
+            filter(or_(*chunk)).\
+            filter(collection_replica_exists)
+        for scope, name, child_scope, child_name in query:
+            replicas_delta, bytes_delta = deltas[(child_scope, child_name)]
+            old_replicas_delta, old_bytes_delta = dataset_deltas.get((scope, name), (0, 0))
+            dataset_deltas[(scope, name)] = (old_replicas_delta + replicas_delta, old_bytes_delta + bytes_delta)
+
+    updates = [{'scope': scope,
+                'name': name,
+                'did_type': DIDType.DATASET,
+                'rse_id': rse_id,
+                'available_replicas_delta': replicas_delta,
+                'available_bytes_delta': bytes_delta} for (scope, name), (replicas_delta, bytes_delta) in dataset_deltas.items()]
+    if updates:
+        session.bulk_insert_mappings(models.UpdatedCollectionReplica, updates)
+
+
 @transactional_session
 def touch_replica(replica, session=None):
     """
@@ -1858,6 +2062,75 @@ def touch_replica(replica, session=None):
     return True
 
 
+@transactional_session
+def touch_replicas(replicas, session=None):
+    """
+    Update the accessed_at timestamp of a list of file replicas/dids with one bulk update per table,
+    but don't wait if rows are locked.
+
+    :param replicas: a list of dictionaries with the information of the affected replicas.
+    :param session: The database session in use.
+
+    :returns: True, if successful, False if one of the rows is locked. Nothing is updated in this case.
+    """
+    if not replicas:
+        return True
+
+    rse_ids = {}
+    replica_values, did_values = [], {}
+    now = datetime.utcnow()
+    for replica in replicas:
+        if 'rse_id' not in replica:
+            if replica['rse'] not in rse_ids:
+                rse_ids[replica['rse']] = get_rse_id(rse=replica['rse'], session=session)
+            replica['rse_id'] = rse_ids[replica['rse']]
+        accessed_at = replica.get('accessed_at') or now
+        replica_values.append({'b_rse_id': replica['rse_id'], 'b_scope': replica['scope'], 'b_name': replica['name'], 'b_accessed_at': accessed_at})
+        did_key = (replica['scope'], replica['name'])
+        if did_key not in did_values or did_values[did_key]['b_accessed_at'] < accessed_at:
+            did_values[did_key] = {'b_scope': replica['scope'], 'b_name': replica['name'], 'b_accessed_at': accessed_at}
+
+    accessed_at = bindparam('b_accessed_at', type_=models.RSEFileAssociation.accessed_at.type)
+    none_value = None
+    try:
+        session.query(models.RSEFileAssociation.rse_id).\
+            filter(or_(*[and_(models.RSEFileAssociation.rse_id == replica['rse_id'],
+                              models.RSEFileAssociation.scope == replica['scope'],
+                              models.RSEFileAssociation.name == replica['name']) for replica in replicas])).\
+            with_hint(models.RSEFileAssociation, "index(REPLICAS REPLICAS_PK)", 'oracle').\
+            with_for_update(nowait=True).all()
+
+        session.query(models.DataIdentifier.scope).\
+            filter(models.DataIdentifier.did_type == DIDType.FILE).\
+            filter(or_(*[and_(models.DataIdentifier.scope == scope,
+                              models.DataIdentifier.name == name) for scope, name in did_values])).\
+            with_hint(models.DataIdentifier, "INDEX(DIDS DIDS_PK)", 'oracle').\
+            with_for_update(nowait=True).all()
+
+        stmt = update(models.RSEFileAssociation).\
+            where(and_(models.RSEFileAssociation.rse_id == bindparam('b_rse_id'),
+                       models.RSEFileAssociation.scope == bindparam('b_scope'),
+                       models.RSEFileAssociation.name == bindparam('b_name'))).\
+            values(accessed_at=accessed_at,
+                   tombstone=case([(and_(models.RSEFileAssociation.tombstone != none_value,
+                                         models.RSEFileAssociation.tombstone != OBSOLETE),
+                                    accessed_at)],
+                                  else_=models.RSEFileAssociation.tombstone))
+        session.execute(stmt, replica_values)
+
+        stmt = update(models.DataIdentifier).\
+            where(and_(models.DataIdentifier.scope == bindparam('b_scope'),
+                       models.DataIdentifier.name == bindparam('b_name'),
+                       models.DataIdentifier.did_type == DIDType.FILE)).\
+            values(accessed_at=accessed_at)
+        session.execute(stmt, list(did_values.values()))
+
+    except DatabaseError:
+        return False
+
+    return True
+
+
 @transactional_session
 def update_replica_state(rse, scope, name, state, session=None):
     """
@@ -2511,28 +2784,6 @@ def get_cleaned_updated_collection_replicas(total_workers, worker_number, sessio
     :param session:            Database session in use.
     :returns:                  List of update requests for collection replicas.
     """
-    # Delete duplicates
-    replica_update_requests = session.query(models.UpdatedCollectionReplica)
-    update_requests_with_rse_id = []
-    update_requests_without_rse_id = []
-    duplicate_request_ids = []
-    for update_request in replica_update_requests.all():
-        if update_request.rse_id is not None:
-            small_request = {'name': update_request.name, 'scope': update_request.scope, 'rse_id': update_request.rse_id}
-            if small_request not in update_requests_with_rse_id:
-                update_requests_with_rse_id.append(small_request)
-            else:
-                duplicate_request_ids.append(update_request.id)
-                continue
-        else:
-            small_request = {'name': update_request.name, 'scope': update_request.scope}
-            if small_request not in update_requests_without_rse_id:
-                update_requests_without_rse_id.append(small_request)
-            else:
-                duplicate_request_ids.append(update_request.id)
-                continue
-    replica_update_requests.filter(models.UpdatedCollectionReplica.id.in_(duplicate_request_ids)).delete(synchronize_session=False)
-
     # Delete update requests which do not have collection_replicas
     session.query(models.UpdatedCollectionReplica).filter(models.UpdatedCollectionReplica.rse_id.is_(None) &
                                                           ~exists().where(and_(models.CollectionReplica.name == models.UpdatedCollectionReplica.name,
@@ -2542,16 +2793,95 @@ def get_cleaned_updated_collection_replicas(total_workers, worker_number, sessio
                                                                                models.CollectionReplica.scope == models.UpdatedCollectionReplica.scope,
                                                                                models.CollectionReplica.rse_id == models.UpdatedCollectionReplica.rse_id))).delete(synchronize_session=False)
 
+    # Claim the update requests of this worker, all the requests of a dataset go to the same worker
     query = session.query(models.UpdatedCollectionReplica)
-    return [update_request.to_dict() for update_request in query.all()]
+    if session.bind.dialect.name == 'oracle':
+        bindparams = [bindparam('worker_number', worker_number),
+                      bindparam('total_workers', total_workers)]
+        query = query.filter(text('ORA_HASH(name, :total_workers) = :worker_number', bindparams=bindparams))
+    elif session.bind.dialect.name == 'mysql':
+        query = query.filter(text('mod(md5(name), %s) = %s' % (total_workers + 1, worker_number)))
+    elif session.bind.dialect.name == 'postgresql':
+        query = query.filter(text('mod(abs((\'x\'||md5(name))::bit(32)::int), %s) = %s' % (total_workers + 1, worker_number)))
+    query = query.with_for_update(skip_locked=True)
+
+    datasets = {}
+    for update_request in query.all():
+        datasets.setdefault((update_request.scope, update_request.name), []).append(update_request)
+
+    # Delete duplicates and fold the deltas of the same collection replica
+    kept_requests = []
+    duplicate_request_ids = []
+    for dataset_requests in datasets.values():
+        recounts = [update_request for update_request in dataset_requests if update_request.rse_id is None]
+        if recounts:
+            # The recount of the dataset supersedes its other requests, their changes are counted by it
+            kept_requests.append(recounts[0])
+            duplicate_request_ids.extend(update_request.id for update_request in dataset_requests if update_request is not recounts[0])
+            continue
+        rse_requests = {}
+        for update_request in dataset_requests:
+            rse_requests.setdefault(update_request.rse_id, []).append(update_request)
+        for requests in rse_requests.values():
+            recounts = [update_request for update_request in requests if update_request.available_replicas_delta is None]
+            if recounts:
+                kept_request = recounts[0]
+            else:
+                kept_request = requests[0]
+                kept_request.available_replicas_delta = sum(update_request.available_replicas_delta for update_request in requests)
+                kept_request.available_bytes_delta = sum(update_request.available_bytes_delta for update_request in requests)
+            kept_requests.append(kept_request)
+            duplicate_request_ids.extend(update_request.id for update_request in requests if update_request is not kept_request)
+    for chunk in chunks(duplicate_request_ids, 100):
+        session.query(models.UpdatedCollectionReplica).filter(models.UpdatedCollectionReplica.id.in_(chunk)).delete(synchronize_session=False)
+    session.flush()
+
+    return [update_request.to_dict() for update_request in kept_requests]
 
 
 @transactional_session
 def update_collection_replica(update_request, session=None):
     """
     Update a collection replica.
+
+    Update requests carrying deltas are applied to the counters of the collection replica, unless the
+    collection replica becomes complete or empty, in which case the dataset replica is recounted.
+
     :param update_request: update request from the upated_col_rep table.
     """
+    # Claim the update request, and apply it as it is now: it is gone if it was superseded meanwhile
+    request_row = session.query(models.UpdatedCollectionReplica).filter_by(id=update_request['id']).with_for_update().first()
+    if request_row is None:
+        return
+    update_request = request_row.to_dict()
+
+    if update_request['rse_id'] is not None and update_request.get('available_replicas_delta') is not None:
+        collection_replica = session.query(models.CollectionReplica)\
+                                    .filter_by(scope=update_request['scope'],
+                                               name=update_request['name'],
+                                               rse_id=update_request['rse_id'])\
+                                    .with_for_update()\
+                                    .first()
+        if collection_replica is None:
+            session.query(models.UpdatedCollectionReplica).filter_by(id=update_request['id']).delete()
+            return
+        available_replicas = (collection_replica.available_replicas_cnt or 0) + update_request['available_replicas_delta']
+        available_bytes = (collection_replica.available_bytes or 0) + update_request['available_bytes_delta']
+        if 0 < available_replicas < (collection_replica.length or 0) and 0 < available_bytes:
+            collection_replica.state = ReplicaState.UNAVAILABLE
+            collection_replica.available_replicas_cnt = available_replicas
+            collection_replica.available_bytes = available_bytes
+            session.query(models.UpdatedCollectionReplica).filter_by(id=update_request['id']).delete()
+            return
+
+    # The recount includes the changes of the other requests of the same collection replicas
+    superseded_requests = session.query(models.UpdatedCollectionReplica).filter(models.UpdatedCollectionReplica.scope == update_request['scope'],
+                                                                                models.UpdatedCollectionReplica.name == update_request['name'],
+                                                                                models.UpdatedCollectionReplica.id != update_request['id'])
+    if update_request['rse_id'] is not None:
+        superseded_requests = superseded_requests.filter(models.UpdatedCollectionReplica.rse_id == update_request['rse_id'])
+    superseded_requests.delete(synchronize_session=False)
+
     if update_request['rse_id'] is not None:
         # Check one specific dataset replica
         ds_length = None
@@ -2594,7 +2924,7 @@ def update_collection_replica(update_request, session=None):
         else:
             ds_replica_state = ReplicaState.UNAVAILABLE
 
-        if old_available_replicas > 0 and available_replicas == 0:
+        if old_available_replicas and available_replicas == 0:
             session.query(models.CollectionReplica).filter_by(scope=update_request['scope'],
                                                               name=update_request['name'],
                                                               rse_id=update_request['rse_id'])\
@@ -2661,6 +2991,41 @@ def update_collection_replica(update_request, session=None):
     session.query(models.UpdatedCollectionReplica).filter_by(id=update_request['id']).delete()
 
 
+@transactional_session
+def queue_collection_replica_recounts(limit=1000, marker=None, session=None):
+    """
+    Queue the recount of a batch of collection replicas, as a consistency check of the counters
+    maintained with the deltas. The collection replicas are walked in primary key order, so that
+    successive calls with the returned marker recount all of them.
+
+    :param limit:   Number of collection replicas to recount.
+    :param marker:  (scope, name, rse_id) of the last collection replica of the previous batch.
+    :param session: The database session in use.
+    :returns:       The marker of the batch, None once all the collection replicas have been walked.
+    """
+    query = session.query(models.CollectionReplica.scope,
+                          models.CollectionReplica.name,
+                          models.CollectionReplica.rse_id).\
+        with_hint(models.CollectionReplica, "INDEX(COLLECTION_REPLICAS COLLECTION_REPLICAS_PK)", 'oracle').\
+        order_by(models.CollectionReplica.scope, models.CollectionReplica.name, models.CollectionReplica.rse_id)
+    if marker:
+        scope, name, rse_id = marker
+        query = query.filter(or_(models.CollectionReplica.scope > scope,
+                                 and_(models.CollectionReplica.scope == scope, models.CollectionReplica.name > name),
+                                 and_(models.CollectionReplica.scope == scope, models.CollectionReplica.name == name, models.CollectionReplica.rse_id > rse_id)))
+    collection_replicas = query.limit(limit).all()
+
+    updates = [{'scope': scope,
+                'name': name,
+                'did_type': DIDType.DATASET,
+                'rse_id': rse_id} for scope, name, rse_id in collection_replicas]
+    if updates:
+        session.bulk_insert_mappings(models.UpdatedCollectionReplica, updates)
+    if len(collection_replicas) < limit:
+        return None
+    return tuple(collection_replicas[-1])
+
+
 @read_session
 def get_bad_pfns(limit=10000, thread=None, total_threads=None, session=None):
     """
@@ -76,14 +76,43 @@ def requeue_and_archive(request, retry_protocol_mismatches=False, session=None):
     :param session:     Database session to use.
     """
 
-    record_counter('core.request.requeue_request')
-    # Probably not needed anymore
-    request_id = request['request_id']
-    new_req = get_request(request_id, session=session)
+    new_reqs = requeue_and_archive_requests([request], retry_protocol_mismatches=retry_protocol_mismatches, session=session)
+    if request['request_id'] not in new_reqs:
+        raise RequestNotFound
+    return new_reqs[request['request_id']]
+
 
-    if new_req:
-        new_req['sources'] = get_sources(request_id, session=session)
-        archive_request(request_id, session=session)
+@transactional_session
+def requeue_and_archive_requests(requests, retry_protocol_mismatches=False, session=None):
+    """
+    Requeue and archive a list of failed requests, with bulk queries.
+
+    :param requests:                   Original requests.
+    :param retry_protocol_mismatches:  Boolean to retry the transfer in case of protocol mismatch.
+    :param session:                    Database session to use.
+    :returns:                          Dictionary {request_id: new request, or None if the request is not retried}.
+                                       The requests which do not exist anymore are not in the dictionary.
+    """
+
+    record_counter('core.request.requeue_request', len(requests))
+    request_ids = [request['request_id'] for request in requests]
+    sources = {}
+    for request_ids_chunk in chunks(request_ids, 1000):
+        for source in session.query(models.Source).filter(models.Source.request_id.in_(request_ids_chunk)):
+            source = dict(source)
+            source.pop('_sa_instance_state')
+            sources.setdefault(source['request_id'], []).append(source)
+
+    # The requests are read again from the database by the archival, not taken from the arguments
+    archived = archive_requests(request_ids, session=session)
+
+    result, new_reqs = {}, []
+    for request_id in request_ids:
+        new_req = archived.get(request_id)
+        if not new_req:
+            continue
+        result[request_id] = None
+        new_req['sources'] = sources.get(request_id)
 
         if should_retry_request(new_req, retry_protocol_mismatches):
             new_req['request_id'] = generate_uuid()
@@ -101,11 +130,12 @@ def requeue_and_archive(request, retry_protocol_mismatches=False, session=None):
                         else:
                             new_req['sources'][i]['ranking'] -= 1
                         new_req['sources'][i]['is_using'] = False
-            queue_requests([new_req], session=session)
-            return new_req
-    else:
-        raise RequestNotFound
-    return None
+            new_reqs.append(new_req)
+            result[request_id] = new_req
+
+    if new_reqs:
+        queue_requests(new_reqs, session=session)
+    return result
 
 
 @transactional_session
@@ -121,8 +151,8 @@ def queue_requests(requests, session=None):
 
     logging.debug("queue requests")
 
-    request_clause = []
-    transfer_limits, rses = {}, {}
+    names_per_scope = {}
+    activities, rse_ids = set(['all_activities']), set()
     for req in requests:
 
         if isinstance(req['attributes'], string_types):
@@ -131,89 +161,72 @@ def queue_requests(requests, session=None):
                 req['attributes'] = json.loads(req['attributes'])
 
         if req['request_type'] == RequestType.TRANSFER:
-            request_clause.append(and_(models.Request.scope == req['scope'],
-                                       models.Request.name == req['name'],
-                                       models.Request.dest_rse_id == req['dest_rse_id'],
-                                       models.Request.request_type == RequestType.TRANSFER))
-
-        if req['dest_rse_id'] not in rses:
-            rses[req['dest_rse_id']] = get_rse_name(req['dest_rse_id'], session=session)
-
-        if req['attributes']['activity'] not in transfer_limits:
-            transfer_limits[req['attributes']['activity']] = {req['dest_rse_id']: transfer_limits_core.get_transfer_limits(req['attributes']['activity'], req['dest_rse_id'])}
-        elif req['dest_rse_id'] not in transfer_limits[req['attributes']['activity']]:
-            transfer_limits[req['attributes']['activity']] = {req['dest_rse_id']: transfer_limits_core.get_transfer_limits(req['attributes']['activity'], req['dest_rse_id'])}
-
-        all_activities = 'all_activities'
-        if all_activities not in transfer_limits:
-            transfer_limits[all_activities] = {}
-        if req['dest_rse_id'] not in transfer_limits[all_activities]:
-            transfer_limits[all_activities][req['dest_rse_id']] = transfer_limits_core.get_transfer_limits(all_activities, req['dest_rse_id'])
-
-    # Check existing requests
-    if request_clause:
-        existing_requests = []
-        for requests_condition in chunks(request_clause, 1000):
+            names_per_scope.setdefault(req['scope'], set()).add(req['name'])
+
+        activities.add(req['attributes']['activity'])
+        rse_ids.add(req['dest_rse_id'])
+
+    # Prefetch the RSE names and the transfer limits of all the requests
+    rses = {}
+    for rse_ids_chunk in chunks(list(rse_ids), 1000):
+        for rse_id, rse in session.query(models.RSE.id, models.RSE.rse).filter(models.RSE.id.in_(rse_ids_chunk)):
+            rses[rse_id] = rse
+    for rse_id in rse_ids:
+        if rse_id not in rses:
+            rses[rse_id] = get_rse_name(rse_id, session=session)
+    transfer_limits = transfer_limits_core.get_transfer_limits_bulk(activities, rse_ids, session=session)
+
+    # Check existing requests, the destination is matched in memory
+    existing_requests = set()
+    for scope, names in names_per_scope.items():
+        for names_chunk in chunks(list(names), 1000):
             query_existing_requests = session.query(models.Request.scope,
                                                     models.Request.name,
                                                     models.Request.dest_rse_id).\
                 with_hint(models.Request,
                           "INDEX(REQUESTS REQUESTS_SC_NA_RS_TY_UQ_IDX)",
                           'oracle').\
-                filter(or_(*requests_condition))
-            for request in query_existing_requests:
-                existing_requests.append(request)
+                filter(models.Request.scope == scope,
+                       models.Request.name.in_(names_chunk),
+                       models.Request.request_type == RequestType.TRANSFER)
+            for existing_scope, name, dest_rse_id in query_existing_requests:
+                existing_requests.add((existing_scope, name, dest_rse_id))
 
     new_requests, sources, messages = [], [], []
     for request in requests:
 
-        if req['request_type'] == RequestType.TRANSFER and (request['scope'], request['name'], request['dest_rse_id']) in existing_requests:
-            logging.warn('Request TYPE %s for DID %s:%s at RSE %s exists - ignoring' % (request['request_type'],
-                                                                                        request['scope'],
-                                                                                        request['name'],
-                                                                                        rses[request['dest_rse_id']]))
-            continue
-
-        transfer_limit_activity = transfer_limits[request['attributes']['activity']].get(request['dest_rse_id'])
-        transfer_limit_all_activities = transfer_limits['all_activities'].get(request['dest_rse_id'])
+        if request['request_type'] == RequestType.TRANSFER:
+            if (request['scope'], request['name'], request['dest_rse_id']) in existing_requests:
+                logging.warn('Request TYPE %s for DID %s:%s at RSE %s exists - ignoring' % (request['request_type'],
+                                                                                            request['scope'],
+                                                                                            request['name'],
+                                                                                            rses[request['dest_rse_id']]))
+                continue
+            existing_requests.add((request['scope'], request['name'], request['dest_rse_id']))
+
+        transfer_limit_activity = transfer_limits[(request['attributes']['activity'], request['dest_rse_id'])]
+        transfer_limit_all_activities = transfer_limits[('all_activities', request['dest_rse_id'])]
         request['state'] = RequestState.WAITING if transfer_limit_activity or transfer_limit_all_activities else RequestState.QUEUED
 
-        if 'previous_attempt_id' in request and 'retry_count' in request:
-            new_requests.append({'id': request['request_id'],
-                                 'request_type': request['request_type'],
-                                 'scope': request['scope'],
-                                 'name': request['name'],
-                                 'dest_rse_id': request['dest_rse_id'],
-                                 'attributes': json.dumps(request['attributes']),
-                                 'state': request['state'],
-                                 'rule_id': request['rule_id'],
-                                 'activity': request['attributes']['activity'],
-                                 'bytes': request['attributes']['bytes'],
-                                 'md5': request['attributes']['md5'],
-                                 'adler32': request['attributes']['adler32'],
-                                 'account': request.get('account', None),
-                                 'priority': request['attributes'].get('priority', None),
-                                 'requested_at': request.get('requested_at', None),
-                                 'retry_count': request['retry_count'],
-                                 'previous_attempt_id': request['previous_attempt_id']})
-        else:
+        if 'previous_attempt_id' not in request or 'retry_count' not in request:
             request['request_id'] = generate_uuid()
-            new_requests.append({'id': request['request_id'],
-                                 'request_type': request['request_type'],
-                                 'scope': request['scope'],
-                                 'name': request['name'],
-                                 'dest_rse_id': request['dest_rse_id'],
-                                 'attributes': json.dumps(request['attributes']),
-                                 'state': request['state'],
-                                 'rule_id': request['rule_id'],
-                                 'activity': request['attributes']['activity'],
-                                 'bytes': request['attributes']['bytes'],
-                                 'md5': request['attributes']['md5'],
-                                 'adler32': request['attributes']['adler32'],
-                                 'account': request.get('account', None),
-                                 'priority': request['attributes'].get('priority', None),
-                                 'requested_at': request.get('requested_at', None),
-                                 'retry_count': request['retry_count']})
+        new_requests.append({'id': request['request_id'],
+                             'request_type': request['request_type'],
+                             'scope': request['scope'],
+                             'name': request['name'],
+                             'dest_rse_id': request['dest_rse_id'],
+                             'attributes': json.dumps(request['attributes']),
+                             'state': request['state'],
+                             'rule_id': request['rule_id'],
+                             'activity': request['attributes']['activity'],
+                             'bytes': request['attributes']['bytes'],
+                             'md5': request['attributes']['md5'],
+                             'adler32': request['attributes']['adler32'],
+                             'account': request.get('account', None),
+                             'priority': request['attributes'].get('priority', None),
+                             'requested_at': request.get('requested_at', None),
+                             'retry_count': request['retry_count'],
+                             'previous_attempt_id': request.get('previous_attempt_id', None)})
 
         if 'sources' in request and request['sources']:
             for source in request['sources']:
@@ -251,14 +264,17 @@ def queue_requests(requests, session=None):
         messages.append({'event_type': transfer_status.lower(),
                          'payload': json.dumps(payload)})
 
+    # One multi-row INSERT per table and chunk, without the overhead of the ORM
     for requests_chunk in chunks(new_requests, 1000):
-        session.bulk_insert_mappings(models.Request, requests_chunk)
+        session.execute(models.Request.__table__.insert(), requests_chunk)
 
     for sources_chunk in chunks(sources, 1000):
-        session.bulk_insert_mappings(models.Source, sources_chunk)
+        session.execute(models.Source.__table__.insert(), sources_chunk)
 
     for messages_chunk in chunks(messages, 1000):
-        session.bulk_insert_mappings(models.Message, messages_chunk)
+        session.execute(models.Message.__table__.insert(), messages_chunk)
+
+    return [request['id'] for request in new_requests]
 
 
 @read_session
@@ -603,47 +619,49 @@ def archive_request(request_id, session=None):
     :param session:     Database session to use.
     """
 
-    record_counter('core.request.archive')
-    req = get_request(request_id=request_id, session=session)
-
-    if req:
-        hist_request = models.Request.__history_mapper__.class_(id=req['id'],
-                                                                created_at=req['created_at'],
-                                                                request_type=req['request_type'],
-                                                                scope=req['scope'],
-                                                                name=req['name'],
-                                                                dest_rse_id=req['dest_rse_id'],
-                                                                source_rse_id=req['source_rse_id'],
-                                                                attributes=req['attributes'],
-                                                                state=req['state'],
-                                                                account=req['account'],
-                                                                external_id=req['external_id'],
-                                                                retry_count=req['retry_count'],
-                                                                err_msg=req['err_msg'],
-                                                                previous_attempt_id=req['previous_attempt_id'],
-                                                                external_host=req['external_host'],
-                                                                rule_id=req['rule_id'],
-                                                                activity=req['activity'],
-                                                                bytes=req['bytes'],
-                                                                md5=req['md5'],
-                                                                adler32=req['adler32'],
-                                                                dest_url=req['dest_url'],
-                                                                requested_at=req['requested_at'],
-                                                                submitted_at=req['submitted_at'],
-                                                                started_at=req['started_at'],
-                                                                estimated_started_at=req['estimated_started_at'],
-                                                                estimated_at=req['estimated_at'],
-                                                                transferred_at=req['transferred_at'],
-                                                                estimated_transferred_at=req['estimated_transferred_at'])
-        hist_request.save(session=session)
-        try:
+    archive_requests([request_id], session=session)
+
+
+@transactional_session
+def archive_requests(request_ids, session=None):
+    """
+    Move a list of requests to the history table, with bulk queries.
+
+    :param request_ids:  List of Request-IDs as 32 character hex strings.
+    :param session:      Database session to use.
+    :returns:            Dictionary {request_id: request as a dictionary} of the archived requests.
+    """
+
+    record_counter('core.request.archive', len(request_ids))
+    history_table = models.Request.__history_mapper__.local_table
+    history_columns = ['id', 'created_at', 'request_type', 'scope', 'name', 'dest_rse_id', 'source_rse_id', 'attributes', 'state', 'account',
+                       'external_id', 'retry_count', 'err_msg', 'previous_attempt_id', 'external_host', 'rule_id', 'activity', 'bytes', 'md5',
+                       'adler32', 'dest_url', 'requested_at', 'submitted_at', 'started_at', 'estimated_started_at', 'estimated_at',
+                       'transferred_at', 'estimated_transferred_at']
+
+    archived = {}
+    for request_ids_chunk in chunks(list(set(request_ids)), 1000):
+        reqs = []
+        for tmp in session.query(models.Request).filter(models.Request.id.in_(request_ids_chunk)):
+            req = dict(tmp)
+            req.pop('_sa_instance_state')
+            reqs.append(req)
+        if not reqs:
+            continue
+
+        session.execute(history_table.insert(), [dict((column, req[column]) for column in history_columns) for req in reqs])
+        for req in reqs:
+            archived[req['id']] = req
             time_diff = req['updated_at'] - req['created_at']
             time_diff_s = time_diff.seconds + time_diff.days * 24 * 3600
             record_timer('core.request.archive_request.%s' % req['activity'].replace(' ', '_'), time_diff_s)
-            session.query(models.Source).filter_by(request_id=request_id).delete()
-            session.query(models.Request).filter_by(id=request_id).delete()
+        try:
+            archived_ids = [req['id'] for req in reqs]
+            session.query(models.Source).filter(models.Source.request_id.in_(archived_ids)).delete(synchronize_session=False)
+            session.query(models.Request).filter(models.Request.id.in_(archived_ids)).delete(synchronize_session=False)
         except IntegrityError as error:
             raise RucioException(error.args)
+    return archived
 
 
 @transactional_session
@@ -1263,6 +1281,109 @@ def update_request_state(response, logging_prepend_str=None, session=None):
         logging.critical(prepend_str + traceback.format_exc())
 
 
+@transactional_session
+def update_requests_states(responses, logging_prepend_str=None, session=None):
+    """
+    Bulk version of update_request_state: the requests are fetched together and
+    their new states are written with one bulk UPDATE, in a single transaction.
+
+    Each request is updated at most once: if several responses concern the same request,
+    only the first one matching the current transfer of the request is applied.
+
+    :param responses:             List of transfertool response dictionaries.
+    :param logging_prepend_str:   String to prepend to the logging
+    :param session:               The database session to use.
+    :returns:                     Dictionary {request_id: True if the request was updated, False otherwise}.
+    """
+
+    prepend_str = ''
+    if logging_prepend_str:
+        prepend_str = logging_prepend_str
+
+    result = {}
+    requests = {}
+    request_ids = list(set(response['request_id'] for response in responses if response['request_id']))
+    for chunk in chunks(request_ids, 100):
+        for tmp in session.query(models.Request).filter(models.Request.id.in_(chunk)):
+            request = dict(tmp)
+            request.pop('_sa_instance_state')
+            requests[request['id']] = request
+
+    now = datetime.datetime.utcnow()
+    touched, values, messages = [], [], []
+    for response in responses:
+        request_id = response['request_id']
+        request = requests.get(request_id)
+        if not request:
+            logging.debug(prepend_str + "Request %s doesn't exist, will not update" % request_id)
+            result.setdefault(request_id, False)
+        elif not response['new_state']:
+            if request_id not in result:
+                touched.append(request_id)
+            result.setdefault(request_id, False)
+        elif request['external_id'] != response['transfer_id']:
+            logging.warning(prepend_str + "Response %s with transfer id %s is different from the request transfer id %s, will not update" % (request_id, response['transfer_id'], request['external_id']))
+            result.setdefault(request_id, False)
+        elif result.get(request_id):
+            logging.debug(prepend_str + "Request %s is already updated by another response, will not update" % request_id)
+        elif request['state'] == response['new_state']:
+            logging.debug(prepend_str + "Request %s is already in %s state, will not update" % (request_id, response['new_state']))
+            result[request_id] = False
+        else:
+            response['submitted_at'] = request.get('submitted_at', None)
+            response['external_host'] = request['external_host']
+            logging.info(prepend_str + 'UPDATING REQUEST %s FOR TRANSFER %s STATE %s' % (str(request_id), response['transfer_id'], str(response['new_state'])))
+
+            job_m_replica = response.get('job_m_replica', None)
+            src_url = response.get('src_url', None)
+            src_rse_id = response.get('src_rse_id', None)
+            if job_m_replica and (str(job_m_replica).lower() == str('true')) and src_url:
+                try:
+                    src_rse_name, src_rse_id = __get_source_rse(request_id, response.get('scope', None), response.get('name', None), src_url, session=session)
+                except Exception:
+                    logging.warn(prepend_str + 'Cannot get correct RSE for source url: %s(%s)' % (src_url, traceback.format_exc()))
+                    src_rse_name = None
+                if src_rse_name and src_rse_name != response.get('src_rse', None):
+                    response['src_rse'] = src_rse_name
+                    response['src_rse_id'] = src_rse_id
+                    logging.debug(prepend_str + 'Correct RSE: %s for source surl: %s' % (src_rse_name, src_url))
+
+            values.append({'b_id': request_id,
+                           'b_external_id': response['transfer_id'],
+                           'b_state': response['new_state'],
+                           'b_updated_at': now,
+                           'b_started_at': response.get('started_at', None) or request['started_at'],
+                           'b_transferred_at': response.get('transferred_at', None) or request['transferred_at'],
+                           'b_source_rse_id': src_rse_id or request['source_rse_id'],
+                           'b_err_msg': get_transfer_error(response['new_state'], response.get('reason', None)) or request['err_msg']})
+            messages.append((request, response))
+            result[request_id] = True
+
+    try:
+        if values:
+            record_counter('core.request.set_request_state', len(values))
+            stmt = update(models.Request).\
+                where(and_(models.Request.id == bindparam('b_id'),
+                           models.Request.external_id == bindparam('b_external_id'))).\
+                values(state=bindparam('b_state'),
+                       updated_at=bindparam('b_updated_at'),
+                       started_at=bindparam('b_started_at'),
+                       transferred_at=bindparam('b_transferred_at'),
+                       source_rse_id=bindparam('b_source_rse_id'),
+                       err_msg=bindparam('b_err_msg'))
+            session.execute(stmt, values)
+
+        for chunk in chunks(touched, 100):
+            record_counter('core.request.touch_request', len(chunk))
+            session.query(models.Request).filter(models.Request.id.in_(chunk)).update({'updated_at': now}, synchronize_session=False)
+    except IntegrityError as error:
+        raise RucioException(error.args)
+
+    for request, response in messages:
+        add_monitor_message(request, response, session=session)
+    return result
+
+
 @read_session
 def add_monitor_message(request, response, session=None):
     """
@@ -64,6 +64,34 @@ REGION = make_region().configure('dogpile.cache.memcached',
                                  arguments={'url': "127.0.0.1:11211",
                                             'distributed_lock': True})
 
+# Counter of the RSE metadata changes done by this process.
+# In-memory consumers (e.g. the RSE metadata snapshot) use it to check the versions right away.
+__RSE_GENERATION = 0
+
+
+def get_rse_generation():
+    """
+    Return the local RSE generation counter.
+
+    :returns: Integer which changes whenever this process modified the RSE metadata.
+    """
+    return __RSE_GENERATION
+
+
+def bump_rse_version(tables, session=None):
+    """
+    Increment the change counters of RSE metadata tables, in the transaction of the change,
+    and the local RSE generation counter.
+
+    :param tables: Names of the changed tables, among rses, attributes, protocols, limits and distances.
+    :param session: The database session in use.
+    """
+    global __RSE_GENERATION
+    __RSE_GENERATION += 1
+    for name in tables:
+        if not session.query(models.RSEMetadataVersion).filter_by(name=name).update({'version': models.RSEMetadataVersion.version + 1}, synchronize_session=False):
+            models.RSEMetadataVersion(name=name, version=1).save(session=session)
+
 
 @transactional_session
 def add_rse(rse, deterministic=True, volatile=False, city=None, region_code=None, country_name=None, continent=None, time_zone=None,
@@ -112,6 +140,7 @@ def add_rse(rse, deterministic=True, volatile=False, city=None, region_code=None
     # Add account counter
     rucio.core.account_counter.create_counters_for_new_rse(rse_id=new_rse.id, session=session)
 
+    bump_rse_version(['rses', 'attributes'], session=session)
     return new_rse.id
 
 
@@ -178,6 +207,7 @@ def del_rse(rse, session=None):
         del_rse_attribute(rse=rse, key=rse, session=session)
     except exception.RSEAttributeNotFound:
         pass
+    bump_rse_version(['rses', 'attributes'], session=session)
 
 
 @read_session
@@ -361,6 +391,7 @@ def add_rse_attribute(rse, key, value, session=None):
         new_rse_attr.save(session=session)
     except IntegrityError:
         raise exception.Duplicate("RSE attribute '%(key)s-%(value)s\' for RSE '%(rse)s' already exists!" % locals())
+    bump_rse_version(['attributes'], session=session)
     return True
 
 
@@ -383,6 +414,7 @@ def del_rse_attribute(rse, key, session=None):
     except sqlalchemy.orm.exc.NoResultFound:
         raise exception.RSEAttributeNotFound('RSE attribute \'%s\' cannot be found' % key)
     rse_attr.delete(session=session)
+    bump_rse_version(['attributes'], session=session)
     return True
 
 
@@ -610,6 +642,7 @@ def set_rse_limits(rse, name, value, session=None):
     rse_limit = models.RSELimit(rse_id=rse_id, name=name, value=value)
     rse_limit = session.merge(rse_limit)
     rse_limit.save(session=session)
+    bump_rse_version(['limits'], session=session)
     return True
 
 
@@ -651,6 +684,7 @@ def delete_rse_limit(rse, name=None, rse_id=None, session=None):
         session.query(models.RSELimit).filter_by(rse_id=rse_id, name=name).delete()
     except IntegrityError as error:
         raise exception.RucioException(error.args)
+    bump_rse_version(['limits'], session=session)
 
 
 @transactional_session
@@ -825,6 +859,7 @@ def add_protocol(rse, parameter, session=None):
              or match('.*OperationalError.*cannot be null.*', error.args[0]):
             raise exception.InvalidObject('Missing values!')
         raise error
+    bump_rse_version(['protocols'], session=session)
     return new_protocol
 
 
@@ -904,32 +939,42 @@ def get_rse_protocols(rse, schemes=None, session=None):
                           models.RSEProtocols.extended_attributes).filter(*terms)
 
     for row in query:
-        p = {'hostname': row.hostname,
-             'scheme': row.scheme,
-             'port': row.port,
-             'prefix': row.prefix if row.prefix is not None else '',
-             'impl': row.impl,
-             'domains': {
-                 'lan': {'read': row.read_lan,
-                         'write': row.write_lan,
-                         'delete': row.delete_lan},
-                 'wan': {'read': row.read_wan,
-                         'write': row.write_wan,
-                         'delete': row.delete_wan,
-                         'third_party_copy': row.third_party_copy}
-             },
-             'extended_attributes': row.extended_attributes}
-
-        try:
-            p['extended_attributes'] = json.load(StringIO(p['extended_attributes']))
-        except ValueError:
-            pass  # If value is not a JSON string
-
-        info['protocols'].append(p)
+        info['protocols'].append(format_rse_protocol(row))
     info['protocols'] = sorted(info['protocols'], key=lambda p: (p['hostname'], p['scheme'], p['port']))
     return info
 
 
+def format_rse_protocol(row):
+    """
+    Format a RSE protocol as in the RSE information returned by get_rse_protocols.
+
+    :param row: Row with the columns of the RSE protocol.
+
+    :returns: A dict with the protocol settings.
+    """
+    p = {'hostname': row.hostname,
+         'scheme': row.scheme,
+         'port': row.port,
+         'prefix': row.prefix if row.prefix is not None else '',
+         'impl': row.impl,
+         'domains': {
+             'lan': {'read': row.read_lan,
+                     'write': row.write_lan,
+                     'delete': row.delete_lan},
+             'wan': {'read': row.read_wan,
+                     'write': row.write_wan,
+                     'delete': row.delete_wan,
+                     'third_party_copy': row.third_party_copy}
+         },
+         'extended_attributes': row.extended_attributes}
+
+    try:
+        p['extended_attributes'] = json.load(StringIO(p['extended_attributes']))
+    except ValueError:
+        pass  # If value is not a JSON string
+    return p
+
+
 @transactional_session
 def update_protocols(rse, scheme, data, hostname, port, session=None):
     """
@@ -1046,6 +1091,7 @@ def update_protocols(rse, scheme, data, hostname, port, session=None):
         if match('.*DatabaseError.*ORA-01407: cannot update .*RSE_PROTOCOLS.*IMPL.*to NULL.*', error.args[0]):
             raise exception.InvalidObject('Invalid values !')
         raise error
+    bump_rse_version(['protocols'], session=session)
 
 
 @transactional_session
@@ -1097,6 +1143,7 @@ def del_protocols(rse, scheme, hostname=None, port=None, session=None):
                 for p in prots:
                     p.update({op_name: i})
                     i += 1
+    bump_rse_version(['protocols'], session=session)
 
 
 @transactional_session
@@ -1138,6 +1185,7 @@ def update_rse(rse, parameters, session=None):
         query = session.query(models.RSEAttrAssociation).filter_by(rse_id=rse_id).filter(models.RSEAttrAssociation.key == rse)
         rse_attr = query.one()
         rse_attr.delete(session=session)
+    bump_rse_version(['rses', 'attributes'], session=session)
 
 
 @read_session
@@ -0,0 +1,435 @@
+# Copyright 2019 CERN for the benefit of the ATLAS collaboration.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# PY3K COMPATIBLE
+
+"""
+Process wide cache of the RSE metadata: RSEs, attributes, protocols, limits and distances.
+"""
+
+import threading
+
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta
+
+from sqlalchemy import String, func, type_coerce
+
+from rucio.common import utils
+from rucio.common.config import config_get, get_lfn2pfn_algorithm_default
+from rucio.common.exception import RSENotFound
+from rucio.core.rse import format_rse_protocol, get_rse_generation
+from rucio.db.sqla import models
+from rucio.db.sqla.session import read_session
+from rucio.db.sqla.types import BooleanString
+
+
+REFRESH_INTERVAL = int(config_get('common', 'rse_cache_refresh_interval', False, 30))
+REFRESH_MARGIN = int(config_get('common', 'rse_cache_refresh_margin', False, 300))
+
+# Cached tables with their primary key
+TABLES = {'rses': (models.RSE, ('id', )),
+          'attributes': (models.RSEAttrAssociation, ('rse_id', 'key')),
+          'protocols': (models.RSEProtocols, ('rse_id', 'scheme', 'hostname', 'port')),
+          'limits': (models.RSELimit, ('rse_id', 'name')),
+          'distances': (models.Distance, ('src_rse_id', 'dest_rse_id'))}
+
+# Tables a lookup structure is built from, when not only its own
+VIEW_TABLES = {'values': ('rses', 'attributes'),
+               'numeric': ('rses', 'attributes')}
+
+BOOLEAN_STRING = BooleanString()
+
+
+class RSESnapshot(object):
+    """
+    Read-only view of the RSE metadata at one point in time.
+
+    A snapshot is never modified once published, so it can be used by several threads without locking.
+    The lookup structures are built on first use, and reused by the next snapshot for the tables which did not change.
+    """
+
+    def __init__(self, tables, fingerprints, versions, previous=None, changed=()):
+        """
+        :param tables: Dictionary {table name: {primary key: row}}.
+        :param fingerprints: Dictionary {table name: (count, last update)}.
+        :param versions: Dictionary {table name: change counter} the tables were loaded at.
+        :param previous: The previous snapshot.
+        :param changed: Names of the tables changed since the previous snapshot.
+        """
+        self.tables = tables
+        self.fingerprints = fingerprints
+        self.versions = versions
+        self.__views = {}
+        if previous is not None:
+            for name, view in previous.__views.items():
+                if not set(VIEW_TABLES.get(name, (name, ))) & set(changed):
+                    self.__views[name] = view
+
+    def __get_view(self, name):
+        """
+        Return the lookup structure of a table.
+
+        :param name: The table name.
+        """
+        view = self.__views.get(name)
+        if view is not None:
+            return view
+
+        rows = self.tables[name].values() if name in self.tables else ()
+        if name == 'rses':
+            rses = dict((row.id, row) for row in rows if not row.deleted)
+            view = (rses, dict((row.rse, row.id) for row in rses.values()))
+        elif name == 'attributes':
+            view = {}
+            for row in rows:
+                view.setdefault(row.rse_id, {})[row.key] = BOOLEAN_STRING.process_result_value(row.value, None)
+        elif name == 'values':
+            # Inverted index {key: {raw value: frozenset of rse_ids}} of the attributes of the active RSEs
+            rses, _ = self.__get_view('rses')
+            view = {}
+            for row in self.tables['attributes'].values():
+                if row.rse_id in rses:
+                    view.setdefault(row.key, {}).setdefault(row.value, set()).add(row.rse_id)
+            for key in view:
+                view[key] = dict((value, frozenset(rse_ids)) for value, rse_ids in view[key].items())
+        elif name == 'numeric':
+            # Sorted numeric indexes, built per attribute key on first use
+            view = {}
+        elif name == 'protocols':
+            view = {}
+            for row in rows:
+                view.setdefault(row.rse_id, []).append(row)
+        elif name == 'limits':
+            view = {}
+            for row in rows:
+                view.setdefault(row.rse_id, {})[row.name] = row.value
+        else:
+            view = self.tables[name]
+        self.__views[name] = view
+        return view
+
+    def get_rse(self, rse_id):
+        """
+        Return the columns of a RSE.
+
+        :param rse_id: The RSE id.
+        :returns: A dictionary with the RSE columns.
+        :raises RSENotFound: If the RSE does not exist.
+        """
+        rses, _ = self.__get_view('rses')
+        if rse_id not in rses:
+            raise RSENotFound('RSE with id \'%s\' cannot be found' % rse_id)
+        return rses[rse_id]._asdict()
+
+    def get_rse_id(self, rse):
+        """
+        Return the id of a RSE.
+
+        :param rse: The RSE name.
+        :returns: The RSE id.
+        :raises RSENotFound: If the RSE does not exist.
+        """
+        _, rse_ids = self.__get_view('rses')
+        if rse not in rse_ids:
+            raise RSENotFound('RSE \'%s\' cannot be found' % rse)
+        return rse_ids[rse]
+
+    def list_rses(self):
+        """
+        Return the columns of all the RSEs.
+
+        :returns: A list of dictionaries with the RSE columns.
+        """
+        rses, _ = self.__get_view('rses')
+        return [row._asdict() for row in rses.values()]
+
+    def list_rse_attributes(self, rse_id):
+        """
+        Return the attributes of a RSE.
+
+        :param rse_id: The RSE id.
+        :returns: A dictionary with the RSE attributes.
+        """
+        return dict(self.__get_view('attributes').get(rse_id, {}))
+
+    def all_rses(self):
+        """
+        Return the ids of all the RSEs.
+
+        :returns: Set of RSE ids.
+        """
+        rses, _ = self.__get_view('rses')
+        return frozenset(rses)
+
+    def get_rses_with_value(self, key, value):
+        """
+        Return the RSE ids having the attribute key set to value.
+        Matches the same values as the attribute filter of :py:func:`rucio.core.rse.list_rses`.
+
+        :param key: Key of the RSE attribute.
+        :param value: Value of the RSE attribute.
+        :returns: Set of RSE ids.
+        """
+        values = self.__get_view('values').get(key)
+        if not values:
+            return frozenset()
+        if isinstance(value, bool):
+            candidates = [BOOLEAN_STRING.process_bind_param(value, None), str(value), '1' if value else '0']
+        else:
+            candidates = [BOOLEAN_STRING.process_bind_param(value, None)]
+        result = frozenset()
+        for candidate in set(candidates):
+            result = result | values.get(candidate, frozenset())
+        return result
+
+    def __get_numeric_index(self, key):
+        """
+        Return the sorted numeric index of an attribute, built on first use.
+
+        :param key: Key of the RSE attribute.
+        :returns: Tuple (sorted list of float values, list of rse_ids in the same order).
+        """
+        numeric = self.__get_view('numeric')
+        index = numeric.get(key)
+        if index is None:
+            pairs = []
+            for value, rse_ids in self.__get_view('values').get(key, {}).items():
+                try:
+                    number = float(BOOLEAN_STRING.process_result_value(value, None))
+                except (TypeError, ValueError):
+                    continue
+                pairs.extend((number, rse_id) for rse_id in rse_ids)
+            pairs.sort()
+            index = ([number for number, _ in pairs], [rse_id for _, rse_id in pairs])
+            numeric[key] = index
+        return index
+
+    def get_rses_smaller(self, key, value):
+        """
+        Return the RSE ids having a numeric attribute key smaller than value.
+
+        :param key: Key of the RSE attribute.
+        :param value: Numeric value to compare to.
+        :returns: Set of RSE ids.
+        """
+        try:
+            value = float(value)
+        except ValueError:
+            return frozenset()
+        numbers, rse_ids = self.__get_numeric_index(key)
+        return frozenset(rse_ids[:bisect_left(numbers, value)])
+
+    def get_rses_larger(self, key, value):
+        """
+        Return the RSE ids having a numeric attribute key larger than value.
+
+        :param key: Key of the RSE attribute.
+        :param value: Numeric value to compare to.
+        :returns: Set of RSE ids.
+        """
+        try:
+            value = float(value)
+        except ValueError:
+            return frozenset()
+        numbers, rse_ids = self.__get_numeric_index(key)
+        return frozenset(rse_ids[bisect_right(numbers, value):])
+
+    def get_rse_protocols(self, rse_id, schemes=None):
+        """
+        Return the protocol information of a RSE, as rucio.core.rse.get_rse_protocols.
+
+        :param rse_id: The RSE id.
+        :param schemes: a list of schemes to filter by.
+        :returns: A dict with RSE information and supported protocols.
+        :raises RSENotFound: If the RSE does not exist.
+        """
+        rses, _ = self.__get_view('rses')
+        if rse_id not in rses:
+            raise RSENotFound('RSE with id \'%s\' cannot be found' % rse_id)
+        rse = rses[rse_id]
+        attributes = self.__get_view('attributes').get(rse_id, {})
+
+        info = {'id': rse.id,
+                'rse': rse.rse,
+                'availability_read': True if rse.availability & 4 else False,
+                'availability_write': True if rse.availability & 2 else False,
+                'availability_delete': True if rse.availability & 1 else False,
+                'domain': utils.rse_supported_protocol_domains(),
+                'protocols': list(),
+                'deterministic': rse.deterministic,
+                'lfn2pfn_algorithm': attributes.get('lfn2pfn_algorithm', get_lfn2pfn_algorithm_default()),
+                'rse_type': str(rse.rse_type),
+                'credentials': None,
+                'volatile': rse.volatile,
+                'verify_checksum': attributes.get('verify_checksum', True),
+                'sign_url': attributes.get('sign_url', None),
+                'staging_area': rse.staging_area}
+
+        for op in utils.rse_supported_protocol_operations():
+            info['%s_protocol' % op] = 1  # 1 indicates the default protocol
+
+        if schemes and not isinstance(schemes, list):
+            schemes = [schemes]
+        for row in self.__get_view('protocols').get(rse_id, []):
+            if not schemes or row.scheme in schemes:
+                info['protocols'].append(format_rse_protocol(row))
+        info['protocols'] = sorted(info['protocols'], key=lambda p: (p['hostname'], p['scheme'], p['port']))
+        return info
+
+    def get_rse_limits(self, rse_id, name=None):
+        """
+        Return the limits of a RSE.
+
+        :param rse_id: The RSE id.
+        :param name: A limit name.
+        :returns: A dictionary with the limits {'limit.name': limit.value}.
+        """
+        limits = self.__get_view('limits').get(rse_id, {})
+        if name:
+            return dict((key, value) for key, value in limits.items() if key == name)
+        return dict(limits)
+
+    def get_distance(self, src_rse_id, dest_rse_id):
+        """
+        Return the distance between two RSEs.
+
+        :param src_rse_id: The source RSE id.
+        :param dest_rse_id: The destination RSE id.
+        :returns: A dictionary with the distance columns, or None if there is no distance.
+        """
+        row = self.__get_view('distances').get((src_rse_id, dest_rse_id))
+        if row is None:
+            return None
+        distance = row._asdict()
+        distance['distance'] = distance['agis_distance']
+        return distance
+
+
+class RSEMetadataCache(object):
+    """
+    Holder of the current RSESnapshot of the process.
+
+    The snapshot is bulk loaded on first use and afterwards refreshed incrementally:
+    every REFRESH_INTERVAL seconds, or whenever this process changed a RSE, the change counters
+    of the tables (rse_metadata_versions, bumped in the transaction of every change) are compared
+    to the ones of the snapshot. Only the tables whose counter moved are refreshed, by fetching the
+    rows updated since their last known update minus REFRESH_MARGIN, so that rows committed late
+    with an older timestamp are not missed; if the number of rows of a table does not add up
+    (e.g. deleted rows) the table is reloaded completely.
+    """
+
+    def __init__(self):
+        """
+        Creates an empty cache.
+        """
+        self.snapshot = None
+        self.generation = None
+        self.checked_at = None
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        """
+        Force a complete reload on next use.
+        """
+        with self.lock:
+            self.snapshot = None
+
+    def get_snapshot(self, session):
+        """
+        Return an up-to-date snapshot.
+
+        :param session: Database session in use.
+        :returns: RSESnapshot.
+        """
+        snapshot = self.snapshot
+        if snapshot is not None and self.generation == get_rse_generation() and datetime.utcnow() - self.checked_at < timedelta(seconds=REFRESH_INTERVAL):
+            return snapshot
+        with self.lock:
+            generation = get_rse_generation()
+            # Read the counters first: the rows loaded afterwards contain at least these changes
+            versions = dict(session.query(models.RSEMetadataVersion.name, models.RSEMetadataVersion.version))
+            previous = self.snapshot
+            tables = dict(previous.tables) if previous else {}
+            fingerprints = dict(previous.fingerprints) if previous else {}
+            changed = []
+            for name, (model, primary_key) in TABLES.items():
+                if previous is not None and versions.get(name, 0) == previous.versions.get(name, 0):
+                    continue
+                fingerprint = session.query(func.count(), func.max(model.updated_at)).select_from(model).one()
+                since = fingerprints[name][1] if previous is not None else None
+                if since is not None:
+                    since = since - timedelta(seconds=REFRESH_MARGIN)
+                tables[name] = self.__load(model, primary_key, since=since, rows=tables.get(name), session=session)
+                if len(tables[name]) != fingerprint[0]:
+                    tables[name] = self.__load(model, primary_key, session=session)
+                fingerprints[name] = fingerprint
+                changed.append(name)
+            if previous is None or changed:
+                self.snapshot = RSESnapshot(tables=tables, fingerprints=fingerprints, versions=versions, previous=previous, changed=changed)
+            self.generation = generation
+            self.checked_at = datetime.utcnow()
+            return self.snapshot
+
+    @staticmethod
+    def __load(model, primary_key, since=None, rows=None, session=None):
+        """
+        Load the rows of a table.
+
+        :param model: The model of the table.
+        :param primary_key: The primary key columns.
+        :param since: If set, only the rows updated since then are loaded and merged into rows.
+        :param rows: The rows of the previous snapshot.
+        :param session: Database session in use.
+        :returns: Dictionary {primary key: row}.
+        """
+        # Values are kept as stored, e.g. for the attribute index, and converted by the lookup structures
+        query = session.query(*[type_coerce(column, String).label(column.name) if isinstance(column.type, BooleanString) else column
+                                for column in model.__table__.columns])
+        if since is not None and rows is not None:
+            query = query.filter(model.updated_at >= since)
+            rows = dict(rows)
+        else:
+            rows = {}
+        for row in query:
+            rows[tuple(getattr(row, column) for column in primary_key) if len(primary_key) > 1 else getattr(row, primary_key[0])] = row
+        return rows
+
+
+RSE_METADATA_CACHE = RSEMetadataCache()
+
+
+@read_session
+def get_rse_snapshot(session=None):
+    """
+    Return an up-to-date snapshot of the RSE metadata shared by the process.
+
+    :param session: The database session in use.
+    :returns: RSESnapshot.
+    """
+    return RSE_METADATA_CACHE.get_snapshot(session=session)
+
+
+@read_session
+def get_rse_protocols(rse, schemes=None, session=None):
+    """
+    Return the protocol information of a RSE from the snapshot, as rucio.core.rse.get_rse_protocols.
+
+    :param rse: The RSE name.
+    :param schemes: a list of schemes to filter by.
+    :param session: The database session in use.
+    :returns: A dict with RSE information and supported protocols.
+    :raises RSENotFound: If the RSE does not exist.
+    """
+    snapshot = RSE_METADATA_CACHE.get_snapshot(session=session)
+    return snapshot.get_rse_protocols(snapshot.get_rse_id(rse), schemes=schemes)
@@ -18,14 +18,13 @@
 import abc
 import re
 
-from dogpile.cache import make_region
-from dogpile.cache.api import NoValue
-from hashlib import sha256
 from six import add_metaclass
 
 from rucio.common import schema
 from rucio.common.exception import InvalidRSEExpression, RSEBlacklisted
-from rucio.core.rse import list_rses, get_rses_with_attribute, get_rse_attribute
+from rucio.core.rse import list_rses
+from rucio.core.rse_cache import get_rse_snapshot
+from rucio.db.sqla import models
 from rucio.db.sqla.session import transactional_session
 
 
@@ -38,10 +37,12 @@ COMPLEMENT = r'(\\%s)' % (PRIMITIVE)
 
 PATTERN = r'^%s(%s|%s|%s)*' % (PRIMITIVE, UNION, INTERSECTION, COMPLEMENT)
 
+# Filters of list_rses which, like the RSE table columns, are not resolved by the attribute index
+RSE_FILTER_KEYS = ['availability_read', 'availability_write', 'availability_delete']
 
-REGION = make_region().configure('dogpile.cache.memcached',
-                                 expiration_time=3600,
-                                 arguments={'url': "127.0.0.1:11211", 'distributed_lock': True})
+MAX_COMPILED_EXPRESSIONS = 10000
+
+COMPILED_EXPRESSIONS = {}
 
 
 @transactional_session
@@ -55,34 +56,10 @@ def parse_expression(expression, filter=None, session=None):
     :returns:             A list of rse dictionaries.
     :raises:              InvalidRSEExpression, RSENotFound, RSEBlacklisted
     """
-    result = REGION.get(sha256(expression).hexdigest())
-    if type(result) is NoValue:
-        # Evaluate the correctness of the parentheses
-        parantheses_open_count = 0
-        parantheses_close_count = 0
-        for char in expression:
-            if (char == '('):
-                parantheses_open_count += 1
-            elif (char == ')'):
-                parantheses_close_count += 1
-            if (parantheses_close_count > parantheses_open_count):
-                raise InvalidRSEExpression('Problem with parantheses.')
-        if (parantheses_open_count != parantheses_close_count):
-            raise InvalidRSEExpression('Problem with parantheses.')
-
-        # Check the expression pattern
-        match = re.match(PATTERN, expression)
-        if match is None:
-            raise InvalidRSEExpression('Expression does not comply to RSE Expression syntax')
-        else:
-            if match.group() != expression:
-                raise InvalidRSEExpression('Expression does not comply to RSE Expression syntax')
-        result_tuple = __resolve_term_expression(expression)[0].resolve_elements(session=session)
-        # result_tuple = ([rse_ids], {rse_id: {rse_info}})
-        result = []
-        for rse in list(result_tuple[0]):
-            result.append(result_tuple[1][rse])
-        REGION.set(sha256(expression).hexdigest(), result)
+    compiled_expression = compile_expression(expression)
+    snapshot = get_rse_snapshot(session=session)
+    all_rses = snapshot.all_rses()
+    result = [snapshot.get_rse(rse_id) for rse_id in compiled_expression.resolve_elements(snapshot, session=session) if rse_id in all_rses]
 
     if not result:
         raise InvalidRSEExpression('RSE Expression resulted in an empty set.')
@@ -103,6 +80,47 @@ def parse_expression(expression, filter=None, session=None):
     return final_result
 
 
+def compile_expression(expression):
+    """
+    Validate a RSE expression and return its expression tree.
+    The tree does not depend on the database content, thus it is cached per expression.
+
+    :param expression:  RSE expression, e.g: 'CERN|BNL'.
+    :returns:           BaseExpressionElement, root of the expression tree.
+    :raises:            InvalidRSEExpression
+    """
+    compiled_expression = COMPILED_EXPRESSIONS.get(expression)
+    if compiled_expression is not None:
+        return compiled_expression
+
+    # Evaluate the correctness of the parentheses
+    parantheses_open_count = 0
+    parantheses_close_count = 0
+    for char in expression:
+        if (char == '('):
+            parantheses_open_count += 1
+        elif (char == ')'):
+            parantheses_close_count += 1
+        if (parantheses_close_count > parantheses_open_count):
+            raise InvalidRSEExpression('Problem with parantheses.')
+    if (parantheses_open_count != parantheses_close_count):
+        raise InvalidRSEExpression('Problem with parantheses.')
+
+    # Check the expression pattern
+    match = re.match(PATTERN, expression)
+    if match is None:
+        raise InvalidRSEExpression('Expression does not comply to RSE Expression syntax')
+    else:
+        if match.group() != expression:
+            raise InvalidRSEExpression('Expression does not comply to RSE Expression syntax')
+
+    compiled_expression = __resolve_term_expression(expression)[0]
+    if len(COMPILED_EXPRESSIONS) >= MAX_COMPILED_EXPRESSIONS:
+        COMPILED_EXPRESSIONS.clear()
+    COMPILED_EXPRESSIONS[expression] = compiled_expression
+    return compiled_expression
+
+
 def __resolve_term_expression(expression):
     """
     Resolves a Term Expression and returns an object of type BaseExpressionElement
@@ -204,13 +222,14 @@ def __extract_term(expression):
 @add_metaclass(abc.ABCMeta)
 class BaseExpressionElement:
     @abc.abstractmethod
-    def resolve_elements(self, session):
+    def resolve_elements(self, snapshot, session):
         """
         Resolve the ExpressionElement and return a set of RSE ids
 
+        :param snapshot: RSESnapshot to resolve against
         :param session:  Database session in use
-        :returns:        (Set of RSE ids, Dictionary of RSE dicts)
-        :rtype:          (Set of Strings, Dictionary of RSE dicts organized by rse_id)
+        :returns:        Set of RSE ids
+        :rtype:          Set of Strings
         """
         pass
 
@@ -220,17 +239,11 @@ class RSEAll(BaseExpressionElement):
     Representation of all RSEs
     """
 
-    def resolve_elements(self, session):
+    def resolve_elements(self, snapshot, session):
         """
         Inherited from :py:func:`BaseExpressionElement.resolve_elements`
         """
-        output = list_rses(session=session)
-        if not output:
-            return (set(), {})
-        rse_dict = {}
-        for rse in output:
-            rse_dict[rse['id']] = rse
-        return (set([rse['id'] for rse in output]), rse_dict)
+        return snapshot.all_rses()
 
 
 class RSEAttributeEqualCheck(BaseExpressionElement):
@@ -248,17 +261,13 @@ class RSEAttributeEqualCheck(BaseExpressionElement):
         self.key = key
         self.value = value
 
-    def resolve_elements(self, session):
+    def resolve_elements(self, snapshot, session):
         """
         Inherited from :py:func:`BaseExpressionElement.resolve_elements`
         """
-        output = list_rses({self.key: self.value}, session=session)
-        if not output:
-            return (set(), {})
-        rse_dict = {}
-        for rse in output:
-            rse_dict[rse['id']] = rse
-        return (set([rse['id'] for rse in output]), rse_dict)
+        if hasattr(models.RSE, self.key) or self.key in RSE_FILTER_KEYS:
+            return frozenset(rse['id'] for rse in list_rses({self.key: self.value}, session=session))
+        return snapshot.get_rses_with_value(self.key, self.value)
 
 
 class RSEAttributeSmallerCheck(BaseExpressionElement):
@@ -276,24 +285,11 @@ class RSEAttributeSmallerCheck(BaseExpressionElement):
         self.key = key
         self.value = value
 
-    def resolve_elements(self, session):
+    def resolve_elements(self, snapshot, session):
         """
         Inherited from :py:func:`BaseExpressionElement.resolve_elements`
         """
-        rse_list = get_rses_with_attribute(key=self.key, session=session)
-        if not rse_list:
-            return (set(), {})
-
-        output = []
-        rse_dict = {}
-        for rse in rse_list:
-            try:
-                if float(get_rse_attribute(key=self.key, rse_id=rse['id'], session=session)[0]) < float(self.value):
-                    rse_dict[rse['id']] = rse
-                    output.append(rse['id'])
-            except ValueError:
-                continue
-        return (set(output), rse_dict)
+        return snapshot.get_rses_smaller(self.key, self.value)
 
 
 class RSEAttributeLargerCheck(BaseExpressionElement):
@@ -311,24 +307,11 @@ class RSEAttributeLargerCheck(BaseExpressionElement):
         self.key = key
         self.value = value
 
-    def resolve_elements(self, session):
+    def resolve_elements(self, snapshot, session):
         """
         Inherited from :py:func:`BaseExpressionElement.resolve_elements`
         """
-        rse_list = get_rses_with_attribute(key=self.key, session=session)
-        if not rse_list:
-            return (set(), {})
-
-        output = []
-        rse_dict = {}
-        for rse in rse_list:
-            try:
-                if float(get_rse_attribute(key=self.key, rse_id=rse['id'], session=session)[0]) > float(self.value):
-                    rse_dict[rse['id']] = rse
-                    output.append(rse['id'])
-            except ValueError:
-                continue
-        return (set(output), rse_dict)
+        return snapshot.get_rses_larger(self.key, self.value)
 
 
 @add_metaclass(abc.ABCMeta)
@@ -377,13 +360,11 @@ class ComplementOperator(BaseRSEOperator):
         """
         self.right_term = right_term
 
-    def resolve_elements(self, session):
+    def resolve_elements(self, snapshot, session):
         """
         Inherited from :py:func:`BaseExpressionElement.resolve_elements`
         """
-        left_term_tuple = self.left_term.resolve_elements(session=session)
-        right_term_tuple = self.right_term.resolve_elements(session=session)
-        return (left_term_tuple[0] - right_term_tuple[0], dict(left_term_tuple[1].items() + right_term_tuple[1].items()))
+        return self.left_term.resolve_elements(snapshot, session=session) - self.right_term.resolve_elements(snapshot, session=session)
 
 
 class UnionOperator(BaseRSEOperator):
@@ -411,13 +392,11 @@ class UnionOperator(BaseRSEOperator):
         """
         self.right_term = right_term
 
-    def resolve_elements(self, session):
+    def resolve_elements(self, snapshot, session):
         """
         Inherited from :py:func:`BaseExpressionElement.resolve_elements`
         """
-        left_term_tuple = self.left_term.resolve_elements(session=session)
-        right_term_tuple = self.right_term.resolve_elements(session=session)
-        return (left_term_tuple[0] | right_term_tuple[0], dict(left_term_tuple[1].items() + right_term_tuple[1].items()))
+        return self.left_term.resolve_elements(snapshot, session=session) | self.right_term.resolve_elements(snapshot, session=session)
 
 
 class IntersectOperator(BaseRSEOperator):
@@ -445,10 +424,8 @@ class IntersectOperator(BaseRSEOperator):
         """
         self.right_term = right_term
 
-    def resolve_elements(self, session):
+    def resolve_elements(self, snapshot, session):
         """
         Inherited from :py:func:`BaseExpressionElement.resolve_elements`
         """
-        left_term_tuple = self.left_term.resolve_elements(session=session)
-        right_term_tuple = self.right_term.resolve_elements(session=session)
-        return (left_term_tuple[0] & right_term_tuple[0], dict(left_term_tuple[1].items() + right_term_tuple[1].items()))
+        return self.left_term.resolve_elements(snapshot, session=session) & self.right_term.resolve_elements(snapshot, session=session)
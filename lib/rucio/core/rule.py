@@ -62,7 +62,7 @@ from rucio.common.exception import (InvalidRSEExpression, InvalidReplicationRule
                                     ManualRuleApprovalBlocked, UnsupportedOperation, UndefinedPolicy)
 from rucio.common.schema import validate_schema
 from rucio.common.utils import str_to_date, sizefmt
-from rucio.core import account_counter, rse_counter, request as request_core
+from rucio.core import account_counter, rse_counter, request as request_core, work_lease
 from rucio.core.account import get_account
 from rucio.core.lifetime_exception import define_eol
 from rucio.core.message import add_message
@@ -1485,7 +1485,7 @@ def re_evaluate_did(scope, name, rule_evaluation_action, session=None):
 
 
 @read_session
-def get_updated_dids(total_workers, worker_number, limit=100, blacklisted_dids=[], session=None):
+def get_updated_dids(total_workers, worker_number, limit=100, blacklisted_dids=[], buckets=None, session=None):
     """
     Get updated dids.
 
@@ -1493,6 +1493,7 @@ def get_updated_dids(total_workers, worker_number, limit=100, blacklisted_dids=[
     :param worker_number:      id of the executing worker.
     :param limit:              Maximum number of dids to return.
     :param blacklisted_dids:   Blacklisted dids to filter.
+    :param buckets:            List of (first, last) work bucket ranges leased by the worker, used instead of total_workers and worker_number.
     :param session:            Database session in use.
     """
     query = session.query(models.UpdatedDID.id,
@@ -1500,7 +1501,9 @@ def get_updated_dids(total_workers, worker_number, limit=100, blacklisted_dids=[
                           models.UpdatedDID.name,
                           models.UpdatedDID.rule_evaluation_action)
 
-    if total_workers > 0:
+    if buckets is not None:
+        query = query.filter(work_lease.bucket_filter(models.UpdatedDID.bucket, buckets))
+    elif total_workers > 0:
         if session.bind.dialect.name == 'oracle':
             bindparams = [bindparam('worker_number', worker_number),
                           bindparam('total_workers', total_workers)]
@@ -1518,6 +1521,7 @@ def get_updated_dids(total_workers, worker_number, limit=100, blacklisted_dids=[
                                     worker_number=worker_number,
                                     limit=None,
                                     blacklisted_dids=blacklisted_dids,
+                                    buckets=buckets,
                                     session=session)
         else:
             return filtered_dids
@@ -2009,6 +2013,22 @@ def insert_rule_history(rule, recent=True, longterm=False, session=None):
                                       split_container=rule.split_container, meta=rule.meta).save(session=session)
 
 
+@transactional_session
+def insert_rules_history(rules, recent=True, longterm=False, session=None):
+    """
+    Bulk insert the history of several rules to recent/longterm history.
+
+    :param rules:     The list of rule objects.
+    :param recent:    Insert to recent table.
+    :param longterm:  Insert to longterm table.
+    :param session:   The Database session.
+    """
+    for flag, model in ((recent, models.ReplicationRuleHistoryRecent), (longterm, models.ReplicationRuleHistory)):
+        if flag and rules:
+            columns = [column.name for column in model.__table__.columns]
+            session.bulk_insert_mappings(model, [dict((column, getattr(rule, column)) for column in columns) for rule in rules])
+
+
 @transactional_session
 def approve_rule(rule_id, approver=None, notify_approvers=True, session=None):
     """
@@ -19,6 +19,7 @@ from __future__ import division
 import datetime
 import json
 import logging
+import threading
 import time
 import traceback
 
@@ -29,13 +30,13 @@ from sqlalchemy.exc import IntegrityError
 from sqlalchemy.sql.expression import bindparam, text, false
 
 from rucio.common import constants
-from rucio.common.exception import RucioException, UnsupportedOperation, InvalidRSEExpression, RSEProtocolNotSupported, RequestNotFound
-from rucio.common.rse_attributes import get_rse_attributes
-from rucio.common.utils import construct_surl
+from rucio.common.exception import RucioException, UnsupportedOperation, InvalidRSEExpression, RSEProtocolNotSupported, RequestNotFound, RSENotFound
+from rucio.common.utils import chunks, construct_surl
 from rucio.common.constants import SUPPORTED_PROTOCOLS
 from rucio.core import did, message as message_core, request as request_core
 from rucio.core.monitor import record_counter, record_timer
 from rucio.core.rse import get_rse_name, list_rses
+from rucio.core.rse_cache import get_rse_snapshot
 from rucio.core.rse_expression_parser import parse_expression
 from rucio.db.sqla import models
 from rucio.db.sqla.constants import DIDType, RequestState, FTSState, RSEType, RequestType, ReplicaState
@@ -347,6 +348,28 @@ def touch_transfer(external_host, transfer_id, session=None):
         raise RucioException(error.args)
 
 
+@transactional_session
+def touch_transfers(transfer_ids, session=None):
+    """
+    Bulk version of touch_transfer: update the timestamp of the submitted requests of several transfers,
+    regardless of their last update, so that they are not selected again while they are polled.
+
+    :param transfer_ids:   List of external transfer job ids as strings.
+    :param session:        Database session to use.
+    """
+
+    record_counter('core.request.touch_transfers')
+
+    now = datetime.datetime.utcnow()
+    try:
+        for chunk in chunks(list(transfer_ids), 100):
+            session.query(models.Request).filter(models.Request.external_id.in_(chunk))\
+                                         .filter(models.Request.state == RequestState.SUBMITTED)\
+                                         .update({'updated_at': now}, synchronize_session=False)
+    except IntegrityError as error:
+        raise RucioException(error.args)
+
+
 @transactional_session
 def update_transfer_state(external_host, transfer_id, state, logging_prepend_str=None, session=None):
     """
@@ -420,9 +443,184 @@ def update_transfer_state(external_host, transfer_id, state, logging_prepend_str
         return False
 
 
+class TransferLinkPlan(object):
+    """
+    Precomputed transfer information for one configuration of the RSEs.
+
+    RSE settings and RSE attributes are taken from a RSE metadata snapshot.
+    They, the matching third party copy schemes of the links and the instantiated protocols
+    are computed on first use and kept as long as the plan is valid, i.e. until a RSE,
+    a RSE protocol or a RSE attribute changes.
+    """
+
+    def __init__(self, snapshot):
+        """
+        Creates an empty plan.
+
+        :param snapshot: The RSESnapshot the plan is based on.
+        """
+        self.snapshot = snapshot
+        self.rses_info = {}
+        self.rse_attrs = {}
+        self.links = {}
+        self.source_protocols = {}
+
+    def get_rse_info(self, rse_id, session):
+        """
+        Return the protocol related settings of a RSE.
+
+        :param rse_id:   The RSE id.
+        :param session:  Database session in use.
+        :returns:        RSE settings as returned by rucio.core.rse.get_rse_protocols.
+        """
+        if rse_id not in self.rses_info:
+            self.rses_info[rse_id] = self.snapshot.get_rse_protocols(rse_id)
+        return self.rses_info[rse_id]
+
+    def get_rse_attributes(self, rse_id, session):
+        """
+        Return the attributes of a RSE.
+
+        :param rse_id:   The RSE id.
+        :param session:  Database session in use.
+        :returns:        Dictionary of the RSE attributes.
+        """
+        if rse_id not in self.rse_attrs:
+            self.rse_attrs[rse_id] = self.snapshot.list_rse_attributes(rse_id)
+        return self.rse_attrs[rse_id]
+
+    def get_link(self, source_rse_id, dest_rse_id, schemes, session):
+        """
+        Return the third party copy settings of a link.
+
+        :param source_rse_id:  The source RSE id.
+        :param dest_rse_id:    The destination RSE id.
+        :param schemes:        Tuple of the allowed schemes.
+        :param session:        Database session in use.
+        :returns:              Dictionary with the matching_scheme, the dest_protocol, the source_protocol and the dest_spacetoken.
+        :raises RSEProtocolNotSupported: If there is no third party copy possible on the link with these schemes.
+        """
+        key = (source_rse_id, dest_rse_id, schemes)
+        if key not in self.links:
+            try:
+                self.links[key] = self.__plan_link(source_rse_id=source_rse_id, dest_rse_id=dest_rse_id, schemes=schemes, session=session)
+            except RSEProtocolNotSupported as error:
+                self.links[key] = error
+        if isinstance(self.links[key], RSEProtocolNotSupported):
+            raise RSEProtocolNotSupported(*self.links[key].args)
+        return self.links[key]
+
+    def get_source_protocol(self, source_rse_id, schemes, session):
+        """
+        Return the third party copy protocol of a source RSE for additional sources of a transfer.
+
+        :param source_rse_id:  The source RSE id.
+        :param schemes:        Tuple of the allowed schemes.
+        :param session:        Database session in use.
+        :returns:              Protocol instance.
+        :raises RSEProtocolNotSupported: If the RSE does not support third party copy with these schemes.
+        """
+        key = (source_rse_id, schemes)
+        if key not in self.source_protocols:
+            source_info = self.get_rse_info(source_rse_id, session=session)
+            try:
+                self.source_protocols[key] = rsemgr.create_protocol(source_info, 'third_party_copy', list(schemes))
+            except RSEProtocolNotSupported:
+                self.source_protocols[key] = RSEProtocolNotSupported('Operation "third_party_copy" not supported by %s with schemes %s' % (source_info['rse'], list(schemes)))
+        if isinstance(self.source_protocols[key], RSEProtocolNotSupported):
+            raise RSEProtocolNotSupported(*self.source_protocols[key].args)
+        return self.source_protocols[key]
+
+    def __plan_link(self, source_rse_id, dest_rse_id, schemes, session):
+        """
+        Compute the third party copy settings of a link.
+
+        :param source_rse_id:  The source RSE id.
+        :param dest_rse_id:    The destination RSE id.
+        :param schemes:        Tuple of the allowed schemes.
+        :param session:        Database session in use.
+        :returns:              Dictionary with the matching_scheme, the dest_protocol, the source_protocol and the dest_spacetoken.
+        :raises RSEProtocolNotSupported: If there is no third party copy possible on the link with these schemes.
+        """
+        source_info = self.get_rse_info(source_rse_id, session=session)
+        dest_info = self.get_rse_info(dest_rse_id, session=session)
+        try:
+            matching_scheme = rsemgr.find_matching_scheme(rse_settings_dest=dest_info,
+                                                          rse_settings_src=source_info,
+                                                          operation_src='third_party_copy',
+                                                          operation_dest='third_party_copy',
+                                                          domain='wan',
+                                                          scheme=list(schemes))
+        except RSEProtocolNotSupported:
+            raise RSEProtocolNotSupported('No matching schemes in %s for operation "third_party_copy" between %s and %s' % (list(schemes), source_info['rse'], dest_info['rse']))
+
+        try:
+            dest_protocol = rsemgr.create_protocol(dest_info, 'third_party_copy', matching_scheme[0])
+        except RSEProtocolNotSupported:
+            raise RSEProtocolNotSupported('Operation "third_party_copy" not supported by dest_rse %s with schemes %s' % (dest_info['rse'], list(schemes)))
+
+        try:
+            source_protocol = rsemgr.create_protocol(source_info, 'third_party_copy', matching_scheme[1])
+        except RSEProtocolNotSupported:
+            raise RSEProtocolNotSupported('Operation "third_party_copy" not supported by source_rse %s with schemes %s' % (source_info['rse'], matching_scheme[1]))
+
+        dest_spacetoken = None
+        if dest_protocol.attributes and \
+           'extended_attributes' in dest_protocol.attributes and \
+           dest_protocol.attributes['extended_attributes'] and \
+           'space_token' in dest_protocol.attributes['extended_attributes']:
+            dest_spacetoken = dest_protocol.attributes['extended_attributes']['space_token']
+
+        return {'matching_scheme': matching_scheme,
+                'dest_protocol': dest_protocol,
+                'source_protocol': source_protocol,
+                'dest_spacetoken': dest_spacetoken}
+
+
+class TransferLinkPlanner(object):
+    """
+    Persistent holder of the TransferLinkPlan of the process.
+
+    The plan is dropped when the RSEs, RSE protocols or RSE attributes of the RSE metadata snapshot change.
+    """
+
+    def __init__(self):
+        """
+        Creates a planner without plan.
+        """
+        self.plan = None
+        self.fingerprint = None
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        """
+        Force a new plan on next use.
+        """
+        with self.lock:
+            self.plan = None
+
+    def get_plan(self, session):
+        """
+        Return the plan valid for the current configuration of the RSEs.
+
+        :param session:  Database session in use.
+        :returns:        TransferLinkPlan.
+        """
+        snapshot = get_rse_snapshot(session=session)
+        fingerprint = tuple(snapshot.versions.get(name, 0) for name in ('rses', 'protocols', 'attributes'))
+        with self.lock:
+            if self.plan is None or fingerprint != self.fingerprint:
+                self.plan = TransferLinkPlan(snapshot)
+                self.fingerprint = fingerprint
+            return self.plan
+
+
+TRANSFER_PLANNER = TransferLinkPlanner()
+
+
 @read_session
 def get_transfer_requests_and_source_replicas(total_workers=0, worker_number=0, limit=None, activity=None, older_than=None, rses=None, schemes=None,
-                                              bring_online=43200, retry_other_fts=False, failover_schemes=None, session=None):
+                                              bring_online=43200, retry_other_fts=False, failover_schemes=None, exclude_request_ids=None, session=None):
     """
     Get transfer requests and the associated source replicas
 
@@ -436,6 +634,7 @@ def get_transfer_requests_and_source_replicas(total_workers=0, worker_number=0,
     :param bring_online:          Bring online timeout.
     :parm retry_other_fts:        Retry other fts servers.
     :param failover_schemes:      Failover schemes.
+    :param exclude_request_ids:   Ids of requests not to select, e.g. already being submitted.
     :session:                     The database session in use.
     :returns:                     transfers, reqs_no_source, reqs_scheme_mismatch, reqs_only_tape_source
     """
@@ -446,25 +645,29 @@ def get_transfer_requests_and_source_replicas(total_workers=0, worker_number=0,
                                                                activity=activity,
                                                                older_than=older_than,
                                                                rses=rses,
+                                                               exclude_request_ids=exclude_request_ids,
                                                                session=session)
 
     unavailable_read_rse_ids = __get_unavailable_rse_ids(operation='read', session=session)
     unavailable_write_rse_ids = __get_unavailable_rse_ids(operation='write', session=session)
 
+    plan = TRANSFER_PLANNER.get_plan(session=session)
+
     bring_online_local = bring_online
-    transfers, rses_info, protocols, rse_attrs, reqs_no_source, reqs_only_tape_source, reqs_scheme_mismatch = {}, {}, {}, {}, [], [], []
-    rse_map = {}
+    transfers, allowed_source_rses, reqs_no_source, reqs_only_tape_source, reqs_scheme_mismatch = {}, {}, [], [], []
+    reqs_rse_not_found = set()
 
     for req_id, rule_id, scope, name, md5, adler32, bytes, activity, attributes, previous_attempt_id, dest_rse_id, source_rse_id, rse, deterministic, rse_type, path, retry_count, src_url, ranking, link_ranking in req_sources:
-        if dest_rse_id in unavailable_write_rse_ids:
-            if dest_rse_id not in rse_map:
-                rse_map[dest_rse_id] = get_rse_name(rse_id=dest_rse_id, session=session)
-            logging.warning('RSE %s is blacklisted for write. Will skip the submission of new jobs' % (rse_map[dest_rse_id]))
+        if req_id in reqs_rse_not_found:
             continue
         transfer_src_type = "DISK"
         transfer_dst_type = "DISK"
         allow_tape_source = True
         try:
+            if dest_rse_id in unavailable_write_rse_ids:
+                logging.warning('RSE %s is blacklisted for write. Will skip the submission of new jobs' % (plan.get_rse_info(dest_rse_id, session=session)['rse']))
+                continue
+
             if rses and dest_rse_id not in rses:
                 continue
 
@@ -473,6 +676,8 @@ def get_transfer_requests_and_source_replicas(total_workers=0, worker_number=0,
                 current_schemes = schemes
             if previous_attempt_id and failover_schemes:
                 current_schemes = failover_schemes
+            if not isinstance(current_schemes, list):
+                current_schemes = [current_schemes]
 
             if req_id not in transfers:
                 if req_id not in reqs_no_source:
@@ -490,19 +695,11 @@ def get_transfer_requests_and_source_replicas(total_workers=0, worker_number=0,
                 if source_rse_id in unavailable_read_rse_ids:
                     continue
 
-                # Get destination rse information
-                if dest_rse_id not in rses_info:
-                    dest_rse = get_rse_name(rse_id=dest_rse_id, session=session)
-                    rses_info[dest_rse_id] = rsemgr.get_rse_info(dest_rse, session=session)
-                if dest_rse_id not in rse_attrs:
-                    rse_attrs[dest_rse_id] = get_rse_attributes(dest_rse_id, session=session)
-
-                # Get the source rse information
-                if source_rse_id not in rses_info:
-                    source_rse = get_rse_name(rse_id=source_rse_id, session=session)
-                    rses_info[source_rse_id] = rsemgr.get_rse_info(source_rse, session=session)
-                if source_rse_id not in rse_attrs:
-                    rse_attrs[source_rse_id] = get_rse_attributes(source_rse_id, session=session)
+                # Get the destination and source rse information
+                dest_rse_info = plan.get_rse_info(dest_rse_id, session=session)
+                dest_rse_attrs = plan.get_rse_attributes(dest_rse_id, session=session)
+                source_rse_info = plan.get_rse_info(source_rse_id, session=session)
+                source_rse_attrs = plan.get_rse_attributes(source_rse_id, session=session)
 
                 attr = None
                 if attributes:
@@ -514,60 +711,34 @@ def get_transfer_requests_and_source_replicas(total_workers=0, worker_number=0,
                 # parse source expression
                 source_replica_expression = attr["source_replica_expression"] if (attr and "source_replica_expression" in attr) else None
                 if source_replica_expression:
-                    try:
-                        parsed_rses = parse_expression(source_replica_expression, session=session)
-                    except InvalidRSEExpression as error:
-                        logging.error("Invalid RSE exception %s: %s" % (source_replica_expression, error))
+                    if source_replica_expression not in allowed_source_rses:
+                        try:
+                            allowed_source_rses[source_replica_expression] = set(x['rse'] for x in parse_expression(source_replica_expression, session=session))
+                        except InvalidRSEExpression as error:
+                            logging.error("Invalid RSE exception %s: %s" % (source_replica_expression, error))
+                            allowed_source_rses[source_replica_expression] = None
+                    if allowed_source_rses[source_replica_expression] is None or rse not in allowed_source_rses[source_replica_expression]:
                         continue
-                    else:
-                        allowed_rses = [x['rse'] for x in parsed_rses]
-                        if rse not in allowed_rses:
-                            continue
 
                 # parse allow tape source expression, not finally version.
                 # allow_tape_source = attr["allow_tape_source"] if (attr and "allow_tape_source" in attr) else True
                 allow_tape_source = True
 
-                # Find matching scheme between destination and source
+                # Find matching scheme, protocols and space token between destination and source
                 try:
-                    matching_scheme = rsemgr.find_matching_scheme(rse_settings_dest=rses_info[dest_rse_id],
-                                                                  rse_settings_src=rses_info[source_rse_id],
-                                                                  operation_src='third_party_copy',
-                                                                  operation_dest='third_party_copy',
-                                                                  domain='wan',
-                                                                  scheme=current_schemes)
-                except RSEProtocolNotSupported:
-                    logging.error('No matching schemes in %s for operation "third_party_copy" between %s and %s' % (current_schemes, rses_info[source_rse_id]['rse'], rses_info[dest_rse_id]['rse']))
+                    link = plan.get_link(source_rse_id, dest_rse_id, tuple(current_schemes), session=session)
+                except RSEProtocolNotSupported as error:
+                    logging.error(error)
                     if req_id in reqs_no_source:
                         reqs_no_source.remove(req_id)
                     if req_id not in reqs_scheme_mismatch:
                         reqs_scheme_mismatch.append(req_id)
                     continue
-
-                # Get destination protocol
-                dest_rse_id_key = '%s_%s' % (dest_rse_id, matching_scheme[0])
-                if dest_rse_id_key not in protocols:
-                    try:
-                        protocols[dest_rse_id_key] = rsemgr.create_protocol(rses_info[dest_rse_id], 'third_party_copy', matching_scheme[0])
-                    except RSEProtocolNotSupported:
-                        logging.error('Operation "third_party_copy" not supported by dest_rse %s with schemes %s' % (rses_info[dest_rse_id]['rse'], current_schemes))
-                        if req_id in reqs_no_source:
-                            reqs_no_source.remove(req_id)
-                        if req_id not in reqs_scheme_mismatch:
-                            reqs_scheme_mismatch.append(req_id)
-                        continue
-
-                # get dest space token
-                dest_spacetoken = None
-                if protocols[dest_rse_id_key].attributes and \
-                   'extended_attributes' in protocols[dest_rse_id_key].attributes and \
-                   protocols[dest_rse_id_key].attributes['extended_attributes'] and \
-                   'space_token' in protocols[dest_rse_id_key].attributes['extended_attributes']:
-                    dest_spacetoken = protocols[dest_rse_id_key].attributes['extended_attributes']['space_token']
+                matching_scheme, dest_spacetoken = link['matching_scheme'], link['dest_spacetoken']
 
                 # Compute the destination url
-                if rses_info[dest_rse_id]['deterministic']:
-                    dest_url = list(protocols[dest_rse_id_key].lfns2pfns(lfns={'scope': scope, 'name': name}).values())[0]
+                if dest_rse_info['deterministic']:
+                    dest_url = list(link['dest_protocol'].lfns2pfns(lfns={'scope': scope, 'name': name}).values())[0]
                 else:
                     # compute dest url in case of non deterministic
                     # naming convention, etc.
@@ -582,32 +753,19 @@ def get_transfer_requests_and_source_replicas(total_workers=0, worker_number=0,
                                 dsn = parent['name']
                                 break
                     # DQ2 path always starts with /, but prefix might not end with /
-                    naming_convention = rse_attrs[dest_rse_id].get('naming_convention', None)
+                    naming_convention = dest_rse_attrs.get('naming_convention', None)
                     dest_path = construct_surl(dsn, name, naming_convention)
-                    if rses_info[dest_rse_id]['rse_type'] == RSEType.TAPE or rses_info[dest_rse_id]['rse_type'] == 'TAPE':
+                    if dest_rse_info['rse_type'] == RSEType.TAPE or dest_rse_info['rse_type'] == 'TAPE':
                         if retry_count or activity == 'Recovery':
                             dest_path = '%s_%i' % (dest_path, int(time.time()))
 
-                    dest_url = list(protocols[dest_rse_id_key].lfns2pfns(lfns={'scope': scope, 'name': name, 'path': dest_path}).values())[0]
-
-                # Get source protocol
-                source_rse_id_key = '%s_%s' % (source_rse_id, '_'.join([matching_scheme[0], matching_scheme[1]]))
-                if source_rse_id_key not in protocols:
-                    try:
-                        protocols[source_rse_id_key] = rsemgr.create_protocol(rses_info[source_rse_id], 'third_party_copy', matching_scheme[1])
-                    except RSEProtocolNotSupported:
-                        logging.error('Operation "third_party_copy" not supported by source_rse %s with schemes %s' % (rses_info[source_rse_id]['rse'], matching_scheme[1]))
-                        if req_id in reqs_no_source:
-                            reqs_no_source.remove(req_id)
-                        if req_id not in reqs_scheme_mismatch:
-                            reqs_scheme_mismatch.append(req_id)
-                        continue
+                    dest_url = list(link['dest_protocol'].lfns2pfns(lfns={'scope': scope, 'name': name, 'path': dest_path}).values())[0]
 
-                source_url = list(protocols[source_rse_id_key].lfns2pfns(lfns={'scope': scope, 'name': name, 'path': path}).values())[0]
+                source_url = list(link['source_protocol'].lfns2pfns(lfns={'scope': scope, 'name': name, 'path': path}).values())[0]
 
                 # Extend the metadata dictionary with request attributes
                 overwrite, bring_online = True, None
-                if rses_info[source_rse_id]['rse_type'] == RSEType.TAPE or rses_info[source_rse_id]['rse_type'] == 'TAPE':
+                if source_rse_info['rse_type'] == RSEType.TAPE or source_rse_info['rse_type'] == 'TAPE':
                     bring_online = bring_online_local
                     transfer_src_type = "TAPE"
                     if not allow_tape_source:
@@ -617,20 +775,20 @@ def get_transfer_requests_and_source_replicas(total_workers=0, worker_number=0,
                             reqs_no_source.remove(req_id)
                         continue
 
-                if rses_info[dest_rse_id]['rse_type'] == RSEType.TAPE or rses_info[dest_rse_id]['rse_type'] == 'TAPE':
+                if dest_rse_info['rse_type'] == RSEType.TAPE or dest_rse_info['rse_type'] == 'TAPE':
                     overwrite = False
                     transfer_dst_type = "TAPE"
 
                 # get external_host
-                fts_hosts = rse_attrs[dest_rse_id].get('fts', None)
-                source_globus_endpoint_id = rse_attrs[source_rse_id].get('globus_endpoint_id', None)
-                dest_globus_endpoint_id = rse_attrs[dest_rse_id].get('globus_endpoint_id', None)
+                fts_hosts = dest_rse_attrs.get('fts', None)
+                source_globus_endpoint_id = source_rse_attrs.get('globus_endpoint_id', None)
+                dest_globus_endpoint_id = dest_rse_attrs.get('globus_endpoint_id', None)
 
                 if TRANSFER_TOOL == 'fts3' and not fts_hosts:
-                    logging.error('Destination RSE %s FTS attribute not defined - SKIP REQUEST %s' % (dest_rse, req_id))
+                    logging.error('Destination RSE %s FTS attribute not defined - SKIP REQUEST %s' % (dest_rse_info['rse'], req_id))
                     continue
                 if TRANSFER_TOOL == 'globus' and (not dest_globus_endpoint_id or not source_globus_endpoint_id):
-                    logging.error('Destination RSE %s Globus endpoint attributes not defined - SKIP REQUEST %s' % (dest_rse, req_id))
+                    logging.error('Destination RSE %s Globus endpoint attributes not defined - SKIP REQUEST %s' % (dest_rse_info['rse'], req_id))
                     continue
                 if retry_count is None:
                     retry_count = 0
@@ -638,13 +796,13 @@ def get_transfer_requests_and_source_replicas(total_workers=0, worker_number=0,
                     fts_list = fts_hosts.split(",")
 
                 verify_checksum = 'both'
-                if not rse_attrs[dest_rse_id].get('verify_checksum', True):
-                    if not rse_attrs[source_rse_id].get('verify_checksum', True):
+                if not dest_rse_attrs.get('verify_checksum', True):
+                    if not source_rse_attrs.get('verify_checksum', True):
                         verify_checksum = 'none'
                     else:
                         verify_checksum = 'source'
                 else:
-                    if not rse_attrs[source_rse_id].get('verify_checksum', True):
+                    if not source_rse_attrs.get('verify_checksum', True):
                         verify_checksum = 'destination'
                     else:
                         verify_checksum = 'both'
@@ -662,7 +820,7 @@ def get_transfer_requests_and_source_replicas(total_workers=0, worker_number=0,
                                  'src_type': transfer_src_type,
                                  'dst_type': transfer_dst_type,
                                  'src_rse': rse,
-                                 'dst_rse': rses_info[dest_rse_id]['rse'],
+                                 'dst_rse': dest_rse_info['rse'],
                                  'src_rse_id': source_rse_id,
                                  'dest_rse_id': dest_rse_id,
                                  'filesize': bytes,
@@ -714,39 +872,32 @@ def get_transfer_requests_and_source_replicas(total_workers=0, worker_number=0,
                 # parse source expression
                 source_replica_expression = attr["source_replica_expression"] if (attr and "source_replica_expression" in attr) else None
                 if source_replica_expression:
-                    try:
-                        parsed_rses = parse_expression(source_replica_expression, session=session)
-                    except InvalidRSEExpression as error:
-                        logging.error("Invalid RSE exception %s: %s" % (source_replica_expression, error))
+                    if source_replica_expression not in allowed_source_rses:
+                        try:
+                            allowed_source_rses[source_replica_expression] = set(x['rse'] for x in parse_expression(source_replica_expression, session=session))
+                        except InvalidRSEExpression as error:
+                            logging.error("Invalid RSE exception %s: %s" % (source_replica_expression, error))
+                            allowed_source_rses[source_replica_expression] = None
+                    if allowed_source_rses[source_replica_expression] is None or rse not in allowed_source_rses[source_replica_expression]:
                         continue
-                    else:
-                        allowed_rses = [x['rse'] for x in parsed_rses]
-                        if rse not in allowed_rses:
-                            continue
 
                 # parse allow tape source expression, not finally version.
                 allow_tape_source = attr["allow_tape_source"] if (attr and "allow_tape_source" in attr) else True
 
-                # Compute the source rse information
-                if source_rse_id not in rses_info:
-                    source_rse = get_rse_name(rse_id=source_rse_id, session=session)
-                    rses_info[source_rse_id] = rsemgr.get_rse_info(source_rse, session=session)
-
                 # Get protocol
-                source_rse_id_key = '%s_%s' % (source_rse_id, '_'.join(current_schemes))
-                if source_rse_id_key not in protocols:
-                    try:
-                        protocols[source_rse_id_key] = rsemgr.create_protocol(rses_info[source_rse_id], 'third_party_copy', current_schemes)
-                    except RSEProtocolNotSupported:
-                        logging.error('Operation "third_party_copy" not supported by %s with schemes %s' % (rses_info[source_rse_id]['rse'], current_schemes))
-                        continue
-                source_url = list(protocols[source_rse_id_key].lfns2pfns(lfns={'scope': scope, 'name': name, 'path': path}).values())[0]
+                source_rse_info = plan.get_rse_info(source_rse_id, session=session)
+                try:
+                    source_protocol = plan.get_source_protocol(source_rse_id, tuple(current_schemes), session=session)
+                except RSEProtocolNotSupported as error:
+                    logging.error(error)
+                    continue
+                source_url = list(source_protocol.lfns2pfns(lfns={'scope': scope, 'name': name, 'path': path}).values())[0]
 
                 if ranking is None:
                     ranking = 0
                 # TAPE should not mixed with Disk and should not use as first try
                 # If there is a source whose ranking is no less than the Tape ranking, Tape will not be used.
-                if rses_info[source_rse_id]['rse_type'] == RSEType.TAPE or rses_info[source_rse_id]['rse_type'] == 'TAPE':
+                if source_rse_info['rse_type'] == RSEType.TAPE or source_rse_info['rse_type'] == 'TAPE':
                     # current src_rse is Tape
                     if not allow_tape_source:
                         continue
@@ -808,6 +959,16 @@ def get_transfer_requests_and_source_replicas(total_workers=0, worker_number=0,
                 # transfers[id]['src_urls'].append((source_rse_id, source_url))
                 transfers[req_id]['sources'].append((rse, source_url, source_rse_id, ranking, link_ranking))
 
+        except RSENotFound as error:
+            # The RSE was deleted after the plan was built: skip the source, or the request if the RSE is its destination
+            logging.warning('Request %s: %s' % (req_id, error))
+            TRANSFER_PLANNER.invalidate()
+            if dest_rse_id not in plan.rses_info:
+                reqs_rse_not_found.add(req_id)
+                transfers.pop(req_id, None)
+                if req_id in reqs_no_source:
+                    reqs_no_source.remove(req_id)
+            continue
         except Exception:
             logging.critical("Exception happened when trying to get transfer for request %s: %s" % (req_id, traceback.format_exc()))
             break
@@ -825,7 +986,7 @@ def get_transfer_requests_and_source_replicas(total_workers=0, worker_number=0,
 
 @read_session
 def __list_transfer_requests_and_source_replicas(total_workers=0, worker_number=0,
-                                                 limit=None, activity=None, older_than=None, rses=None, session=None):
+                                                 limit=None, activity=None, older_than=None, rses=None, exclude_request_ids=None, session=None):
     """
     List requests with source replicas
 
@@ -835,6 +996,7 @@ def __list_transfer_requests_and_source_replicas(total_workers=0, worker_number=
     :param activity:         Activity to be selected.
     :param older_than:       Only select requests older than this DateTime.
     :param rses:             List of rse_id to select requests.
+    :param exclude_request_ids: Ids of requests not to select.
     :param session:          Database session to use.
     :returns:                List.
     """
@@ -863,6 +1025,10 @@ def __list_transfer_requests_and_source_replicas(total_workers=0, worker_number=
     if activity:
         sub_requests = sub_requests.filter(models.Request.activity == activity)
 
+    if exclude_request_ids:
+        for chunk in chunks(list(exclude_request_ids), 1000):
+            sub_requests = sub_requests.filter(~models.Request.id.in_(chunk))
+
     if total_workers > 0:
         if session.bind.dialect.name == 'oracle':
             bindparams = [bindparam('worker_number', worker_number),
@@ -15,7 +15,7 @@ import logging
 import traceback
 
 from dogpile.cache import make_region
-from dogpile.cache.api import NoValue
+from dogpile.cache.api import NoValue, NO_VALUE
 
 from rucio.common.config import config_get
 from rucio.core import config as config_core
@@ -123,7 +123,51 @@ def get_config_limit(activity, rse_id):
 
     :returns: max_transfers if exists else None.
     """
-    result = NoValue()
+    return __get_config_threshold(__get_cached_config_limits(), activity, rse_id)
+
+
+def get_transfer_limits_bulk(activities, rse_ids, session=None):
+    """
+    Get the RSE transfer limits of several activities and RSEs at once,
+    with the same result as get_transfer_limits for every pair.
+
+    :param activities:  The activities.
+    :param rse_ids:     The RSE ids.
+    :param session:     The database session to use.
+
+    :returns: Dictionary {(activity, rse_id): max_transfers if exists else None}.
+    """
+    limits = dict(((activity, rse_id), None) for activity in activities for rse_id in rse_ids)
+    try:
+        if queue_mode == 'strict':
+            config_limits = __get_cached_config_limits()
+            for activity, rse_id in limits:
+                threshold = __get_config_threshold(config_limits, activity, rse_id)
+                if threshold:
+                    limits[(activity, rse_id)] = {'max_transfers': threshold, 'transfers': 0, 'waitings': 0}
+        else:
+            result = NO_VALUE
+            if using_memcache:
+                result = REGION_SHORT.get('rse_transfer_limits')
+            if type(result) is NoValue:
+                result = get_rse_transfer_limits(session=session)
+                if using_memcache:
+                    REGION_SHORT.set('rse_transfer_limits', result)
+            for activity, rse_id in limits:
+                if result and activity in result and rse_id in result[activity]:
+                    limits[(activity, rse_id)] = result[activity][rse_id]
+    except Exception:
+        logging.warning("Failed to get transfer limits: %s" % traceback.format_exc())
+    return limits
+
+
+def __get_cached_config_limits():
+    """
+    Get config limits, from the cache if enabled.
+
+    :returns: Dictionary of limits.
+    """
+    result = NO_VALUE
     key = 'config_limits'
     if using_memcache:
         result = REGION_SHORT.get(key)
@@ -135,7 +179,19 @@ def get_config_limit(activity, rse_id):
         except:
             logging.warning("Failed to retrieve rse transfer limits: %s" % (traceback.format_exc()))
             result = None
+    return result
+
+
+def __get_config_threshold(result, activity, rse_id):
+    """
+    Get the threshold of an activity and RSE from the config limits.
+
+    :param result:    Dictionary of config limits.
+    :param activity:  The activity.
+    :param rse_id:    The RSE id.
 
+    :returns: max_transfers if exists else None.
+    """
     threshold = None
     if result:
         if activity in result.keys():
@@ -0,0 +1,226 @@
+# Copyright 2019 CERN for the benefit of the ATLAS collaboration.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# PY3K COMPATIBLE
+
+"""
+Distribution of the work of the daemons with leases on work buckets.
+
+The rows to process carry a bucket number (rucio.common.utils.work_bucket), from 0 to WORK_BUCKETS - 1.
+The workers of an executable lease the buckets for a limited time and select only the rows of
+their buckets, with a range filter on the bucket column. Each worker renews its leases every cycle:
+a worker keeps its buckets as long as it is alive, the buckets of the departed workers are taken over
+by the others once their leases expire, and a worker with more than its share releases the excess
+buckets for the new workers. A lease is never taken while it is live, so a bucket has at most one worker.
+The new workers, which have no lease yet, are seen by the others through their heartbeats.
+"""
+
+import datetime
+
+from sqlalchemy import or_
+from sqlalchemy.sql.expression import false
+
+from rucio.common.exception import DatabaseException
+from rucio.common.utils import WORK_BUCKETS, chunks, pid_exists
+from rucio.core.heartbeat import calc_hash
+from rucio.db.sqla.models import Heartbeats, WorkLease
+from rucio.db.sqla.session import read_session, transactional_session
+
+
+@transactional_session
+def acquire(executable, hostname, pid, thread, ttl=600, hash_executable=None, session=None):
+    """
+    Renew the leases of a worker, and take or release buckets so that it gets its share.
+
+    :param executable: Executable name as a string, e.g., judge-evaluator.
+    :param hostname: Hostname as a string, e.g., rucio-daemon-prod-01.cern.ch.
+    :param pid: UNIX Process ID as a number, e.g., 1234.
+    :param thread: Python Thread Object.
+    :param ttl: Lifetime of the leases in seconds.
+    :param hash_executable: Hash of the executable.
+    :param session: The database session in use.
+
+    :returns: Dictionary {buckets: list of (first, last) bucket ranges, nr_workers: number of live workers}
+    """
+    if not hash_executable:
+        hash_executable = calc_hash(executable)
+
+    if not session.query(WorkLease).filter_by(executable=hash_executable).first():
+        try:
+            __create_buckets(hash_executable)
+        except DatabaseException:
+            # Created by another worker in the meantime
+            pass
+
+    now = datetime.datetime.utcnow()
+    expires_at = now + datetime.timedelta(seconds=ttl)
+    owner = {'hostname': hostname, 'pid': pid, 'thread_id': thread.ident}
+
+    # Renew the live leases only, the expired ones may be owned by another worker already
+    session.query(WorkLease).filter_by(executable=hash_executable, **owner)\
+                            .filter(WorkLease.expires_at >= now)\
+                            .update({'expires_at': expires_at}, synchronize_session=False)
+    buckets = [bucket for bucket, in session.query(WorkLease.bucket).filter_by(executable=hash_executable, **owner).filter(WorkLease.expires_at >= now)]
+
+    # The workers are the owners of live leases and the workers with a recent heartbeat, without lease yet
+    workers = set(tuple(worker) for worker in session.query(WorkLease.hostname, WorkLease.pid, WorkLease.thread_id)
+                                                     .filter(WorkLease.executable == hash_executable)
+                                                     .filter(WorkLease.expires_at >= now)
+                                                     .distinct())
+    workers.update(tuple(worker) for worker in session.query(Heartbeats.hostname, Heartbeats.pid, Heartbeats.thread_id)
+                                                      .filter(Heartbeats.executable == hash_executable)
+                                                      .filter(Heartbeats.updated_at >= now - datetime.timedelta(seconds=ttl))
+                                                      .distinct())
+    workers.add((hostname, pid, thread.ident))
+    nr_workers = len(workers)
+    share = -(-WORK_BUCKETS // nr_workers)
+
+    if len(buckets) > share:
+        # Leave the excess buckets to the new workers
+        buckets.sort()
+        for chunk in chunks(buckets[share:], 100):
+            session.query(WorkLease).filter_by(executable=hash_executable, **owner)\
+                                    .filter(WorkLease.bucket.in_(chunk))\
+                                    .update({'expires_at': now}, synchronize_session=False)
+        buckets = buckets[:share]
+    else:
+        # Take over free buckets up to the share, the update fails for the ones taken by another worker in the meantime.
+        # The buckets still free after a whole lease period, e.g. when a departed worker still has a heartbeat, are taken anyway.
+        stale = now - datetime.timedelta(seconds=ttl)
+        free = [bucket for bucket, in session.query(WorkLease.bucket)
+                                             .filter(WorkLease.executable == hash_executable)
+                                             .filter(WorkLease.expires_at < now)
+                                             .order_by(WorkLease.bucket)
+                                             .limit(share - len(buckets))]
+        free = set(free).union(bucket for bucket, in session.query(WorkLease.bucket)
+                                                            .filter(WorkLease.executable == hash_executable)
+                                                            .filter(WorkLease.expires_at < stale))
+        for chunk in chunks(sorted(free), 100):
+            session.query(WorkLease).filter(WorkLease.executable == hash_executable)\
+                                    .filter(WorkLease.bucket.in_(chunk))\
+                                    .filter(WorkLease.expires_at < now)\
+                                    .update(dict(owner, expires_at=expires_at), synchronize_session=False)
+        if free:
+            buckets = [bucket for bucket, in session.query(WorkLease.bucket).filter_by(executable=hash_executable, **owner).filter(WorkLease.expires_at >= now)]
+
+    return {'buckets': bucket_ranges(buckets),
+            'nr_workers': nr_workers}
+
+
+@transactional_session
+def release(executable, hostname, pid, thread, hash_executable=None, session=None):
+    """
+    Release all the buckets of a worker, so that the other workers can take them over immediately.
+
+    :param executable: Executable name as a string, e.g., judge-evaluator.
+    :param hostname: Hostname as a string, e.g., rucio-daemon-prod-01.cern.ch.
+    :param pid: UNIX Process ID as a number, e.g., 1234.
+    :param thread: Python Thread Object.
+    :param hash_executable: Hash of the executable.
+    :param session: The database session in use.
+    """
+    if not hash_executable:
+        hash_executable = calc_hash(executable)
+
+    session.query(WorkLease).filter_by(executable=hash_executable, hostname=hostname, pid=pid, thread_id=thread.ident)\
+                            .update({'expires_at': datetime.datetime.utcnow()}, synchronize_session=False)
+
+
+@transactional_session
+def sanity_check(executable, hostname, hash_executable=None, session=None):
+    """
+    Release the buckets of the processes of the host which are not running anymore.
+
+    :param executable: Executable name as a string, e.g., judge-evaluator.
+    :param hostname: Hostname as a string, e.g., rucio-daemon-prod-01.cern.ch.
+    :param hash_executable: Hash of the executable.
+    :param session: The database session in use.
+    """
+    if not hash_executable:
+        hash_executable = calc_hash(executable)
+
+    now = datetime.datetime.utcnow()
+    query = session.query(WorkLease.pid).filter(WorkLease.executable == hash_executable)\
+                                        .filter(WorkLease.hostname == hostname)\
+                                        .filter(WorkLease.expires_at >= now)\
+                                        .distinct()
+    for pid, in query.all():
+        if not pid_exists(pid):
+            session.query(WorkLease).filter_by(executable=hash_executable, hostname=hostname, pid=pid)\
+                                    .update({'expires_at': now}, synchronize_session=False)
+
+
+@read_session
+def list_leases(executable, hash_executable=None, session=None):
+    """
+    List the live leases of an executable.
+
+    :param executable: Executable name as a string, e.g., judge-evaluator.
+    :param hash_executable: Hash of the executable.
+    :param session: The database session in use.
+
+    :returns: Dictionary {(hostname, pid, thread_id): list of (first, last) bucket ranges}
+    """
+    if not hash_executable:
+        hash_executable = calc_hash(executable)
+
+    leases = {}
+    query = session.query(WorkLease.hostname, WorkLease.pid, WorkLease.thread_id, WorkLease.bucket)\
+                   .filter(WorkLease.executable == hash_executable)\
+                   .filter(WorkLease.expires_at >= datetime.datetime.utcnow())
+    for hostname, pid, thread_id, bucket in query:
+        leases.setdefault((hostname, pid, thread_id), []).append(bucket)
+    return dict((owner, bucket_ranges(buckets)) for owner, buckets in leases.items())
+
+
+def bucket_ranges(buckets):
+    """
+    Collapse bucket numbers into ranges.
+
+    :param buckets: List of bucket numbers.
+    :returns: Sorted list of (first, last) bucket ranges.
+    """
+    ranges = []
+    for bucket in sorted(buckets):
+        if ranges and ranges[-1][1] == bucket - 1:
+            ranges[-1] = (ranges[-1][0], bucket)
+        else:
+            ranges.append((bucket, bucket))
+    return ranges
+
+
+def bucket_filter(column, ranges):
+    """
+    Return the filter selecting the rows of bucket ranges.
+
+    :param column: The bucket column, e.g., models.UpdatedDID.bucket.
+    :param ranges: List of (first, last) bucket ranges.
+    :returns: A SQLAlchemy expression.
+    """
+    if not ranges:
+        return false()
+    return or_(*[column.between(first, last) for first, last in ranges])
+
+
+@transactional_session
+def __create_buckets(hash_executable, session=None):
+    """
+    Create the free buckets of an executable.
+
+    :param hash_executable: Hash of the executable.
+    :param session: The database session in use.
+    """
+    expired = datetime.datetime(1970, 1, 1)
+    for chunk in chunks(list(range(WORK_BUCKETS)), 1000):
+        session.execute(WorkLease.__table__.insert(), [{'executable': hash_executable, 'bucket': bucket, 'expires_at': expired} for bucket in chunk])
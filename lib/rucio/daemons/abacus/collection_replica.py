@@ -29,7 +29,7 @@ import traceback
 
 from rucio.common.config import config_get
 from rucio.core.heartbeat import live, die, sanity_check
-from rucio.core.replica import get_cleaned_updated_collection_replicas, update_collection_replica
+from rucio.core.replica import get_cleaned_updated_collection_replicas, update_collection_replica, queue_collection_replica_recounts
 
 graceful_stop = threading.Event()
 
@@ -41,9 +41,16 @@ logging.basicConfig(stream=sys.stdout,
                     format='%(asctime)s\t%(process)d\t%(levelname)s\t%(message)s')
 
 
-def collection_replica_update(once=False):
+def collection_replica_update(once=False, recount_interval=86400, recount_bulk=1000):
     """
     Main loop to check and update the collection replicas.
+
+    The first worker also queues the recount of all the collection replicas every recount_interval
+    seconds, a batch of recount_bulk per cycle, as a consistency check of the counters updated with deltas.
+
+    :param once:             Run only once.
+    :param recount_interval: Interval in seconds between two recounts of all the collection replicas, 0 to disable.
+    :param recount_bulk:     Number of collection replicas to recount per cycle.
     """
 
     logging.info('collection_replica_update: starting')
@@ -56,11 +63,19 @@ def collection_replica_update(once=False):
     current_thread = threading.current_thread()
     live(executable='rucio-abacus-collection-replica', hostname=hostname, pid=pid, thread=current_thread)
 
+    recount_marker, next_recount = None, time.time()
     while not graceful_stop.is_set():
         try:
             # Heartbeat
             heartbeat = live(executable='rucio-abacus-collection-replica', hostname=hostname, pid=pid, thread=current_thread)
 
+            # Periodic consistency check of the counters
+            if recount_interval and heartbeat['assign_thread'] == 0 and time.time() >= next_recount:
+                recount_marker = queue_collection_replica_recounts(limit=recount_bulk, marker=recount_marker)
+                logging.debug('collection_replica_update: queued the recount of collection replicas up to %s' % (recount_marker, ))
+                if recount_marker is None:
+                    next_recount = time.time() + recount_interval
+
             # Select a bunch of collection replicas for to update for this worker
             start = time.time()  # NOQA
             replicas = get_cleaned_updated_collection_replicas(total_workers=heartbeat['nr_threads'] - 1,
@@ -96,19 +111,24 @@ def stop(signum=None, frame=None):
     graceful_stop.set()
 
 
-def run(once=False, threads=1):
+def run(once=False, threads=1, recount_interval=86400, recount_bulk=1000):
     """
     Starts up the Abacus-Collection-Replica threads.
+
+    :param once:             Run only once.
+    :param threads:          Number of threads.
+    :param recount_interval: Interval in seconds between two recounts of all the collection replicas, 0 to disable.
+    :param recount_bulk:     Number of collection replicas to recount per cycle.
     """
     hostname = socket.gethostname()
     sanity_check(executable='rucio-abacus-collection-replica', hostname=hostname)
 
     if once:
         logging.info('main: executing one iteration only')
-        collection_replica_update(once)
+        collection_replica_update(once, recount_interval=recount_interval, recount_bulk=recount_bulk)
     else:
         logging.info('main: starting threads')
-        threads = [threading.Thread(target=collection_replica_update, kwargs={'once': once}) for i in range(0, threads)]
+        threads = [threading.Thread(target=collection_replica_update, kwargs={'once': once, 'recount_interval': recount_interval, 'recount_bulk': recount_bulk}) for i in range(0, threads)]
         [t.start() for t in threads]
         logging.info('main: waiting for interrupts')
         # Interruptible joins require a timeout.
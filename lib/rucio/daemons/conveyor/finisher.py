@@ -49,7 +49,7 @@ from sqlalchemy.exc import DatabaseError
 
 from rucio.common.config import config_get
 from rucio.common.utils import chunks
-from rucio.common.exception import DatabaseException, ConfigNotFound, UnsupportedOperation, ReplicaNotFound, RequestNotFound
+from rucio.common.exception import DatabaseException, ConfigNotFound, UnsupportedOperation, ReplicaNotFound
 from rucio.core import request as request_core, heartbeat, replica as replica_core
 from rucio.core.config import items
 from rucio.core.monitor import record_timer, record_counter
@@ -201,6 +201,9 @@ def __handle_requests(reqs, suspicious_patterns, retry_protocol_mismatches, prep
     """
     Used by finisher to handle terminated requests,
 
+    The whole chunk is classified first, then the failed requests are requeued and archived
+    in bulk and the replicas are updated in bulk per rule.
+
     :param reqs:                         List of requests.
     :param suspicious_patterns:          List of suspicious patterns.
     :param retry_protocol_mismatches:    Boolean to retry the transfer in case of protocol mismatch.
@@ -210,8 +213,17 @@ def __handle_requests(reqs, suspicious_patterns, retry_protocol_mismatches, prep
     failed_during_submission = [RequestState.SUBMITTING, RequestState.SUBMISSION_FAILED, RequestState.LOST]
     failed_no_submission_attempts = [RequestState.NO_SOURCES, RequestState.ONLY_TAPE_SOURCES, RequestState.MISMATCH_SCHEME]
     undeterministic_rses = __get_undeterministic_rses()
+
+    # Resolve once the RSEs whose replica path must be set
     rses_info, protocols = {}, {}
-    replicas = {}
+    for rse_id in set(req['dest_rse_id'] for req in reqs if req['state'] == RequestState.DONE and req['request_type'] in (RequestType.TRANSFER, RequestType.STAGEIN)):
+        if rse_id in undeterministic_rses:
+            try:
+                rses_info[rse_id] = rsemanager.get_rse_info(get_rse_name(rse_id=rse_id))
+            except Exception as error:
+                logging.error('%s Cannot get the information of RSE %s: %s', prepend_str, rse_id, str(error))
+
+    replicas, to_requeue = {}, []
     for req in reqs:
         try:
             replica = {'scope': req['scope'], 'name': req['name'], 'rse_id': req['dest_rse_id'], 'bytes': req['bytes'], 'adler32': req['adler32'], 'request_id': req['request_id']}
@@ -220,20 +232,12 @@ def __handle_requests(reqs, suspicious_patterns, retry_protocol_mismatches, prep
             replica['request_type'] = req['request_type']
             replica['error_message'] = None
 
-            if req['request_type'] not in replicas:
-                replicas[req['request_type']] = {}
-            if req['rule_id'] not in replicas[req['request_type']]:
-                replicas[req['request_type']][req['rule_id']] = []
-
             if req['state'] == RequestState.DONE:
                 replica['state'] = ReplicaState.AVAILABLE
                 replica['archived'] = False
 
                 # for TAPE, replica path is needed
                 if req['request_type'] in (RequestType.TRANSFER, RequestType.STAGEIN) and req['dest_rse_id'] in undeterministic_rses:
-                    if req['dest_rse_id'] not in rses_info:
-                        dest_rse = get_rse_name(rse_id=req['dest_rse_id'])
-                        rses_info[req['dest_rse_id']] = rsemanager.get_rse_info(dest_rse)
                     pfn = req['dest_url']
                     scheme = urlparse(pfn).scheme
                     dest_rse_id_scheme = '%s_%s' % (req['dest_rse_id'], scheme)
@@ -243,57 +247,19 @@ def __handle_requests(reqs, suspicious_patterns, retry_protocol_mismatches, prep
                     replica['path'] = os.path.join(path, os.path.basename(pfn))
 
                 # replica should not be added to replicas until all info are filled
-                replicas[req['request_type']][req['rule_id']].append(replica)
+                replicas.setdefault(req['request_type'], {}).setdefault(req['rule_id'], []).append(replica)
 
             # Standard failure from the transfer tool
             elif req['state'] == RequestState.FAILED:
                 __check_suspicious_files(req, suspicious_patterns)
-                tss = time.time()
-                try:
-                    new_req = request_core.requeue_and_archive(req, retry_protocol_mismatches)
-                    if new_req:
-                        # should_retry_request and requeue_and_archive are not in one session,
-                        # another process can requeue_and_archive and this one will return None.
-                        record_timer('daemons.conveyor.common.update_request_state.request-requeue_and_archive', (time.time() - tss) * 1000)
-                        logging.warn(prepend_str + 'REQUEUED DID %s:%s REQUEST %s AS %s TRY %s' % (req['scope'],
-                                                                                                   req['name'],
-                                                                                                   req['request_id'],
-                                                                                                   new_req['request_id'],
-                                                                                                   new_req['retry_count']))
-                    else:
-                        # No new_req is return if should_retry_request returns False
-                        logging.warn('%s EXCEEDED SUBMITTING DID %s:%s REQUEST %s in state %s', prepend_str, req['scope'], req['name'], req['request_id'], req['state'])
-                        replica['state'] = ReplicaState.UNAVAILABLE
-                        replica['archived'] = False
-                        replica['error_message'] = req['err_msg'] if req['err_msg'] else request_core.get_transfer_error(req['state'])
-                        replicas[req['request_type']][req['rule_id']].append(replica)
-                except RequestNotFound:
-                    logging.warn('%s Cannot find request %s anymore', prepend_str, req['request_id'])
+                to_requeue.append((req, replica))
 
             # All other failures
             elif req['state'] in failed_during_submission or req['state'] in failed_no_submission_attempts:
                 if req['state'] in failed_during_submission and req['updated_at'] > (datetime.datetime.utcnow() - datetime.timedelta(minutes=120)):
                     # To prevent race conditions
                     continue
-                try:
-                    tss = time.time()
-                    new_req = request_core.requeue_and_archive(req, retry_protocol_mismatches)
-                    if new_req:
-                        record_timer('daemons.conveyor.common.update_request_state.request-requeue_and_archive', (time.time() - tss) * 1000)
-                        logging.warn(prepend_str + 'REQUEUED SUBMITTING DID %s:%s REQUEST %s AS %s TRY %s' % (req['scope'],
-                                                                                                              req['name'],
-                                                                                                              req['request_id'],
-                                                                                                              new_req['request_id'],
-                                                                                                              new_req['retry_count']))
-                    else:
-                        # No new_req is return if should_retry_request returns False
-                        logging.warn('%s EXCEEDED SUBMITTING DID %s:%s REQUEST %s in state %s', prepend_str, req['scope'], req['name'], req['request_id'], req['state'])
-                        replica['state'] = ReplicaState.UNAVAILABLE
-                        replica['archived'] = False
-                        replica['error_message'] = req['err_msg'] if req['err_msg'] else request_core.get_transfer_error(req['state'])
-                        replicas[req['request_type']][req['rule_id']].append(replica)
-                except RequestNotFound:
-                    logging.warn('%s Cannot find request %s anymore', prepend_str, req['request_id'])
+                to_requeue.append((req, replica))
 
         except Exception as error:
             logging.error(prepend_str + "Something unexpected happened when handling request %s(%s:%s) at %s: %s" % (req['request_id'],
@@ -302,9 +268,63 @@ def __handle_requests(reqs, suspicious_patterns, retry_protocol_mismatches, prep
                                                                                                                      req['dest_rse_id'],
                                                                                                                      str(error)))
 
+    def requeue(items):
+        tss = time.time()
+        new_reqs = request_core.requeue_and_archive_requests([req for req, _ in items], retry_protocol_mismatches)
+        record_timer('daemons.conveyor.common.update_request_state.request-requeue_and_archive', (time.time() - tss) * 1000 / len(items))
+        for req, replica in items:
+            if req['request_id'] not in new_reqs:
+                logging.warn('%s Cannot find request %s anymore', prepend_str, req['request_id'])
+            elif new_reqs[req['request_id']]:
+                new_req = new_reqs[req['request_id']]
+                logging.warn(prepend_str + 'REQUEUED DID %s:%s REQUEST %s AS %s TRY %s' % (req['scope'],
+                                                                                           req['name'],
+                                                                                           req['request_id'],
+                                                                                           new_req['request_id'],
+                                                                                           new_req['retry_count']))
+            else:
+                # No new_req is return if should_retry_request returns False
+                logging.warn('%s EXCEEDED SUBMITTING DID %s:%s REQUEST %s in state %s', prepend_str, req['scope'], req['name'], req['request_id'], req['state'])
+                replica['state'] = ReplicaState.UNAVAILABLE
+                replica['archived'] = True
+                replica['error_message'] = req['err_msg'] if req['err_msg'] else request_core.get_transfer_error(req['state'])
+                replicas.setdefault(req['request_type'], {}).setdefault(req['rule_id'], []).append(replica)
+
+    def requeue_failed(item, error):
+        req = item[0]
+        logging.error(prepend_str + "Something unexpected happened when handling request %s(%s:%s) at %s: %s" % (req['request_id'],
+                                                                                                                 req['scope'],
+                                                                                                                 req['name'],
+                                                                                                                 req['dest_rse_id'],
+                                                                                                                 str(error)))
+
+    if to_requeue:
+        __apply_with_bisection(requeue, to_requeue, Exception, requeue_failed)
+
     __handle_terminated_replicas(replicas, prepend_str)
 
 
+def __apply_with_bisection(function, items, exceptions, on_failure):
+    """
+    Apply a bulk function on a list of items. If it fails, the list is split in two halves
+    which are retried separately, until the failing items are isolated.
+
+    :param function:    Function taking a list of items, applied in one transaction.
+    :param items:       List of items.
+    :param exceptions:  Exception types which trigger the bisection, the others are raised.
+    :param on_failure:  Function called with each failing item and its exception.
+    """
+    try:
+        function(items)
+    except exceptions as error:
+        if len(items) == 1:
+            on_failure(items[0], error)
+            return
+        middle = len(items) // 2
+        __apply_with_bisection(function, items[:middle], exceptions, on_failure)
+        __apply_with_bisection(function, items[middle:], exceptions, on_failure)
+
+
 def __get_undeterministic_rses():
     """
     Get the undeterministic rses from the database
@@ -364,23 +384,24 @@ def __handle_terminated_replicas(replicas, prepend_str=''):
     :param prepend_str: String to prepend to logging.
     """
 
+    def update_replica(replica, bulk_error):
+        # The failing replica is isolated, handle it on its own
+        logging.warn('%s Problem to bulk update the replica %s:%s at RSE %s: %s', prepend_str, replica['scope'], replica['name'], replica['rse_id'], str(bulk_error))
+        try:
+            __update_replica(replica)
+        except (DatabaseException, DatabaseError) as error:
+            if re.match('.*ORA-00054.*', error.args[0]) or re.match('.*ORA-00060.*', error.args[0]) or 'ERROR 1205 (HY000)' in error.args[0]:
+                logging.warn("%s Locks detected when handling replica %s:%s at RSE %s", prepend_str, replica['scope'], replica['name'], replica['rse_id'])
+            else:
+                logging.error("%s Could not finish handling replicas %s:%s at RSE %s (%s)", prepend_str, replica['scope'], replica['name'], replica['rse_id'], traceback.format_exc())
+        except Exception as error:
+            logging.error("%s Something unexpected happened when updating replica state for transfer %s:%s at %s (%s)", prepend_str, replica['scope'], replica['name'], replica['rse_id'], str(error))
+
     for req_type in replicas:
         for rule_id in replicas[req_type]:
             try:
-                __update_bulk_replicas(replicas[req_type][rule_id])
-            except (UnsupportedOperation, ReplicaNotFound):
-                # one replica in the bulk cannot be found. register it one by one
-                logging.warn('%s Problem to bulk update the replicas states. Will try one by one', prepend_str)
-                for replica in replicas[req_type][rule_id]:
-                    try:
-                        __update_replica(replica)
-                    except (DatabaseException, DatabaseError) as error:
-                        if re.match('.*ORA-00054.*', error.args[0]) or re.match('.*ORA-00060.*', error.args[0]) or 'ERROR 1205 (HY000)' in error.args[0]:
-                            logging.warn("%s Locks detected when handling replica %s:%s at RSE %s", prepend_str, replica['scope'], replica['name'], replica['rse_id'])
-                        else:
-                            logging.error("%s Could not finish handling replicas %s:%s at RSE %s (%s)", prepend_str, replica['scope'], replica['name'], replica['rse_id'], traceback.format_exc())
-                    except Exception as error:
-                        logging.error("%s Something unexpected happened when updating replica state for transfer %s:%s at %s (%s)", prepend_str, replica['scope'], replica['name'], replica['rse_id'], str(error))
+                # one replica in the bulk cannot be found: it is isolated by bisection
+                __apply_with_bisection(__update_bulk_replicas, replicas[req_type][rule_id], (UnsupportedOperation, ReplicaNotFound), update_replica)
             except (DatabaseException, DatabaseError) as error:
                 if re.match('.*ORA-00054.*', error.args[0]) or re.match('.*ORA-00060.*', error.args[0]) or 'ERROR 1205 (HY000)' in error.args[0]:
                     logging.warn("%s Locks detected when handling replicas on %s rule %s, update updated time.", prepend_str, req_type, rule_id)
@@ -403,15 +424,9 @@ def __update_bulk_replicas(replicas, session=None):
     :param session:               The database session to use.
     :returns commit_or_rollback:  Boolean.
     """
-    try:
-        replica_core.update_replicas_states(replicas, nowait=True, session=session)
-    except ReplicaNotFound as error:
-        logging.warn('Failed to bulk update replicas, will do it one by one: %s', str(error))
-        raise ReplicaNotFound(error)
-
+    replica_core.update_replicas_states(replicas, nowait=True, session=session)
+    request_core.archive_requests([replica['request_id'] for replica in replicas if not replica['archived']], session=session)
     for replica in replicas:
-        if not replica['archived']:
-            request_core.archive_request(replica['request_id'], session=session)
         logging.info("HANDLED REQUEST %s DID %s:%s AT RSE %s STATE %s", replica['request_id'], replica['scope'], replica['name'], replica['rse_id'], str(replica['state']))
     return True
 
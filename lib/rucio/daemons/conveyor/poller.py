@@ -40,6 +40,10 @@ import time
 import traceback
 
 from collections import defaultdict
+try:
+    from Queue import Queue, Empty  # py2
+except ImportError:
+    from queue import Queue, Empty  # py3
 try:
     from ConfigParser import NoOptionError  # py2
 except Exception:
@@ -68,10 +72,41 @@ datetime.datetime.strptime('', '')
 
 TRANSFER_TOOL = config_get('conveyor', 'transfertool', False, None)
 
+def query_worker(external_host, queries, results, timeout=None, stop_event=None):
+    """
+    Query the transfers of one transfertool host. Several workers share the queue of
+    a host, which bounds the number of concurrent queries against it, while a slow
+    host only delays its own queue.
+
+    :param external_host:    The FTS server to query from.
+    :param queries:          Queue of (transfer ids, request ids, prepend_str) to query.
+    :param results:          Queue receiving the (external_host, transfer ids, request ids, responses).
+    :param timeout:          Timeout.
+    :param stop_event:       Event to stop the worker.
+    """
+    while not stop_event.is_set():
+        try:
+            xfers, request_ids, prepend_str = queries.get(timeout=1)
+        except Empty:
+            continue
+        resps = {}
+        try:
+            resps = query_transfers(external_host=external_host, xfers=xfers, prepend_str=prepend_str, timeout=timeout)
+        except Exception:
+            logging.error(traceback.format_exc())
+        # The result is always sent back, so that the transfers are not in flight anymore
+        results.put((external_host, xfers, request_ids, resps))
+
+
 def poller(once=False, activities=None, sleep_time=60,
            fts_bulk=100, db_bulk=1000, older_than=60, activity_shares=None):
     """
     Main loop to check the status of a transfer primitive with a transfertool.
+
+    The transfers are queried by [conveyor] poller_host_concurrency worker threads per
+    transfertool host, and the responses are applied to the database by this thread in
+    batches of [conveyor] poller_db_batch responses. Up to [conveyor] poller_max_in_flight
+    transfers are polled at the same time.
     """
 
     try:
@@ -79,6 +114,9 @@ def poller(once=False, activities=None, sleep_time=60,
         timeout = float(timeout)
     except NoOptionError:
         timeout = None
+    host_concurrency = int(config_get('conveyor', 'poller_host_concurrency', False, 4))
+    max_in_flight = int(config_get('conveyor', 'poller_max_in_flight', False, 10 * db_bulk))
+    db_batch = int(config_get('conveyor', 'poller_db_batch', False, 500))
 
     executable = sys.argv[0]
     if activities:
@@ -94,7 +132,7 @@ def poller(once=False, activities=None, sleep_time=60,
     heartbeat.sanity_check(executable=executable, hostname=hostname)
     heart_beat = heartbeat.live(executable, hostname, pid, hb_thread)
     prepend_str = 'Thread [%i/%i] : ' % (heart_beat['assign_thread'] + 1, heart_beat['nr_threads'])
-    logging.info(prepend_str + 'Poller starting - db_bulk (%i) fts_bulk (%i) timeout (%s)' % (db_bulk, fts_bulk, timeout))
+    logging.info(prepend_str + 'Poller starting - db_bulk (%i) fts_bulk (%i) timeout (%s) host_concurrency (%i) max_in_flight (%i)' % (db_bulk, fts_bulk, timeout, host_concurrency, max_in_flight))
 
     time.sleep(10)  # To prevent running on the same partition if all the poller restart at the same time
     heart_beat = heartbeat.live(executable, hostname, pid, hb_thread)
@@ -103,6 +141,9 @@ def poller(once=False, activities=None, sleep_time=60,
     logging.info(prepend_str + 'Poller started')
 
     activity_next_exe_time = defaultdict(time.time)
+    queries, results = {}, Queue()
+    in_flight = set()
+    workers, workers_stop = [], threading.Event()
 
     while not graceful_stop.is_set():
 
@@ -114,8 +155,10 @@ def poller(once=False, activities=None, sleep_time=60,
                 activities = [None]
             for activity in activities:
                 if activity_next_exe_time[activity] > time.time():
-                    graceful_stop.wait(1)
                     continue
+                if len(in_flight) >= max_in_flight:
+                    logging.debug(prepend_str + '%i transfers in flight, will not poll new transfers' % len(in_flight))
+                    break
 
                 start_time = time.time()
                 logging.debug(prepend_str + 'Start to poll transfers older than %i seconds for activity %s' % (older_than, activity))
@@ -135,21 +178,39 @@ def poller(once=False, activities=None, sleep_time=60,
 
                 xfers_ids = {}
                 for transf in transfs:
+                    if transf['external_id'] in in_flight:
+                        continue
                     if not transf['external_host'] in xfers_ids:
-                        xfers_ids[transf['external_host']] = []
-                    xfers_ids[transf['external_host']].append((transf['external_id'], transf['request_id']))
+                        xfers_ids[transf['external_host']] = {}
+                    xfers_ids[transf['external_host']].setdefault(transf['external_id'], set()).add(transf['request_id'])
+
+                # The transfers are touched, so that they are not selected again until they are polled
+                transfer_core.touch_transfers([external_id for external_ids in xfers_ids.values() for external_id in external_ids])
 
                 for external_host in xfers_ids:
-                    external_ids = list({trf[0] for trf in xfers_ids[external_host]})
-                    request_ids = [trf[1] for trf in xfers_ids[external_host]]
-                    for xfers in chunks(external_ids, fts_bulk):
-                        # poll transfers
-                        poll_transfers(external_host=external_host, xfers=xfers, prepend_str=prepend_str, request_ids=request_ids, timeout=timeout)
+                    if external_host not in queries:
+                        queries[external_host] = Queue()
+                        for _ in range(host_concurrency):
+                            worker = threading.Thread(target=query_worker, kwargs={'external_host': external_host,
+                                                                                   'queries': queries[external_host],
+                                                                                   'results': results,
+                                                                                   'timeout': timeout,
+                                                                                   'stop_event': workers_stop})
+                            worker.start()
+                            workers.append(worker)
+                    for xfers in chunks(list(xfers_ids[external_host]), fts_bulk):
+                        in_flight.update(xfers)
+                        request_ids = set(request_id for xfer in xfers for request_id in xfers_ids[external_host][xfer])
+                        queries[external_host].put((xfers, request_ids, prepend_str))
 
                 if len(transfs) < fts_bulk / 2:
                     logging.info(prepend_str + "Only %s transfers for activity %s, which is less than half of the bulk %s, will sleep %s seconds" % (len(transfs), activity, fts_bulk, sleep_time))
                     if activity_next_exe_time[activity] < time.time():
                         activity_next_exe_time[activity] = time.time() + sleep_time
+
+            update_polled_transfers(results=results, in_flight=in_flight, db_batch=db_batch, prepend_str=prepend_str)
+            while once and in_flight:
+                update_polled_transfers(results=results, in_flight=in_flight, db_batch=db_batch, prepend_str=prepend_str)
         except Exception:
             logging.critical(prepend_str + "%s" % (traceback.format_exc()))
 
@@ -158,11 +219,47 @@ def poller(once=False, activities=None, sleep_time=60,
 
     logging.info(prepend_str + 'Graceful stop requested')
 
+    workers_stop.set()
+    for worker in workers:
+        worker.join()
+
     heartbeat.die(executable, hostname, pid, hb_thread)
 
     logging.info(prepend_str + 'Graceful stop done')
 
 
+def update_polled_transfers(results, in_flight, db_batch=500, wait=1, prepend_str=''):
+    """
+    Apply the responses of the query workers to the database, in batches.
+    Waits up to wait seconds for the first response, then applies all the available ones.
+
+    :param results:          Queue of (external_host, transfer ids, request ids, responses).
+    :param in_flight:        Set of the transfer ids being polled.
+    :param db_batch:         Number of request responses per database transaction.
+    :param wait:             Seconds to wait for the first response.
+    :param prepend_str:      String to prepend to the logging.
+    """
+    batch, nb_responses = [], 0
+    try:
+        result = results.get(timeout=wait)
+    except Empty:
+        return
+    while result:
+        external_host, xfers, request_ids, resps = result
+        in_flight.difference_update(xfers)
+        batch.append((external_host, resps, request_ids))
+        nb_responses += sum(len(resp) for resp in resps.values() if isinstance(resp, dict))
+        if nb_responses >= db_batch:
+            update_transfers_states(batch, prepend_str=prepend_str)
+            batch, nb_responses = [], 0
+        try:
+            result = results.get_nowait()
+        except Empty:
+            result = None
+    if batch:
+        update_transfers_states(batch, prepend_str=prepend_str)
+
+
 def stop(signum=None, frame=None):
     """
     Graceful exit.
@@ -231,75 +328,132 @@ def poll_transfers(external_host, xfers, prepend_str='', request_ids=None, timeo
     :param timeout:          Timeout.
     """
     try:
-        try:
-            tss = time.time()
-            logging.info(prepend_str + 'Polling %i transfers against %s with timeout %s' % (len(xfers), external_host, timeout))
-            resps = transfer_core.bulk_query_transfers(external_host, xfers, TRANSFER_TOOL, timeout)
-            record_timer('daemons.conveyor.poller.bulk_query_transfers', (time.time() - tss) * 1000 / len(xfers))
-        except TransferToolTimeout as error:
-            logging.error(prepend_str + str(error))
-            return
-        except TransferToolWrongAnswer as error:
-            logging.error(prepend_str + str(error))
-            logging.error(prepend_str + 'Problem querying %s on %s. All jobs are being checked individually' % (str(xfers), external_host))
-            for xfer in xfers:
-                try:
-                    logging.debug(prepend_str + 'Checking %s on %s' % (xfer, external_host))
-                    status = transfer_core.bulk_query_transfers(external_host, [xfer, ], TRANSFER_TOOL, timeout)
-                    logging.debug(prepend_str + str(status))
-                    if xfer in status and isinstance(status[xfer], Exception):
-                        logging.error(prepend_str + 'Problem querying %s on %s . Error returned : %s' % (xfer, external_host, str(status[xfer])))
-                except Exception as err:
-                    logging.error(prepend_str + 'Problem querying %s on %s . Error returned : %s' % (xfer, external_host, str(err)))
-                    break
-            return
-        except RequestException as error:
-            logging.error(prepend_str + "Failed to contact FTS server: %s" % (str(error)))
-            return
-        except Exception:
-            logging.error(prepend_str + "Failed to query FTS info: %s" % (traceback.format_exc()))
-            return
+        transfer_core.touch_transfers(xfers)
+        resps = query_transfers(external_host=external_host, xfers=xfers, prepend_str=prepend_str, timeout=timeout)
+        update_transfers_states([(external_host, resps, request_ids)], prepend_str=prepend_str)
+    except Exception:
+        logging.error(traceback.format_exc())
+
 
-        logging.debug(prepend_str + 'Polled %s transfer requests status in %s seconds' % (len(xfers), (time.time() - tss)))
+def query_transfers(external_host, xfers, prepend_str='', timeout=None):
+    """
+    Query a list of transfers from an FTS server. If the bulk query gets a wrong
+    answer, the transfers are queried individually.
+
+    :param external_host:    The FTS server to query from.
+    :param xfers:            List of transfers to poll.
+    :param prepend_str:      String to prepend to the logging.
+    :param timeout:          Timeout.
+    :returns:                Dictionary {transfer id: response}, empty if the server could not be queried.
+    """
+    try:
         tss = time.time()
-        logging.debug(prepend_str + 'Updating %s transfer requests status' % (len(xfers)))
-        cnt = 0
+        logging.info(prepend_str + 'Polling %i transfers against %s with timeout %s' % (len(xfers), external_host, timeout))
+        resps = transfer_core.bulk_query_transfers(external_host, xfers, TRANSFER_TOOL, timeout)
+        record_timer('daemons.conveyor.poller.bulk_query_transfers', (time.time() - tss) * 1000 / len(xfers))
+    except TransferToolTimeout as error:
+        logging.error(prepend_str + str(error))
+        return {}
+    except TransferToolWrongAnswer as error:
+        logging.error(prepend_str + str(error))
+        logging.error(prepend_str + 'Problem querying %s on %s. All jobs are being checked individually' % (str(xfers), external_host))
+        resps = {}
+        for xfer in xfers:
+            try:
+                logging.debug(prepend_str + 'Checking %s on %s' % (xfer, external_host))
+                status = transfer_core.bulk_query_transfers(external_host, [xfer, ], TRANSFER_TOOL, timeout)
+                logging.debug(prepend_str + str(status))
+                if xfer in status and isinstance(status[xfer], Exception):
+                    logging.error(prepend_str + 'Problem querying %s on %s . Error returned : %s' % (xfer, external_host, str(status[xfer])))
+                elif xfer in status:
+                    resps[xfer] = status[xfer]
+            except Exception as err:
+                logging.error(prepend_str + 'Problem querying %s on %s . Error returned : %s' % (xfer, external_host, str(err)))
+                break
+        return resps
+    except RequestException as error:
+        logging.error(prepend_str + "Failed to contact FTS server: %s" % (str(error)))
+        return {}
+    except Exception:
+        logging.error(prepend_str + "Failed to query FTS info: %s" % (traceback.format_exc()))
+        return {}
+
+    logging.debug(prepend_str + 'Polled %s transfer requests status in %s seconds' % (len(xfers), (time.time() - tss)))
+    return resps
+
 
+def update_transfers_states(results, prepend_str=''):
+    """
+    Update the requests of polled transfers. The terminated requests of all the
+    transfers are updated together, and one by one if the bulk update fails.
+
+    :param results:          List of (external_host, responses, request ids) as returned by query_transfers.
+                             Only the requests in request ids are updated, or all of them if it is None.
+    :param prepend_str:      String to prepend to the logging.
+    """
+    tss = time.time()
+    responses = []
+    for external_host, resps, request_ids in results:
         if TRANSFER_TOOL == 'globus':
             for task_id in resps:
                 ret = transfer_core.update_transfer_state(external_host=None, transfer_id=task_id, state=resps[task_id])
                 record_counter('daemons.conveyor.poller.update_request_state.%s' % ret)
-        else:
-            for transfer_id in resps:
+            continue
+
+        for transfer_id in resps:
+            transf_resp = resps[transfer_id]
+            # transf_resp is None: Lost.
+            #             is Exception: Failed to get fts job status.
+            #             is {}: No terminated jobs.
+            #             is {request_id: {file_status}}: terminated jobs.
+            if transf_resp is None:
                 try:
-                    transf_resp = resps[transfer_id]
-                    # transf_resp is None: Lost.
-                    #             is Exception: Failed to get fts job status.
-                    #             is {}: No terminated jobs.
-                    #             is {request_id: {file_status}}: terminated jobs.
-                    if transf_resp is None:
-                        transfer_core.update_transfer_state(external_host, transfer_id, RequestState.LOST, logging_prepend_str=prepend_str)
-                        record_counter('daemons.conveyor.poller.transfer_lost')
-                    elif isinstance(transf_resp, Exception):
-                        logging.warning(prepend_str + "Failed to poll FTS(%s) job (%s): %s" % (external_host, transfer_id, transf_resp))
-                        record_counter('daemons.conveyor.poller.query_transfer_exception')
-                    else:
-                        for request_id in transf_resp:
-                            if request_id in request_ids:
-                                ret = request_core.update_request_state(transf_resp[request_id], logging_prepend_str=prepend_str)
-                                # if True, really update request content; if False, only touch request
-                                if ret:
-                                    cnt += 1
-                                record_counter('daemons.conveyor.poller.update_request_state.%s' % ret)
-
-                    # should touch transfers.
-                    # Otherwise if one bulk transfer includes many requests and one is not terminated, the transfer will be poll again.
-                    transfer_core.touch_transfer(external_host, transfer_id)
+                    transfer_core.update_transfer_state(external_host, transfer_id, RequestState.LOST, logging_prepend_str=prepend_str)
+                    record_counter('daemons.conveyor.poller.transfer_lost')
                 except (DatabaseException, DatabaseError) as error:
-                    if re.match('.*ORA-00054.*', error.args[0]) or re.match('.*ORA-00060.*', error.args[0]) or 'ERROR 1205 (HY000)' in error.args[0]:
-                        logging.warn(prepend_str + "Lock detected when handling request %s - skipping" % request_id)
+                    if __is_lock_error(error):
+                        logging.warn(prepend_str + "Lock detected when handling transfer %s - skipping" % transfer_id)
                     else:
                         logging.error(traceback.format_exc())
-            logging.debug(prepend_str + 'Finished updating %s transfer requests status (%i requests state changed) in %s seconds' % (len(xfers), cnt, (time.time() - tss)))
+                except Exception:
+                    logging.error(traceback.format_exc())
+            elif isinstance(transf_resp, Exception):
+                logging.warning(prepend_str + "Failed to poll FTS(%s) job (%s): %s" % (external_host, transfer_id, transf_resp))
+                record_counter('daemons.conveyor.poller.query_transfer_exception')
+            else:
+                responses.extend(transf_resp[request_id] for request_id in transf_resp if request_ids is None or request_id in request_ids)
+
+    if not responses:
+        return
+
+    logging.debug(prepend_str + 'Updating %s transfer requests status' % (len(responses)))
+    try:
+        ret = request_core.update_requests_states(responses, logging_prepend_str=prepend_str)
+        updates = list(ret.values())
     except Exception:
-        logging.error(traceback.format_exc())
+        logging.warning(prepend_str + 'Bulk update of %s requests failed, updating them one by one: %s' % (len(responses), traceback.format_exc()))
+        updates = []
+        for response in responses:
+            try:
+                updates.append(request_core.update_request_state(response, logging_prepend_str=prepend_str))
+            except (DatabaseException, DatabaseError) as error:
+                if __is_lock_error(error):
+                    logging.warn(prepend_str + "Lock detected when handling request %s - skipping" % response['request_id'])
+                else:
+                    logging.error(traceback.format_exc())
+            except Exception:
+                logging.error(traceback.format_exc())
+    for updated in updates:
+        # if True, really update request content; if False, only touch request
+        record_counter('daemons.conveyor.poller.update_request_state.%s' % updated)
+    logging.debug(prepend_str + 'Finished updating %s transfer requests status (%i requests state changed) in %s seconds' % (len(responses), updates.count(True), (time.time() - tss)))
+
+
+def __is_lock_error(error):
+    """
+    Check if a database error is due to a row lock.
+
+    :param error: The database exception.
+    :returns: True if it is a lock error.
+    """
+    return re.match('.*ORA-00054.*', error.args[0]) or re.match('.*ORA-00060.*', error.args[0]) or 'ERROR 1205 (HY000)' in error.args[0]
@@ -39,6 +39,11 @@ import threading
 import time
 import traceback
 
+try:
+    from Queue import Queue, Empty  # py2
+except ImportError:
+    from queue import Queue, Empty  # py3
+
 import stomp
 
 from rucio.common.config import config_get, config_get_int
@@ -63,11 +68,12 @@ graceful_stop = threading.Event()
 
 class Receiver(object):
 
-    def __init__(self, broker, id, total_threads, full_mode=False):
+    def __init__(self, broker, id, total_threads, full_mode=False, queues=None):
         self.__broker = broker
         self.__id = id
         self.__total_threads = total_threads
         self.__full_mode = full_mode
+        self.__queues = queues
 
     def on_error(self, headers, message):
         record_counter('daemons.conveyor.receiver.error')
@@ -151,33 +157,130 @@ class Receiver(object):
                 elif str(msg['t_final_transfer_state']) == str(FTSCompleteState.ERROR):
                     response['new_state'] = RequestState.FAILED
 
+                if response['new_state']:
+                    logging.info('RECEIVED DID %s:%s FROM %s TO %s REQUEST %s TRANSFER_ID %s STATE %s' % (response['scope'],
+                                                                                                          response['name'],
+                                                                                                          response['src_rse'],
+                                                                                                          response['dst_rse'],
+                                                                                                          response['request_id'],
+                                                                                                          response['transfer_id'],
+                                                                                                          response['new_state']))
+                    # The state is updated by the workers, in batches
+                    dispatch_response(self.__queues, response)
+
+
+def dispatch_response(queues, response):
+    """
+    Put a response in the queue of its worker.
+
+    All the responses of a request go to the same worker, so that its updates are
+    collapsed together and applied in order. The queues are bounded: when the workers
+    lag behind, the listeners block and stop reading from the brokers.
+
+    :param queues: List of the queues of the workers.
+    :param response: The parsed message.
+    """
+    queues[hash(response['request_id']) % len(queues)].put(response)
+
+
+def collapse_responses(batch, response):
+    """
+    Add a response to a batch, keeping only the last completion of each transfer.
+
+    Messages can be redelivered or arrive out of order: for a given transfer the one
+    with the latest completion time is kept. Responses of different transfers of the
+    same request are all kept, the request itself knows which transfer is the current one.
+
+    :param batch: Dictionary {request_id: {transfer_id: response}}.
+    :param response: The parsed message.
+    """
+    transfers = batch.setdefault(response['request_id'], {})
+    previous = transfers.get(response['transfer_id'])
+    if previous is None or previous['transferred_at'] <= response['transferred_at']:
+        transfers[response['transfer_id']] = response
+
+
+def apply_responses(responses, full_mode=False):
+    """
+    Apply a batch of responses to the database.
+
+    In full mode the request states are updated in one transaction. If it fails, the
+    responses are applied one by one so that one bad response does not block the others.
+    Otherwise only the update time of the transfers is reset, so that the poller picks them up.
+
+    :param responses: List of parsed messages.
+    :param full_mode: Update the request states.
+    """
+    if full_mode:
+        try:
+            ret = request.update_requests_states(responses)
+            for updated in ret.values():
+                record_counter('daemons.conveyor.receiver.update_request_state.%s' % updated)
+        except Exception:
+            logging.warning('Bulk update of %s requests failed, updating them one by one: %s' % (len(responses), traceback.format_exc()))
+            for response in responses:
                 try:
-                    if response['new_state']:
-                        logging.info('RECEIVED DID %s:%s FROM %s TO %s REQUEST %s TRANSFER_ID %s STATE %s' % (response['scope'],
-                                                                                                              response['name'],
-                                                                                                              response['src_rse'],
-                                                                                                              response['dst_rse'],
-                                                                                                              response['request_id'],
-                                                                                                              response['transfer_id'],
-                                                                                                              response['new_state']))
-
-                        if self.__full_mode:
-                            ret = request.update_request_state(response)
-                            record_counter('daemons.conveyor.receiver.update_request_state.%s' % ret)
-                        else:
-                            try:
-                                logging.debug("Update request %s update time" % response['request_id'])
-                                set_transfer_update_time(response['external_host'], response['transfer_id'], datetime.datetime.utcnow() - datetime.timedelta(hours=24))
-                                record_counter('daemons.conveyor.receiver.set_transfer_update_time')
-                            except Exception as error:
-                                logging.debug("Failed to update transfer's update time: %s" % str(error))
+                    ret = request.update_request_state(response)
+                    record_counter('daemons.conveyor.receiver.update_request_state.%s' % ret)
                 except Exception:
                     logging.critical(traceback.format_exc())
+    else:
+        for external_host, transfer_id in set((response['external_host'], response['transfer_id']) for response in responses):
+            try:
+                logging.debug("Update transfer %s update time" % transfer_id)
+                set_transfer_update_time(external_host, transfer_id, datetime.datetime.utcnow() - datetime.timedelta(hours=24))
+                record_counter('daemons.conveyor.receiver.set_transfer_update_time')
+            except Exception as error:
+                logging.debug("Failed to update transfer's update time: %s" % str(error))
 
 
-def receiver(id, total_threads=1, full_mode=False):
+def worker(queue, full_mode=False):
+    """
+    Drain the queue filled by the listeners into micro-batches and apply them.
+
+    A batch is applied when it reaches [conveyor] receiver_batch_size messages, or
+    [conveyor] receiver_batch_wait seconds after its first message.
+
+    :param queue: Queue of the parsed messages.
+    :param full_mode: Update the request states.
+    """
+    batch_size = int(config_get('conveyor', 'receiver_batch_size', raise_exception=False, default=500))
+    batch_wait = float(config_get('conveyor', 'receiver_batch_wait', raise_exception=False, default=1))
+
+    while not graceful_stop.is_set() or not queue.empty():
+        batch, nb_messages = {}, 0
+        try:
+            collapse_responses(batch, queue.get(timeout=1))
+            nb_messages += 1
+        except Empty:
+            continue
+
+        deadline = time.time() + batch_wait
+        while nb_messages < batch_size:
+            try:
+                collapse_responses(batch, queue.get(timeout=max(deadline - time.time(), 0)))
+                nb_messages += 1
+            except Empty:
+                break
+
+        responses = [response for transfers in batch.values() for response in transfers.values()]
+        record_counter('daemons.conveyor.receiver.collapsed', nb_messages - len(responses))
+        start_time = time.time()
+        try:
+            apply_responses(responses, full_mode=full_mode)
+        except Exception:
+            logging.critical(traceback.format_exc())
+        logging.debug('Applied %s responses from %s messages in %s seconds' % (len(responses), nb_messages, time.time() - start_time))
+
+
+def receiver(id, total_threads=1, full_mode=False, queues=None):
     """
     Main loop to consume messages from the FTS3 producer.
+
+    :param id: The receiver thread id.
+    :param total_threads: The total number of receiver threads.
+    :param full_mode: Update the request states.
+    :param queues: The queues of the workers.
     """
 
     logging.info('receiver starting in full mode: %s' % full_mode)
@@ -228,7 +331,7 @@ def receiver(id, total_threads=1, full_mode=False):
                 logging.info('connecting to %s' % conn.transport._Transport__host_and_ports[0][0])
                 record_counter('daemons.messaging.fts3.reconnect.%s' % conn.transport._Transport__host_and_ports[0][0].split('.')[0])
 
-                conn.set_listener('rucio-messaging-fts3', Receiver(broker=conn.transport._Transport__host_and_ports[0], id=id, total_threads=total_threads, full_mode=full_mode))
+                conn.set_listener('rucio-messaging-fts3', Receiver(broker=conn.transport._Transport__host_and_ports[0], id=id, total_threads=total_threads, full_mode=full_mode, queues=queues))
                 conn.start()
                 conn.connect()
                 conn.subscribe(destination=config_get('messaging-fts3', 'destination'),
@@ -258,15 +361,23 @@ def stop(signum=None, frame=None):
     graceful_stop.set()
 
 
-def run(once=False, total_threads=1, full_mode=False):
+def run(once=False, total_threads=1, full_mode=False, worker_threads=2):
     """
-    Starts up the receiver thread
+    Starts up the receiver and worker threads
     """
 
+    queue_size = int(config_get('conveyor', 'receiver_queue_size', raise_exception=False, default=10000))
+    queues = [Queue(maxsize=queue_size) for _ in range(0, worker_threads)]
+
+    logging.info('starting worker threads')
+    threads = [threading.Thread(target=worker, kwargs={'queue': queue,
+                                                       'full_mode': full_mode}) for queue in queues]
+
     logging.info('starting receiver thread')
-    threads = [threading.Thread(target=receiver, kwargs={'id': i,
-                                                         'full_mode': full_mode,
-                                                         'total_threads': total_threads}) for i in range(0, total_threads)]
+    threads.extend(threading.Thread(target=receiver, kwargs={'id': i,
+                                                             'full_mode': full_mode,
+                                                             'total_threads': total_threads,
+                                                             'queues': queues}) for i in range(0, total_threads))
 
     [thread.start() for thread in threads]
 
@@ -41,6 +41,10 @@ import time
 import traceback
 
 from collections import defaultdict
+try:
+    from Queue import Queue, Empty  # py2
+except ImportError:
+    from queue import Queue, Empty  # py3
 try:
     from ConfigParser import NoOptionError  # py2
 except Exception:
@@ -67,11 +71,195 @@ USER_TRANSFERS = config_get('conveyor', 'user_transfers', False, None)
 TRANSFER_TOOL = config_get('conveyor', 'transfertool', False, None)
 TRANSFER_TYPE = config_get('conveyor', 'transfertype', False, 'single')
 
+
+class SubmissionPipeline(object):
+    """
+    Grouping and submission stages of a submitter thread.
+
+    The transfers fetched by the submitter thread go through a bounded queue to a grouping thread,
+    which puts the jobs in a bounded queue per transfertool host, consumed by host_concurrency
+    submission threads. When the submission is slower than the fetch the queues fill up and the
+    submitter thread waits, instead of fetching more transfers. The requests are tracked from their
+    fetch until the end of their submission, so that the fetch can exclude them meanwhile.
+    """
+
+    def __init__(self, group_policy='rule', group_bulk=1, source_strategy=None, max_time_in_queue=None, timeout=None,
+                 host_concurrency=2, queue_size=4):
+        """
+        :param group_policy:       Grouping policy of bulk_group_transfer.
+        :param group_bulk:         Maximum number of files per job.
+        :param source_strategy:    Source strategy of bulk_group_transfer.
+        :param max_time_in_queue:  Dictionary {activity: hours} of bulk_group_transfer.
+        :param timeout:            Timeout of the submissions.
+        :param host_concurrency:   Number of submission threads per transfertool host.
+        :param queue_size:         Maximum number of fetched bulks, and of jobs per host, waiting in the queues.
+        """
+        self.group_policy = group_policy
+        self.group_bulk = group_bulk
+        self.source_strategy = source_strategy
+        self.max_time_in_queue = max_time_in_queue
+        self.timeout = timeout
+        self.host_concurrency = host_concurrency
+        self.queue_size = queue_size
+        self.in_flight = set()
+        self.lock = threading.Lock()
+        self.__grouping_queue = Queue(maxsize=queue_size)
+        self.__submit_queues = {}
+        self.__fetch_done = threading.Event()
+        self.__group_done = threading.Event()
+        self.__grouper = threading.Thread(target=self.__group)
+        self.__workers = []
+
+    def start(self):
+        """
+        Start the grouping thread.
+        """
+        self.__grouper.start()
+
+    def get_in_flight(self):
+        """
+        Return the ids of the requests in the pipeline.
+
+        :returns: Set of request ids.
+        """
+        with self.lock:
+            return set(self.in_flight)
+
+    def put(self, transfers, activity=None, user_transfer=False, prepend_str=''):
+        """
+        Queue fetched transfers, waiting if the queue is full.
+        The transfers already in the pipeline are ignored.
+
+        :param transfers:      Dictionary {request_id: transfer} as returned by __get_transfers.
+        :param activity:       Activity of the transfers.
+        :param user_transfer:  Submit the transfers with the user credentials.
+        :param prepend_str:    String to prepend to the logging.
+        :returns:              Number of new transfers.
+        """
+        with self.lock:
+            transfers = dict((request_id, transfer) for request_id, transfer in iteritems(transfers) if request_id not in self.in_flight)
+            self.in_flight.update(transfers)
+        if transfers:
+            self.__grouping_queue.put((transfers, activity, user_transfer, prepend_str))
+        return len(transfers)
+
+    def stop(self):
+        """
+        Submit the queued transfers and stop the threads.
+        """
+        self.__fetch_done.set()
+        self.__grouper.join()
+        self.__group_done.set()
+        for worker in self.__workers:
+            worker.join()
+
+    def __group(self):
+        """
+        Grouping stage: group the fetched transfers into jobs and dispatch them to their transfertool host.
+        """
+        while not self.__fetch_done.is_set() or not self.__grouping_queue.empty():
+            try:
+                transfers, activity, user_transfer, prepend_str = self.__grouping_queue.get(timeout=1)
+            except Empty:
+                continue
+            try:
+                logging.info('%s Starting to group transfers for %s', prepend_str, activity)
+                start_time = time.time()
+                grouped_jobs = bulk_group_transfer(transfers, self.group_policy, self.group_bulk, self.source_strategy, self.max_time_in_queue)
+                record_timer('daemons.conveyor.transfer_submitter.bulk_group_transfer', (time.time() - start_time) * 1000 / (len(transfers) if transfers else 1))
+
+                logging.info('%s Starting to submit transfers for %s', prepend_str, activity)
+                submitted = set()
+                for external_host, job in self.__get_jobs(grouped_jobs, user_transfer, prepend_str):
+                    if external_host not in self.__submit_queues:
+                        self.__submit_queues[external_host] = Queue(maxsize=self.queue_size)
+                        for _ in range(self.host_concurrency):
+                            worker = threading.Thread(target=self.__submit, args=(self.__submit_queues[external_host], ))
+                            worker.start()
+                            self.__workers.append(worker)
+                    request_ids = set(t_file['metadata']['request_id'] for t_file in job['files'])
+                    submitted.update(request_ids)
+                    self.__submit_queues[external_host].put((external_host, job, user_transfer, request_ids, prepend_str))
+                # The transfers which are not part of any job are not in the pipeline anymore
+                with self.lock:
+                    self.in_flight.difference_update(set(transfers) - submitted)
+            except Exception:
+                logging.critical('%s %s', prepend_str, str(traceback.format_exc()))
+                with self.lock:
+                    self.in_flight.difference_update(transfers)
+
+    def __submit(self, submit_queue):
+        """
+        Submission stage: submit the jobs of one transfertool host.
+
+        :param submit_queue: The queue of the host.
+        """
+        while not self.__group_done.is_set() or not submit_queue.empty():
+            try:
+                external_host, job, user_transfer, request_ids, prepend_str = submit_queue.get(timeout=1)
+            except Empty:
+                continue
+            try:
+                submit_transfer(external_host=external_host, job=job, submitter='transfer_submitter',
+                                logging_prepend_str=prepend_str, timeout=self.timeout, user_transfer_job=user_transfer)
+            except Exception:
+                logging.critical('%s %s', prepend_str, str(traceback.format_exc()))
+            finally:
+                with self.lock:
+                    self.in_flight.difference_update(request_ids)
+
+    @staticmethod
+    def __get_jobs(grouped_jobs, user_transfer=False, prepend_str=''):
+        """
+        Build the jobs to submit from the grouped transfers, depending on the transfertool.
+
+        :param grouped_jobs:   Dictionary {external_host: jobs} as returned by bulk_group_transfer.
+        :param user_transfer:  The jobs are grouped by user.
+        :param prepend_str:    String to prepend to the logging.
+        :returns:              List of (external_host, job).
+        """
+        jobs = []
+        if TRANSFER_TOOL == 'fts3':
+            for external_host in grouped_jobs:
+                if not user_transfer:
+                    for job in grouped_jobs[external_host]:
+                        jobs.append((external_host, job))
+                else:
+                    for _, user_jobs in iteritems(grouped_jobs[external_host]):
+                        for job in user_jobs:
+                            jobs.append((external_host, job))
+        elif TRANSFER_TOOL == 'globus':
+            if TRANSFER_TYPE == 'bulk':
+                # build bulk job file list per external host to send to submit_transfer
+                for external_host in grouped_jobs:
+                    # pad the job with job_params; irrelevant for globus but needed for further rucio parsing
+                    submitjob = {'files': [], 'job_params': grouped_jobs[''][0].get('job_params')}
+                    for job in grouped_jobs[external_host]:
+                        submitjob.get('files').append(job.get('files')[0])
+                    logging.debug('submitjob: %s' % submitjob)
+                    jobs.append((external_host, submitjob))
+            else:
+                # build single job files and individually send to submit_transfer
+                job_params = grouped_jobs[''][0].get('job_params') if grouped_jobs else None
+                for external_host in grouped_jobs:
+                    for job in grouped_jobs[external_host]:
+                        for file in job['files']:
+                            singlejob = {'files': [file], 'job_params': job_params}
+                            logging.debug('singlejob: %s' % singlejob)
+                            jobs.append((external_host, singlejob))
+        else:
+            logging.error(prepend_str + 'No transfer tool specified in rucio configuration file')
+        return jobs
+
+
 def submitter(once=False, rses=None, mock=False,
               bulk=100, group_bulk=1, group_policy='rule', source_strategy=None,
               activities=None, sleep_time=600, max_sources=4, retry_other_fts=False):
     """
     Main loop to submit a new transfer primitive to a transfertool.
+
+    The transfers are grouped and submitted by a SubmissionPipeline, with [conveyor] submitter_host_concurrency
+    submission threads per transfertool host and queues of [conveyor] submitter_queue_size elements.
     """
 
     try:
@@ -107,6 +295,9 @@ def submitter(once=False, rses=None, mock=False,
         max_time_in_queue['default'] = 168
     logging.debug("Maximum time in queue for different activities: %s", max_time_in_queue)
 
+    host_concurrency = int(config_get('conveyor', 'submitter_host_concurrency', False, 2))
+    queue_size = int(config_get('conveyor', 'submitter_queue_size', False, 4))
+
     activity_next_exe_time = defaultdict(time.time)
     executable = sys.argv[0]
     if activities:
@@ -126,6 +317,11 @@ def submitter(once=False, rses=None, mock=False,
     prepend_str = 'Thread [%i/%i] : ' % (heart_beat['assign_thread'] + 1, heart_beat['nr_threads'])
     logging.info('%s Transfer submitter started', prepend_str)
 
+    pipeline = SubmissionPipeline(group_policy=group_policy, group_bulk=group_bulk, source_strategy=source_strategy,
+                                  max_time_in_queue=max_time_in_queue, timeout=timeout,
+                                  host_concurrency=host_concurrency, queue_size=queue_size)
+    pipeline.start()
+
     while not graceful_stop.is_set():
 
         try:
@@ -155,6 +351,7 @@ def submitter(once=False, rses=None, mock=False,
                                             worker_number=heart_beat['assign_thread'],
                                             failover_schemes=failover_scheme,
                                             limit=bulk,
+                                            exclude_request_ids=pipeline.get_in_flight(),
                                             activity=activity,
                                             rses=rse_ids,
                                             schemes=scheme,
@@ -167,52 +364,12 @@ def submitter(once=False, rses=None, mock=False,
                 record_timer('daemons.conveyor.transfer_submitter.get_transfers.transfers', len(transfers))
                 logging.info('%s Got %s transfers for %s in %s seconds', prepend_str, len(transfers), activity, time.time() - start_time)
 
-                # group transfers
-                logging.info('%s Starting to group transfers for %s', prepend_str, activity)
-                start_time = time.time()
-
-                grouped_jobs = bulk_group_transfer(transfers, group_policy, group_bulk, source_strategy, max_time_in_queue)
-                record_timer('daemons.conveyor.transfer_submitter.bulk_group_transfer', (time.time() - start_time) * 1000 / (len(transfers) if transfers else 1))
-
-                logging.info('%s Starting to submit transfers for %s', prepend_str, activity)
+                # group and submit transfers in the pipeline, while the next transfers are fetched
+                nb_transfers = pipeline.put(transfers, activity=activity, user_transfer=user_transfer, prepend_str=prepend_str)
+                logging.info('%s Queued %s new transfers for %s, %s transfers in the pipeline', prepend_str, nb_transfers, activity, len(pipeline.in_flight))
 
-                if TRANSFER_TOOL == 'fts3':
-                    for external_host in grouped_jobs:
-                        if not user_transfer:
-                            for job in grouped_jobs[external_host]:
-                                # submit transfers
-                                submit_transfer(external_host=external_host, job=job, submitter='transfer_submitter',
-                                                logging_prepend_str=prepend_str, timeout=timeout)
-                        else:
-                            for _, jobs in iteritems(grouped_jobs[external_host]):
-                                # submit transfers
-                                for job in jobs:
-                                    submit_transfer(external_host=external_host, job=job, submitter='transfer_submitter',
-                                                    logging_prepend_str=prepend_str, timeout=timeout, user_transfer_job=user_transfer)
-                elif TRANSFER_TOOL == 'globus':
-                    if TRANSFER_TYPE == 'bulk':
-                        # build bulk job file list per external host to send to submit_transfer
-                        for external_host in grouped_jobs:
-                            # pad the job with job_params; irrelevant for globus but needed for further rucio parsing
-                            submitjob = {'files': [], 'job_params': grouped_jobs[''][0].get('job_params')}
-                            for job in grouped_jobs[external_host]:
-                                 submitjob.get('files').append(job.get('files')[0])
-                            logging.debug('submitjob: %s' % submitjob)
-                            submit_transfer(external_host=external_host, job=submitjob, submitter='transfer_submitter', logging_prepend_str=prepend_str, timeout=timeout)
-                    else:
-                        # build single job files and individually send to submit_transfer
-                        job_params = grouped_jobs[''][0].get('job_params') if grouped_jobs else None
-                        for external_host in grouped_jobs:
-                            for job in grouped_jobs[external_host]:
-                                for file in job['files']:
-                                    singlejob = {'files': [file], 'job_params': job_params}
-                                    logging.debug('singlejob: %s' % singlejob)
-                                    submit_transfer(external_host=external_host, job=singlejob, submitter='transfer_submitter', logging_prepend_str=prepend_str, timeout=timeout)
-                else:
-                    logging.error(prepend_str + 'No transfer tool specified in rucio configuration file')
-
-                if len(transfers) < group_bulk:
-                    logging.info('%s Only %s transfers for %s which is less than group bulk %s, sleep %s seconds', prepend_str, len(transfers), activity, group_bulk, sleep_time)
+                if nb_transfers < group_bulk:
+                    logging.info('%s Only %s transfers for %s which is less than group bulk %s, sleep %s seconds', prepend_str, nb_transfers, activity, group_bulk, sleep_time)
                     if activity_next_exe_time[activity] < time.time():
                         activity_next_exe_time[activity] = time.time() + sleep_time
         except Exception:
@@ -223,6 +380,8 @@ def submitter(once=False, rses=None, mock=False,
 
     logging.info('%s Graceful stop requested', prepend_str)
 
+    pipeline.stop()
+
     heartbeat.die(executable, hostname, pid, hb_thread)
 
     logging.info('%s Graceful stop done', prepend_str)
@@ -285,7 +444,7 @@ def run(once=False, group_bulk=1, group_policy='rule',
 
 def __get_transfers(total_workers=0, worker_number=0, failover_schemes=None, limit=None, activity=None, older_than=None,
                     rses=None, schemes=None, mock=False, max_sources=4, bring_online=43200,
-                    retry_other_fts=False):
+                    retry_other_fts=False, exclude_request_ids=None):
     """
     Get transfers to process
 
@@ -301,6 +460,7 @@ def __get_transfers(total_workers=0, worker_number=0, failover_schemes=None, lim
     :param max_sources:      Max sources.
     :bring_online:           Bring online timeout.
     :retry_other_fts:        Retry other fts servers if needed
+    :param exclude_request_ids: Ids of the requests not to fetch.
     :returns:                List of transfers
     """
 
@@ -313,7 +473,8 @@ def __get_transfers(total_workers=0, worker_number=0, failover_schemes=None, lim
                                                                                                                                      schemes=schemes,
                                                                                                                                      bring_online=bring_online,
                                                                                                                                      retry_other_fts=retry_other_fts,
-                                                                                                                                     failover_schemes=failover_schemes)
+                                                                                                                                     failover_schemes=failover_schemes,
+                                                                                                                                     exclude_request_ids=exclude_request_ids)
     request_core.set_requests_state(reqs_no_source, RequestState.NO_SOURCES)
     request_core.set_requests_state(reqs_only_tape_source, RequestState.ONLY_TAPE_SOURCES)
     request_core.set_requests_state(reqs_scheme_mismatch, RequestState.MISMATCH_SCHEME)
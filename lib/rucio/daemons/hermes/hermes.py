@@ -29,7 +29,6 @@
 import json
 import logging
 import os
-import random
 import smtplib
 import socket
 import sys
@@ -38,11 +37,17 @@ import time
 import traceback
 
 from email.mime.text import MIMEText
+try:
+    from Queue import Queue, Empty, Full  # py2
+except ImportError:
+    from queue import Queue, Empty, Full  # py3
 from sqlalchemy.orm.exc import NoResultFound
 
 import stomp
 
 from rucio.common.config import config_get, config_get_int, config_get_bool
+from rucio.common.utils import generate_uuid
+from rucio.core import work_lease
 from rucio.core.heartbeat import live, die, sanity_check
 from rucio.core.message import retrieve_messages, delete_messages
 from rucio.core.monitor import record_counter
@@ -60,6 +65,8 @@ logging.basicConfig(stream=sys.stdout,
 
 GRACEFUL_STOP = threading.Event()
 
+HEARTBEAT_INTERVAL = 300
+
 
 def deliver_emails(once=False, send_email=True, thread=0, bulk=1000, delay=10):
     '''
@@ -154,6 +161,8 @@ class HermesListener(stomp.ConnectionListener):
         __init__
         '''
         self.__broker = broker
+        self.__receipts = {}
+        self.__lock = threading.Lock()
 
     def on_error(self, headers, body):
         '''
@@ -161,6 +170,153 @@ class HermesListener(stomp.ConnectionListener):
         '''
         logging.error('[broker] [%s]: %s', self.__broker, body)
 
+    def expect_receipt(self, receipt):
+        '''
+        Register a receipt to wait for.
+
+        :param receipt: The receipt identifier.
+        :returns: threading.Event set when the receipt is received.
+        '''
+        event = threading.Event()
+        with self.__lock:
+            self.__receipts[receipt] = event
+        return event
+
+    def forget_receipt(self, receipt):
+        '''
+        Stop waiting for a receipt.
+
+        :param receipt: The receipt identifier.
+        '''
+        with self.__lock:
+            self.__receipts.pop(receipt, None)
+
+    def on_receipt(self, headers, body):
+        '''
+        Receipt handler
+        '''
+        with self.__lock:
+            event = self.__receipts.pop(headers.get('receipt-id'), None)
+        if event:
+            event.set()
+
+
+def prepare_message(message):
+    '''
+    Serialize a message for the broker and for the history.
+
+    The payload is serialized only once, and the result is used for both.
+
+    :param message: The message as returned by retrieve_messages.
+    :returns: Dictionary with the body and event_type to send, and the history entry to_delete.
+    '''
+    event_type = str(message['event_type']).lower()
+    try:
+        payload = json.dumps(message['payload'])
+    except ValueError:
+        logging.warn('Cannot serialize payload to JSON: %s', str(message['payload']))
+        return {'body': None,
+                'event_type': event_type,
+                'to_delete': {'id': message['id'],
+                              'created_at': message['created_at'],
+                              'updated_at': message['created_at'],
+                              'payload': str(message['payload']),
+                              'event_type': message['event_type']}}
+
+    # Same document as json.dumps({'event_type': ..., 'payload': ..., 'created_at': ...}), without serializing the payload again
+    body = '{"event_type": %s, "payload": %s, "created_at": %s}' % (json.dumps(event_type), payload, json.dumps(str(message['created_at'])))
+    return {'body': body,
+            'event_type': event_type,
+            'to_delete': {'id': message['id'],
+                          'created_at': message['created_at'],
+                          'updated_at': message['created_at'],
+                          'payload': payload,
+                          'event_type': message['event_type']}}
+
+
+def send_to_broker(conn, listener, connect, destination, pending, confirmed, batch_size=100, timeout=3, prepend_str=''):
+    '''
+    Send the messages of a queue to one broker until a None is read from the queue.
+
+    The messages are sent in STOMP transactions of up to batch_size messages, committed with a receipt.
+    Only the messages of transactions whose receipt arrived within the timeout are added to confirmed.
+    If the broker cannot be reached, the sender stops and leaves the remaining messages to the other senders.
+
+    :param conn: The stomp connection.
+    :param listener: The HermesListener of the connection.
+    :param connect: Function connecting the connection.
+    :param destination: The destination on the broker.
+    :param pending: Queue of the messages prepared by prepare_message.
+    :param confirmed: List to which the history entries of the delivered messages are added.
+    :param batch_size: Maximum number of messages per transaction.
+    :param timeout: Seconds to wait for the receipt of a transaction.
+    :param prepend_str: String to prepend to the log messages.
+    '''
+    host = conn.transport._Transport__host_and_ports[0][0]
+    stop = False
+    while not stop:
+        batch = []
+        while len(batch) < batch_size:
+            try:
+                message = pending.get(block=not batch)
+            except Empty:
+                break
+            if message is None:
+                stop = True
+                break
+            batch.append(message)
+        if not batch:
+            continue
+
+        try:
+            if not conn.is_connected():
+                record_counter('daemons.hermes.reconnect.%s' % host.split('.')[0])
+                connect(conn)
+
+            transaction = conn.begin()
+            for message in batch:
+                conn.send(body=message['body'],
+                          destination=destination,
+                          headers={'persistent': 'true',
+                                   'event_type': message['event_type'],
+                                   'transaction': transaction})
+            receipt = generate_uuid()
+            received = listener.expect_receipt(receipt)
+            conn.commit(transaction=transaction, headers={'receipt': receipt})
+            if received.wait(timeout):
+                confirmed.extend(message['to_delete'] for message in batch)
+            else:
+                listener.forget_receipt(receipt)
+                logging.warn('%s No receipt from %s for %i messages, they will be sent again', prepend_str, host, len(batch))
+        except stomp.exception.NotConnectedException as error:
+            logging.warn('%s Could not deliver %i messages due to NotConnectedException: %s', prepend_str, len(batch), str(error))
+            return
+        except stomp.exception.ConnectFailedException as error:
+            logging.warn('%s Could not deliver %i messages due to ConnectFailedException: %s', prepend_str, len(batch), str(error))
+            return
+        except Exception as error:
+            logging.warn('%s Could not deliver %i messages: %s', prepend_str, len(batch), str(error))
+            logging.critical(traceback.format_exc())
+            return
+
+
+def enqueue(pending, item, senders):
+    '''
+    Put an item in the queue of the senders, waiting while the queue is full.
+
+    :param pending: The bounded queue.
+    :param item: The item to put.
+    :param senders: The sender threads reading the queue.
+    :returns: False if all the senders stopped, True otherwise.
+    '''
+    while any(sender.is_alive() for sender in senders):
+        try:
+            pending.put(item, timeout=1)
+            return True
+        except Full:
+            pass
+    return False
+
 
 def deliver_messages(once=False, brokers_resolved=None, thread=0, bulk=1000, delay=10,
                      broker_timeout=3, broker_retry=3):
@@ -205,140 +361,134 @@ def deliver_messages(once=False, brokers_resolved=None, thread=0, bulk=1000, del
                                      keepalive=True,
                                      timeout=broker_timeout)
 
-        con.set_listener('rucio-hermes',
-                         HermesListener(con.transport._Transport__host_and_ports[0]))
+        listener = HermesListener(con.transport._Transport__host_and_ports[0])
+        con.set_listener('rucio-hermes', listener)
 
-        conns.append(con)
+        conns.append((con, listener))
     destination = config_get('messaging-hermes', 'destination')
+    send_batch_size = int(config_get('messaging-hermes', 'send_batch_size', raise_exception=False, default=100))
 
     executable = 'hermes [broker]'
     hostname = socket.getfqdn()
     pid = os.getpid()
     heartbeat_thread = threading.current_thread()
 
-    # Make an initial heartbeat so that all daemons have the correct worker number on the next try
+    def connect(conn):
+        '''
+        Connect to a broker.
+        '''
+        host_and_ports = conn.transport._Transport__host_and_ports[0][0]
+        conn.start()
+        if not use_ssl:
+            logging.info('[broker] connecting with USERPASS to %s', host_and_ports)
+            conn.connect(username, password, wait=True)
+        else:
+            logging.info('[broker] connecting with SSL to %s', host_and_ports)
+            conn.connect(wait=True)
+
+    # Make an initial heartbeat, and release the work buckets of the dead processes of this host
     sanity_check(executable=executable, hostname=hostname, pid=pid, thread=heartbeat_thread)
+    work_lease.sanity_check(executable=executable, hostname=hostname)
+    live(executable=executable, hostname=hostname, pid=pid, thread=heartbeat_thread)
+    prepend_str = '[broker] -'
+    next_heartbeat = time.time() + HEARTBEAT_INTERVAL
     GRACEFUL_STOP.wait(1)
 
     while not GRACEFUL_STOP.is_set():
         try:
             t_start = time.time()
 
-            heartbeat = live(executable=executable, hostname=hostname, pid=pid,
-                             thread=heartbeat_thread)
+            # heartbeat, for monitoring only: the work is distributed with the leases of the work buckets
+            if t_start >= next_heartbeat:
+                live(executable=executable, hostname=hostname, pid=pid,
+                     thread=heartbeat_thread)
+                next_heartbeat = t_start + HEARTBEAT_INTERVAL
+            leases = work_lease.acquire(executable=executable, hostname=hostname, pid=pid,
+                                        thread=heartbeat_thread)
+            prepend_str = '[broker] buckets %s of %i workers -' % (leases['buckets'], leases['nr_workers'])
 
-            logging.debug('[broker] %i:%i - using: %s', heartbeat['assign_thread'],
-                          heartbeat['nr_threads'],
-                          [conn.transport._Transport__host_and_ports[0][0] for conn in conns])
+            logging.debug('%s using: %s', prepend_str,
+                          [conn.transport._Transport__host_and_ports[0][0] for conn, _ in conns])
 
             messages = retrieve_messages(bulk=bulk,
-                                         thread=heartbeat['assign_thread'],
-                                         total_threads=heartbeat['nr_threads'])
+                                         buckets=leases['buckets'])
 
             if messages:
 
-                logging.debug('[broker] %i:%i - retrieved %i messages',
-                              heartbeat['assign_thread'], heartbeat['nr_threads'],
-                              len(messages))
+                logging.debug('%s retrieved %i messages', prepend_str, len(messages))
+
+                # One sender per broker connection, fed through a bounded queue
                 to_delete = []
-                for message in messages:
-                    try:
-                        conn = random.sample(conns, 1)[0]
-                        if not conn.is_connected():
-                            host_and_ports = conn.transport._Transport__host_and_ports[0][0]
-                            record_counter('daemons.hermes.reconnect.%s' % host_and_ports.split('.')[0])
-                            conn.start()
-                            if not use_ssl:
-                                logging.info('[broker] %i:%i - connecting with USERPASS to %s',
-                                             heartbeat['assign_thread'],
-                                             heartbeat['nr_threads'],
-                                             host_and_ports)
-                                conn.connect(username, password, wait=True)
-                            else:
-                                logging.info('[broker] %i:%i - connecting with SSL to %s',
-                                             heartbeat['assign_thread'],
-                                             heartbeat['nr_threads'],
-                                             host_and_ports)
-                                conn.connect(wait=True)
-
-                        conn.send(body=json.dumps({'event_type': str(message['event_type']).lower(),
-                                                   'payload': message['payload'],
-                                                   'created_at': str(message['created_at'])}),
-                                  destination=destination,
-                                  headers={'persistent': 'true',
-                                           'event_type': str(message['event_type']).lower()})
-
-                        to_delete.append({'id': message['id'],
-                                          'created_at': message['created_at'],
-                                          'updated_at': message['created_at'],
-                                          'payload': json.dumps(message['payload']),
-                                          'event_type': message['event_type']})
-                    except ValueError:
-                        logging.warn('Cannot serialize payload to JSON: %s',
-                                     str(message['payload']))
-                        to_delete.append({'id': message['id'],
-                                          'created_at': message['created_at'],
-                                          'updated_at': message['created_at'],
-                                          'payload': str(message['payload']),
-                                          'event_type': message['event_type']})
-                        continue
-                    except stomp.exception.NotConnectedException as error:
-                        logging.warn('Could not deliver message due to NotConnectedException: %s',
-                                     str(error))
-                        continue
-                    except stomp.exception.ConnectFailedException as error:
-                        logging.warn('Could not deliver message due to ConnectFailedException: %s',
-                                     str(error))
-                        continue
-                    except Exception as error:
-                        logging.warn('Could not deliver message: %s', str(error))
-                        logging.critical(traceback.format_exc())
-                        continue
-
-                    if str(message['event_type']).lower().startswith('transfer') or str(message['event_type']).lower().startswith('stagein'):
-                        logging.debug('[broker] %i:%i - event_type: %s, scope: %s, name: %s, rse: %s, request-id: %s, transfer-id: %s, created_at: %s',
-                                      heartbeat['assign_thread'], heartbeat['nr_threads'],
-                                      str(message['event_type']).lower(),
-                                      message['payload'].get('scope', None),
-                                      message['payload'].get('name', None),
-                                      message['payload'].get('dst-rse', None),
-                                      message['payload'].get('request-id', None),
-                                      message['payload'].get('transfer-id', None),
-                                      str(message['created_at']))
-
-                    elif str(message['event_type']).lower().startswith('dataset'):
-                        logging.debug('[broker] %i:%i - event_type: %s, scope: %s, name: %s, rse: %s, rule-id: %s, created_at: %s)',
-                                      heartbeat['assign_thread'],
-                                      heartbeat['nr_threads'],
-                                      str(message['event_type']).lower(),
-                                      message['payload']['scope'],
-                                      message['payload']['name'],
-                                      message['payload']['rse'],
-                                      message['payload']['rule_id'],
-                                      str(message['created_at']))
-
-                    elif str(message['event_type']).lower().startswith('deletion'):
-                        if 'url' not in message['payload']:
-                            message['payload']['url'] = 'unknown'
-                        logging.debug('[broker] %i:%i - event_type: %s, scope: %s, name: %s, rse: %s, url: %s, created_at: %s)',
-                                      heartbeat['assign_thread'],
-                                      heartbeat['nr_threads'],
-                                      str(message['event_type']).lower(),
-                                      message['payload']['scope'],
-                                      message['payload']['name'],
-                                      message['payload']['rse'],
-                                      message['payload']['url'],
-                                      str(message['created_at']))
-                    else:
-                        logging.debug('[broker] %i:%i - other message: %s',
-                                      heartbeat['assign_thread'], heartbeat['nr_threads'],
-                                      message)
-
-                delete_messages(to_delete)
-                logging.info('[broker] %i:%i - submitted %i messages',
-                             heartbeat['assign_thread'],
-                             heartbeat['nr_threads'],
-                             len(to_delete))
+                pending = Queue(maxsize=2 * send_batch_size * len(conns))
+                senders = [threading.Thread(target=send_to_broker,
+                                            kwargs={'conn': conn,
+                                                    'listener': listener,
+                                                    'connect': connect,
+                                                    'destination': destination,
+                                                    'pending': pending,
+                                                    'confirmed': to_delete,
+                                                    'batch_size': send_batch_size,
+                                                    'timeout': broker_timeout,
+                                                    'prepend_str': prepend_str}) for conn, listener in conns]
+                for sender in senders:
+                    sender.start()
+
+                try:
+                    for message in messages:
+                        prepared = prepare_message(message)
+                        if prepared['body'] is None:
+                            to_delete.append(prepared['to_delete'])
+                            continue
+
+                        if not enqueue(pending, prepared, senders):
+                            logging.warn('%s no broker available, the remaining messages will be sent in the next cycle', prepend_str)
+                            break
+
+                        if str(message['event_type']).lower().startswith('transfer') or str(message['event_type']).lower().startswith('stagein'):
+                            logging.debug('%s event_type: %s, scope: %s, name: %s, rse: %s, request-id: %s, transfer-id: %s, created_at: %s',
+                                          prepend_str,
+                                          str(message['event_type']).lower(),
+                                          message['payload'].get('scope', None),
+                                          message['payload'].get('name', None),
+                                          message['payload'].get('dst-rse', None),
+                                          message['payload'].get('request-id', None),
+                                          message['payload'].get('transfer-id', None),
+                                          str(message['created_at']))
+
+                        elif str(message['event_type']).lower().startswith('dataset'):
+                            logging.debug('%s event_type: %s, scope: %s, name: %s, rse: %s, rule-id: %s, created_at: %s)',
+                                          prepend_str,
+                                          str(message['event_type']).lower(),
+                                          message['payload'].get('scope', None),
+                                          message['payload'].get('name', None),
+                                          message['payload'].get('rse', None),
+                                          message['payload'].get('rule_id', None),
+                                          str(message['created_at']))
+
+                        elif str(message['event_type']).lower().startswith('deletion'):
+                            if 'url' not in message['payload']:
+                                message['payload']['url'] = 'unknown'
+                            logging.debug('%s event_type: %s, scope: %s, name: %s, rse: %s, url: %s, created_at: %s)',
+                                          prepend_str,
+                                          str(message['event_type']).lower(),
+                                          message['payload'].get('scope', None),
+                                          message['payload'].get('name', None),
+                                          message['payload'].get('rse', None),
+                                          message['payload'].get('url', None),
+                                          str(message['created_at']))
+                        else:
+                            logging.debug('%s other message: %s',
+                                          prepend_str,
+                                          message)
+                finally:
+                    # Always stop the senders and delete the delivered messages, even if the loop failed
+                    for _ in senders:
+                        enqueue(pending, None, senders)
+                    for sender in senders:
+                        sender.join()
+                    delete_messages(to_delete)
+
+                logging.info('%s submitted %i messages', prepend_str, len(to_delete))
 
                 if once:
                     break
@@ -352,23 +502,21 @@ def deliver_messages(once=False, brokers_resolved=None, thread=0, bulk=1000, del
         t_delay = delay - (time.time() - t_start)
         t_delay = t_delay if t_delay > 0 else 0
         if t_delay:
-            logging.debug('[broker] %i:%i - sleeping %s seconds',
-                          heartbeat['assign_thread'], heartbeat['nr_threads'], t_delay)
+            logging.debug('%s sleeping %s seconds', prepend_str, t_delay)
         time.sleep(t_delay)
 
-    for conn in conns:
+    for conn, _ in conns:
         try:
             conn.disconnect()
         except Exception:
             pass
 
-    logging.debug('[broker] %i:%i - graceful stop requested',
-                  heartbeat['assign_thread'], heartbeat['nr_threads'])
+    logging.debug('%s graceful stop requested', prepend_str)
 
+    work_lease.release(executable, hostname, pid, heartbeat_thread)
     die(executable, hostname, pid, heartbeat_thread)
 
-    logging.debug('[broker] %i:%i - graceful stop done', heartbeat['assign_thread'],
-                  heartbeat['nr_threads'])
+    logging.debug('%s graceful stop done', prepend_str)
 
 
 def stop(signum=None, frame=None):
@@ -43,12 +43,15 @@ from sqlalchemy.orm.exc import FlushError
 
 from rucio.common.config import config_get
 from rucio.common.exception import DatabaseException, DataIdentifierNotFound, ReplicationRuleCreationTemporaryFailed
+from rucio.core import work_lease
 from rucio.core.heartbeat import live, die, sanity_check
 from rucio.core.rule import re_evaluate_did, get_updated_dids, delete_updated_did
 from rucio.core.monitor import record_counter
 
 graceful_stop = threading.Event()
 
+HEARTBEAT_INTERVAL = 300
+
 logging.basicConfig(stream=sys.stdout,
                     level=getattr(logging,
                                   config_get('common', 'loglevel',
@@ -68,14 +71,19 @@ def re_evaluator(once=False):
 
     paused_dids = {}  # {(scope, name): datetime}
 
-    # Make an initial heartbeat so that all judge-evaluators have the correct worker number on the next try
-    live(executable='rucio-judge-evaluator', hostname=hostname, pid=pid, thread=current_thread, older_than=60 * 30)
+    # Make an initial heartbeat, and release the work buckets of the dead processes of this host
+    heartbeat = live(executable='rucio-judge-evaluator', hostname=hostname, pid=pid, thread=current_thread, older_than=60 * 30)
+    work_lease.sanity_check(executable='rucio-judge-evaluator', hostname=hostname)
+    next_heartbeat = time.time() + HEARTBEAT_INTERVAL
     graceful_stop.wait(1)
 
     while not graceful_stop.is_set():
         try:
-            # heartbeat
-            heartbeat = live(executable='rucio-judge-evaluator', hostname=hostname, pid=pid, thread=current_thread, older_than=60 * 30)
+            # heartbeat, for monitoring only: the work is distributed with the leases of the work buckets
+            if time.time() >= next_heartbeat:
+                heartbeat = live(executable='rucio-judge-evaluator', hostname=hostname, pid=pid, thread=current_thread, older_than=60 * 30)
+                next_heartbeat = time.time() + HEARTBEAT_INTERVAL
+            leases = work_lease.acquire(executable='rucio-judge-evaluator', hostname=hostname, pid=pid, thread=current_thread)
 
             start = time.time()  # NOQA
 
@@ -86,12 +94,13 @@ def re_evaluator(once=False):
             dids = get_updated_dids(total_workers=heartbeat['nr_threads'] - 1,
                                     worker_number=heartbeat['assign_thread'],
                                     limit=100,
-                                    blacklisted_dids=[key for key in paused_dids])
-            logging.debug('re_evaluator[%s/%s] index query time %f fetch size is %d' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, time.time() - start, len(dids)))
+                                    blacklisted_dids=[key for key in paused_dids],
+                                    buckets=leases['buckets'])
+            logging.debug('re_evaluator[buckets %s of %i workers] index query time %f fetch size is %d' % (leases['buckets'], leases['nr_workers'], time.time() - start, len(dids)))
 
             # If the list is empty, sent the worker to sleep
             if not dids and not once:
-                logging.debug('re_evaluator[%s/%s] did not get any work (paused_dids=%s)' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, str(len(paused_dids))))
+                logging.debug('re_evaluator[buckets %s of %i workers] did not get any work (paused_dids=%s)' % (leases['buckets'], leases['nr_workers'], str(len(paused_dids))))
                 graceful_stop.wait(30)
             else:
                 done_dids = {}
@@ -102,7 +111,7 @@ def re_evaluator(once=False):
                     # Check if this did has already been operated on
                     if '%s:%s' % (did.scope, did.name) in done_dids:
                         if did.rule_evaluation_action in done_dids['%s:%s' % (did.scope, did.name)]:
-                            logging.debug('re_evaluator[%s/%s]: evaluation of %s:%s already done' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, did.scope, did.name))
+                            logging.debug('re_evaluator[buckets %s of %i workers]: evaluation of %s:%s already done' % (leases['buckets'], leases['nr_workers'], did.scope, did.name))
                             delete_updated_did(id=did.id)
                             continue
                     else:
@@ -111,7 +120,7 @@ def re_evaluator(once=False):
                     try:
                         start_time = time.time()
                         re_evaluate_did(scope=did.scope, name=did.name, rule_evaluation_action=did.rule_evaluation_action)
-                        logging.debug('re_evaluator[%s/%s]: evaluation of %s:%s took %f' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, did.scope, did.name, time.time() - start_time))
+                        logging.debug('re_evaluator[buckets %s of %i workers]: evaluation of %s:%s took %f' % (leases['buckets'], leases['nr_workers'], did.scope, did.name, time.time() - start_time))
                         delete_updated_did(id=did.id)
                         done_dids['%s:%s' % (did.scope, did.name)].append(did.rule_evaluation_action)
                     except DataIdentifierNotFound as e:
@@ -119,7 +128,7 @@ def re_evaluator(once=False):
                     except (DatabaseException, DatabaseError) as e:
                         if match('.*ORA-00054.*', str(e.args[0])):
                             paused_dids[(did.scope, did.name)] = datetime.utcnow() + timedelta(seconds=randint(60, 600))
-                            logging.warning('re_evaluator[%s/%s]: Locks detected for %s:%s' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, did.scope, did.name))
+                            logging.warning('re_evaluator[buckets %s of %i workers]: Locks detected for %s:%s' % (leases['buckets'], leases['nr_workers'], did.scope, did.name))
                             record_counter('rule.judge.exceptions.LocksDetected')
                         elif match('.*QueuePool.*', str(e.args[0])):
                             logging.warning(traceback.format_exc())
@@ -132,10 +141,10 @@ def re_evaluator(once=False):
                             record_counter('rule.judge.exceptions.%s' % e.__class__.__name__)
                     except ReplicationRuleCreationTemporaryFailed as e:
                         record_counter('rule.judge.exceptions.%s' % e.__class__.__name__)
-                        logging.warning('re_evaluator[%s/%s]: Replica Creation temporary failed, retrying later for %s:%s' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, did.scope, did.name))
+                        logging.warning('re_evaluator[buckets %s of %i workers]: Replica Creation temporary failed, retrying later for %s:%s' % (leases['buckets'], leases['nr_workers'], did.scope, did.name))
                     except FlushError as e:
                         record_counter('rule.judge.exceptions.%s' % e.__class__.__name__)
-                        logging.warning('re_evaluator[%s/%s]: Flush error for %s:%s' % (heartbeat['assign_thread'], heartbeat['nr_threads'] - 1, did.scope, did.name))
+                        logging.warning('re_evaluator[buckets %s of %i workers]: Flush error for %s:%s' % (leases['buckets'], leases['nr_workers'], did.scope, did.name))
         except (DatabaseException, DatabaseError) as e:
             if match('.*QueuePool.*', str(e.args[0])):
                 logging.warning(traceback.format_exc())
@@ -153,6 +162,7 @@ def re_evaluator(once=False):
         if once:
             break
 
+    work_lease.release(executable='rucio-judge-evaluator', hostname=hostname, pid=pid, thread=current_thread)
     die(executable='rucio-judge-evaluator', hostname=hostname, pid=pid, thread=current_thread)
 
 
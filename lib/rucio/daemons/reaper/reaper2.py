@@ -39,6 +39,10 @@ import time
 import traceback
 
 from math import ceil
+try:
+    from Queue import Queue, Empty  # py2
+except ImportError:
+    from queue import Queue, Empty  # py3
 from operator import itemgetter
 from collections import OrderedDict
 
@@ -56,7 +60,8 @@ from rucio.core.credential import get_signed_url
 from rucio.core.heartbeat import live, die, sanity_check, list_payload_counts
 from rucio.core.message import add_message
 from rucio.core.replica import list_and_mark_unlocked_replicas, delete_replicas
-from rucio.core.rse import list_rses, get_rse_limits, get_rse_usage, list_rse_attributes, get_rse_protocols
+from rucio.core.rse import list_rses, get_rse_limits, get_rse_usage, list_rse_attributes
+from rucio.core.rse_cache import get_rse_snapshot
 from rucio.core.rse_expression_parser import parse_expression
 from rucio.rse import rsemanager as rsemgr
 
@@ -78,79 +83,263 @@ REGION = make_region().configure('dogpile.cache.memcached',
                                             'distributed_lock': True})
 
 
-def delete_from_storage(replicas, prot, rse_info, staging_areas, prepend_str):
-    deleted_files = []
-    rse_name = rse_info['rse']
-    try:
-        prot.connect()
-        for replica in replicas:
-            # Physical deletion
-            try:
-                deletion_dict = {'scope': replica['scope'],
-                                 'name': replica['name'],
-                                 'rse': rse_name,
-                                 'file-size': replica['bytes'],
-                                 'bytes': replica['bytes'],
-                                 'url': replica['pfn'],
-                                 'protocol': prot.attributes['scheme']}
-                logging.info('%s Deletion ATTEMPT of %s:%s as %s on %s', prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name)
-                start = time.time()
-                # For STAGING RSEs, no physical deletion
-                if rse_name in staging_areas:
-                    logging.warning('%s Deletion STAGING of %s:%s as %s on %s, will only delete the catalog and not do physical deletion', prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name)
-                    deleted_files.append({'scope': replica['scope'], 'name': replica['name']})
-                    continue
+# Thresholds of the adaptive deletion concurrency: a batch with a larger fraction of failed deletions,
+# or with a latency per file larger than this factor times the best latency seen, halves the concurrency.
+DELETION_ERROR_RATIO = 0.1
+DELETION_LATENCY_FACTOR = 3
 
-                if replica['pfn']:
-                    pfn = replica['pfn']
-                    # sign the URL if necessary
-                    if prot.attributes['scheme'] == 'https' and rse_info['sign_url'] is not None:
-                        pfn = get_signed_url(rse_info['sign_url'], 'delete', pfn)
-                    prot.delete(pfn)
-                else:
-                    logging.warning('%s Deletion UNAVAILABLE of %s:%s as %s on %s', prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name)
+HOST_LIMITERS = {}
+HOST_LIMITERS_LOCK = threading.Lock()
+
+# RSE to hostname mapping computed from the last RSE metadata snapshot
+HOSTNAME_MAPPING = (None, None)
 
-                monitor.record_timer('daemons.reaper.delete.%s.%s' % (prot.attributes['scheme'], rse_name), (time.time() - start) * 1000)
-                duration = time.time() - start
 
-                deleted_files.append({'scope': replica['scope'], 'name': replica['name']})
+class HostDeletionLimiter(object):
+    """
+    Bounds the number of parallel deletions on a storage hostname, shared by all reaper threads of the process.
 
-                deletion_dict['duration'] = duration
-                add_message('deletion-done', deletion_dict)
-                logging.info('%s Deletion SUCCESS of %s:%s as %s on %s in %s seconds', prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name, duration)
+    The limit follows an additive increase / multiplicative decrease scheme: it grows by one after
+    every healthy batch and is halved when a batch fails too often or is much slower than usual.
+    """
 
-            except SourceNotFound:
-                err_msg = '%s Deletion NOTFOUND of %s:%s as %s on %s' % (prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name)
-                logging.warning(err_msg)
-                deleted_files.append({'scope': replica['scope'], 'name': replica['name']})
-                if replica['state'] == ReplicaState.AVAILABLE:
-                    deletion_dict['reason'] = str(err_msg)
-                    add_message('deletion-failed', deletion_dict)
+    def __init__(self, hostname, max_concurrency):
+        """
+        :param hostname:         The hostname of the storage.
+        :param max_concurrency:  Maximum number of parallel deletions.
+        """
+        self.hostname = hostname
+        self.max_concurrency = max_concurrency
+        self.limit = max(1, max_concurrency // 2)
+        self.active = 0
+        self.best_latency = None
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Wait for a free deletion slot on the hostname.
+        """
+        with self.condition:
+            while self.active >= self.limit:
+                self.condition.wait()
+            self.active += 1
+
+    def release(self):
+        """
+        Free a deletion slot on the hostname.
+        """
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def report(self, nb_files, nb_errors, duration):
+        """
+        Adapt the limit to the outcome of a deletion batch.
+
+        :param nb_files:   Number of files in the batch.
+        :param nb_errors:  Number of files which could not be deleted because of a storage error.
+        :param duration:   Duration of the batch in seconds.
+        """
+        latency = duration / max(nb_files, 1)
+        with self.condition:
+            # Slowly forget the best latency, so a single fast batch does not throttle the hostname forever
+            self.best_latency = latency if self.best_latency is None else min(latency, self.best_latency * 1.05)
+            if nb_errors > DELETION_ERROR_RATIO * nb_files or latency > DELETION_LATENCY_FACTOR * self.best_latency:
+                self.limit = max(1, self.limit // 2)
+            elif self.limit < self.max_concurrency:
+                self.limit += 1
+                self.condition.notify()
+            limit = self.limit
+        monitor.record_gauge(stat='reaper.deletion_concurrency.%s' % self.hostname.replace('.', '_'), value=limit)
+
+
+def get_host_limiter(hostname, max_concurrency):
+    """
+    Return the deletion limiter of a hostname.
+
+    :param hostname:         The hostname of the storage.
+    :param max_concurrency:  Maximum number of parallel deletions on the hostname.
+
+    :returns: HostDeletionLimiter.
+    """
+    with HOST_LIMITERS_LOCK:
+        if hostname not in HOST_LIMITERS:
+            HOST_LIMITERS[hostname] = HostDeletionLimiter(hostname, max_concurrency)
+        limiter = HOST_LIMITERS[hostname]
+    with limiter.condition:
+        limiter.max_concurrency = max_concurrency
+        limiter.limit = min(limiter.limit, max_concurrency)
+    return limiter
 
-            except (ServiceUnavailable, RSEAccessDenied, ResourceTemporaryUnavailable) as error:
-                logging.warning('%s Deletion NOACCESS of %s:%s as %s on %s: %s', prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name, str(error))
-                deletion_dict['reason'] = str(error)
-                add_message('deletion-failed', deletion_dict)
 
-            except Exception as error:
-                logging.critical('%s Deletion CRITICAL of %s:%s as %s on %s: %s', prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name, str(traceback.format_exc()))
-                deletion_dict['reason'] = str(error)
+def __deletion_message(replica, rse_name, prot):
+    """
+    Build the payload of the deletion messages of a replica.
+    """
+    return {'scope': replica['scope'],
+            'name': replica['name'],
+            'rse': rse_name,
+            'file-size': replica['bytes'],
+            'bytes': replica['bytes'],
+            'url': replica['pfn'],
+            'protocol': prot.attributes['scheme']}
+
+
+def __delete_batch(replicas, prot, rse_info, prepend_str):
+    """
+    Physically delete a batch of replicas with one bulk deletion.
+
+    :param replicas:     List of replicas with their PFN.
+    :param prot:         The connected protocol to use.
+    :param rse_info:     The RSE settings.
+    :param prepend_str:  String to prepend to the log messages.
+
+    :returns: (deleted_files, nb_errors)
+    """
+    deleted_files, nb_errors = [], 0
+    rse_name = rse_info['rse']
+
+    pfns = []
+    for replica in replicas:
+        logging.info('%s Deletion ATTEMPT of %s:%s as %s on %s', prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name)
+        pfn = replica['pfn']
+        # sign the URL if necessary
+        if prot.attributes['scheme'] == 'https' and rse_info['sign_url'] is not None:
+            pfn = get_signed_url(rse_info['sign_url'], 'delete', pfn)
+        pfns.append(pfn)
+
+    start = time.time()
+    try:
+        results = prot.bulk_delete(pfns)
+    except Exception as error:
+        results = dict((pfn, error) for pfn in pfns)
+    duration = (time.time() - start) / len(pfns)
+
+    for replica, pfn in zip(replicas, pfns):
+        deletion_dict = __deletion_message(replica, rse_name, prot)
+        error = results.get(pfn, ServiceUnavailable('No deletion result for %s' % pfn))
+        if error is None:
+            monitor.record_timer('daemons.reaper.delete.%s.%s' % (prot.attributes['scheme'], rse_name), duration * 1000)
+            deleted_files.append({'scope': replica['scope'], 'name': replica['name']})
+            deletion_dict['duration'] = duration
+            add_message('deletion-done', deletion_dict)
+            logging.info('%s Deletion SUCCESS of %s:%s as %s on %s in %s seconds', prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name, duration)
+
+        elif isinstance(error, SourceNotFound):
+            err_msg = '%s Deletion NOTFOUND of %s:%s as %s on %s' % (prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name)
+            logging.warning(err_msg)
+            deleted_files.append({'scope': replica['scope'], 'name': replica['name']})
+            if replica['state'] == ReplicaState.AVAILABLE:
+                deletion_dict['reason'] = str(err_msg)
                 add_message('deletion-failed', deletion_dict)
 
-    except (ServiceUnavailable, RSEAccessDenied, ResourceTemporaryUnavailable) as error:
-        for replica in replicas:
+        elif isinstance(error, (ServiceUnavailable, RSEAccessDenied, ResourceTemporaryUnavailable)):
+            nb_errors += 1
             logging.warning('%s Deletion NOACCESS of %s:%s as %s on %s: %s', prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name, str(error))
-            add_message('deletion-failed', {'scope': replica['scope'],
-                                            'name': replica['name'],
-                                            'rse': rse_name,
-                                            'file-size': replica['bytes'],
-                                            'bytes': replica['bytes'],
-                                            'url': replica['pfn'],
-                                            'reason': str(error),
-                                            'protocol': prot.attributes['scheme']})
-
-    finally:
-        prot.close()
+            deletion_dict['reason'] = str(error)
+            add_message('deletion-failed', deletion_dict)
+
+        else:
+            nb_errors += 1
+            logging.critical('%s Deletion CRITICAL of %s:%s as %s on %s: %s', prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name, str(error))
+            deletion_dict['reason'] = str(error)
+            add_message('deletion-failed', deletion_dict)
+
+    return deleted_files, nb_errors
+
+
+def delete_from_storage(replicas, prot, rse_info, staging_areas, prepend_str, limiter=None, bulk_size=100):
+    """
+    Physically delete replicas from a storage.
+
+    The replicas are split into batches, deleted with the bulk deletion of the protocol by parallel
+    workers, each one with its own connection. The number of workers running at the same time on
+    the storage hostname is bounded by the limiter.
+
+    :param replicas:       List of replicas with their PFN.
+    :param prot:           The protocol to use, used as template for the connections of the workers.
+    :param rse_info:       The RSE settings.
+    :param staging_areas:  List of the staging RSEs, for which no physical deletion is done.
+    :param prepend_str:    String to prepend to the log messages.
+    :param limiter:        HostDeletionLimiter of the hostname. If None, the replicas are deleted sequentially.
+    :param bulk_size:      Maximum number of files per bulk deletion.
+
+    :returns: List of the deleted files.
+    """
+    deleted_files = []
+    rse_name = rse_info['rse']
+
+    to_delete = []
+    for replica in replicas:
+        # For STAGING RSEs, no physical deletion
+        if rse_name in staging_areas:
+            logging.warning('%s Deletion STAGING of %s:%s as %s on %s, will only delete the catalog and not do physical deletion', prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name)
+            deleted_files.append({'scope': replica['scope'], 'name': replica['name']})
+        elif not replica['pfn']:
+            logging.warning('%s Deletion UNAVAILABLE of %s:%s as %s on %s', prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name)
+            deleted_files.append({'scope': replica['scope'], 'name': replica['name']})
+            add_message('deletion-done', __deletion_message(replica, rse_name, prot))
+        else:
+            to_delete.append(replica)
+
+    if not to_delete:
+        return deleted_files
+
+    if limiter is None:
+        limiter = HostDeletionLimiter(prot.attributes['hostname'], 1)
+    batch_size = max(1, min(bulk_size, int(ceil(len(to_delete) / limiter.limit))))
+    batches = Queue()
+    for batch in chunks(to_delete, batch_size):
+        batches.put(batch)
+    results = []
+
+    def worker(worker_prot):
+        """
+        Delete the batches of the queue with a dedicated connection.
+        """
+        connected = False
+        try:
+            while True:
+                try:
+                    batch = batches.get_nowait()
+                except Empty:
+                    break
+                limiter.acquire()
+                start = time.time()
+                try:
+                    if not connected:
+                        worker_prot.connect()
+                        connected = True
+                    batch_deleted, nb_errors = __delete_batch(batch, worker_prot, rse_info, prepend_str)
+                except (ServiceUnavailable, RSEAccessDenied, ResourceTemporaryUnavailable) as error:
+                    batch_deleted, nb_errors = [], len(batch)
+                    for replica in batch:
+                        logging.warning('%s Deletion NOACCESS of %s:%s as %s on %s: %s', prepend_str, replica['scope'], replica['name'], replica['pfn'], rse_name, str(error))
+                        deletion_dict = __deletion_message(replica, rse_name, worker_prot)
+                        deletion_dict['reason'] = str(error)
+                        add_message('deletion-failed', deletion_dict)
+                except Exception:
+                    batch_deleted, nb_errors = [], len(batch)
+                    logging.critical('%s %s', prepend_str, str(traceback.format_exc()))
+                finally:
+                    limiter.release()
+                limiter.report(nb_files=len(batch), nb_errors=nb_errors, duration=time.time() - start)
+                results.append(batch_deleted)
+        except Exception:
+            logging.critical('%s %s', prepend_str, str(traceback.format_exc()))
+        finally:
+            if connected:
+                worker_prot.close()
+
+    nb_workers = min(limiter.max_concurrency, batches.qsize())
+    workers = [threading.Thread(target=worker, args=(prot if not i else rsemgr.create_protocol(rse_info, 'delete', scheme=prot.attributes['scheme']),)) for i in range(nb_workers)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    for batch_deleted in results:
+        deleted_files.extend(batch_deleted)
     return deleted_files
 
 
@@ -161,21 +350,21 @@ def get_rses_to_hostname_mapping():
     :returns: Dictionary with RSE as key and (hostname, rse_info) as value
     """
 
-    result = REGION.get('rse_hostname_mapping')
-    if result is NO_VALUE:
-        result = {}
-        all_rses = list_rses()
-        for rse in all_rses:
-            rse_protocol = get_rse_protocols(rse['rse'])
-            for prot in rse_protocol['protocols']:
-                if prot['domains']['wan']['delete'] == 1:
-                    result[rse['rse']] = (prot['hostname'], rse_protocol)
-            if rse['rse'] not in result:
-                logging.warn('No default delete protocol for %s', rse['rse'])
-
-        REGION.set('rse_hostname_mapping', result)
-        return result
-
+    global HOSTNAME_MAPPING
+    snapshot = get_rse_snapshot()
+    if HOSTNAME_MAPPING[0] is snapshot:
+        return HOSTNAME_MAPPING[1]
+
+    result = {}
+    for rse in snapshot.list_rses():
+        rse_protocol = snapshot.get_rse_protocols(rse['id'])
+        for prot in rse_protocol['protocols']:
+            if prot['domains']['wan']['delete'] == 1:
+                result[rse['rse']] = (prot['hostname'], rse_protocol)
+        if rse['rse'] not in result:
+            logging.warn('No default delete protocol for %s', rse['rse'])
+
+    HOSTNAME_MAPPING = (snapshot, result)
     return result
 
 
@@ -285,6 +474,14 @@ def reaper(rses, chunk_size=100, once=False, greedy=False,
         max_deletion_thread = get('reaper', 'nb_workers_by_hostname')
     except ConfigNotFound as error:
         max_deletion_thread = 5
+    try:
+        max_deletions_by_hostname = int(get('reaper', 'max_deletions_by_hostname'))
+    except ConfigNotFound:
+        max_deletions_by_hostname = 10
+    try:
+        bulk_delete_size = int(get('reaper', 'bulk_delete_size'))
+    except ConfigNotFound:
+        bulk_delete_size = 50
     hostname = socket.getfqdn()
     executable = sys.argv[0]
     pid = os.getpid()
@@ -400,12 +597,17 @@ def reaper(rses, chunk_size=100, once=False, greedy=False,
                         # Refresh heartbeat
                         live(executable, hostname, pid, hb_thread, older_than=600, hash_executable=None, payload=rse_hostname_key, session=None)
                         del_start_time = time.time()
+                        try:
+                            pfns = prot.lfns2pfns([{'scope': replica['scope'], 'name': replica['name'], 'path': replica['path']} for replica in file_replicas])
+                        except Exception:
+                            # Resolve them one by one to isolate the failing replicas
+                            pfns = {}
                         for replica in file_replicas:
                             try:
-                                replica['pfn'] = str(rsemgr.lfns2pfns(rse_settings=rse_info,
-                                                                      lfns=[{'scope': replica['scope'], 'name': replica['name'], 'path': replica['path']}],
-                                                                      operation='delete', scheme=scheme).values()[0])
-                                time.sleep(random.uniform(0, 0.01))
+                                did_key = '%s:%s' % (replica['scope'], replica['name'])
+                                if did_key not in pfns:
+                                    pfns.update(prot.lfns2pfns({'scope': replica['scope'], 'name': replica['name'], 'path': replica['path']}))
+                                replica['pfn'] = str(pfns[did_key])
                             except (ReplicaUnAvailable, ReplicaNotFound) as error:
                                 logging.warning('%s Failed get pfn UNAVAILABLE replica %s:%s on %s with error %s', prepend_str, replica['scope'], replica['name'], rse_name, str(error))
                                 replica['pfn'] = None
@@ -413,7 +615,8 @@ def reaper(rses, chunk_size=100, once=False, greedy=False,
                             except Exception:
                                 logging.critical('%s %s', prepend_str, str(traceback.format_exc()))
 
-                        deleted_files = delete_from_storage(file_replicas, prot, rse_info, staging_areas, prepend_str)
+                        limiter = get_host_limiter(rse_hostname, max_deletions_by_hostname)
+                        deleted_files = delete_from_storage(file_replicas, prot, rse_info, staging_areas, prepend_str, limiter=limiter, bulk_size=bulk_delete_size)
                         logging.info('%s %i files processed in %s seconds', prepend_str, len(file_replicas), time.time() - del_start_time)
 
                         # Then finally delete the replicas
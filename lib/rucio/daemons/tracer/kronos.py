@@ -31,6 +31,7 @@ import logging
 import re
 import socket
 
+from collections import OrderedDict
 from datetime import datetime
 from json import loads as jloads, dumps as jdumps
 from os import getpid
@@ -39,7 +40,7 @@ try:
 except ImportError:
     from queue import Queue  # py3
 from sys import stdout
-from threading import Event, Thread, current_thread
+from threading import Event, Lock, Thread, current_thread
 from time import sleep, time
 from traceback import format_exc
 
@@ -47,12 +48,13 @@ from stomp import Connection
 
 from rucio.common.config import config_get, config_get_bool, config_get_int
 from rucio.common.exception import ConfigNotFound
+from rucio.common.utils import chunks
 from rucio.core.monitor import record_counter, record_timer
 from rucio.core.config import get
 from rucio.core.did import touch_dids, list_parent_dids
 from rucio.core.heartbeat import live, die, sanity_check
 from rucio.core.lock import touch_dataset_locks
-from rucio.core.replica import touch_replica, touch_collection_replicas, declare_bad_file_replicas
+from rucio.core.replica import touch_replica, touch_replicas, touch_collection_replicas, declare_bad_file_replicas
 from rucio.db.sqla.constants import DIDType, BadFilesStatus
 
 logging.getLogger("stomp").setLevel(logging.CRITICAL)
@@ -66,6 +68,58 @@ logging.basicConfig(stream=stdout,
 
 graceful_stop = Event()
 
+# Number of replicas touched by one bulk update
+TOUCH_CHUNKSIZE = int(config_get('tracer-kronos', 'touch_chunksize', raise_exception=False, default=100))
+# Maximum number of seconds a report is buffered before its chunk is processed
+FLUSH_INTERVAL = int(config_get('tracer-kronos', 'flush_interval', raise_exception=False, default=10))
+
+
+class ParentDatasetCache(object):
+    """
+    LRU cache of the parent datasets of the files, shared by the consumers.
+    """
+
+    def __init__(self, max_size, lifetime):
+        """
+        :param max_size:  Maximum number of files in the cache.
+        :param lifetime:  Number of seconds after which an entry is fetched again from the database.
+        """
+        self.__max_size = max_size
+        self.__lifetime = lifetime
+        self.__entries = OrderedDict()
+        self.__lock = Lock()
+
+    def get(self, scope, name):
+        """
+        Return the parent datasets of a file, excluding the panda _dis datasets.
+
+        :param scope:  The scope of the file.
+        :param name:   The name of the file.
+        :returns:      Tuple of (scope, name) of the datasets.
+        """
+        key = (scope, name)
+        now = time()
+        with self.__lock:
+            if key in self.__entries:
+                expires_at, datasets = self.__entries.pop(key)
+                if expires_at > now:
+                    self.__entries[key] = (expires_at, datasets)
+                    record_counter('daemons.tracer.kronos.parent_cache.hit')
+                    return datasets
+        record_counter('daemons.tracer.kronos.parent_cache.miss')
+        # do not update _dis datasets
+        datasets = tuple((did['scope'], did['name']) for did in list_parent_dids(scope, name)
+                         if did['type'] == DIDType.DATASET and not (did['scope'] == 'panda' and '_dis' in did['name']))
+        with self.__lock:
+            self.__entries[key] = (now + self.__lifetime, datasets)
+            while len(self.__entries) > self.__max_size:
+                self.__entries.popitem(last=False)
+        return datasets
+
+
+PARENT_DATASETS = ParentDatasetCache(max_size=int(config_get('tracer-kronos', 'parent_cache_size', raise_exception=False, default=100000)),
+                                     lifetime=int(config_get('tracer-kronos', 'parent_cache_lifetime', raise_exception=False, default=3600)))
+
 
 class AMQConsumer(object):
     def __init__(self, broker, conn, queue, chunksize, subscription_id, excluded_usrdns, dataset_queue, bad_files_patterns):
@@ -74,6 +128,8 @@ class AMQConsumer(object):
         self.__queue = queue
         self.__reports = []
         self.__ids = []
+        self.__first_report_time = None
+        self.__lock = Lock()
         self.__chunksize = chunksize
         self.__subscription_id = subscription_id
         # excluded states empty for the moment, maybe that should be recosidered in the future
@@ -113,29 +169,64 @@ class AMQConsumer(object):
             self.__conn.ack(msg_id, self.__subscription_id)
             return
 
-        self.__ids.append(msg_id)
-        self.__reports.append(report)
-
         try:
             logging.debug('(kronos_file) message received: %s %s %s' % (str(report['eventType']), report['filename'], report['remoteSite']))
         except Exception:
             pass
 
-        if len(self.__ids) >= self.__chunksize:
-            self.__update_atime()
-            for msg_id in self.__ids:
-                self.__conn.ack(msg_id, self.__subscription_id)
+        with self.__lock:
+            if not self.__ids:
+                self.__first_report_time = time()
+            self.__ids.append(msg_id)
+            self.__reports.append(report)
+
+            if len(self.__ids) >= self.__chunksize:
+                self.__flush()
 
-            self.__reports = []
-            self.__ids = []
+    def flush(self, older_than=0):
+        """
+        Process the buffered reports if the oldest one was received more than older_than seconds ago.
+
+        :param older_than:  Number of seconds.
+        """
+        with self.__lock:
+            if self.__ids and time() - self.__first_report_time >= older_than:
+                self.__flush()
+
+    def __flush(self):
+        """
+        Process and acknowledge the buffered reports. The lock must be held.
+        """
+        self.__update_atime()
+        for msg_id in self.__ids:
+            self.__conn.ack(msg_id, self.__subscription_id)
+
+        self.__reports = []
+        self.__ids = []
+
+    @staticmethod
+    def __coalesce(updates, key, update):
+        """
+        Keep only the most recent access of each key.
+
+        :param updates:  Dictionary of the updates to do.
+        :param key:      Key of the update.
+        :param update:   Dictionary with the accessed_at of the update.
+        """
+        if key not in updates or updates[key]['accessed_at'] < update['accessed_at']:
+            updates[key] = update
 
     def __update_atime(self):
         """
         Bulk update atime.
+
+        The reports are coalesced, so that every replica and every dataset is updated once per chunk
+        with its most recent access, and the replicas are touched with one bulk update per TOUCH_CHUNKSIZE replicas.
         """
-        replicas = []
-        rses = []
+        replicas = {}
+        datasets = {}
         for report in self.__reports:
+            rses = []
             try:
                 # Identify suspicious files
                 try:
@@ -213,7 +304,8 @@ class AMQConsumer(object):
 
                     rses = report['remoteSite'].strip().split(',')
                     for rse in rses:
-                        replicas.append({'name': report['filename'], 'scope': report['scope'], 'rse': rse, 'accessed_at': datetime.utcfromtimestamp(report['traceTimeentryUnix']),
+                        self.__coalesce(replicas, (report['scope'], report['filename'], rse),
+                                        {'name': report['filename'], 'scope': report['scope'], 'rse': rse, 'accessed_at': datetime.utcfromtimestamp(report['traceTimeentryUnix']),
                                          'traceTimeentryUnix': report['traceTimeentryUnix'], 'eventVersion': report['eventVersion']})
                 else:
                     # if touch event and if datasetScope is in the report then it means
@@ -223,45 +315,53 @@ class AMQConsumer(object):
                         rse = None
                         if 'remoteSite' in report:
                             rse = report['remoteSite']
-                        self.__dataset_queue.put({'scope': report['datasetScope'], 'name': report['dataset'], 'rse': rse, 'accessed_at': datetime.utcfromtimestamp(report['traceTimeentryUnix'])})
+                        self.__coalesce(datasets, (report['datasetScope'], report['dataset'], rse),
+                                        {'scope': report['datasetScope'], 'name': report['dataset'], 'rse': rse, 'accessed_at': datetime.utcfromtimestamp(report['traceTimeentryUnix'])})
                         continue
                     else:
                         if 'remoteSite' not in report:
                             continue
-                        replicas.append({'name': report['filename'], 'scope': report['scope'], 'rse': report['remoteSite'], 'accessed_at': datetime.utcfromtimestamp(report['traceTimeentryUnix'])})
+                        rses = [report['remoteSite']]
+                        self.__coalesce(replicas, (report['scope'], report['filename'], report['remoteSite']),
+                                        {'name': report['filename'], 'scope': report['scope'], 'rse': report['remoteSite'], 'accessed_at': datetime.utcfromtimestamp(report['traceTimeentryUnix']),
+                                         'traceTimeentryUnix': report['traceTimeentryUnix'], 'eventVersion': report.get('eventVersion')})
 
             except (KeyError, AttributeError):
                 logging.error(format_exc())
                 record_counter('daemons.tracer.kronos.report_error')
                 continue
 
-            for did in list_parent_dids(report['scope'], report['filename']):
-                if did['type'] != DIDType.DATASET:
-                    continue
-                # do not update _dis datasets
-                if did['scope'] == 'panda' and '_dis' in did['name']:
-                    continue
+            for scope, name in PARENT_DATASETS.get(report['scope'], report['filename']):
                 for rse in rses:
-                    self.__dataset_queue.put({'scope': did['scope'], 'name': did['name'], 'did_type': did['type'], 'rse': rse, 'accessed_at': datetime.utcfromtimestamp(report['traceTimeentryUnix'])})
+                    self.__coalesce(datasets, (scope, name, rse),
+                                    {'scope': scope, 'name': name, 'did_type': DIDType.DATASET, 'rse': rse, 'accessed_at': datetime.utcfromtimestamp(report['traceTimeentryUnix'])})
+
+        for dataset in datasets.values():
+            self.__dataset_queue.put(dataset)
 
+        replicas = list(replicas.values())
         logging.debug(replicas)
 
         try:
             start_time = time()
-            for replica in replicas:
-                # if touch replica hits a locked row put the trace back into queue for later retry
-                if not touch_replica(replica):
-                    resubmit = {'filename': replica['name'], 'scope': replica['scope'], 'remoteSite': replica['rse'], 'traceTimeentryUnix': replica['traceTimeentryUnix'],
-                                'eventType': 'get', 'usrdn': 'someuser', 'clientState': 'DONE', 'eventVersion': replica['eventVersion']}
-                    self.__conn.send(body=jdumps(resubmit), destination=self.__queue, headers={'appversion': 'rucio', 'resubmitted': '1'})
-                    record_counter('daemons.tracer.kronos.sent_resubmitted')
-                    logging.warning('(kronos_file) hit locked row, resubmitted to queue')
+            for chunk in chunks(replicas, TOUCH_CHUNKSIZE):
+                if touch_replicas(chunk):
+                    continue
+                # a row of the chunk is locked, touch the replicas one by one
+                for replica in chunk:
+                    # if touch replica hits a locked row put the trace back into queue for later retry
+                    if not touch_replica(replica):
+                        resubmit = {'filename': replica['name'], 'scope': replica['scope'], 'remoteSite': replica['rse'], 'traceTimeentryUnix': replica['traceTimeentryUnix'],
+                                    'eventType': 'get', 'usrdn': 'someuser', 'clientState': 'DONE', 'eventVersion': replica['eventVersion']}
+                        self.__conn.send(body=jdumps(resubmit), destination=self.__queue, headers={'appversion': 'rucio', 'resubmitted': '1'})
+                        record_counter('daemons.tracer.kronos.sent_resubmitted')
+                        logging.warning('(kronos_file) hit locked row, resubmitted to queue')
             record_timer('daemons.tracer.kronos.update_atime', (time() - start_time) * 1000)
         except Exception:
             logging.error(format_exc())
             record_counter('daemons.tracer.kronos.update_error')
 
-        logging.info('(kronos_file) updated %d replicas' % len(replicas))
+        logging.info('(kronos_file) updated %d replicas of %d reports' % (len(replicas), len(self.__reports)))
 
 
 def kronos_file(once=False, thread=0, brokers_resolved=None, dataset_queue=None, sleep_time=60):
@@ -304,7 +404,7 @@ def kronos_file(once=False, thread=0, brokers_resolved=None, dataset_queue=None,
     excluded_usrdns = set(config_get('tracer-kronos', 'excluded_usrdns').split(','))
     vhost = config_get('tracer-kronos', 'broker_virtual_host', raise_exception=False)
 
-    conns = []
+    conns, listeners = [], {}
     for broker in brokers_resolved:
         if not use_ssl:
             conns.append(Connection(host_and_ports=[(broker, config_get_int('tracer-kronos', 'port'))],
@@ -329,14 +429,16 @@ def kronos_file(once=False, thread=0, brokers_resolved=None, dataset_queue=None,
             if not conn.is_connected():
                 logging.info('(kronos_file) connecting to %s' % conn.transport._Transport__host_and_ports[0][0])
                 record_counter('daemons.tracer.kronos.reconnect.%s' % conn.transport._Transport__host_and_ports[0][0].split('.')[0])
-                conn.set_listener('rucio-tracer-kronos', AMQConsumer(broker=conn.transport._Transport__host_and_ports[0],
-                                                                     conn=conn,
-                                                                     queue=config_get('tracer-kronos', 'queue'),
-                                                                     chunksize=chunksize,
-                                                                     subscription_id=subscription_id,
-                                                                     excluded_usrdns=excluded_usrdns,
-                                                                     dataset_queue=dataset_queue,
-                                                                     bad_files_patterns=bad_files_patterns))
+                listener = AMQConsumer(broker=conn.transport._Transport__host_and_ports[0],
+                                       conn=conn,
+                                       queue=config_get('tracer-kronos', 'queue'),
+                                       chunksize=chunksize,
+                                       subscription_id=subscription_id,
+                                       excluded_usrdns=excluded_usrdns,
+                                       dataset_queue=dataset_queue,
+                                       bad_files_patterns=bad_files_patterns)
+                listeners[conn] = listener
+                conn.set_listener('rucio-tracer-kronos', listener)
                 conn.start()
                 if not use_ssl:
                     conn.connect(username, password)
@@ -346,10 +448,23 @@ def kronos_file(once=False, thread=0, brokers_resolved=None, dataset_queue=None,
         tottime = time() - start_time
         if tottime < sleep_time:
             logging.info('(kronos_file) Will sleep for %s seconds' % (sleep_time - tottime))
-            sleep(sleep_time - tottime)
+            # process the reports buffered for too long while sleeping
+            while not graceful_stop.is_set() and time() - start_time < sleep_time:
+                sleep(max(0, min(FLUSH_INTERVAL, sleep_time - (time() - start_time))))
+                for listener in listeners.values():
+                    try:
+                        listener.flush(older_than=FLUSH_INTERVAL)
+                    except Exception:
+                        logging.error(format_exc())
 
     logging.info('(kronos_file) graceful stop requested')
 
+    for listener in listeners.values():
+        try:
+            listener.flush()
+        except Exception:
+            logging.error(format_exc())
+
     for conn in conns:
         try:
             conn.disconnect()
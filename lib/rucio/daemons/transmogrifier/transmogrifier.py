@@ -63,6 +63,10 @@ logging.basicConfig(stream=stdout,
 
 graceful_stop = threading.Event()
 
+# Filter keys used to index the subscriptions, the scope is taken from the DID and the others from its metadata
+INDEXED_KEYS = ('scope', 'project', 'datatype', 'stream')
+REGEX_SPECIAL_CHARACTERS = re.compile(r'[.^$*+?{}\[\]\\|()]')
+
 
 def _retrial(func, *args, **kwargs):
     """
@@ -144,6 +148,133 @@ def is_matching_subscription(subscription, did, metadata):
     return True
 
 
+class SubscriptionMatcher(object):
+    """
+    Matcher of DIDs against a list of subscriptions.
+
+    The filters of the subscriptions are parsed and their regular expressions compiled once.
+    The subscriptions filtering on literal values of one of the INDEXED_KEYS are indexed by these values,
+    so that a DID is only checked against the subscriptions which can match it.
+    As the filters use re.match, a literal value matches any string starting with it,
+    so the index is looked up with all the prefixes of the value of the DID.
+    """
+
+    def __init__(self, subscriptions, prepend_str=''):
+        """
+        :param subscriptions: The subscription dictionaries, ordered by priority.
+        :param prepend_str: String to prepend to the log messages.
+        """
+        self.__subscriptions = []
+        self.__index = dict((key, {}) for key in INDEXED_KEYS)
+        self.__unindexed = []
+        for subscription in subscriptions:
+            try:
+                filter_string = loads(subscription['filter'])
+                checks = self.__compile(filter_string)
+            except (ValueError, re.error) as error:
+                logging.error(prepend_str + '%s : Subscription %s will be skipped' % (error, subscription['name']))
+                continue
+            position = len(self.__subscriptions)
+            self.__subscriptions.append((subscription, filter_string, checks))
+
+            for key in INDEXED_KEYS:
+                if key in filter_string:
+                    values = filter_string[key]
+                    if key != 'scope' and not isinstance(values, list):
+                        values = [values, ]
+                    values = [str(value) for value in values]
+                    if not any(REGEX_SPECIAL_CHARACTERS.search(value) for value in values):
+                        for value in values:
+                            self.__index[key].setdefault(value, set()).add(position)
+                        break
+            else:
+                self.__unindexed.append(position)
+
+    @staticmethod
+    def __compile(filter_string):
+        """
+        Compile the regular expressions of a subscription filter.
+
+        :param filter_string: The parsed filter of the subscription.
+        :returns: List of (key, compiled patterns) to check.
+        """
+        checks = []
+        for key in filter_string:
+            values = filter_string[key]
+            if key in ('pattern', 'excluded_pattern'):
+                checks.append((key, re.compile(values)))
+            elif key == 'split_rule':
+                pass
+            elif key == 'scope':
+                checks.append((key, [re.compile(scope) for scope in values]))
+            else:
+                if not isinstance(values, list):
+                    values = [values, ]
+                checks.append((str(key), [re.compile(str(value)) for value in values]))
+        return checks
+
+    @staticmethod
+    def __check(checks, did, metadata):
+        """
+        Check a DID against the compiled filter of a subscription.
+
+        :param checks: The compiled filter.
+        :param did: The DID dictionary.
+        :param metadata: The metadata dictionary of the DID, with string keys.
+        :returns: True/False
+        """
+        for key, patterns in checks:
+            if key == 'pattern':
+                if not patterns.match(did['name']):
+                    return False
+            elif key == 'excluded_pattern':
+                if patterns.match(did['name']):
+                    return False
+            elif key == 'scope':
+                if not any(pattern.match(did['scope']) for pattern in patterns):
+                    return False
+            else:
+                if key not in metadata:
+                    return False
+                value = str(metadata[key])
+                if not any(pattern.match(value) for pattern in patterns):
+                    return False
+        return True
+
+    def match(self, did, metadata):
+        """
+        Get the subscriptions matching a DID.
+
+        :param did: The DID dictionary.
+        :param metadata: The metadata dictionary of the DID.
+        :returns: List of (subscription, parsed filter) in the order of the subscriptions.
+        """
+        if metadata['hidden']:
+            return []
+        metadata = dict((str(key), value) for key, value in metadata.items())
+
+        candidates = set(self.__unindexed)
+        for key in INDEXED_KEYS:
+            index = self.__index[key]
+            if not index:
+                continue
+            if key == 'scope':
+                value = did['scope']
+            elif key in metadata:
+                value = str(metadata[key])
+            else:
+                continue
+            for length in range(len(value) + 1):
+                candidates.update(index.get(value[:length], ()))
+
+        matching = []
+        for position in sorted(candidates):
+            subscription, filter_string, checks = self.__subscriptions[position]
+            if self.__check(checks, did, metadata):
+                matching.append((subscription, filter_string))
+        return matching
+
+
 def transmogrifier(bulk=5, once=False, sleep_time=60):
     """
     Creates a Transmogrifier Worker that gets a list of new DIDs for a given hash,
@@ -205,6 +336,7 @@ def transmogrifier(bulk=5, once=False, sleep_time=60):
             results = {}
             start_time = time.time()
             blacklisted_rse_id = [rse['id'] for rse in list_rses({'availability_write': False})]
+            matcher = SubscriptionMatcher(subscriptions, prepend_str=prepend_str)
             logging.debug(prepend_str + 'In transmogrifier worker')
             identifiers = []
             #  Loop over all the new dids
@@ -214,140 +346,137 @@ def transmogrifier(bulk=5, once=False, sleep_time=60):
                     results['%s:%s' % (did['scope'], did['name'])] = []
                     try:
                         metadata = get_metadata(did['scope'], did['name'])
-                        # Loop over all the subscriptions
-                        for subscription in subscriptions:
-                            #  Check if the DID match the subscription
-                            if is_matching_subscription(subscription, did, metadata) is True:
-                                filter_string = loads(subscription['filter'])
-                                split_rule = filter_string.get('split_rule', False)
-                                if split_rule == 'true':
-                                    split_rule = True
-                                elif split_rule == 'false':
-                                    split_rule = False
-                                stime = time.time()
-                                results['%s:%s' % (did['scope'], did['name'])].append(subscription['id'])
-                                logging.info(prepend_str + '%s:%s matches subscription %s' % (did['scope'], did['name'], subscription['name']))
-                                for rule_string in loads(subscription['replication_rules']):
-                                    # Get all the rule and subscription parameters
-                                    grouping = rule_string.get('grouping', 'DATASET')
-                                    lifetime = rule_string.get('lifetime', None)
-                                    ignore_availability = rule_string.get('ignore_availability', None)
-                                    weight = rule_string.get('weight', None)
-                                    source_replica_expression = rule_string.get('source_replica_expression', None)
-                                    locked = rule_string.get('locked', None)
-                                    if locked == 'True':
-                                        locked = True
-                                    else:
-                                        locked = False
-                                    purge_replicas = rule_string.get('purge_replicas', False)
-                                    if purge_replicas == 'True':
-                                        purge_replicas = True
-                                    else:
-                                        purge_replicas = False
-                                    rse_expression = str(rule_string['rse_expression'])
-                                    comment = str(subscription['comments'])
-                                    subscription_id = str(subscription['id'])
-                                    account = subscription['account']
-                                    copies = int(rule_string['copies'])
-                                    activity = rule_string.get('activity', 'User Subscriptions')
+                        # Loop over the subscriptions matching the DID
+                        for subscription, filter_string in matcher.match(did, metadata):
+                            split_rule = filter_string.get('split_rule', False)
+                            if split_rule == 'true':
+                                split_rule = True
+                            elif split_rule == 'false':
+                                split_rule = False
+                            stime = time.time()
+                            results['%s:%s' % (did['scope'], did['name'])].append(subscription['id'])
+                            logging.info(prepend_str + '%s:%s matches subscription %s' % (did['scope'], did['name'], subscription['name']))
+                            for rule_string in loads(subscription['replication_rules']):
+                                # Get all the rule and subscription parameters
+                                grouping = rule_string.get('grouping', 'DATASET')
+                                lifetime = rule_string.get('lifetime', None)
+                                ignore_availability = rule_string.get('ignore_availability', None)
+                                weight = rule_string.get('weight', None)
+                                source_replica_expression = rule_string.get('source_replica_expression', None)
+                                locked = rule_string.get('locked', None)
+                                if locked == 'True':
+                                    locked = True
+                                else:
+                                    locked = False
+                                purge_replicas = rule_string.get('purge_replicas', False)
+                                if purge_replicas == 'True':
+                                    purge_replicas = True
+                                else:
+                                    purge_replicas = False
+                                rse_expression = str(rule_string['rse_expression'])
+                                comment = str(subscription['comments'])
+                                subscription_id = str(subscription['id'])
+                                account = subscription['account']
+                                copies = int(rule_string['copies'])
+                                activity = rule_string.get('activity', 'User Subscriptions')
+                                try:
+                                    validate_schema(name='activity', obj=activity)
+                                except InputValidationError as error:
+                                    logging.error(prepend_str + 'Error validating the activity %s' % (str(error)))
+                                    activity = 'User Subscriptions'
+                                if lifetime:
+                                    lifetime = int(lifetime)
+
+                                str_activity = "".join(activity.split())
+                                success = False
+                                nattempt = 5
+                                attemptnr = 0
+                                skip_rule_creation = False
+
+                                if split_rule:
+                                    rses = parse_expression(rse_expression)
+                                    list_of_rses = [rse['rse'] for rse in rses]
+                                    # Check that some rule doesn't already exist for this DID and subscription
+                                    preferred_rse_ids = []
+                                    for rule in list_rules(filters={'subscription_id': subscription_id, 'scope': did['scope'], 'name': did['name']}):
+                                        already_existing_rses = [(rse['rse'], rse['id']) for rse in parse_expression(rule['rse_expression'])]
+                                        for rse, rse_id in already_existing_rses:
+                                            if (rse in list_of_rses) and (rse_id not in preferred_rse_ids):
+                                                preferred_rse_ids.append(rse_id)
+                                    if len(preferred_rse_ids) >= copies:
+                                        skip_rule_creation = True
+
+                                    rse_id_dict = {}
+                                    for rse in rses:
+                                        rse_id_dict[rse['id']] = rse['rse']
                                     try:
-                                        validate_schema(name='activity', obj=activity)
-                                    except InputValidationError as error:
-                                        logging.error(prepend_str + 'Error validating the activity %s' % (str(error)))
-                                        activity = 'User Subscriptions'
-                                    if lifetime:
-                                        lifetime = int(lifetime)
-
-                                    str_activity = "".join(activity.split())
-                                    success = False
-                                    nattempt = 5
-                                    attemptnr = 0
-                                    skip_rule_creation = False
-
-                                    if split_rule:
-                                        rses = parse_expression(rse_expression)
-                                        list_of_rses = [rse['rse'] for rse in rses]
-                                        # Check that some rule doesn't already exist for this DID and subscription
-                                        preferred_rse_ids = []
-                                        for rule in list_rules(filters={'subscription_id': subscription_id, 'scope': did['scope'], 'name': did['name']}):
-                                            already_existing_rses = [(rse['rse'], rse['id']) for rse in parse_expression(rule['rse_expression'])]
-                                            for rse, rse_id in already_existing_rses:
-                                                if (rse in list_of_rses) and (rse_id not in preferred_rse_ids):
-                                                    preferred_rse_ids.append(rse_id)
-                                        if len(preferred_rse_ids) >= copies:
-                                            skip_rule_creation = True
-
-                                        rse_id_dict = {}
-                                        for rse in rses:
-                                            rse_id_dict[rse['id']] = rse['rse']
+                                        rseselector = RSESelector(account=account, rses=rses, weight=weight, copies=copies - len(preferred_rse_ids))
+                                        selected_rses = [rse_id_dict[rse_id] for rse_id, _, _ in rseselector.select_rse(0, preferred_rse_ids=preferred_rse_ids, copies=copies, blacklist=blacklisted_rse_id)]
+                                    except (InsufficientTargetRSEs, InsufficientAccountLimit, InvalidRuleWeight, RSEOverQuota) as error:
+                                        logging.warning(prepend_str + 'Problem getting RSEs for subscription "%s" for account %s : %s. Try including blacklisted sites' %
+                                                        (subscription['name'], account, str(error)))
+                                        # Now including the blacklisted sites
                                         try:
                                             rseselector = RSESelector(account=account, rses=rses, weight=weight, copies=copies - len(preferred_rse_ids))
-                                            selected_rses = [rse_id_dict[rse_id] for rse_id, _, _ in rseselector.select_rse(0, preferred_rse_ids=preferred_rse_ids, copies=copies, blacklist=blacklisted_rse_id)]
+                                            selected_rses = [rse_id_dict[rse_id] for rse_id, _, _ in rseselector.select_rse(0, preferred_rse_ids=preferred_rse_ids, copies=copies, blacklist=[])]
+                                            ignore_availability = True
                                         except (InsufficientTargetRSEs, InsufficientAccountLimit, InvalidRuleWeight, RSEOverQuota) as error:
-                                            logging.warning(prepend_str + 'Problem getting RSEs for subscription "%s" for account %s : %s. Try including blacklisted sites' %
-                                                            (subscription['name'], account, str(error)))
-                                            # Now including the blacklisted sites
-                                            try:
-                                                rseselector = RSESelector(account=account, rses=rses, weight=weight, copies=copies - len(preferred_rse_ids))
-                                                selected_rses = [rse_id_dict[rse_id] for rse_id, _, _ in rseselector.select_rse(0, preferred_rse_ids=preferred_rse_ids, copies=copies, blacklist=[])]
-                                                ignore_availability = True
-                                            except (InsufficientTargetRSEs, InsufficientAccountLimit, InvalidRuleWeight, RSEOverQuota) as error:
-                                                logging.error(prepend_str + 'Problem getting RSEs for subscription "%s" for account %s : %s. Skipping rule creation.' %
-                                                              (subscription['name'], account, str(error)))
-                                                monitor.record_counter(counters='transmogrifier.addnewrule.errortype.%s' % (str(error.__class__.__name__)), delta=1)
-                                                # The DID won't be reevaluated at the next cycle
-                                                did_success = did_success and True
-                                                continue
-
-                                    for attempt in range(0, nattempt):
-                                        attemptnr = attempt
-                                        nb_rule = 0
-                                        #  Try to create the rule
-                                        try:
-                                            if split_rule:
-                                                if not skip_rule_creation:
-                                                    for rse in selected_rses:
-                                                        logging.info(prepend_str + 'Will insert one rule for %s:%s on %s' % (did['scope'], did['name'], rse))
-                                                        add_rule(dids=[{'scope': did['scope'], 'name': did['name']}], account=account, copies=1,
-                                                                 rse_expression=rse, grouping=grouping, weight=weight, lifetime=lifetime, locked=locked,
-                                                                 subscription_id=subscription_id, source_replica_expression=source_replica_expression, activity=activity,
-                                                                 purge_replicas=purge_replicas, ignore_availability=ignore_availability, comment=comment)
-
-                                                        nb_rule += 1
-                                                        if nb_rule == copies:
-                                                            success = True
-                                                            break
-                                            else:
-                                                add_rule(dids=[{'scope': did['scope'], 'name': did['name']}], account=account, copies=copies,
-                                                         rse_expression=rse_expression, grouping=grouping, weight=weight, lifetime=lifetime, locked=locked,
-                                                         subscription_id=subscription['id'], source_replica_expression=source_replica_expression, activity=activity,
-                                                         purge_replicas=purge_replicas, ignore_availability=ignore_availability, comment=comment)
-                                                nb_rule += 1
-                                            monitor.record_counter(counters='transmogrifier.addnewrule.done', delta=nb_rule)
-                                            monitor.record_counter(counters='transmogrifier.addnewrule.activity.%s' % str_activity, delta=nb_rule)
-                                            success = True
-                                            break
-                                        except (InvalidReplicationRule, InvalidRuleWeight, InvalidRSEExpression, StagingAreaRuleRequiresLifetime, DuplicateRule) as error:
-                                            # Errors that won't be retried
-                                            success = True
-                                            logging.error(prepend_str + '%s' % (str(error)))
-                                            monitor.record_counter(counters='transmogrifier.addnewrule.errortype.%s' % (str(error.__class__.__name__)), delta=1)
-                                            break
-                                        except (ReplicationRuleCreationTemporaryFailed, InsufficientTargetRSEs, InsufficientAccountLimit, DatabaseException, RSEBlacklisted) as error:
-                                            # Errors to be retried
-                                            logging.error(prepend_str + '%s Will perform an other attempt %i/%i' % (str(error), attempt + 1, nattempt))
+                                            logging.error(prepend_str + 'Problem getting RSEs for subscription "%s" for account %s : %s. Skipping rule creation.' %
+                                                          (subscription['name'], account, str(error)))
                                             monitor.record_counter(counters='transmogrifier.addnewrule.errortype.%s' % (str(error.__class__.__name__)), delta=1)
-                                        except Exception as error:
-                                            # Unexpected errors
-                                            monitor.record_counter(counters='transmogrifier.addnewrule.errortype.unknown', delta=1)
-                                            exc_type, exc_value, exc_traceback = exc_info()
-                                            logging.critical(prepend_str + ''.join(format_exception(exc_type, exc_value, exc_traceback)).strip())
-
-                                    did_success = (did_success and success)
-                                    if (attemptnr + 1) == nattempt and not success:
-                                        logging.error(prepend_str + 'Rule for %s:%s on %s cannot be inserted' % (did['scope'], did['name'], rse_expression))
-                                    else:
-                                        logging.info(prepend_str + '%s rule(s) inserted in %f seconds' % (str(nb_rule), time.time() - stime))
+                                            # The DID won't be reevaluated at the next cycle
+                                            did_success = did_success and True
+                                            continue
+
+                                for attempt in range(0, nattempt):
+                                    attemptnr = attempt
+                                    nb_rule = 0
+                                    #  Try to create the rule
+                                    try:
+                                        if split_rule:
+                                            if not skip_rule_creation:
+                                                for rse in selected_rses:
+                                                    logging.info(prepend_str + 'Will insert one rule for %s:%s on %s' % (did['scope'], did['name'], rse))
+                                                    add_rule(dids=[{'scope': did['scope'], 'name': did['name']}], account=account, copies=1,
+                                                             rse_expression=rse, grouping=grouping, weight=weight, lifetime=lifetime, locked=locked,
+                                                             subscription_id=subscription_id, source_replica_expression=source_replica_expression, activity=activity,
+                                                             purge_replicas=purge_replicas, ignore_availability=ignore_availability, comment=comment)
+
+                                                    nb_rule += 1
+                                                    if nb_rule == copies:
+                                                        success = True
+                                                        break
+                                        else:
+                                            add_rule(dids=[{'scope': did['scope'], 'name': did['name']}], account=account, copies=copies,
+                                                     rse_expression=rse_expression, grouping=grouping, weight=weight, lifetime=lifetime, locked=locked,
+                                                     subscription_id=subscription['id'], source_replica_expression=source_replica_expression, activity=activity,
+                                                     purge_replicas=purge_replicas, ignore_availability=ignore_availability, comment=comment)
+                                            nb_rule += 1
+                                        monitor.record_counter(counters='transmogrifier.addnewrule.done', delta=nb_rule)
+                                        monitor.record_counter(counters='transmogrifier.addnewrule.activity.%s' % str_activity, delta=nb_rule)
+                                        success = True
+                                        break
+                                    except (InvalidReplicationRule, InvalidRuleWeight, InvalidRSEExpression, StagingAreaRuleRequiresLifetime, DuplicateRule) as error:
+                                        # Errors that won't be retried
+                                        success = True
+                                        logging.error(prepend_str + '%s' % (str(error)))
+                                        monitor.record_counter(counters='transmogrifier.addnewrule.errortype.%s' % (str(error.__class__.__name__)), delta=1)
+                                        break
+                                    except (ReplicationRuleCreationTemporaryFailed, InsufficientTargetRSEs, InsufficientAccountLimit, DatabaseException, RSEBlacklisted) as error:
+                                        # Errors to be retried
+                                        logging.error(prepend_str + '%s Will perform an other attempt %i/%i' % (str(error), attempt + 1, nattempt))
+                                        monitor.record_counter(counters='transmogrifier.addnewrule.errortype.%s' % (str(error.__class__.__name__)), delta=1)
+                                    except Exception as error:
+                                        # Unexpected errors
+                                        monitor.record_counter(counters='transmogrifier.addnewrule.errortype.unknown', delta=1)
+                                        exc_type, exc_value, exc_traceback = exc_info()
+                                        logging.critical(prepend_str + ''.join(format_exception(exc_type, exc_value, exc_traceback)).strip())
+
+                                did_success = (did_success and success)
+                                if (attemptnr + 1) == nattempt and not success:
+                                    logging.error(prepend_str + 'Rule for %s:%s on %s cannot be inserted' % (did['scope'], did['name'], rse_expression))
+                                else:
+                                    logging.info(prepend_str + '%s rule(s) inserted in %f seconds' % (str(nb_rule), time.time() - stime))
                     except DataIdentifierNotFound as error:
                         logging.warning(prepend_str + error)
 
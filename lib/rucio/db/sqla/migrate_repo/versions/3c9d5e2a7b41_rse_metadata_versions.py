@@ -0,0 +1,53 @@
+# Copyright 2013-2019 CERN for the benefit of the ATLAS collaboration.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+''' added rse_metadata_versions table '''
+
+import datetime
+
+import sqlalchemy as sa
+
+from alembic import context
+from alembic.op import create_primary_key, create_table, drop_table
+
+
+# Alembic revision identifiers
+revision = '3c9d5e2a7b41'
+down_revision = '7d4a2c8e1f63'
+
+
+def upgrade():
+    '''
+    Upgrade the database to this revision
+    '''
+
+    if context.get_context().dialect.name in ['oracle', 'mysql', 'postgresql']:
+        schema = context.get_context().version_table_schema if context.get_context().version_table_schema else ''
+        create_table('rse_metadata_versions',
+                     sa.Column('name', sa.String(64)),
+                     sa.Column('version', sa.BigInteger()),
+                     sa.Column('created_at', sa.DateTime, default=datetime.datetime.utcnow),
+                     sa.Column('updated_at', sa.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow),
+                     schema=schema)
+        create_primary_key('RSE_METADATA_VERSIONS_PK', 'rse_metadata_versions', ['name'], schema=schema)
+
+
+def downgrade():
+    '''
+    Downgrade the database to the previous revision
+    '''
+
+    if context.get_context().dialect.name in ['oracle', 'mysql', 'postgresql']:
+        schema = context.get_context().version_table_schema if context.get_context().version_table_schema else ''
+        drop_table('rse_metadata_versions', schema=schema)
@@ -0,0 +1,85 @@
+# Copyright 2013-2019 CERN for the benefit of the ATLAS collaboration.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+''' added work_leases table and work buckets of messages and updated_dids '''
+
+import datetime
+
+import sqlalchemy as sa
+
+from alembic import context
+from alembic.op import (add_column, create_index, create_primary_key, create_table,
+                        drop_column, drop_index, drop_table, execute)
+
+
+# Alembic revision identifiers
+revision = '7d4a2c8e1f63'
+down_revision = 'f502b465d159'
+
+# Must be the same as rucio.common.utils.WORK_BUCKETS
+WORK_BUCKETS = 1024
+
+
+def upgrade():
+    '''
+    Upgrade the database to this revision
+    '''
+
+    if context.get_context().dialect.name in ['oracle', 'mysql', 'postgresql']:
+        schema = context.get_context().version_table_schema if context.get_context().version_table_schema else ''
+        prefix = schema + '.' if schema else ''
+
+        create_table('work_leases',
+                     sa.Column('executable', sa.String(64)),
+                     sa.Column('bucket', sa.Integer(), autoincrement=False),
+                     sa.Column('hostname', sa.String(128)),
+                     sa.Column('pid', sa.Integer(), autoincrement=False),
+                     sa.Column('thread_id', sa.BigInteger(), autoincrement=False),
+                     sa.Column('expires_at', sa.DateTime),
+                     sa.Column('created_at', sa.DateTime, default=datetime.datetime.utcnow),
+                     sa.Column('updated_at', sa.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow),
+                     schema=schema)
+        create_primary_key('WORK_LEASES_PK', 'work_leases', ['executable', 'bucket'], schema=schema)
+        create_index('WORK_LEASES_OWNER_IDX', 'work_leases', ['executable', 'hostname', 'pid', 'thread_id'], schema=schema)
+
+        add_column('messages', sa.Column('bucket', sa.Integer), schema=schema)
+        add_column('updated_dids', sa.Column('bucket', sa.Integer), schema=schema)
+
+        # The bucket of the updated dids is the one computed by rucio.common.utils.work_bucket on their name
+        if context.get_context().dialect.name == 'oracle':
+            execute("UPDATE %smessages SET bucket = ORA_HASH(id, %s)" % (prefix, WORK_BUCKETS - 1))  # pylint: disable=no-member
+            execute("UPDATE %supdated_dids SET bucket = MOD(TO_NUMBER(SUBSTR(LOWER(RAWTOHEX(STANDARD_HASH(name, 'MD5'))), 1, 8), 'xxxxxxxx'), %s)" % (prefix, WORK_BUCKETS))  # pylint: disable=no-member
+        elif context.get_context().dialect.name == 'mysql':
+            execute("UPDATE %smessages SET bucket = MOD(CONV(SUBSTR(MD5(id), 1, 8), 16, 10), %s)" % (prefix, WORK_BUCKETS))  # pylint: disable=no-member
+            execute("UPDATE %supdated_dids SET bucket = MOD(CONV(SUBSTR(MD5(name), 1, 8), 16, 10), %s)" % (prefix, WORK_BUCKETS))  # pylint: disable=no-member
+        elif context.get_context().dialect.name == 'postgresql':
+            execute("UPDATE %smessages SET bucket = MOD(('x' || SUBSTR(MD5(id::text), 1, 8))::bit(32)::bigint, %s)" % (prefix, WORK_BUCKETS))  # pylint: disable=no-member
+            execute("UPDATE %supdated_dids SET bucket = MOD(('x' || SUBSTR(MD5(name), 1, 8))::bit(32)::bigint, %s)" % (prefix, WORK_BUCKETS))  # pylint: disable=no-member
+
+        create_index('MESSAGES_BUCKET_IDX', 'messages', ['bucket', 'created_at'], schema=schema)
+        create_index('UPDATED_DIDS_BUCKET_IDX', 'updated_dids', ['bucket', 'created_at'], schema=schema)
+
+
+def downgrade():
+    '''
+    Downgrade the database to the previous revision
+    '''
+
+    if context.get_context().dialect.name in ['oracle', 'mysql', 'postgresql']:
+        schema = context.get_context().version_table_schema if context.get_context().version_table_schema else ''
+        drop_index('MESSAGES_BUCKET_IDX', 'messages', schema=schema)
+        drop_index('UPDATED_DIDS_BUCKET_IDX', 'updated_dids', schema=schema)
+        drop_column('messages', 'bucket', schema=schema)
+        drop_column('updated_dids', 'bucket', schema=schema)
+        drop_table('work_leases', schema=schema)
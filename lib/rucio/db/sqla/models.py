@@ -25,6 +25,7 @@
 # PY3K COMPATIBLE
 
 import datetime
+import random
 import uuid
 
 from six import iteritems
@@ -452,10 +453,12 @@ class UpdatedDID(BASE, ModelBase):
     scope = Column(String(SCOPE_LENGTH))
     name = Column(String(NAME_LENGTH))
     rule_evaluation_action = Column(DIDReEvaluation.db_type(name='UPDATED_DIDS_RULE_EVAL_ACT_CHK'))
+    bucket = Column(Integer, default=lambda context: utils.work_bucket(context.current_parameters['name']))
     _table_args = (PrimaryKeyConstraint('id', name='UPDATED_DIDS_PK'),
                    CheckConstraint('SCOPE IS NOT NULL', name='UPDATED_DIDS_SCOPE_NN'),
                    CheckConstraint('NAME IS NOT NULL', name='UPDATED_DIDS_NAME_NN'),
-                   Index('UPDATED_DIDS_SCOPERULENAME_IDX', 'scope', 'rule_evaluation_action', 'name'))
+                   Index('UPDATED_DIDS_SCOPERULENAME_IDX', 'scope', 'rule_evaluation_action', 'name'),
+                   Index('UPDATED_DIDS_BUCKET_IDX', 'bucket', 'created_at'))
 
 
 class BadReplicas(BASE, ModelBase):
@@ -807,6 +810,8 @@ class UpdatedCollectionReplica(BASE, ModelBase):
     name = Column(String(NAME_LENGTH))
     did_type = Column(DIDType.db_type(name='UPDATED_COL_REP_TYPE_CHK'))
     rse_id = Column(GUID())
+    available_replicas_delta = Column(BigInteger)  # if set with the deltas, only the changes of the file replicas states are applied
+    available_bytes_delta = Column(BigInteger)
     _table_args = (PrimaryKeyConstraint('id', name='UPDATED_COL_REP_PK'),
                    CheckConstraint('SCOPE IS NOT NULL', name='UPDATED_COL_REP_SCOPE_NN'),
                    CheckConstraint('NAME IS NOT NULL', name='UPDATED_COL_REP_NAME_NN'),
@@ -1154,9 +1159,11 @@ class Message(BASE, ModelBase):
     event_type = Column(String(1024))
     payload = Column(String(4000))
     payload_nolimit = Column(Text)
+    bucket = Column(Integer, default=lambda: random.randint(0, utils.WORK_BUCKETS - 1))
     _table_args = (PrimaryKeyConstraint('id', name='MESSAGES_ID_PK'),
                    CheckConstraint('EVENT_TYPE IS NOT NULL', name='MESSAGES_EVENT_TYPE_NN'),
-                   CheckConstraint('PAYLOAD IS NOT NULL', name='MESSAGES_PAYLOAD_NN'),)
+                   CheckConstraint('PAYLOAD IS NOT NULL', name='MESSAGES_PAYLOAD_NN'),
+                   Index('MESSAGES_BUCKET_IDX', 'bucket', 'created_at'))
 
 
 class MessageHistory(BASE, ModelBase):
@@ -1200,6 +1207,27 @@ class Heartbeats(BASE, ModelBase):
     _table_args = (PrimaryKeyConstraint('executable', 'hostname', 'pid', 'thread_id', name='HEARTBEATS_PK'), )
 
 
+class WorkLease(BASE, ModelBase):
+    """Represents the leases of the work buckets of the daemons"""
+    __tablename__ = 'work_leases'
+    executable = Column(String(64))  # SHA-2
+    bucket = Column(Integer, autoincrement=False)
+    hostname = Column(String(128))
+    pid = Column(Integer, autoincrement=False)
+    thread_id = Column(BigInteger, autoincrement=False)
+    expires_at = Column(DateTime)
+    _table_args = (PrimaryKeyConstraint('executable', 'bucket', name='WORK_LEASES_PK'),
+                   Index('WORK_LEASES_OWNER_IDX', 'executable', 'hostname', 'pid', 'thread_id'))
+
+
+class RSEMetadataVersion(BASE, ModelBase):
+    """Represents the change counters of the RSE metadata tables"""
+    __tablename__ = 'rse_metadata_versions'
+    name = Column(String(64))
+    version = Column(BigInteger, default=0)
+    _table_args = (PrimaryKeyConstraint('name', name='RSE_METADATA_VERSIONS_PK'), )
+
+
 class NamingConvention(BASE, ModelBase):
     """Represents naming conventions for name within a scope"""
     __tablename__ = 'naming_conventions'
@@ -1301,6 +1329,8 @@ def register_models(engine):
               Token,
               UpdatedAccountCounter,
               UpdatedDID,
+              WorkLease,
+              RSEMetadataVersion,
               UpdatedRSECounter,
               UpdatedCollectionReplica)
 
@@ -1357,6 +1387,8 @@ def unregister_models(engine):
               TemporaryDataIdentifier,
               UpdatedAccountCounter,
               UpdatedDID,
+              WorkLease,
+              RSEMetadataVersion,
               UpdatedRSECounter,
               UpdatedCollectionReplica)
 
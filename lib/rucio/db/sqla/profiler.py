@@ -0,0 +1,307 @@
+# Copyright 2019 CERN for the benefit of the ATLAS collaboration.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# PY3K COMPATIBLE
+
+"""
+Request-scoped profiling of the SQL statements.
+
+Enabled with [database] profile = True, the profiler of the process being rucio.db.sqla.session.PROFILER.
+It listens to the cursor execute events of the engine and attributes the time, the number of affected rows and the number of fetched rows of each statement
+to the innermost read_session/transactional_session/stream_session function and to the REST endpoint
+which issued it. The statements are grouped by fingerprint, i.e. their text without the literals and
+with the IN lists collapsed: the slowest fingerprints are kept with a sample of their bind parameters,
+and a fingerprint executed more than [database] profile_n_plus_one times within one REST request, or
+within one outermost session function for the daemons, is reported as a N+1 pattern.
+
+The summaries of the requests are sent to the monitor module and the whole profile is returned by
+the /sql_profile REST endpoint.
+"""
+
+import hashlib
+import re
+import threading
+import time
+
+from functools import wraps
+from inspect import isgeneratorfunction
+
+from sqlalchemy import event
+
+from rucio.core.monitor import record_counter, record_timer
+
+
+_LITERALS = [(re.compile(r"'(?:[^']|'')*'"), '?'),
+             (re.compile(r'\b0x[0-9a-fA-F]+\b|\b\d+(?:\.\d+)?\b'), '?'),
+             (re.compile(r'%\(\w+\)s|:\w+|%s'), '?'),
+             (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(?...)'),
+             (re.compile(r'\s+'), ' ')]
+
+
+def fingerprint(statement):
+    """
+    Return the fingerprint of a SQL statement: its text without the literals and the bind parameters,
+    and with the IN lists collapsed, so that the executions of the same query share it.
+
+    :param statement: The SQL statement as a string.
+    :returns: The fingerprint as a string.
+    """
+    for pattern, replacement in _LITERALS:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+class _CountingCursor(object):
+    """ DBAPI cursor proxy counting the fetched rows of a statement. """
+
+    def __init__(self, cursor, profiler, keys):
+        self.__cursor = cursor
+        self.__profiler = profiler
+        self.__keys = keys
+
+    def fetchone(self):
+        row = self.__cursor.fetchone()
+        if row is not None:
+            self.__profiler.add_fetched(self.__keys, 1)
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self.__cursor.fetchmany(*args, **kwargs)
+        self.__profiler.add_fetched(self.__keys, len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self.__cursor.fetchall()
+        self.__profiler.add_fetched(self.__keys, len(rows))
+        return rows
+
+    def __iter__(self):
+        for row in self.__cursor:
+            self.__profiler.add_fetched(self.__keys, 1)
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self.__cursor, name)
+
+
+class SQLProfiler(object):
+    """
+    Aggregation of the statistics of the SQL statements by session function, REST endpoint and fingerprint.
+    """
+
+    def __init__(self, top_n=20, n_plus_one=10, send_metrics=True):
+        """
+        :param top_n: Number of slowest fingerprints to keep.
+        :param n_plus_one: Number of executions of a fingerprint within a request above which it is a N+1 pattern.
+        :param send_metrics: Send the summaries of the requests to the monitor module.
+        """
+        self.top_n = top_n
+        self.n_plus_one = n_plus_one
+        self.send_metrics = send_metrics
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.reset()
+
+    def reset(self):
+        """ Clear the statistics. """
+        with self.__lock:
+            self.__functions = {}
+            self.__endpoints = {}
+            self.__statements = {}
+            self.__n_plus_one = {}
+
+    def instrument(self, engine):
+        """
+        Listen to the cursor execute events of an engine.
+
+        :param engine: The SQLAlchemy engine.
+        """
+        event.listen(engine, 'before_cursor_execute', self.__before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self.__after_cursor_execute)
+
+    def profile_function(self, function):
+        """
+        Wrap a session function so that its statements are attributed to it.
+
+        :param function: The function decorated by read_session, transactional_session or stream_session.
+        :returns: The wrapped function, a generator function if the function is one.
+        """
+        name = '%s.%s' % (function.__module__, function.__name__)
+
+        if isgeneratorfunction(function):
+            # The statements are attributed to the generator only while it runs, not while its caller consumes the rows
+            @wraps(function)
+            def profiled_generator(*args, **kwargs):
+                iterator = function(*args, **kwargs)
+                while True:
+                    self.enter(name)
+                    try:
+                        row = next(iterator)
+                    except StopIteration:
+                        return
+                    finally:
+                        self.leave()
+                    yield row
+            return profiled_generator
+
+        @wraps(function)
+        def profiled_function(*args, **kwargs):
+            self.enter(name)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.leave()
+        return profiled_function
+
+    def enter(self, name):
+        """
+        Enter a session function in the current thread.
+
+        :param name: The name of the function.
+        """
+        stack = getattr(self.__local, 'functions', None)
+        if stack is None:
+            stack = self.__local.functions = []
+        if not stack and getattr(self.__local, 'endpoint', None) is None:
+            self.__local.counts = {}
+        stack.append(name)
+
+    def leave(self):
+        """ Leave the current session function, and end the unit of work of a daemon with the outermost one. """
+        stack = self.__local.functions
+        name = stack.pop()
+        if not stack and getattr(self.__local, 'endpoint', None) is None:
+            self.__check_n_plus_one(name)
+
+    def begin_request(self, endpoint):
+        """
+        Begin a REST request in the current thread. The previous request of the thread is ended
+        if it was not, as most of the web.py applications have no unload hook.
+
+        :param endpoint: The name of the endpoint, e.g., GET /rules.
+        """
+        self.end_request()
+        self.__local.endpoint = endpoint
+        self.__local.counts = {}
+        self.__local.request = {'statements': 0, 'time': 0.}
+
+    def end_request(self):
+        """ End the REST request of the current thread and send its summary to the monitor module. """
+        endpoint = getattr(self.__local, 'endpoint', None)
+        if endpoint is None:
+            return
+        self.__check_n_plus_one(endpoint)
+        request = self.__local.request
+        self.__local.endpoint = None
+        if self.send_metrics:
+            metric = 'sql.endpoints.%s' % re.sub(r'[^\w]+', '_', endpoint).strip('_').lower()
+            record_counter('%s.statements' % metric, request['statements'])
+            record_timer('%s.time' % metric, request['time'] * 1000)
+
+    def add_fetched(self, keys, count):
+        """
+        Add fetched rows to the statistics.
+
+        :param keys: List of (statistics dictionary, key) pairs.
+        :param count: Number of fetched rows.
+        """
+        if count:
+            with self.__lock:
+                for stats, key in keys:
+                    entry = stats.get(key)
+                    if entry is not None:
+                        entry['fetched'] += count
+
+    def dump(self):
+        """
+        Return the profile.
+
+        :returns: Dictionary {functions: {name: stats}, endpoints: {name: stats},
+                              slowest: [stats of the top N fingerprints by maximum time],
+                              n_plus_one: [N+1 patterns by number of executions]}
+        """
+        with self.__lock:
+            functions = dict((name, dict(stats)) for name, stats in self.__functions.items())
+            endpoints = dict((name, dict(stats)) for name, stats in self.__endpoints.items())
+            slowest = sorted((dict(stats, fingerprint=key) for key, stats in self.__statements.items()),
+                             key=lambda stats: stats['max_time'], reverse=True)[:self.top_n]
+            n_plus_one = sorted((dict(stats) for stats in self.__n_plus_one.values()),
+                                key=lambda stats: stats['max_executions'], reverse=True)
+        return {'functions': functions, 'endpoints': endpoints, 'slowest': slowest, 'n_plus_one': n_plus_one}
+
+    def __before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('profiler_start', []).append(time.time())
+
+    def __after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration = time.time() - conn.info['profiler_start'].pop()
+        rows = cursor.rowcount if cursor.rowcount and cursor.rowcount > 0 else 0
+        stack = getattr(self.__local, 'functions', None)
+        function = stack[-1] if stack else None
+        endpoint = getattr(self.__local, 'endpoint', None)
+        key = hashlib.md5(fingerprint(statement).encode('utf-8')).hexdigest()
+
+        counts = getattr(self.__local, 'counts', None)
+        if counts is not None and (function or endpoint):
+            counts[key] = counts.get(key, 0) + 1
+        if endpoint is not None:
+            self.__local.request['statements'] += 1
+            self.__local.request['time'] += duration
+
+        keys = []
+        with self.__lock:
+            for stats, name in ((self.__functions, function), (self.__endpoints, endpoint)):
+                if name is not None:
+                    self.__add(stats, name, duration, rows)
+                    keys.append((stats, name))
+            entry = self.__add(self.__statements, key, duration, rows)
+            keys.append((self.__statements, key))
+            if duration >= entry['max_time']:
+                entry.update({'max_time': duration, 'statement': statement, 'parameters': repr(parameters)[:1000],
+                              'function': function, 'endpoint': endpoint})
+            if len(self.__statements) > 10 * self.top_n:
+                # Forget the fastest fingerprints to bound the memory
+                for key, _ in sorted(self.__statements.items(), key=lambda item: item[1]['max_time'])[:len(self.__statements) - 5 * self.top_n]:
+                    del self.__statements[key]
+
+        if context is not None and not executemany and cursor.description is not None:
+            context.cursor = _CountingCursor(cursor, self, keys)
+
+    @staticmethod
+    def __add(stats, key, duration, rows):
+        entry = stats.get(key)
+        if entry is None:
+            entry = stats[key] = {'executions': 0, 'time': 0., 'max_time': 0., 'rows': 0, 'fetched': 0}
+        entry['executions'] += 1
+        entry['time'] += duration
+        entry['max_time'] = max(entry['max_time'], duration)
+        entry['rows'] += rows
+        return entry
+
+    def __check_n_plus_one(self, scope):
+        counts = getattr(self.__local, 'counts', None) or {}
+        self.__local.counts = {}
+        repeated = [(key, count) for key, count in counts.items() if count > self.n_plus_one]
+        if not repeated:
+            return
+        with self.__lock:
+            for key, count in repeated:
+                entry = self.__n_plus_one.get((scope, key))
+                if entry is None:
+                    statement = self.__statements.get(key, {}).get('statement')
+                    entry = self.__n_plus_one[(scope, key)] = {'scope': scope, 'fingerprint': key, 'statement': statement,
+                                                               'occurrences': 0, 'max_executions': 0}
+                entry['occurrences'] += 1
+                entry['max_executions'] = max(entry['max_executions'], count)
+        if self.send_metrics:
+            record_counter('sql.n_plus_one', len(repeated))
@@ -37,8 +37,9 @@ from sqlalchemy.exc import DatabaseError, DisconnectionError, OperationalError,
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
 
-from rucio.common.config import config_get
+from rucio.common.config import config_get, config_get_bool
 from rucio.common.exception import RucioException, DatabaseException
+from rucio.db.sqla.profiler import SQLProfiler
 
 try:
     main_script = os.path.basename(sys.argv[0])
@@ -63,6 +64,11 @@ if DEFAULT_SCHEMA_NAME:
 
 _MAKER, _ENGINE, _LOCK = None, None, Lock()
 
+PROFILER = None
+if config_get_bool(DATABASE_SECTION, 'profile', raise_exception=False, default=False):
+    PROFILER = SQLProfiler(top_n=int(config_get(DATABASE_SECTION, 'profile_top_n', raise_exception=False, default=20)),
+                           n_plus_one=int(config_get(DATABASE_SECTION, 'profile_n_plus_one', raise_exception=False, default=10)))
+
 
 def _fk_pragma_on_connect(dbapi_con, con_record):
     # Hack for previous versions of sqlite3
@@ -174,6 +180,8 @@ def get_engine(echo=True):
             event.listen(_ENGINE, 'connect', _fk_pragma_on_connect)
         elif 'oracle' in sql_connection:
             event.listen(_ENGINE, 'connect', my_on_connect)
+        if PROFILER:
+            PROFILER.instrument(_ENGINE)
     assert _ENGINE
     return _ENGINE
 
@@ -259,6 +267,9 @@ def read_session(function):
     This is useful if only SELECTs and the like are being done; anything involving
     INSERTs, UPDATEs etc should use transactional_session.
     '''
+    if PROFILER:
+        function = PROFILER.profile_function(function)
+
     @retry(retry_on_exception=retry_if_db_connection_error,
            wait_fixed=500,
            stop_max_attempt_number=2,
@@ -301,6 +312,9 @@ def stream_session(function):
     This is useful if only SELECTs and the like are being done; anything involving
     INSERTs, UPDATEs etc should use transactional_session.
     '''
+    if PROFILER:
+        function = PROFILER.profile_function(function)
+
     @retry(retry_on_exception=retry_if_db_connection_error,
            wait_fixed=500,
            stop_max_attempt_number=2,
@@ -347,6 +361,9 @@ def transactional_session(function):
 
     session is a sqlalchemy session, and you can get one calling get_session().
     '''
+    if PROFILER:
+        function = PROFILER.profile_function(function)
+
     @wraps(function)
     def new_funct(*args, **kwargs):
         if not kwargs.get('session'):
@@ -78,12 +78,11 @@ if rsemanager.CLIENT_MODE:   # pylint:disable=no-member
 
 
 if rsemanager.SERVER_MODE:   # pylint:disable=no-member
-    from rucio.core.rse import get_rse_protocols
+    from rucio.core.rse_cache import get_rse_protocols
     from rucio.core.credential import get_signed_url
     setattr(rsemanager, '__request_rse_info', get_rse_protocols)
     setattr(rsemanager, '__get_signed_url', get_signed_url)
-    RSE_REGION = make_region(function_key_generator=rse_key_generator).configure(
-        'dogpile.cache.memcached',
-        expiration_time=3600,
-        arguments={'url': "127.0.0.1:11211", 'distributed_lock': True})
+    # The RSE metadata snapshot is already a process wide cache kept up to date with the database,
+    # a second cache in front of it would only serve stale protocols
+    RSE_REGION = make_region(function_key_generator=rse_key_generator).configure('dogpile.cache.null')
     setattr(rsemanager, 'RSE_REGION', RSE_REGION)
@@ -273,6 +273,30 @@ class Default(protocol.RSEProtocol):
         except Exception as error:
             raise exception.ServiceUnavailable(error)
 
+    def bulk_delete(self, pfns):
+        """
+        Deletes a list of files from the connected RSE with a single gfal2 bulk unlink.
+
+        :param pfns: list of the to be deleted files
+
+        :returns: a dict with the PFN as key and None, or the exception raised for this PFN, as value
+        """
+
+        try:
+            errors = self.__ctx.unlink([str(pfn) for pfn in pfns])
+        except gfal2.GError as error:  # pylint: disable=no-member
+            raise exception.ServiceUnavailable(error)
+
+        ret = {}
+        for pfn, error in zip(pfns, errors):
+            if not error:
+                ret[pfn] = None
+            elif error.code == errno.ENOENT or 'No such file' in str(error):
+                ret[pfn] = exception.SourceNotFound(str(error))
+            else:
+                ret[pfn] = exception.ServiceUnavailable(str(error))
+        return ret
+
     def rename(self, path, new_path):
         """
         Allows to rename a file stored inside the connected RSE.
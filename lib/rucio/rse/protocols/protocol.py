@@ -224,6 +224,9 @@ class RSEProtocol(object):
         self.renaming = True
         self.overwrite = False
         self.rse = rse_settings
+        # Checksums of the downloaded files {dest: {algorithm: checksum}}, set by the protocols
+        # streaming the bytes through the client so that the files are not read again for validation
+        self.received_checksums = {}
         if self.rse['deterministic']:
             self.translator = RSEDeterministicTranslation(self.rse['rse'], rse_settings, self.attributes)
             if getattr(rsemanager, 'CLIENT_MODE', None) and \
@@ -431,6 +434,24 @@ class RSEProtocol(object):
         """
         raise NotImplementedError
 
+    def bulk_delete(self, pfns):
+        """
+            Deletes a list of files from the connected RSE.
+            Protocols supporting bulk deletion natively should overwrite this method.
+
+            :param pfns: list of the to be deleted files
+
+            :returns: a dict with the PFN as key and None, or the exception raised for this PFN, as value
+        """
+        ret = {}
+        for pfn in pfns:
+            try:
+                self.delete(pfn)
+                ret[pfn] = None
+            except Exception as error:
+                ret[pfn] = error
+        return ret
+
     def rename(self, path, new_path):
         """ Allows to rename a file stored inside the connected RSE.
 
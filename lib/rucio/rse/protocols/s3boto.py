@@ -29,6 +29,7 @@ from boto.s3.key import Key
 
 from rucio.common import exception
 from rucio.common.config import get_rse_credentials
+from rucio.common.utils import chunks
 
 from rucio.rse.protocols import protocol
 
@@ -279,6 +280,43 @@ class Default(protocol.RSEProtocol):
         except Exception as e:
             raise exception.ServiceUnavailable(e)
 
+    def bulk_delete(self, pfns):
+        """
+            Deletes a list of files from the connected RSE with S3 multi-object deletes.
+
+            :param pfns: list of the to be deleted files
+
+            :returns: a dict with the PFN as key and None, or the exception raised for this PFN, as value
+        """
+        ret, keys = {}, {}
+        for pfn in pfns:
+            try:
+                bucket_name, key_name = self.get_bucket_key_name(pfn)
+                keys.setdefault(bucket_name, {})[key_name] = pfn
+            except Exception as e:
+                ret[pfn] = e
+
+        for bucket_name, bucket_keys in keys.items():
+            bucket = self.__conn.get_bucket(bucket_name, validate=False)
+            for key_names in chunks(list(bucket_keys), 1000):
+                try:
+                    result = bucket.delete_keys(key_names, quiet=False)
+                except Exception as e:
+                    for key_name in key_names:
+                        ret[bucket_keys[key_name]] = exception.ServiceUnavailable(e)
+                    continue
+                for deleted in result.deleted:
+                    ret[bucket_keys[deleted.key]] = None
+                for error in result.errors:
+                    if error.code == 'NoSuchKey':
+                        ret[bucket_keys[error.key]] = exception.SourceNotFound(error.message)
+                    else:
+                        ret[bucket_keys[error.key]] = exception.ServiceUnavailable(error.message)
+                for key_name in key_names:
+                    if bucket_keys[key_name] not in ret:
+                        ret[bucket_keys[key_name]] = exception.ServiceUnavailable('No deletion result for %s' % key_name)
+        return ret
+
     def rename(self, pfn, new_pfn):
         """ Allows to rename a file stored inside the connected RSE.
 
@@ -31,6 +31,7 @@ from sys import stdout
 
 from rucio.client.objectstoreclient import ObjectStoreClient
 from rucio.common import exception
+from rucio.common.utils import ChecksumCalculator
 from rucio.rse.protocols import protocol
 
 
@@ -180,11 +181,14 @@ class Default(protocol.RSEProtocol):
                             pbar = ProgressBar(maxval=totnchunk).start()
                         else:
                             print('Malformed HTTP response (missing content-length header). Cannot show progress bar.')
+                        calculator = ChecksumCalculator(('adler32', 'md5'))
                         for chunk in result.iter_content(chunksize):
                             f.write(chunk)
+                            calculator.update(chunk)
                             if length:
                                 nchunk += 1
                                 pbar.update(nchunk)
+                        self.received_checksums[dest] = calculator.hexdigests()
                     finally:
                         if length:
                             pbar.finish()
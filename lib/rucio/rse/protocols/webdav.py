@@ -30,6 +30,7 @@ from requests.adapters import HTTPAdapter
 from urllib3.poolmanager import PoolManager
 
 from rucio.common import exception
+from rucio.common.utils import ChecksumCalculator
 from rucio.rse.protocols import protocol
 
 
@@ -269,11 +270,14 @@ class Default(protocol.RSEProtocol):
                             pbar = ProgressBar(maxval=totnchunk).start()
                         else:
                             print('Malformed HTTP response (missing content-length header). Cannot show progress bar.')
+                        calculator = ChecksumCalculator(('adler32', 'md5'))
                         for chunk in result.iter_content(chunksize):
                             file_out.write(chunk)
+                            calculator.update(chunk)
                             if length:
                                 nchunk += 1
                                 pbar.update(nchunk)
+                        self.received_checksums[dest] = calculator.hexdigests()
                     finally:
                         if length:
                             pbar.finish()
@@ -10,8 +10,11 @@
   - Wen Guan, <wen.guan@cern.ch>, 2015
 '''
 
+import threading
 import time
 
+from nose.tools import assert_equal
+
 from rucio.daemons.mock.conveyorinjector import request_transfer
 from rucio.daemons.conveyor import submitter, poller, finisher, throttler
 
@@ -31,3 +34,55 @@ class TestConveyorSubmitter:
         time.sleep(5)
         poller.run(once=True)
         finisher.run(once=True)
+
+
+class TestSubmissionPipeline:
+    """ Test of the grouping and submission stages of the submitter, with a fake transfertool """
+
+    def setup(self):
+        self.submitted = []
+        self.release = threading.Event()
+        self.release.set()
+        self.original = (submitter.bulk_group_transfer, submitter.submit_transfer, submitter.TRANSFER_TOOL)
+
+        def bulk_group_transfer(transfers, policy, group_bulk, source_strategy, max_time_in_queue):
+            # one job per transfer, on the host of the transfer
+            grouped_jobs = {}
+            for request_id, transfer in transfers.items():
+                grouped_jobs.setdefault(transfer['external_host'], []).append({'files': [{'metadata': {'request_id': request_id}}], 'job_params': {}})
+            return grouped_jobs
+
+        def submit_transfer(external_host, job, submitter, logging_prepend_str, timeout, user_transfer_job):
+            self.release.wait()
+            self.submitted.extend(t_file['metadata']['request_id'] for t_file in job['files'])
+
+        submitter.bulk_group_transfer = bulk_group_transfer
+        submitter.submit_transfer = submit_transfer
+        submitter.TRANSFER_TOOL = 'fts3'
+
+    def teardown(self):
+        submitter.bulk_group_transfer, submitter.submit_transfer, submitter.TRANSFER_TOOL = self.original
+
+    def test_pipeline_submission(self):
+        """ CONVEYOR (DAEMON): Test that the pipeline submits all the queued transfers before stopping """
+        pipeline = submitter.SubmissionPipeline(host_concurrency=2, queue_size=1)
+        pipeline.start()
+        transfers = dict(('request_%s' % i, {'external_host': 'https://fts%s:8446' % (i % 2)}) for i in range(10))
+        assert_equal(pipeline.put(transfers), 10)
+        pipeline.stop()
+        assert_equal(sorted(self.submitted), sorted(transfers))
+        assert_equal(pipeline.get_in_flight(), set())
+
+    def test_pipeline_in_flight(self):
+        """ CONVEYOR (DAEMON): Test that the requests are in flight until their submission, and not queued twice """
+        self.release.clear()
+        pipeline = submitter.SubmissionPipeline(host_concurrency=1, queue_size=1)
+        pipeline.start()
+        transfers = {'request_1': {'external_host': 'https://fts:8446'}, 'request_2': {'external_host': 'https://fts:8446'}}
+        assert_equal(pipeline.put(transfers), 2)
+        assert_equal(pipeline.get_in_flight(), set(transfers))
+        assert_equal(pipeline.put(dict(transfers, request_3={'external_host': 'https://fts:8446'})), 1)
+        self.release.set()
+        pipeline.stop()
+        assert_equal(sorted(self.submitted), ['request_1', 'request_2', 'request_3'])
+        assert_equal(pipeline.get_in_flight(), set())
@@ -20,10 +20,11 @@
 #
 # PY3K COMPATIBLE
 
-from nose.tools import assert_equal, assert_true
+from nose.tools import assert_equal
 
 from rucio.core.did import attach_dids, add_did, add_dids
-from rucio.core.replica import list_datasets_per_rse, update_collection_replica, get_cleaned_updated_collection_replicas, delete_replicas, add_replicas
+from rucio.core.replica import (list_datasets_per_rse, update_collection_replica, get_cleaned_updated_collection_replicas, delete_replicas, add_replicas,
+                                update_replicas_states, list_and_mark_unlocked_replicas, queue_collection_replica_recounts)
 from rucio.core.rse import add_rse, del_rse, add_protocol, get_rse
 from rucio.client.didclient import DIDClient
 from rucio.client.replicaclient import ReplicaClient
@@ -165,12 +166,14 @@ class TestDatasetReplicaUpdate:
         models.UpdatedCollectionReplica(scope=self.scope, name=dataset_name_with_collection_replica, did_type=constants.DIDType.DATASET).save(session=self.db_session)
         models.UpdatedCollectionReplica(scope=self.scope, name=dataset_name_with_collection_replica, did_type=constants.DIDType.DATASET).save(session=self.db_session)
 
+        # the recount of the whole dataset supersedes the recounts of its replica
         cleaned_collection_replica_updates = get_cleaned_updated_collection_replicas(total_workers=0, worker_number=0, session=self.db_session)
-        assert_equal(len(cleaned_collection_replica_updates), 2)
-        for update_request in cleaned_collection_replica_updates:
-            update_request = self.db_session.query(models.UpdatedCollectionReplica).filter_by(id=update_request['id']).one()  # pylint: disable=no-member
-            assert_equal(update_request.scope, self.scope)
-            assert_true(update_request.name in (dataset_name_with_collection_replica, dataset_name_without_collection_replica))
+        assert_equal(len(cleaned_collection_replica_updates), 1)
+        update_request = self.db_session.query(models.UpdatedCollectionReplica).filter_by(id=cleaned_collection_replica_updates[0]['id']).one()  # pylint: disable=no-member
+        assert_equal(update_request.scope, self.scope)
+        assert_equal(update_request.name, dataset_name_with_collection_replica)
+        assert_equal(update_request.rse_id, None)
+        assert_equal(self.db_session.query(models.UpdatedCollectionReplica).count(), 1)  # pylint: disable=no-member
 
     def test_update_collection_replica(self):
         """ REPLICA (CORE): Update collection replicas from update requests. """
@@ -342,3 +345,104 @@ class TestDatasetReplicaUpdate:
         assert_equal(dataset_replica['available_bytes'], len(files) * file_size)
         assert_equal(dataset_replica['available_replicas_cnt'], len(files))
         assert_equal(str(dataset_replica['state']), 'AVAILABLE')
+
+    def test_update_collection_replica_with_deltas(self):
+        """ REPLICA (CORE): Update collection replicas from the deltas of the file replica states. """
+        file_size = 2
+        files = [{'name': 'file_%s' % generate_uuid(), 'scope': self.scope, 'bytes': file_size, 'state': 'C'} for i in range(0, 3)]
+        dataset_name = 'dataset_test_%s' % generate_uuid()
+        add_replicas(rse=self.rse, files=files, account=self.account, session=self.db_session)
+        add_did(scope=self.scope, name=dataset_name, type=constants.DIDType.DATASET, account=self.account, session=self.db_session)
+        attach_dids(scope=self.scope, name=dataset_name, dids=files, account=self.account, session=self.db_session)
+        models.CollectionReplica(rse_id=self.rse_id, scope=self.scope, state=constants.ReplicaState.UNAVAILABLE, name=dataset_name, did_type=constants.DIDType.DATASET,
+                                 bytes=len(files) * file_size, length=len(files), available_bytes=0, available_replicas_cnt=0).save(session=self.db_session)
+        self.db_session.query(models.UpdatedCollectionReplica).delete()  # pylint: disable=no-member
+
+        # Two files become available -> the deltas are folded in one update request
+        update_replicas_states([{'scope': self.scope, 'name': files[0]['name'], 'rse_id': self.rse_id, 'state': constants.ReplicaState.AVAILABLE}], session=self.db_session)
+        update_replicas_states([{'scope': self.scope, 'name': files[1]['name'], 'rse_id': self.rse_id, 'state': constants.ReplicaState.AVAILABLE}], session=self.db_session)
+        update_requests = get_cleaned_updated_collection_replicas(total_workers=0, worker_number=0, session=self.db_session)
+        assert_equal(len(update_requests), 1)
+        assert_equal(update_requests[0]['available_replicas_delta'], 2)
+        assert_equal(update_requests[0]['available_bytes_delta'], 2 * file_size)
+        update_collection_replica(update_request=update_requests[0], session=self.db_session)
+        dataset_replica = self.db_session.query(models.CollectionReplica).filter_by(scope=self.scope, name=dataset_name).one()  # pylint: disable=no-member
+        assert_equal(dataset_replica['available_bytes'], 2 * file_size)
+        assert_equal(dataset_replica['available_replicas_cnt'], 2)
+        assert_equal(str(dataset_replica['state']), 'UNAVAILABLE')
+
+        # Last file becomes available -> dataset replica should be available
+        update_replicas_states([{'scope': self.scope, 'name': files[2]['name'], 'rse_id': self.rse_id, 'state': constants.ReplicaState.AVAILABLE}], session=self.db_session)
+        update_requests = get_cleaned_updated_collection_replicas(total_workers=0, worker_number=0, session=self.db_session)
+        assert_equal(len(update_requests), 1)
+        update_collection_replica(update_request=update_requests[0], session=self.db_session)
+        dataset_replica = self.db_session.query(models.CollectionReplica).filter_by(scope=self.scope, name=dataset_name).one()  # pylint: disable=no-member
+        assert_equal(dataset_replica['available_bytes'], len(files) * file_size)
+        assert_equal(dataset_replica['available_replicas_cnt'], len(files))
+        assert_equal(str(dataset_replica['state']), 'AVAILABLE')
+        assert_equal(self.db_session.query(models.UpdatedCollectionReplica).filter_by(scope=self.scope, name=dataset_name).count(), 0)  # pylint: disable=no-member
+
+    def test_update_collection_replica_recount_supersedes_deltas(self):
+        """ REPLICA (CORE): The recount of a dataset supersedes the deltas of its replicas, which are applied once. """
+        file_size = 2
+        files = [{'name': 'file_%s' % generate_uuid(), 'scope': self.scope, 'bytes': file_size, 'state': 'C'} for i in range(0, 3)]
+        dataset_name = 'dataset_test_%s' % generate_uuid()
+        add_replicas(rse=self.rse, files=files, account=self.account, session=self.db_session)
+        add_did(scope=self.scope, name=dataset_name, type=constants.DIDType.DATASET, account=self.account, session=self.db_session)
+        attach_dids(scope=self.scope, name=dataset_name, dids=files, account=self.account, session=self.db_session)
+        models.CollectionReplica(rse_id=self.rse_id, scope=self.scope, state=constants.ReplicaState.UNAVAILABLE, name=dataset_name, did_type=constants.DIDType.DATASET,
+                                 bytes=len(files) * file_size, length=len(files), available_bytes=0, available_replicas_cnt=0).save(session=self.db_session)
+        self.db_session.query(models.UpdatedCollectionReplica).delete()  # pylint: disable=no-member
+
+        # A file becomes available and the dataset is queued for a recount
+        update_replicas_states([{'scope': self.scope, 'name': files[0]['name'], 'rse_id': self.rse_id, 'state': constants.ReplicaState.AVAILABLE}], session=self.db_session)
+        models.UpdatedCollectionReplica(scope=self.scope, name=dataset_name, did_type=constants.DIDType.DATASET).save(session=self.db_session)
+        update_requests = get_cleaned_updated_collection_replicas(total_workers=0, worker_number=0, session=self.db_session)
+        assert_equal(len(update_requests), 1)
+        assert_equal(update_requests[0]['rse_id'], None)
+        update_collection_replica(update_request=update_requests[0], session=self.db_session)
+        # the request is gone once applied, applying it again changes nothing
+        update_collection_replica(update_request=update_requests[0], session=self.db_session)
+        dataset_replica = self.db_session.query(models.CollectionReplica).filter_by(scope=self.scope, name=dataset_name).one()  # pylint: disable=no-member
+        assert_equal(dataset_replica['available_bytes'], file_size)
+        assert_equal(dataset_replica['available_replicas_cnt'], 1)
+        assert_equal(self.db_session.query(models.UpdatedCollectionReplica).filter_by(scope=self.scope, name=dataset_name).count(), 0)  # pylint: disable=no-member
+
+    def test_update_collection_replica_after_reaper_deletion(self):
+        """ REPLICA (CORE): Update collection replicas from the deltas of the replicas deleted by the reaper. """
+        file_size = 2
+        rse = rse_name_generator()
+        rse_id = add_rse(rse)
+        files = [{'name': 'file_%s' % generate_uuid(), 'scope': self.scope, 'bytes': file_size} for i in range(0, 3)]
+        dataset_name = 'dataset_test_%s' % generate_uuid()
+        add_replicas(rse=rse, files=files, account=self.account, session=self.db_session)
+        add_replicas(rse=self.rse2, files=files, account=self.account, session=self.db_session)
+        add_did(scope=self.scope, name=dataset_name, type=constants.DIDType.DATASET, account=self.account, session=self.db_session)
+        attach_dids(scope=self.scope, name=dataset_name, dids=files, account=self.account, session=self.db_session)
+        models.CollectionReplica(rse_id=rse_id, scope=self.scope, state=constants.ReplicaState.AVAILABLE, name=dataset_name, did_type=constants.DIDType.DATASET,
+                                 bytes=len(files) * file_size, length=len(files), available_bytes=len(files) * file_size, available_replicas_cnt=len(files)).save(session=self.db_session)
+        self.db_session.query(models.UpdatedCollectionReplica).delete()  # pylint: disable=no-member
+
+        # The reaper marks the replica as being deleted, then deletes it
+        self.db_session.query(models.RSEFileAssociation).filter_by(rse_id=rse_id, scope=self.scope, name=files[0]['name']).update({'tombstone': constants.OBSOLETE})  # pylint: disable=no-member
+        replicas = list_and_mark_unlocked_replicas(limit=10, rse_id=rse_id, session=self.db_session)
+        assert_equal([replica['name'] for replica in replicas], [files[0]['name']])
+        delete_replicas(rse=rse, files=[{'scope': self.scope, 'name': files[0]['name']}], session=self.db_session)
+
+        update_requests = get_cleaned_updated_collection_replicas(total_workers=0, worker_number=0, session=self.db_session)
+        assert_equal(len(update_requests), 1)
+        assert_equal(update_requests[0]['available_replicas_delta'], -1)
+        update_collection_replica(update_request=update_requests[0], session=self.db_session)
+        dataset_replica = self.db_session.query(models.CollectionReplica).filter_by(scope=self.scope, name=dataset_name).one()  # pylint: disable=no-member
+        assert_equal(dataset_replica['available_bytes'], (len(files) - 1) * file_size)
+        assert_equal(dataset_replica['available_replicas_cnt'], len(files) - 1)
+        assert_equal(str(dataset_replica['state']), 'UNAVAILABLE')
+
+    def test_queue_collection_replica_recounts(self):
+        """ REPLICA (CORE): Queue the periodic recount of all the collection replicas. """
+        self.db_session.query(models.UpdatedCollectionReplica).delete()  # pylint: disable=no-member
+        nb_collection_replicas = self.db_session.query(models.CollectionReplica).count()  # pylint: disable=no-member
+        marker = queue_collection_replica_recounts(limit=2, session=self.db_session)
+        while marker is not None:
+            marker = queue_collection_replica_recounts(limit=2, marker=marker, session=self.db_session)
+        assert_equal(self.db_session.query(models.UpdatedCollectionReplica).filter(models.UpdatedCollectionReplica.available_replicas_delta.is_(None)).count(), nb_collection_replicas)  # pylint: disable=no-member
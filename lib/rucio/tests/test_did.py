@@ -161,6 +161,54 @@ class TestDIDCore:
 
         detach_dids(scope=tmp_scope, name=parent_name, dids=files)
 
+    def test_list_dids_marker(self):
+        """ DATA IDENTIFIERS (CORE): List dids page by page with a marker """
+        tmp_scope = scope_name_generator()
+        scope.add_scope(tmp_scope, 'root', 'root')
+        dsns = sorted(['dsn_%s' % generate_uuid() for i in range(7)])
+        for dsn in dsns:
+            add_did(scope=tmp_scope, name=dsn, type=DIDType.DATASET, account='root')
+
+        pages, marker = [], None
+        while True:
+            page = list(list_dids(scope=tmp_scope, filters={}, type='dataset', limit=3, marker=marker))
+            pages.append(page)
+            if len(page) < 3:
+                break
+            marker = page[-1]
+        assert_equal([len(page) for page in pages], [3, 3, 1])
+        assert_equal([dsn for page in pages for dsn in page], dsns)
+
+        with assert_raises(UnsupportedOperation):
+            list(list_dids(scope=tmp_scope, filters={}, recursive=True, marker=dsns[0]))
+
+    def test_list_dids_recursive(self):
+        """ DATA IDENTIFIERS (CORE): List dids recursively level by level """
+        tmp_scope = 'mock'
+        root = 'container_%s' % generate_uuid()
+        containers = ['container_%s' % generate_uuid() for _ in range(3)]
+        datasets = ['dsn_%s' % generate_uuid() for _ in range(6)]
+        add_did(scope=tmp_scope, name=root, type=DIDType.CONTAINER, account='root')
+        for name in containers:
+            add_did(scope=tmp_scope, name=name, type=DIDType.CONTAINER, account='root')
+        for name in datasets:
+            add_did(scope=tmp_scope, name=name, type=DIDType.DATASET, account='root')
+        attach_dids(scope=tmp_scope, name=root, dids=[{'scope': tmp_scope, 'name': name} for name in containers], account='root')
+        for i, name in enumerate(containers):
+            attach_dids(scope=tmp_scope, name=name, dids=[{'scope': tmp_scope, 'name': dsn} for dsn in datasets[2 * i:2 * i + 2]], account='root')
+        # A dataset attached to two containers is listed once
+        attach_dids(scope=tmp_scope, name=containers[0], dids=[{'scope': tmp_scope, 'name': datasets[-1]}], account='root')
+
+        dids = list(list_dids(scope=tmp_scope, filters={'name': root}, type='collection', recursive=True))
+        assert_equal(dids[0], root)
+        assert_equal(sorted(dids[1:4]), sorted(containers))
+        assert_equal(sorted(dids[4:]), sorted(datasets))
+
+        dids = list(list_dids(scope=tmp_scope, filters={'name': root}, type='container', recursive=True))
+        assert_equal(sorted(dids), sorted([root] + containers))
+
+        assert_equal(len(list(list_dids(scope=tmp_scope, filters={'name': root}, type='collection', recursive=True, limit=5))), 5)
+
 
 class TestDIDApi:
 
@@ -756,6 +804,18 @@ class TestDIDClients:
         for i in range(2):
             assert_equal(meta[keys[i]], values[i])
 
+    def test_get_meta_bulk(self):
+        """ DATA IDENTIFIERS (CLIENT): retrieve the meta data of several identifiers, skipping the unknown ones"""
+        rse = 'MOCK'
+        scope = 'mock'
+        files = [generate_uuid() for _ in range(3)]
+        for file in files:
+            self.replica_client.add_replica(rse, scope, file, 1, '0cc737eb')
+
+        metas = list(self.did_client.get_metadata_bulk([{'scope': scope, 'name': name} for name in files + [generate_uuid()]]))
+        assert_equal(sorted(meta['name'] for meta in metas), sorted(files))
+        assert_true(all(meta['adler32'] == '0cc737eb' for meta in metas))
+
     def test_list_content(self):
         """ DATA IDENTIFIERS (CLIENT): test to list contents for an identifier"""
         rse = 'MOCK'
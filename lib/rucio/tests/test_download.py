@@ -18,13 +18,16 @@
 # PY3K COMPATIBLE
 
 import logging
+import threading
+import time
 
 import nose.tools
 import os.path
 
 from rucio.client.client import Client
-from rucio.client.downloadclient import DownloadClient
+from rucio.client.downloadclient import DownloadClient, EndpointScheduler
 from rucio.client.uploadclient import UploadClient
+from rucio.common.exception import NoFilesDownloaded, RucioException
 from rucio.common.utils import generate_uuid
 from rucio.tests.common import file_generator
 
@@ -71,3 +74,121 @@ class TestDownloadClient(object):
         # Download with wildcard and name
         result = self.download_client.download_dids([{'did': '%s:%s' % (scope, '*'), 'filters': {'guid': uuid}}])
         nose.tools.assert_true(result)
+
+    def test_download_pipelined_upload(self):
+        """ DOWNLOAD (CLIENT): download a dataset uploaded with a pipelined upload. """
+        upload_client = UploadClient(_client=self.client, registration_chunk_size=2)
+        dataset_name = 'dataset_%s' % generate_uuid()
+        items = [{'path': file_generator(),
+                  'rse': 'MOCK4',
+                  'did_scope': 'mock',
+                  'dataset_scope': 'mock',
+                  'dataset_name': dataset_name} for _ in range(5)]
+        nose.tools.assert_equal(upload_client.upload(items, pipelined=True), 0)
+
+        files = list(self.client.list_files('mock', dataset_name))
+        nose.tools.assert_equal(sorted(f['name'] for f in files), sorted(os.path.basename(item['path']) for item in items))
+
+        result = self.download_client.download_dids([{'did': 'mock:%s' % dataset_name, 'base_dir': '/tmp'}])
+        nose.tools.assert_equal(len(result), 5)
+        nose.tools.assert_true(all(item['clientState'] == 'DONE' for item in result))
+
+    @nose.tools.raises(NoFilesDownloaded)
+    def test_download_empty_dataset(self):
+        """ DOWNLOAD (CLIENT): download a DID without replicas. """
+        dataset_name = 'dataset_%s' % generate_uuid()
+        self.client.add_dataset(scope='mock', name=dataset_name)
+        self.download_client.download_dids([{'did': 'mock:%s' % dataset_name, 'base_dir': '/tmp'}])
+
+
+class FakeClient(object):
+    account = 'root'
+
+
+class TestDownloadFeeder(object):
+
+    def test_feeder_error(self):
+        """ DOWNLOAD (CLIENT): The queued downloads are dropped when the resolution of the sources fails """
+        download_client = DownloadClient(client=FakeClient(), logger=logging.getLogger('dlul_client'), tracing=False)
+        downloaded = []
+
+        def download_worker(input_queue, output_queue, trace_custom_fields, traces_copy_out, log_prefix):
+            while True:
+                item = input_queue.get()
+                if item is None:
+                    break
+                time.sleep(0.05)
+                downloaded.append(item)
+                output_queue.put(item)
+        download_client._download_worker = download_worker
+
+        def input_items():
+            for i in range(50):
+                yield {'did': 'mock:file_%i' % i}
+            time.sleep(0.1)
+            raise RucioException('Multiple file items with same destination file path')
+
+        nose.tools.assert_raises(RucioException, download_client._download_multithreaded, input_items(), num_threads=2)
+        nose.tools.assert_true(len(downloaded) < 50)
+
+
+class TestEndpointScheduler(object):
+
+    def test_endpoint_concurrency(self):
+        """ DOWNLOAD (CLIENT): The concurrent transfers per endpoint are limited """
+        scheduler = EndpointScheduler(max_per_endpoint=2)
+        endpoint = scheduler.get_endpoint({'pfn': 'root://door.cern.ch:1094//data/file_1', 'rse': 'MOCK'})
+        nose.tools.assert_equal(endpoint, 'root://door.cern.ch:1094')
+        nose.tools.assert_equal(scheduler.get_endpoint({'pfn': 'file:///data/file_1', 'rse': 'MOCK'}), 'file://MOCK')
+
+        active = []
+        max_active = [0]
+        lock = threading.Lock()
+
+        def transfer():
+            scheduler.acquire(endpoint)
+            with lock:
+                active.append(1)
+                max_active[0] = max(max_active[0], len(active))
+            time.sleep(0.05)
+            with lock:
+                active.pop()
+            scheduler.release(endpoint, True, 1000, 0.05)
+
+        threads = [threading.Thread(target=transfer) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        nose.tools.assert_equal(max_active[0], 2)
+
+        stats = scheduler.get_stats()
+        nose.tools.assert_equal(stats['files'], 6)
+        nose.tools.assert_equal(stats['bytes'], 6000)
+        nose.tools.assert_equal(stats['endpoints'][endpoint]['active'], 0)
+        nose.tools.assert_true(stats['throughput'] > 0)
+
+    def test_source_ordering(self):
+        """ DOWNLOAD (CLIENT): The sources of the same priority are ordered by the observed throughput of their endpoints """
+        scheduler = EndpointScheduler(max_per_endpoint=1)
+        slow = {'pfn': 'root://slow.cern.ch//file_1', 'rse': 'SLOW'}
+        fast = {'pfn': 'root://fast.cern.ch//file_1', 'rse': 'FAST'}
+        new = {'pfn': 'root://new.cern.ch//file_1', 'rse': 'NEW'}
+        for source, duration in ((slow, 10.), (fast, 1.)):
+            scheduler.acquire(scheduler.get_endpoint(source))
+            scheduler.release(scheduler.get_endpoint(source), True, 1000, duration)
+        nose.tools.assert_equal(scheduler.order_sources([slow, fast, new]), [new, fast, slow])
+
+        # a busy endpoint comes after the free ones
+        scheduler.acquire(scheduler.get_endpoint(fast))
+        nose.tools.assert_equal(scheduler.order_sources([slow, fast]), [slow, fast])
+        scheduler.release(scheduler.get_endpoint(fast), False)
+        nose.tools.assert_equal(scheduler.get_stats()['endpoints']['root://fast.cern.ch']['failures'], 1)
+
+        # the throughput only reorders the sources within the same domain and priority of the server
+        lan = dict(slow, domain='lan', priority=1)
+        wan_fast = dict(fast, domain='wan', priority=1)
+        wan_new = dict(new, domain='wan', priority=2)
+        nose.tools.assert_equal(scheduler.order_sources([lan, wan_fast, wan_new]), [lan, wan_fast, wan_new])
+        wan_new['priority'] = 1
+        nose.tools.assert_equal(scheduler.order_sources([lan, wan_fast, wan_new]), [lan, wan_new, wan_fast])
@@ -9,6 +9,10 @@
 # - Luis Rodrigues, <luis.rodrigues@cern.ch>, 2013
 # - Martin Barisits, <martin.barisits@cern.ch>, 2017
 
+import socket
+
+from nose.tools import assert_equal, assert_in
+
 from rucio.core import monitor
 
 
@@ -51,3 +55,49 @@ class TestMonitor(object):
         with monitor.record_timer_block(['test.context_timer', ('test.context_timer_normal10', 10)]):
             var_a = 2 * 100
             var_a = var_a * 1
+
+    @staticmethod
+    def test_aggregated_metrics():
+        """MONITOR (CORE): Aggregate metrics and flush them in one packet """
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(('127.0.0.1', 0))
+        receiver.settimeout(5)
+        aggregator = monitor.MetricsAggregator('127.0.0.1', receiver.getsockname()[1], 'rucio', flush_interval=3600, timer_samples=5)
+        for value in range(10):
+            aggregator.incr('test.counter', 2)
+            aggregator.timing('test.timer', value)
+        aggregator.gauge('test.gauge', 1)
+        aggregator.gauge('test.gauge', 3)
+        aggregator.flush()
+
+        lines = receiver.recv(65535).decode().split('\n')
+        assert_in('rucio.test.counter:20|c', lines)
+        assert_in('rucio.test.gauge:3|g', lines)
+        timers = [line for line in lines if line.startswith('rucio.test.timer:')]
+        assert_equal(len(timers), 5)
+        assert_equal(set(line.split('|')[-1] for line in timers), set(['@0.500000']))
+
+        metrics = aggregator.render_prometheus().split('\n')
+        assert_in('rucio_test_counter_total 20', metrics)
+        assert_in('rucio_test_gauge 3', metrics)
+        assert_in('rucio_test_timer_count 10', metrics)
+        assert_in('rucio_test_timer_sum 45', metrics)
+        receiver.close()
+
+    @staticmethod
+    def test_prometheus_port_taken():
+        """MONITOR (CORE): The Prometheus exporter is skipped if its port is taken """
+        taken = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        taken.bind(('', 0))
+        taken.listen(1)
+        started, server = monitor.PROMETHEUS_STARTED, monitor.PROMETHEUS_SERVER
+        aggregator = monitor.AGGREGATOR
+        try:
+            monitor.PROMETHEUS_STARTED, monitor.PROMETHEUS_SERVER = False, None
+            monitor.AGGREGATOR = aggregator or monitor.MetricsAggregator('127.0.0.1', 8125, 'rucio', flush_interval=3600)
+            assert_equal(monitor.start_prometheus_server(taken.getsockname()[1]), None)
+            assert_equal(monitor.start_prometheus_server(), None)
+        finally:
+            monitor.PROMETHEUS_STARTED, monitor.PROMETHEUS_SERVER = started, server
+            monitor.AGGREGATOR = aggregator
+            taken.close()
@@ -45,8 +45,11 @@ from rucio.core.replica import (add_replica, add_replicas, delete_replicas, get_
                                 update_replica_lock_counter, get_replica, list_replicas,
                                 declare_bad_file_replicas, list_bad_replicas,
                                 update_replicas_paths, update_replica_state,
-                                get_replica_atime, touch_replica, get_bad_pfns, set_tombstone)
+                                get_replica_atime, touch_replica, get_bad_pfns, set_tombstone,
+                                list_and_mark_unlocked_replicas)
 from rucio.core.rse import add_rse, add_protocol, add_rse_attribute, del_rse_attribute
+from rucio.db.sqla import models
+from rucio.db.sqla.session import get_session
 from rucio.client.ruleclient import RuleClient
 from rucio.daemons.badreplicas.necromancer import run as necromancer_run
 from rucio.daemons.badreplicas.minos import run as minos_run
@@ -435,6 +438,36 @@ class TestReplicaCore:
         with assert_raises(ReplicaNotFound):
             set_tombstone(rse, scope, name)
 
+    def test_list_and_mark_unlocked_replicas(self):
+        """ REPLICA (CORE): List and mark the deletable replicas of a RSE """
+        scope = 'mock'
+        rse = rse_name_generator()
+        rse_id = add_rse(rse)
+        files = dict((key, {'scope': scope, 'name': 'file_%s' % generate_uuid(), 'bytes': 1, 'adler32': '0cc737eb'})
+                     for key in ('three_copies', 'two_copies', 'requested', 'single_copy', 'locked'))
+        add_replicas(rse=rse, files=list(files.values()), account='root', ignore_availability=True)
+        add_replicas(rse='MOCK', files=[files[key] for key in ('three_copies', 'two_copies', 'requested', 'locked')], account='root', ignore_availability=True)
+        add_replicas(rse='MOCK3', files=[files['three_copies']], account='root', ignore_availability=True)
+        for file in files.values():
+            set_tombstone(rse, scope, file['name'], rse_id=rse_id)
+        update_replica_lock_counter(rse=rse, scope=scope, name=files['locked']['name'], value=1)
+
+        session = get_session()
+        models.Request(scope=scope, name=files['requested']['name'], dest_rse_id=rse_id).save(session=session)
+        session.commit()
+
+        replicas = list_and_mark_unlocked_replicas(limit=1, rse_id=rse_id)
+        assert_equal(len(replicas), 1)
+        assert_in(replicas[0]['name'], (files['three_copies']['name'], files['two_copies']['name']))
+
+        # the last copies, the replicas requested for transfer and the locked replicas are not deletable
+        replicas += list_and_mark_unlocked_replicas(limit=10, rse_id=rse_id)
+        assert_equal(sorted(replica['name'] for replica in replicas), sorted(files[key]['name'] for key in ('three_copies', 'two_copies')))
+        for key in ('three_copies', 'two_copies'):
+            assert_equal(get_replica(rse, scope, files[key]['name'])['state'], ReplicaState.BEING_DELETED)
+        for key in ('requested', 'single_copy', 'locked'):
+            assert_equal(get_replica(rse, scope, files[key]['name'])['state'], ReplicaState.AVAILABLE)
+
 
 class TestReplicaClients:
 
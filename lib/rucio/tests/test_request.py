@@ -23,7 +23,8 @@ from nose.tools import assert_equal
 from rucio.common.utils import generate_uuid
 from rucio.core.did import attach_dids, add_did
 from rucio.core.replica import add_replica
-from rucio.core.request import release_all_waiting_requests, queue_requests, get_request_by_did, release_waiting_requests_per_free_volume, release_waiting_requests_grouped_fifo, release_waiting_requests_fifo
+from rucio.core.request import (release_all_waiting_requests, queue_requests, get_request_by_did, release_waiting_requests_per_free_volume, release_waiting_requests_grouped_fifo,
+                                release_waiting_requests_fifo, update_requests_states, requeue_and_archive_requests)
 from rucio.core.rse import get_rse_id, set_rse_transfer_limits
 from rucio.db.sqla import session, models, constants
 
@@ -817,3 +818,79 @@ class TestRequestCore(object):
         assert_equal(request['state'], constants.RequestState.QUEUED)
         request = get_request_by_did(self.scope, name2, self.dest_rse, session=self.db_session)
         assert_equal(request['state'], constants.RequestState.QUEUED)
+
+    def test_queue_requests_duplicates(self):
+        """ REQUEST (CORE): queue requests ignores the existing and duplicated requests. """
+        name1 = generate_uuid()
+        name2 = generate_uuid()
+        add_replica(self.source_rse, self.scope, name1, 1, self.account, session=self.db_session)
+        add_replica(self.source_rse, self.scope, name2, 1, self.account, session=self.db_session)
+
+        def request(name):
+            return {'dest_rse_id': self.dest_rse_id,
+                    'request_type': constants.RequestType.TRANSFER,
+                    'name': name,
+                    'scope': self.scope,
+                    'rule_id': generate_uuid(),
+                    'retry_count': 1,
+                    'attributes': {'activity': 'ignore', 'bytes': 1, 'md5': '', 'adler32': ''}}
+
+        request_ids = queue_requests([request(name1)], session=self.db_session)
+        assert_equal(len(request_ids), 1)
+        request_ids = queue_requests([request(name1), request(name2), request(name2)], session=self.db_session)
+        assert_equal(len(request_ids), 1)
+        assert_equal(self.db_session.query(models.Request).filter(models.Request.name.in_([name1, name2])).count(), 2)
+        assert_equal(get_request_by_did(self.scope, name2, self.dest_rse, session=self.db_session)['id'], request_ids[0])
+
+    def test_requeue_and_archive_requests(self):
+        """ REQUEST (CORE): requeue and archive several failed requests in bulk. """
+        names = [generate_uuid() for _ in range(2)]
+        requests = []
+        for name, retry_count in zip(names, [0, 3]):
+            add_replica(self.source_rse, self.scope, name, 1, self.account, session=self.db_session)
+            request = models.Request(dest_rse_id=self.dest_rse_id, scope=self.scope, name=name, request_type=constants.RequestType.TRANSFER, rule_id=generate_uuid(),
+                                     state=constants.RequestState.FAILED, retry_count=retry_count, activity=self.user_activity, bytes=1,
+                                     attributes='{"activity": "User Subscription", "bytes": 1, "md5": "", "adler32": ""}')
+            request.save(session=self.db_session)
+            requests.append({'request_id': request.id})
+        requests.append({'request_id': generate_uuid()})
+
+        new_requests = requeue_and_archive_requests(requests, session=self.db_session)
+        assert_equal(sorted(new_requests), sorted(request['request_id'] for request in requests[:2]))
+        assert_equal(new_requests[requests[0]['request_id']]['retry_count'], 1)
+        assert_equal(new_requests[requests[1]['request_id']], None)
+        request = get_request_by_did(self.scope, names[0], self.dest_rse, session=self.db_session)
+        assert_equal((request['id'], request['previous_attempt_id']), (new_requests[requests[0]['request_id']]['request_id'], requests[0]['request_id']))
+        history = models.Request.__history_mapper__.class_
+        assert_equal(self.db_session.query(history).filter(history.id.in_([request['request_id'] for request in requests])).count(), 2)
+
+    def test_update_requests_states(self):
+        """ REQUEST (CORE): update the state of several requests in bulk. """
+        names = [generate_uuid() for _ in range(3)]
+        request_ids = []
+        for name in names:
+            add_replica(self.source_rse, self.scope, name, 1, self.account, session=self.db_session)
+            request = models.Request(dest_rse_id=self.dest_rse_id, scope=self.scope, name=name, request_type=constants.RequestType.TRANSFER,
+                                     state=constants.RequestState.SUBMITTED, external_id='transfer_' + name, external_host='https://fts:8446')
+            request.save(session=self.db_session)
+            request_ids.append(request.id)
+        self.db_session.commit()
+
+        def response(index, new_state, transfer_id=None):
+            return {'request_id': request_ids[index], 'transfer_id': transfer_id or 'transfer_' + names[index], 'new_state': new_state,
+                    'scope': self.scope, 'name': names[index], 'previous_attempt_id': None, 'reason': 'error', 'transferred_at': datetime.utcnow()}
+
+        ret = update_requests_states([response(0, constants.RequestState.DONE),
+                                      response(0, constants.RequestState.DONE),
+                                      response(1, constants.RequestState.FAILED),
+                                      response(2, constants.RequestState.DONE, transfer_id='previous_transfer'),
+                                      {'request_id': generate_uuid(), 'transfer_id': 'unknown', 'new_state': constants.RequestState.DONE}],
+                                     session=self.db_session)
+        assert_equal(ret[request_ids[0]], True)
+        assert_equal(ret[request_ids[1]], True)
+        assert_equal(ret[request_ids[2]], False)
+        assert_equal(get_request_by_did(self.scope, names[0], self.dest_rse, session=self.db_session)['state'], constants.RequestState.DONE)
+        request = get_request_by_did(self.scope, names[1], self.dest_rse, session=self.db_session)
+        assert_equal(request['state'], constants.RequestState.FAILED)
+        assert_equal(request['err_msg'], '%s:error' % constants.RequestErrMsg.TRANSFER_FAILED)
+        assert_equal(get_request_by_did(self.scope, names[2], self.dest_rse, session=self.db_session)['state'], constants.RequestState.SUBMITTED)
@@ -0,0 +1,94 @@
+# Copyright 2019 CERN for the benefit of the ATLAS collaboration.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from datetime import timedelta
+
+from nose.tools import assert_equal, assert_true, assert_in, assert_not_in, raises
+
+from rucio.common.exception import RSENotFound
+from rucio.common.utils import generate_uuid
+from rucio.core import rse as rse_core
+from rucio.core.rse_cache import get_rse_snapshot, RSE_METADATA_CACHE
+from rucio.db.sqla import models
+from rucio.db.sqla.session import get_session
+
+
+class TestRSECacheCore(object):
+
+    def __init__(self):
+        self.rse = 'MOCK_' + generate_uuid()[:10].upper()
+        self.rse_id = rse_core.add_rse(self.rse)
+        rse_core.add_rse_attribute(self.rse, 'fts', 'https://fts:8446')
+        rse_core.add_protocol(self.rse, {'scheme': 'root', 'hostname': 'root.aperture.com', 'port': 1094, 'prefix': '/prefix/', 'impl': 'rucio.rse.protocols.xrootd.Default',
+                                         'domains': {'lan': {'read': 1, 'write': 1, 'delete': 1},
+                                                     'wan': {'read': 1, 'write': 1, 'delete': 1, 'third_party_copy': 1}}})
+        rse_core.set_rse_limits(self.rse, 'MinFreeSpace', 10)
+
+    def test_snapshot_content(self):
+        """ RSE CACHE (CORE): Test that the snapshot gives the same RSE information as the database """
+        snapshot = get_rse_snapshot()
+        assert_equal(snapshot.get_rse_id(self.rse), self.rse_id)
+        assert_equal(snapshot.get_rse_protocols(self.rse_id), rse_core.get_rse_protocols(self.rse))
+        assert_equal(snapshot.list_rse_attributes(self.rse_id), rse_core.list_rse_attributes(self.rse))
+        assert_equal(snapshot.get_rse_limits(self.rse_id), rse_core.get_rse_limits(self.rse))
+
+    def test_snapshot_refresh(self):
+        """ RSE CACHE (CORE): Test the refresh of the snapshot after local and remote changes """
+        snapshot = get_rse_snapshot()
+        rse_core.add_rse_attribute(self.rse, 'new_key', 'value')
+        snapshot = get_rse_snapshot()
+        assert_equal(snapshot.list_rse_attributes(self.rse_id)['new_key'], 'value')
+        assert_true(get_rse_snapshot() is snapshot)
+
+        # Changes done by other processes are seen after the refresh interval, through the change counters
+        session = get_session()
+        session.query(models.RSEAttrAssociation).filter_by(rse_id=self.rse_id, key='new_key').delete(synchronize_session=False)
+        session.query(models.RSEMetadataVersion).filter_by(name='attributes').update({'version': models.RSEMetadataVersion.version + 1}, synchronize_session=False)
+        session.commit()
+        RSE_METADATA_CACHE.checked_at -= timedelta(days=1)
+        assert_not_in('new_key', get_rse_snapshot().list_rse_attributes(self.rse_id))
+
+    def test_snapshot_refresh_late_commit(self):
+        """ RSE CACHE (CORE): Test that rows committed with a timestamp older than the last refresh are seen """
+        snapshot = get_rse_snapshot()
+        session = get_session()
+        updated_at = snapshot.fingerprints['limits'][1] - timedelta(seconds=60)
+        models.RSELimit(rse_id=self.rse_id, name='MaxBeingDeletedFiles', value=5, created_at=updated_at, updated_at=updated_at).save(session=session)
+        session.query(models.RSEMetadataVersion).filter_by(name='limits').update({'version': models.RSEMetadataVersion.version + 1}, synchronize_session=False)
+        session.commit()
+        RSE_METADATA_CACHE.checked_at -= timedelta(days=1)
+        assert_equal(get_rse_snapshot().get_rse_limits(self.rse_id, 'MaxBeingDeletedFiles'), {'MaxBeingDeletedFiles': 5})
+
+    def test_unchanged_versions(self):
+        """ RSE CACHE (CORE): Test that the snapshot is kept while the change counters do not move """
+        snapshot = get_rse_snapshot()
+        RSE_METADATA_CACHE.checked_at -= timedelta(days=1)
+        assert_true(get_rse_snapshot() is snapshot)
+
+    def test_attribute_index(self):
+        """ RSE CACHE (CORE): Test the attribute index of the snapshot """
+        rse_core.add_rse_attribute(self.rse, 'cache_index_tag', True)
+        rse_core.add_rse_attribute(self.rse, 'cache_index_number', 10)
+        snapshot = get_rse_snapshot()
+        assert_in(self.rse_id, snapshot.get_rses_with_value('cache_index_tag', True))
+        assert_in(self.rse_id, snapshot.get_rses_with_value('cache_index_number', '10'))
+        assert_in(self.rse_id, snapshot.get_rses_smaller('cache_index_number', 11))
+        assert_not_in(self.rse_id, snapshot.get_rses_larger('cache_index_number', 10))
+        assert_equal(snapshot.list_rse_attributes(self.rse_id)['cache_index_tag'], True)
+
+    @raises(RSENotFound)
+    def test_deleted_rse(self):
+        """ RSE CACHE (CORE): Test that deleted RSEs are not in the snapshot """
+        rse_core.del_rse(self.rse)
+        get_rse_snapshot().get_rse_id(self.rse)
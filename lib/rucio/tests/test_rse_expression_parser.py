@@ -174,6 +174,18 @@ class TestRSEExpressionParserCore(object):
         assert_raises(InvalidRSEExpression, rse_expression_parser.parse_expression, "%s>51" % self.attribute_numeric)
         assert_equal(sorted([t_rse['id'] for t_rse in rse_expression_parser.parse_expression("%s>30" % self.attribute_numeric)]), sorted([self.rse4_id, self.rse5_id]))
 
+    def test_attribute_index_refresh(self):
+        """ RSE_EXPRESSION_PARSER (CORE) Test that attribute changes are visible to the expression index """
+        attribute = attribute_name_generator()
+        rse.add_rse_attribute(self.rse1, attribute, "de")
+        assert_equal([t_rse['id'] for t_rse in rse_expression_parser.parse_expression("%s=de" % attribute)], [self.rse1_id])
+        rse.add_rse_attribute(self.rse2, attribute, "de")
+        assert_equal(sorted([t_rse['id'] for t_rse in rse_expression_parser.parse_expression("%s=de" % attribute)]), sorted([self.rse1_id, self.rse2_id]))
+        rse.del_rse_attribute(self.rse1, attribute)
+        assert_equal([t_rse['id'] for t_rse in rse_expression_parser.parse_expression("%s=de" % attribute)], [self.rse2_id])
+        rse.del_rse_attribute(self.rse2, attribute)
+        assert_raises(InvalidRSEExpression, rse_expression_parser.parse_expression, "%s=de" % attribute)
+
 
 class TestRSEExpressionParserClient(object):
 
@@ -34,7 +34,7 @@ from rucio.common.exception import (RuleNotFound, AccessDenied, InsufficientAcco
                                     RuleReplaceFailed, ManualRuleApprovalBlocked, InputValidationError, UnsupportedOperation)
 from rucio.daemons.judge.evaluator import re_evaluator
 from rucio.core.did import add_did, attach_dids, set_status
-from rucio.core.lock import get_replica_locks, get_dataset_locks, successful_transfer
+from rucio.core.lock import get_replica_locks, get_dataset_locks, successful_transfer, successful_transfers
 from rucio.core.account import add_account_attribute, get_usage
 from rucio.core.account_limit import set_account_limit
 from rucio.core.request import get_request_by_did
@@ -607,6 +607,29 @@ class TestReplicationRuleCore():
         # Check if rule exists
         assert(True is check_dataset_ok_callback(scope, dataset, self.rse3, rule_id))
 
+    def test_successful_transfers(self):
+        """ REPLICATION RULE (CORE): Test the bulk update of the locks and rules of successful transfers"""
+
+        scope = 'mock'
+        files = create_files(3, scope, self.rse1, bytes=100)
+        dataset = 'dataset_' + str(uuid())
+        add_did(scope, dataset, DIDType.from_sym('DATASET'), 'jdoe')
+        attach_dids(scope, dataset, files, 'jdoe')
+
+        set_status(scope=scope, name=dataset, open=False)
+
+        rule_id = add_rule(dids=[{'scope': scope, 'name': dataset}], account='jdoe', copies=1, rse_expression=self.rse3, grouping='DATASET', weight=None, lifetime=None, locked=False, subscription_id=None, notify='C')[0]
+
+        successful_transfers(replicas=[{'scope': scope, 'name': file['name'], 'rse_id': self.rse3_id} for file in files[:2]], nowait=False)
+        rule = get_rule(rule_id)
+        assert_equal((rule['state'], rule['locks_ok_cnt'], rule['locks_replicating_cnt']), (RuleState.REPLICATING, 2, 1))
+
+        # Locks which are already OK are not counted twice
+        successful_transfers(replicas=[{'scope': scope, 'name': file['name'], 'rse_id': self.rse3_id} for file in files], nowait=False)
+        rule = get_rule(rule_id)
+        assert_equal((rule['state'], rule['locks_ok_cnt'], rule['locks_replicating_cnt']), (RuleState.OK, 3, 0))
+        assert(True is check_dataset_ok_callback(scope, dataset, self.rse3, rule_id))
+
     def test_dataset_callback_no(self):
         """ REPLICATION RULE (CORE): Test dataset callback should not be sent"""
 
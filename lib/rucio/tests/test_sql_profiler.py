@@ -0,0 +1,88 @@
+# Copyright 2019 CERN for the benefit of the ATLAS collaboration.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from nose.tools import assert_equal, assert_true
+
+from sqlalchemy import create_engine, text
+
+from rucio.db.sqla.profiler import SQLProfiler, fingerprint
+
+
+class TestSQLProfiler:
+
+    def setup(self):
+        self.profiler = SQLProfiler(top_n=5, n_plus_one=3, send_metrics=False)
+        self.engine = create_engine('sqlite://')
+        self.profiler.instrument(self.engine)
+        self.engine.execute('CREATE TABLE dids (name VARCHAR(50))')
+        self.engine.execute(text('INSERT INTO dids VALUES (:name)'), [{'name': 'file_%i' % i} for i in range(10)])
+        self.profiler.reset()
+
+    def test_fingerprint(self):
+        """ SQL PROFILER: Statements differing by their literals and IN lists share their fingerprint """
+        assert_equal(fingerprint("SELECT * FROM dids WHERE name = 'file_1' AND bytes > 10"),
+                     fingerprint("SELECT *  FROM dids\n WHERE name = 'file_2' AND bytes > 20"))
+        assert_equal(fingerprint('SELECT * FROM dids WHERE name IN (:name_1, :name_2)'),
+                     fingerprint('SELECT * FROM dids WHERE name IN (?, ?, ?)'))
+
+    def test_attribution(self):
+        """ SQL PROFILER: Statements are attributed to the innermost function and to the request """
+        def get_names():
+            return [name for name, in self.engine.execute('SELECT name FROM dids')]
+
+        def list_names():
+            for name, in self.engine.execute("SELECT name FROM dids WHERE name <> 'file_0'"):
+                yield name
+
+        get_names = self.profiler.profile_function(get_names)
+        list_names = self.profiler.profile_function(list_names)
+
+        self.profiler.begin_request('GET /dids')
+        assert_equal(len(get_names()), 10)
+        assert_equal(len(list(list_names())), 9)
+        self.profiler.end_request()
+
+        profile = self.profiler.dump()
+        functions = dict((name.split('.')[-1], stats) for name, stats in profile['functions'].items())
+        assert_equal(functions['get_names']['executions'], 1)
+        assert_equal(functions['get_names']['fetched'], 10)
+        assert_equal(functions['list_names']['fetched'], 9)
+        assert_equal(profile['endpoints']['GET /dids']['executions'], 2)
+        assert_equal(profile['endpoints']['GET /dids']['fetched'], 19)
+        assert_equal(len(profile['slowest']), 2)
+        assert_true(all(stats['endpoint'] == 'GET /dids' for stats in profile['slowest']))
+        assert_equal(profile['n_plus_one'], [])
+
+    def test_n_plus_one(self):
+        """ SQL PROFILER: A statement repeated within a request or an outermost function is a N+1 pattern """
+        def get_name(i):
+            return self.engine.execute(text('SELECT name FROM dids WHERE name = :name'), name='file_%i' % i).scalar()
+
+        def get_names():
+            return [get_name(i) for i in range(10)]
+
+        get_name = self.profiler.profile_function(get_name)
+        get_names = self.profiler.profile_function(get_names)
+
+        get_names()
+        self.profiler.begin_request('GET /dids')
+        for i in range(3):
+            get_name(i)
+        self.profiler.end_request()
+
+        n_plus_one = self.profiler.dump()['n_plus_one']
+        assert_equal(len(n_plus_one), 1)
+        assert_true(n_plus_one[0]['scope'].endswith('get_names'))
+        assert_equal(n_plus_one[0]['max_executions'], 10)
+        assert_true('WHERE name = ?' in n_plus_one[0]['statement'])
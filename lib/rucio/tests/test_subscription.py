@@ -37,7 +37,7 @@ from rucio.core.did import add_did, set_new_dids
 from rucio.core.rse import add_rse, get_rse_id
 from rucio.core.rule import add_rule
 from rucio.core.scope import add_scope
-from rucio.daemons.transmogrifier.transmogrifier import run
+from rucio.daemons.transmogrifier.transmogrifier import run, is_matching_subscription, SubscriptionMatcher
 from rucio.db.sqla.constants import DIDType
 from rucio.web.rest.authentication import APP as auth_app
 from rucio.web.rest.subscription import APP as subs_app
@@ -131,6 +131,34 @@ class TestSubscriptionCoreApi():
             assert_equal(rule[3], 2)
 
 
+class TestSubscriptionMatcher():
+
+    def test_matcher_is_consistent(self):
+        """ SUBSCRIPTION (DAEMON): Test that the subscription matcher gives the same results as is_matching_subscription """
+        filters = [{'scope': ['data12'], 'project': ['data12_8TeV']},
+                   {'scope': ['data1.*'], 'datatype': 'AOD'},
+                   {'project': ['data12_8TeV', 'data13_900GeV'], 'datatype': ['AOD', 'ESD'], 'excluded_pattern': r'.*\.express\..*'},
+                   {'datatype': ['AOD'], 'stream': 'physics_Main', 'pattern': r'data12.*'},
+                   {'stream': '(physics|express)_.*', 'split_rule': 'true'},
+                   {'account': ['tier0'], 'project': 'data13'},
+                   {'pattern': r'.*AOD.*'}]
+        subscriptions = [{'id': uuid(), 'name': uuid(), 'filter': dumps(filter)} for filter in filters]
+        subscriptions.append({'id': uuid(), 'name': uuid(), 'filter': 'not json'})
+        matcher = SubscriptionMatcher(subscriptions)
+
+        for scope in ['data12_8TeV', 'data13_900GeV', 'mc12_8TeV']:
+            for datatype in ['AOD', 'ESD', 'NTUP']:
+                for stream in ['physics_Main', 'express_express', None]:
+                    for hidden in [False, True]:
+                        name = '%s.00123.%s.merge.%s' % (scope, stream, datatype)
+                        did = {'scope': scope, 'name': name}
+                        metadata = {'scope': scope, 'name': name, 'project': scope, 'datatype': datatype, 'hidden': hidden, 'account': 'tier0'}
+                        if stream:
+                            metadata['stream'] = stream
+                        expected = [sub['id'] for sub in subscriptions if is_matching_subscription(sub, did, metadata)]
+                        assert_equal([sub['id'] for sub, _ in matcher.match(did, metadata)], expected)
+
+
 class TestSubscriptionRestApi():
 
     @classmethod
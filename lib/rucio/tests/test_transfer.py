@@ -0,0 +1,48 @@
+# Copyright 2019 CERN for the benefit of the ATLAS collaboration.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from nose.tools import assert_equal, assert_true
+
+from rucio.common.utils import generate_uuid
+from rucio.core import rse as rse_core
+from rucio.core import transfer
+
+
+class TestTransferCore(object):
+
+    def setup(self):
+        self.original = getattr(transfer, '__list_transfer_requests_and_source_replicas')
+
+    def tearDown(self):
+        setattr(transfer, '__list_transfer_requests_and_source_replicas', self.original)
+
+    def test_deleted_rse(self):
+        """ TRANSFER (CORE): A request to a RSE deleted after the plan was built is skipped, not the others """
+        rse_id = rse_core.get_rse_id('MOCK')
+        deleted_rse_id = generate_uuid()
+
+        def list_requests(**kwargs):
+            # req_id, rule_id, scope, name, md5, adler32, bytes, activity, attributes, previous_attempt_id, dest_rse_id,
+            # source_rse_id, rse, deterministic, rse_type, path, retry_count, src_url, ranking, link_ranking
+            return [('request_1', None, 'mock', 'file_1', None, None, 1, 'User Subscriptions', None, None, deleted_rse_id,
+                     rse_id, 'MOCK', True, 'DISK', None, 0, None, 0, 1),
+                    ('request_2', None, 'mock', 'file_2', None, None, 1, 'User Subscriptions', None, None, rse_id,
+                     None, None, None, None, None, 0, None, None, None)]
+        setattr(transfer, '__list_transfer_requests_and_source_replicas', list_requests)
+
+        transfer.TRANSFER_PLANNER.get_plan(session=None)
+        transfers, reqs_no_source, _, _ = transfer.get_transfer_requests_and_source_replicas()
+        assert_equal(transfers, {})
+        assert_equal(reqs_no_source, ['request_2'])
+        assert_true(transfer.TRANSFER_PLANNER.plan is None)
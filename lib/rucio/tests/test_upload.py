@@ -0,0 +1,95 @@
+# Copyright 2019 CERN for the benefit of the ATLAS collaboration.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# PY3K COMPATIBLE
+
+from nose.tools import assert_equal, raises
+
+from rucio.client.uploadclient import UploadClient
+from rucio.common.exception import DataIdentifierAlreadyExists
+
+
+class FakeClient(object):
+    '''
+    Client recording the registration calls, with a catalogue of existing file DIDs and replicas
+    '''
+    account = 'root'
+
+    def __init__(self, dids=None, replicas=None):
+        '''
+        :param dids: Dictionary {(scope, name): adler32} of the existing file DIDs.
+        :param replicas: Dictionary {(scope, name): list of RSEs} of the existing replicas.
+        '''
+        self.dids = dids or {}
+        self.replicas = replicas or {}
+        self.added_replicas = {}
+        self.added_rules = []
+
+    def get_metadata_bulk(self, dids):
+        for did in dids:
+            if (did['scope'], did['name']) in self.dids:
+                yield {'scope': did['scope'], 'name': did['name'], 'adler32': self.dids[(did['scope'], did['name'])]}
+
+    def list_replicas(self, dids, all_states=False):
+        replicas = [{'scope': did['scope'], 'name': did['name'], 'rses': dict((rse, []) for rse in self.replicas[(did['scope'], did['name'])])}
+                    for did in dids if (did['scope'], did['name']) in self.replicas]
+        # like the server, an empty result is an empty string
+        return iter(replicas or [''])
+
+    def add_replicas(self, rse, files):
+        self.added_replicas.setdefault(rse, []).extend(file['name'] for file in files)
+
+    def add_replication_rule(self, dids, copies, rse_expression, lifetime=None):
+        self.added_rules.append((rse_expression, lifetime, sorted(did['name'] for did in dids)))
+
+
+def file_item(name, rse, adler32='0cc737eb', lifetime=None, dataset=None):
+    item = {'did_scope': 'mock', 'did_name': name, 'rse': rse, 'bytes': 1, 'adler32': adler32, 'md5': None, 'meta': {}, 'state': 'C'}
+    if lifetime:
+        item['lifetime'] = lifetime
+    if dataset:
+        item['dataset_did_str'] = 'mock:%s' % dataset
+    return item
+
+
+class TestUploadClientRegistration(object):
+
+    def test_register_files_grouping(self):
+        """ UPLOAD (CLIENT): The bulk registration groups the replicas per RSE and the rules per RSE and lifetime """
+        client = FakeClient()
+        files = [file_item('file_1', 'MOCK'), file_item('file_2', 'MOCK'), file_item('file_3', 'MOCK', lifetime=3600),
+                 file_item('file_4', 'MOCK2'), file_item('file_5', 'MOCK2', dataset='dataset_1')]
+        UploadClient(_client=client)._register_files(files, registered_dataset_dids={'mock:dataset_1'})
+
+        assert_equal(dict((rse, sorted(names)) for rse, names in client.added_replicas.items()),
+                     {'MOCK': ['file_1', 'file_2', 'file_3'], 'MOCK2': ['file_4', 'file_5']})
+        # the file of the dataset gets no rule of its own
+        assert_equal(sorted(client.added_rules, key=lambda rule: (rule[0], rule[1] or 0)),
+                     [('MOCK', None, ['file_1', 'file_2']), ('MOCK', 3600, ['file_3']), ('MOCK2', None, ['file_4'])])
+
+    def test_register_existing_files(self):
+        """ UPLOAD (CLIENT): The bulk registration only adds the missing replicas of existing DIDs, without rules """
+        client = FakeClient(dids={('mock', 'file_1'): '0cc737eb', ('mock', 'file_2'): '0cc737eb'},
+                            replicas={('mock', 'file_1'): ['MOCK']})
+        files = [file_item('file_1', 'MOCK'), file_item('file_2', 'MOCK'), file_item('file_3', 'MOCK')]
+        UploadClient(_client=client)._register_files(files, registered_dataset_dids=set())
+
+        assert_equal(dict((rse, sorted(names)) for rse, names in client.added_replicas.items()), {'MOCK': ['file_2', 'file_3']})
+        assert_equal(client.added_rules, [('MOCK', None, ['file_3'])])
+
+    @raises(DataIdentifierAlreadyExists)
+    def test_register_existing_file_without_replicas(self):
+        """ UPLOAD (CLIENT): The checksum of an existing DID without replicas is checked """
+        client = FakeClient(dids={('mock', 'file_1'): 'deadbeef'})
+        UploadClient(_client=client)._register_files([file_item('file_1', 'MOCK')], registered_dataset_dids=set())
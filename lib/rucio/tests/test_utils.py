@@ -15,10 +15,13 @@
 import unittest
 import tempfile
 
+from io import BytesIO
+
 from nose.tools import assert_raises, assert_equal, assert_is_instance, assert_is_not_none
 from re import match
 from rucio.common.exception import InvalidType
-from rucio.common.utils import md5, adler32, parse_did_filter_from_string
+from rucio.common.utils import (md5, adler32, checksums, checksums_of_files, parse_did_filter_from_string, ChecksumCalculator,
+                                iter_replicas_metalink, parse_replica_json, parse_replicas_from_string)
 
 
 class TestUtils(unittest.TestCase):
@@ -57,6 +60,27 @@ class TestUtils(unittest.TestCase):
             adler32('no_file')
         assert_equal('FATAL - could not get Adler32 checksum of file no_file - [Errno 2] No such file or directory: \'no_file\'', e.exception.message)
 
+    def test_utils_checksums(self):
+        """(COMMON/UTILS): test calculating several checksums of files in a single pass"""
+        assert_equal(checksums(self.temp_file_1.name, ('adler32', 'md5', 'sha256')),
+                     {'adler32': '198d03ff', 'md5': '31d50dd6285b9ff9f8611d0762265d04',
+                      'sha256': 'd1b81a303d340fb689c6b6f4f474d9e04f314ed9ad8925686e4106452b53181b'})
+
+        temp_file_2 = tempfile.NamedTemporaryFile()
+        temp_file_2.write(b'\n'.join([b'hello test'] * 1000000))
+        temp_file_2.flush()
+        with open(temp_file_2.name, 'rb') as f:
+            data = f.read()
+        calculator = ChecksumCalculator(('adler32', 'md5'))
+        for i in range(0, len(data), 1000):
+            calculator.update(data[i:i + 1000])
+        assert_equal(checksums_of_files([self.temp_file_1.name, temp_file_2.name], threads=2),
+                     {self.temp_file_1.name: {'adler32': '198d03ff', 'md5': '31d50dd6285b9ff9f8611d0762265d04'},
+                      temp_file_2.name: calculator.hexdigests()})
+        assert_equal(calculator.hexdigests()['adler32'], adler32(temp_file_2.name))
+        assert_equal(calculator.hexdigests()['md5'], md5(temp_file_2.name))
+        temp_file_2.close()
+
     def test_parse_did_filter_string(self):
         """(COMMON/UTILS): test parsing of did filter string"""
         test_cases = [{
@@ -81,3 +105,40 @@ class TestUtils(unittest.TestCase):
         with assert_raises(InvalidType):
             input = 'type=g'
             parse_did_filter_from_string(input)
+
+    def test_iter_replicas_metalink(self):
+        """(COMMON/UTILS): test parsing a metalink incrementally and a replica of the JSON stream"""
+        metalink = '''<?xml version="1.0" encoding="UTF-8"?>
+<metalink xmlns="urn:ietf:params:xml:ns:metalink">
+ <file name="file_1">
+  <parents>
+   <did>user.jdoe:dataset_1</did>
+  </parents>
+  <identity>user.jdoe:file_1</identity>
+  <hash type="adler32">0cc737eb</hash>
+  <size>10</size>
+  <url location="MOCK" domain="wan" priority="1" client_extract="false">root://mock.cern.ch/file_1</url>
+  <url location="MOCK2" domain="wan" priority="2" client_extract="false">https://mock2.cern.ch/file_1</url>
+ </file>
+ <file name="file_2">
+  <identity>user.jdoe:file_2</identity>
+  <size>20</size>
+  <url location="MOCK" domain="wan" priority="1" client_extract="true">root://mock.cern.ch/archive.zip</url>
+ </file>
+</metalink>
+'''
+        files = list(iter_replicas_metalink(BytesIO(metalink.encode('utf-8'))))
+        assert_equal(files, parse_replicas_from_string(metalink))
+        assert_equal([f['did'] for f in files], ['user.jdoe:file_1', 'user.jdoe:file_2'])
+        assert_equal(files[0]['parent_dids'], set(['user.jdoe:dataset_1']))
+        assert_equal(files[1]['sources'][0]['client_extract'], True)
+
+        replica = {'scope': 'user.jdoe', 'name': 'file_1', 'bytes': 10, 'adler32': '0cc737eb', 'md5': None,
+                   'parents': ['user.jdoe:dataset_1'],
+                   'pfns': {'https://mock2.cern.ch/file_1': {'rse': 'MOCK2', 'domain': 'wan', 'priority': 2, 'client_extract': False},
+                            'root://mock.cern.ch/file_1': {'rse': 'MOCK', 'domain': 'wan', 'priority': 1, 'client_extract': False}}}
+        file_item = parse_replica_json(replica)
+        assert_equal(file_item['did'], files[0]['did'])
+        assert_equal(file_item['parent_dids'], files[0]['parent_dids'])
+        assert_equal([(s['pfn'], s['rse'], int(s['priority'])) for s in file_item['sources']],
+                     [(s['pfn'], s['rse'], int(s['priority'])) for s in files[0]['sources']])
@@ -0,0 +1,94 @@
+# Copyright 2019 CERN for the benefit of the ATLAS collaboration.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import random
+import threading
+
+from nose.tools import assert_equal, assert_true
+
+from rucio.common.utils import WORK_BUCKETS, generate_uuid, work_bucket
+from rucio.core.heartbeat import die, live
+from rucio.core.message import add_message, retrieve_messages, truncate_messages
+from rucio.core.work_lease import acquire, release, list_leases, bucket_ranges
+
+
+class TestWorkLease:
+
+    def __pid(self):
+        return random.randint(0, 2**16)
+
+    def __thread(self):
+        thread = threading.Thread()
+        thread.start()
+        return thread
+
+    def __nb_buckets(self, lease):
+        return sum(last - first + 1 for first, last in lease['buckets'])
+
+    def test_single_worker(self):
+        """ WORK LEASE (CORE): A single worker gets all the buckets """
+        executable = 'test_' + generate_uuid()
+        pid, thread = self.__pid(), self.__thread()
+        assert_equal(acquire(executable, 'host0', pid, thread), {'buckets': [(0, WORK_BUCKETS - 1)], 'nr_workers': 1})
+        assert_equal(acquire(executable, 'host0', pid, thread), {'buckets': [(0, WORK_BUCKETS - 1)], 'nr_workers': 1})
+
+    def test_rebalance(self):
+        """ WORK LEASE (CORE): Buckets are shared by the workers and only the buckets of departed workers move """
+        executable = 'test_' + generate_uuid()
+        pids = [self.__pid() for _ in range(3)]
+        threads = [self.__thread() for _ in range(3)]
+
+        live(executable, 'host0', pids[0], threads[0])
+        acquire(executable, 'host0', pids[0], threads[0])
+        # The new worker is seen by its heartbeat, it does not take the live leases of the first one
+        live(executable, 'host1', pids[1], threads[1])
+        assert_equal(acquire(executable, 'host1', pids[1], threads[1]), {'buckets': [], 'nr_workers': 2})
+        # The first worker releases half of its buckets, which are taken by the second one
+        assert_equal(acquire(executable, 'host0', pids[0], threads[0]), {'buckets': [(0, WORK_BUCKETS // 2 - 1)], 'nr_workers': 2})
+        assert_equal(acquire(executable, 'host1', pids[1], threads[1])['buckets'], [(WORK_BUCKETS // 2, WORK_BUCKETS - 1)])
+
+        live(executable, 'host2', pids[2], threads[2])
+        assert_equal(acquire(executable, 'host2', pids[2], threads[2])['buckets'], [])
+        for _ in range(2):
+            leases = [acquire(executable, 'host%i' % i, pids[i], threads[i]) for i in range(3)]
+        assert_equal(sum(self.__nb_buckets(lease) for lease in leases), WORK_BUCKETS)
+        assert_true(all(self.__nb_buckets(lease) <= -(-WORK_BUCKETS // 3) for lease in leases))
+        assert_equal(len(list_leases(executable)), 3)
+
+        # The buckets of a departed worker are taken over, the others keep theirs
+        release(executable, 'host2', pids[2], threads[2])
+        die(executable, 'host2', pids[2], threads[2])
+        kept = [acquire(executable, 'host%i' % i, pids[i], threads[i])['buckets'] for i in range(2)]
+        assert_equal(sum(last - first + 1 for ranges in kept for first, last in ranges), WORK_BUCKETS)
+        for i in range(2):
+            assert_true(set(bucket for first, last in leases[i]['buckets'] for bucket in range(first, last + 1)) <=
+                        set(bucket for first, last in kept[i] for bucket in range(first, last + 1)))
+
+    def test_bucket_ranges(self):
+        """ WORK LEASE (CORE): Bucket numbers are collapsed into ranges """
+        assert_equal(bucket_ranges([5, 1, 2, 3, 7, 8]), [(1, 3), (5, 5), (7, 8)])
+        assert_equal(bucket_ranges([]), [])
+        assert_equal(work_bucket('file_1'), work_bucket('file_1'))
+        assert_true(0 <= work_bucket('file_1') < WORK_BUCKETS)
+
+    def test_retrieve_messages(self):
+        """ WORK LEASE (CORE): Messages are retrieved by bucket ranges """
+        truncate_messages()
+        for i in range(20):
+            add_message('test', {'foo': i})
+        first_half = retrieve_messages(bulk=100, buckets=[(0, WORK_BUCKETS // 2 - 1)])
+        second_half = retrieve_messages(bulk=100, buckets=[(WORK_BUCKETS // 2, WORK_BUCKETS - 1)])
+        assert_equal(len(first_half) + len(second_half), 20)
+        assert_equal(retrieve_messages(bulk=100, buckets=[]), [])
+        truncate_messages()
@@ -26,6 +26,7 @@ except ImportError:
     JSONDecodeError = ValueError
 import logging
 import sys
+import threading
 import time
 import traceback
 try:
@@ -35,7 +36,7 @@ except ImportError:
 import uuid
 
 import requests
-from requests.adapters import ReadTimeout
+from requests.adapters import HTTPAdapter, ReadTimeout
 from requests.packages.urllib3 import disable_warnings  # pylint: disable=import-error
 
 from dogpile.cache import make_region
@@ -65,6 +66,32 @@ logging.basicConfig(stream=sys.stdout,
 REGION_SHORT = make_region().configure('dogpile.cache.memory',
                                        expiration_time=1800)
 
+# Keep-alive HTTP sessions, one per FTS host, shared by all the threads of the process
+HTTP_SESSIONS = {}
+HTTP_SESSIONS_LOCK = threading.Lock()
+HTTP_POOL_SIZE = int(config_get('conveyor', 'fts_http_pool_size', False, 10))
+
+
+def get_http_session(external_host):
+    """
+    Return the persistent HTTP session of a FTS host, so that the connections
+    are reused across queries instead of being opened for each of them.
+
+    :param external_host: The FTS host as a string.
+    :returns: A requests.Session.
+    """
+    fts_session = HTTP_SESSIONS.get(external_host)
+    if fts_session is None:
+        with HTTP_SESSIONS_LOCK:
+            fts_session = HTTP_SESSIONS.get(external_host)
+            if fts_session is None:
+                fts_session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+                fts_session.mount('https://', adapter)
+                fts_session.mount('http://', adapter)
+                HTTP_SESSIONS[external_host] = fts_session
+    return fts_session
+
 
 class FTS3Transfertool(Transfertool):
     """
@@ -412,7 +439,7 @@ class FTS3Transfertool(Transfertool):
             transfer_ids = [transfer_ids]
 
         responses = {}
-        fts_session = requests.Session()
+        fts_session = get_http_session(self.external_host)
         xfer_ids = ','.join(transfer_ids)
         jobs = fts_session.get('%s/jobs/%s?files=file_state,dest_surl,finish_time,start_time,reason,source_surl,file_metadata' % (self.external_host, xfer_ids),
                                verify=self.verify,
@@ -39,8 +39,8 @@ from rucio.api.account_limit import get_account_limits, get_account_limit, get_a
 from rucio.api.rule import list_replication_rules
 from rucio.api.scope import add_scope, get_scopes
 from rucio.common.exception import AccountNotFound, Duplicate, AccessDenied, RucioException, RuleNotFound, RSENotFound, IdentityError, CounterNotFound
-from rucio.common.utils import generate_http_error_flask, APIEncoder, render_json
-from rucio.web.rest.flaskapi.v1.common import before_request, after_request, check_accept_header_wrapper_flask
+from rucio.common.utils import generate_http_error_flask, render_json
+from rucio.web.rest.flaskapi.v1.common import before_request, after_request, check_accept_header_wrapper_flask, stream_response
 
 
 LOGGER = getLogger("rucio.account")
@@ -376,11 +376,7 @@ class Account(MethodView):
         for k, v in request.args.items():
             filter[k] = v
 
-        data = ""
-        for account in list_accounts(filter=filter):
-            data += render_json(**account) + "\n"
-
-        return Response(data, content_type="application/x-json-stream")
+        return stream_response(list_accounts(filter=filter))
 
 
 class AccountLimits(MethodView):
@@ -478,10 +474,7 @@ class Identities(MethodView):
         """
 
         try:
-            data = ""
-            for identity in list_identities(account):
-                data += render_json(**identity) + "\n"
-            return Response(data, content_type="application/x-json-stream")
+            return stream_response(list_identities(account))
         except AccountNotFound as error:
             return generate_http_error_flask(404, 'AccountNotFound', error.args[0])
         except Exception as error:
@@ -555,10 +548,7 @@ class Rules(MethodView):
             filters[k] = v
 
         try:
-            data = ""
-            for rule in list_replication_rules(filters=filters):
-                data += dumps(rule, cls=APIEncoder) + '\n'
-            return Response(data, content_type="application/x-json-stream")
+            return stream_response(list_replication_rules(filters=filters))
         except RuleNotFound as error:
             return generate_http_error_flask(404, 'RuleNotFound', error.args[0])
         except Exception as error:
@@ -619,10 +609,7 @@ class Usage1(MethodView):
         """
 
         try:
-            data = ""
-            for usage in get_account_usage(account=account, rse=None, issuer=request.environ.get('issuer')):
-                data += dumps(usage, cls=APIEncoder) + '\n'
-            return Response(data, content_type="application/x-json-stream")
+            return stream_response(get_account_usage(account=account, rse=None, issuer=request.environ.get('issuer')))
         except AccountNotFound as error:
             return generate_http_error_flask(404, 'AccountNotFound', error.args[0])
         except AccessDenied as error:
@@ -653,10 +640,7 @@ class Usage2(MethodView):
         :returns: Line separated list of account usages.
         """
         try:
-            data = ""
-            for usage in get_account_usage(account=account, rse=rse, issuer=request.environ.get('issuer')):
-                data += dumps(usage, cls=APIEncoder) + '\n'
-            return Response(data, content_type="application/x-json-stream")
+            return stream_response(get_account_usage(account=account, rse=rse, issuer=request.environ.get('issuer')))
         except AccountNotFound as error:
             return generate_http_error_flask(404, 'AccountNotFound', error.args[0])
         except RSENotFound as error:
@@ -22,15 +22,14 @@
 # PY3K COMPATIBLE
 
 from __future__ import print_function
-from json import dumps
 from logging import getLogger, StreamHandler, DEBUG
 from traceback import format_exc
 
-from flask import Flask, Blueprint, Response
+from flask import Flask, Blueprint
 from flask.views import MethodView
 
 from rucio.api.did import list_archive_content
-from rucio.web.rest.flaskapi.v1.common import before_request, after_request, check_accept_header_wrapper_flask
+from rucio.web.rest.flaskapi.v1.common import before_request, after_request, check_accept_header_wrapper_flask, stream_response
 
 LOGGER, SH = getLogger("rucio.meta"), StreamHandler()
 SH.setLevel(DEBUG)
@@ -55,10 +54,7 @@ class Archive(MethodView):
         :status 500: Internal Error.
         """
         try:
-            data = ""
-            for file in list_archive_content(scope=scope, name=name):
-                data += dumps(file) + '\n'
-            return Response(data, content_type="application/x-json-stream")
+            return stream_response(list_archive_content(scope=scope, name=name))
         except Exception as error:
             print(format_exc())
             return error, 500
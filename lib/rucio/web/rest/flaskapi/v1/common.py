@@ -21,19 +21,32 @@
 
 from __future__ import print_function
 from functools import wraps
-from flask import request
+from flask import request, Response, stream_with_context
+from json import dumps
 from time import time
 from traceback import format_exc
 
 from rucio.api.authentication import validate_auth_token
+from rucio.common.config import config_get
 from rucio.common.exception import RucioException
-from rucio.common.utils import generate_http_error_flask, generate_uuid
+from rucio.common.utils import generate_http_error_flask, generate_uuid, APIEncoder
+from rucio.core.monitor import start_prometheus_server
+from rucio.db.sqla.session import PROFILER
+
+
+STREAM_CHUNK_SIZE = int(config_get('api', 'stream_chunk_size', raise_exception=False, default=100))
 
 
 def before_request():
     if request.environ.get('REQUEST_METHOD') == 'OPTIONS':
         return '', 200
 
+    # Expose the metrics of the process once it serves requests
+    start_prometheus_server()
+
+    if PROFILER:
+        PROFILER.begin_request('%s %s%s' % (request.environ.get('REQUEST_METHOD'), request.environ.get('SCRIPT_NAME'), request.url_rule.rule if request.url_rule else ''))
+
     auth_token = request.environ.get('HTTP_X_RUCIO_AUTH_TOKEN')
 
     try:
@@ -64,6 +77,8 @@ def after_request(response):
         response.headers['Cache-Control'] = 'post-check=0, pre-check=0'
         response.headers['Pragma'] = 'no-cache'
 
+    if PROFILER:
+        PROFILER.end_request()
     return response
 
 
@@ -91,3 +106,46 @@ def check_accept_header_wrapper_flask(supported_content_types):
             return f(*args, **kwargs)
         return decorated
     return wrapper
+
+
+def json_line(row):
+    """ Serialize a row as one line of an application/x-json-stream response. """
+    return dumps(row, cls=APIEncoder) + '\n'
+
+
+def stream_response(rows, serializer=json_line, content_type='application/x-json-stream', header=None, footer=None, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Build a streaming Response from an iterable of rows.
+
+    The first row is fetched eagerly, so that the exceptions raised when the underlying
+    query starts (e.g. DataIdentifierNotFound) still reach the error handling of the caller.
+    The remaining rows are serialized lazily and sent in chunks of chunk_size rows, which
+    bounds the memory used by the worker independently of the number of rows.
+
+    :param rows: Iterable of rows.
+    :param serializer: Function returning the string representation of a row.
+    :param content_type: Content type of the response.
+    :param header: Optional string sent before the rows.
+    :param footer: Optional string sent after the rows.
+    :param chunk_size: Number of rows per chunk.
+    :returns: Flask Response.
+    """
+    rows = iter(rows)
+    try:
+        first = [serializer(next(rows))]
+    except StopIteration:
+        first = []
+
+    def generate():
+        buffer = ([header] if header else []) + first
+        for row in rows:
+            buffer.append(serializer(row))
+            if len(buffer) >= chunk_size:
+                yield ''.join(buffer)
+                buffer = []
+        if footer:
+            buffer.append(footer)
+        if buffer:
+            yield ''.join(buffer)
+
+    return Response(stream_with_context(generate()), content_type=content_type)
@@ -26,7 +26,7 @@
 # PY3K COMPATIBLE
 
 from __future__ import print_function
-from json import dumps, loads
+from json import loads
 from traceback import format_exc
 
 from flask import Flask, Blueprint, Response, request
@@ -36,7 +36,7 @@ from rucio.api.did import (add_did, add_dids, list_content, list_content_history
                            list_dids, list_files, scope_list, get_did, set_metadata,
                            get_metadata, set_status, attach_dids, detach_dids,
                            attach_dids_to_dids, get_dataset_by_guid, list_parent_dids,
-                           create_did_sample, list_new_dids, resurrect)
+                           create_did_sample, list_new_dids, resurrect, get_metadata_bulk)
 from rucio.api.rule import list_replication_rules, list_associated_replication_rules_for_file
 from rucio.common.exception import (ScopeNotFound, DataIdentifierNotFound,
                                     DataIdentifierAlreadyExists, DuplicateContent,
@@ -45,8 +45,8 @@ from rucio.common.exception import (ScopeNotFound, DataIdentifierNotFound,
                                     UnsupportedStatus, UnsupportedOperation,
                                     RSENotFound, RucioException, RuleNotFound,
                                     InvalidMetadata)
-from rucio.common.utils import generate_http_error_flask, render_json, APIEncoder
-from rucio.web.rest.flaskapi.v1.common import before_request, after_request, check_accept_header_wrapper_flask
+from rucio.common.utils import generate_http_error_flask, render_json
+from rucio.web.rest.flaskapi.v1.common import before_request, after_request, check_accept_header_wrapper_flask, stream_response
 
 
 class Scope(MethodView):
@@ -96,10 +96,7 @@ class Scope(MethodView):
             recursive = True
 
         try:
-            data = ""
-            for did in scope_list(scope=scope, name=name, recursive=recursive):
-                data += render_json(**did) + '\n'
-            return Response(data, content_type='application/x-json-stream')
+            return stream_response(scope_list(scope=scope, name=name, recursive=recursive))
         except DataIdentifierNotFound as error:
             return generate_http_error_flask(404, 'DataIdentifierNotFound', error.args[0])
         except Exception as error:
@@ -147,6 +144,8 @@ class Search(MethodView):
         :query length.gte: Number of attached DIDs greater than or equal to
         :query length.lte: Number of attached DIDs less than or equal to
         :query name: Name or pattern of a DID name
+        :query limit: Maximum number of DIDs returned, sorted by name
+        :query marker: Name of the last DID of the previous page, the DIDs are listed after it
         :resheader Content-Type: application/x-json-stream
         :status 200: DIDs found
         :status 401: Invalid Auth Token
@@ -160,6 +159,8 @@ class Search(MethodView):
         long = False
         recursive = False
         type = 'collection'
+        limit = None
+        marker = None
         for k, v in request.args.items():
             if k == 'type':
                 type = v
@@ -167,14 +168,15 @@ class Search(MethodView):
                 long = v == '1'
             elif k == 'recursive':
                 recursive = v == 'True'
+            elif k == 'limit':
+                limit = int(v)
+            elif k == 'marker':
+                marker = v
             else:
                 filters[k] = v
 
         try:
-            data = ""
-            for did in list_dids(scope=scope, filters=filters, type=type, long=long, recursive=recursive):
-                data += dumps(did) + '\n'
-            return Response(data, content_type='application/x-json-stream')
+            return stream_response(list_dids(scope=scope, filters=filters, type=type, long=long, recursive=recursive, limit=limit, marker=marker))
         except UnsupportedOperation as error:
             return generate_http_error_flask(409, 'UnsupportedOperation', error.args[0])
         except KeyNotFound as error:
@@ -519,10 +521,7 @@ class Attachment(MethodView):
         :returns: Dictionary with DID metadata
         """
         try:
-            data = ""
-            for did in list_content(scope=scope, name=name):
-                data += render_json(**did) + '\n'
-            return Response(data, content_type="application/x-json-stream")
+            return stream_response(list_content(scope=scope, name=name))
         except DataIdentifierNotFound as error:
             return generate_http_error_flask(404, 'DataIdentifierNotFound', error.args[0])
         except RucioException as error:
@@ -647,10 +646,7 @@ class AttachmentHistory(MethodView):
         :returns: Stream of dictionarys with DIDs
         """
         try:
-            data = ""
-            for did in list_content_history(scope=scope, name=name):
-                data += render_json(**did) + '\n'
-            return Response(data, content_type="application/x-json-stream")
+            return stream_response(list_content_history(scope=scope, name=name))
         except DataIdentifierNotFound as error:
             return generate_http_error_flask(404, 'DataIdentifierNotFound', error.args[0])
         except RucioException as error:
@@ -684,10 +680,7 @@ class Files(MethodView):
         if "long" in request.args:
             long = True
         try:
-            data = ""
-            for file in list_files(scope=scope, name=name, long=long):
-                data += dumps(file) + "\n"
-            return Response(data, content_type="application/x-json-stream")
+            return stream_response(list_files(scope=scope, name=name, long=long))
         except DataIdentifierNotFound as error:
             return generate_http_error_flask(404, 'DataIdentifierNotFound', error.args[0])
         except RucioException as error:
@@ -716,10 +709,7 @@ class Parents(MethodView):
         :returns: A list of dictionary containing all dataset information.
         """
         try:
-            data = ""
-            for dataset in list_parent_dids(scope=scope, name=name):
-                data += render_json(**dataset) + "\n"
-            return Response(data, content_type="application/x-json-stream")
+            return stream_response(list_parent_dids(scope=scope, name=name))
         except DataIdentifierNotFound as error:
             return generate_http_error_flask(404, 'DataIdentifierNotFound', error.args[0])
         except RucioException as error:
@@ -809,6 +799,38 @@ class Meta(MethodView):
         return "Created", 201
 
 
+class BulkMeta(MethodView):
+
+    @check_accept_header_wrapper_flask(['application/x-json-stream'])
+    def post(self):
+        """
+        List the meta of a list of data identifiers.
+
+        .. :quickref: BulkMeta; List the meta of DIDs.
+
+        :<json list dids: The dids [{'scope': scope, 'name': name}, ...].
+        :resheader Content-Type: application/x-json-stream
+        :status 200: OK
+        :status 400: Cannot decode json parameter list
+        :status 401: Invalid Auth Token
+        :status 406: Not Acceptable
+        :status 500: Database Exception
+        :returns: A dictionary containing all meta, for each existing data identifier.
+        """
+        json_data = request.data
+        try:
+            dids = loads(json_data)['dids']
+        except (ValueError, KeyError):
+            return generate_http_error_flask(400, 'ValueError', 'Cannot decode json parameter list')
+        try:
+            return stream_response(get_metadata_bulk(dids))
+        except RucioException as error:
+            return generate_http_error_flask(500, error.__class__.__name__, error.args[0])
+        except Exception as error:
+            print(format_exc())
+            return error, 500
+
+
 class Rules(MethodView):
 
     @check_accept_header_wrapper_flask(['application/x-json-stream'])
@@ -830,10 +852,7 @@ class Rules(MethodView):
         """
 
         try:
-            data = ""
-            for rule in list_replication_rules({'scope': scope, 'name': name}):
-                data += dumps(rule, cls=APIEncoder) + '\n'
-            return Response(data, content_type="application/x-json-stream")
+            return stream_response(list_replication_rules({'scope': scope, 'name': name}))
         except RuleNotFound as error:
             return generate_http_error_flask(404, 'RuleNotFound', error.args[0])
         except RucioException as error:
@@ -862,10 +881,7 @@ class AssociatedRules(MethodView):
         :returns: List of associated rules.
         """
         try:
-            data = ""
-            for rule in list_associated_replication_rules_for_file(scope=scope, name=name):
-                data += dumps(rule, cls=APIEncoder) + '\n'
-            return Response(data, content_type="application/x-json-stream")
+            return stream_response(list_associated_replication_rules_for_file(scope=scope, name=name))
         except RucioException as error:
             return generate_http_error_flask(500, error.__class__.__name__, error.args[0])
         except Exception as error:
@@ -891,10 +907,7 @@ class GUIDLookup(MethodView):
         :returns: List of files for given GUID
         """
         try:
-            data = ""
-            for dataset in get_dataset_by_guid(guid):
-                data += dumps(dataset, cls=APIEncoder) + '\n'
-            return Response(data, content_type="application/x-json-stream")
+            return stream_response(get_dataset_by_guid(guid))
         except DataIdentifierNotFound as error:
             return generate_http_error_flask(404, 'DataIdentifierNotFound', error.args[0])
         except RucioException as error:
@@ -971,10 +984,7 @@ class NewDIDs(MethodView):
         if 'type' in request.args:
             type = request.args.get('type')
         try:
-            data = ""
-            for did in list_new_dids(type):
-                data += dumps(did, cls=APIEncoder) + '\n'
-            return Response(data, content_type="application/x-json-stream")
+            return stream_response(list_new_dids(type))
         except RucioException as error:
             return generate_http_error_flask(500, error.__class__.__name__, error.args[0])
         except Exception as error:
@@ -1052,6 +1062,8 @@ bp.add_url_rule('/<scope>/<name>/dids', view_func=attachment_view, methods=['get
 meta_view = Meta.as_view('meta')
 bp.add_url_rule('/<scope>/<name>/meta', view_func=meta_view, methods=['get', ])
 bp.add_url_rule('/<scope>/<name>/meta/<key>', view_func=meta_view, methods=['post', ])
+bulkmeta_view = BulkMeta.as_view('bulkmeta')
+bp.add_url_rule('/bulkmeta', view_func=bulkmeta_view, methods=['post', ])
 rules_view = Rules.as_view('rules')
 bp.add_url_rule('/<scope>/<name>/rules', view_func=rules_view, methods=['get', ])
 parents_view = Parents.as_view('parents')
@@ -28,8 +28,8 @@ from flask.views import MethodView
 
 from rucio.api.lifetime_exception import list_exceptions, add_exception, update_exception
 from rucio.common.exception import LifetimeExceptionNotFound, UnsupportedOperation, InvalidObject, RucioException, AccessDenied, LifetimeExceptionDuplicate
-from rucio.common.utils import generate_http_error_flask, APIEncoder
-from rucio.web.rest.flaskapi.v1.common import before_request, after_request, check_accept_header_wrapper_flask
+from rucio.common.utils import generate_http_error_flask
+from rucio.web.rest.flaskapi.v1.common import before_request, after_request, check_accept_header_wrapper_flask, stream_response
 
 
 class LifetimeException(MethodView):
@@ -50,10 +50,7 @@ class LifetimeException(MethodView):
         :status 500: Internal Error.
         """
         try:
-            data = ""
-            for exception in list_exceptions():
-                data += dumps(exception, cls=APIEncoder) + '\n'
-            return Response(data, content_type="application/x-json-stream")
+            return stream_response(list_exceptions())
         except LifetimeExceptionNotFound as error:
             return generate_http_error_flask(404, 'LifetimeExceptionNotFound', error.args[0])
         except RucioException as error:
@@ -129,11 +126,7 @@ class LifetimeExceptionId(MethodView):
         :returns: List of exceptions.
         """
         try:
-            data = ""
-            for exception in list_exceptions(exception_id):
-                data += dumps(exception, cls=APIEncoder) + '\n'
-
-            return Response(data, content_type="application/x-json-stream")
+            return stream_response(list_exceptions(exception_id))
         except LifetimeExceptionNotFound as error:
             return generate_http_error_flask(404, 'LifetimeExceptionNotFound', error.args[0])
         except RucioException as error:
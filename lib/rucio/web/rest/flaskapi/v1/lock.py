@@ -23,13 +23,13 @@
 # PY3K COMPATIBLE
 
 from logging import getLogger, StreamHandler, DEBUG
-from flask import Flask, Blueprint, Response, request
+from flask import Flask, Blueprint, request
 from flask.views import MethodView
 
 from rucio.api.lock import get_dataset_locks_by_rse, get_dataset_locks
 from rucio.common.exception import RucioException, RSENotFound
-from rucio.common.utils import generate_http_error_flask, render_json
-from rucio.web.rest.flaskapi.v1.common import before_request, after_request, check_accept_header_wrapper_flask
+from rucio.common.utils import generate_http_error_flask
+from rucio.web.rest.flaskapi.v1.common import before_request, after_request, check_accept_header_wrapper_flask, stream_response
 
 LOGGER = getLogger("rucio.lock")
 SH = StreamHandler()
@@ -57,10 +57,7 @@ class LockByRSE(MethodView):
         did_type = request.args.get('did_type', None)
         try:
             if did_type == 'dataset':
-                data = ""
-                for lock in get_dataset_locks_by_rse(rse):
-                    data += render_json(**lock) + '\n'
-                return Response(data, content_type="application/x-json-stream")
+                return stream_response(get_dataset_locks_by_rse(rse))
             else:
                 return 'Wrong did_type specified', 500
         except RSENotFound as error:
@@ -92,10 +89,7 @@ class LockByScopeName(MethodView):
         did_type = request.args.get('did_type', None)
         try:
             if did_type == 'dataset':
-                data = ""
-                for lock in get_dataset_locks(scope, name):
-                    data += render_json(**lock) + '\n'
-                return Response(data, content_type="application/x-json-stream")
+                return stream_response(get_dataset_locks(scope, name))
             else:
                 return 'Wrong did_type specified', 500
         except RucioException as error:
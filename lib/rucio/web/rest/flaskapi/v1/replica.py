@@ -46,8 +46,8 @@ from rucio.common.exception import (AccessDenied, DataIdentifierAlreadyExists, I
                                     ResourceTemporaryUnavailable, RucioException,
                                     RSENotFound, UnsupportedOperation, ReplicaNotFound)
 from rucio.common.replica_sorter import sort_random, sort_geoip, sort_closeness, sort_dynamic, sort_ranking
-from rucio.common.utils import generate_http_error_flask, parse_response, APIEncoder, render_json_list
-from rucio.web.rest.flaskapi.v1.common import before_request, after_request, check_accept_header_wrapper_flask
+from rucio.common.utils import generate_http_error_flask, parse_response, render_json_list
+from rucio.web.rest.flaskapi.v1.common import before_request, after_request, check_accept_header_wrapper_flask, stream_response
 
 
 class Replicas(MethodView):
@@ -93,62 +93,52 @@ class Replicas(MethodView):
         if limit:
             limit = int(limit)
 
-        data = ""
-        content_type = 'application/x-json-stream'
+        client_ip = request.environ.get('HTTP_X_FORWARDED_FOR')
+        if client_ip is None:
+            client_ip = request.remote_addr
+
+        def replica_metalink(rfile):
+            dictreplica = {}
+            for rse in rfile['rses']:
+                for replica in rfile['rses'][rse]:
+                    dictreplica[replica] = rse
+            if select == 'geoip':
+                try:
+                    replicas = sort_geoip(dictreplica, client_ip)
+                except AddressNotFoundError:
+                    replicas = list(dictreplica.keys())
+            else:
+                replicas = sort_random(dictreplica)
+
+            data = ' <file name="' + rfile['name'] + '">\n'
+            data += '  <identity>' + rfile['scope'] + ':' + rfile['name'] + '</identity>\n'
+
+            if rfile['adler32'] is not None:
+                data += '  <hash type="adler32">' + rfile['adler32'] + '</hash>\n'
+            if rfile['md5'] is not None:
+                data += '  <hash type="md5">' + rfile['md5'] + '</hash>\n'
+
+            data += '  <size>' + str(rfile['bytes']) + '</size>\n'
+
+            data += '  <glfn name="/atlas/rucio/%s:%s">' % (rfile['scope'], rfile['name'])
+            data += '</glfn>\n'
+
+            idx = 0
+            for replica in replicas:
+                data += '   <url location="' + str(dictreplica[replica]) + '" priority="' + str(idx + 1) + '">' + escape(replica) + '</url>\n'
+                idx += 1
+                if limit and limit == idx:
+                    break
+            data += ' </file>\n'
+            return data
+
         try:
-            # first, set the appropriate content type, and stream the header
-            if metalink:
-                content_type = 'application/metalink4+xml'
-                data += '<?xml version="1.0" encoding="UTF-8"?>\n<metalink xmlns="urn:ietf:params:xml:ns:metalink">\n'
-
-            # then, stream the replica information
-            for rfile in list_replicas(dids=dids, schemes=schemes):
-                client_ip = request.environ.get('HTTP_X_FORWARDED_FOR')
-                if client_ip is None:
-                    client_ip = request.remote_addr
-
-                replicas = []
-                dictreplica = {}
-                for rse in rfile['rses']:
-                    for replica in rfile['rses'][rse]:
-                        replicas.append(replica)
-                        dictreplica[replica] = rse
-                if select == 'geoip':
-                    try:
-                        replicas = sort_geoip(dictreplica, client_ip)
-                    except AddressNotFoundError:
-                        pass
-                else:
-                    replicas = sort_random(dictreplica)
-                if not metalink:
-                    data += dumps(rfile) + '\n'
-                else:
-                    data += ' <file name="' + rfile['name'] + '">\n'
-                    data += '  <identity>' + rfile['scope'] + ':' + rfile['name'] + '</identity>\n'
-
-                    if rfile['adler32'] is not None:
-                        data += '  <hash type="adler32">' + rfile['adler32'] + '</hash>\n'
-                    if rfile['md5'] is not None:
-                        data += '  <hash type="md5">' + rfile['md5'] + '</hash>\n'
-
-                    data += '  <size>' + str(rfile['bytes']) + '</size>\n'
-
-                    data += '  <glfn name="/atlas/rucio/%s:%s">' % (rfile['scope'], rfile['name'])
-                    data += '</glfn>\n'
-
-                    idx = 0
-                    for replica in replicas:
-                        data += '   <url location="' + str(dictreplica[replica]) + '" priority="' + str(idx + 1) + '">' + escape(replica) + '</url>\n'
-                        idx += 1
-                        if limit and limit == idx:
-                            break
-                    data += ' </file>\n'
-
-            # don't forget to send the metalink footer
+            rfiles = list_replicas(dids=dids, schemes=schemes)
             if metalink:
-                data += '</metalink>\n'
-
-            return Response(data, content_type=content_type)
+                return stream_response(rfiles, serializer=replica_metalink, content_type='application/metalink4+xml',
+                                       header='<?xml version="1.0" encoding="UTF-8"?>\n<metalink xmlns="urn:ietf:params:xml:ns:metalink">\n',
+                                       footer='</metalink>\n')
+            return stream_response(rfiles)
         except DataIdentifierNotFound as error:
             return generate_http_error_flask(404, 'DataIdentifierNotFound', error.args[0])
         except RucioException as error:
@@ -316,7 +306,7 @@ class ListReplicas(MethodView):
             client_ip = request.remote_addr
 
         dids, schemes, select, unavailable, limit = [], None, None, False, None
-        ignore_availability, rse_expression, all_states = False, None, False
+        ignore_availability, rse_expression, all_states, domain = False, None, False, None
         client_location = {}
 
         json_data = request.data
@@ -347,68 +337,57 @@ class ListReplicas(MethodView):
         select = request.args.get('select', None)
         select = request.args.get('sort', None)
 
-        data = ""
-        content_type = 'application/x-json-stream'
+        def replica_metalink(rfile):
+            dictreplica = {}
+            for rse in rfile['rses']:
+                for replica in rfile['rses'][rse]:
+                    dictreplica[replica] = rse
+
+            data = ' <file name="' + rfile['name'] + '">\n'
+            data += '  <identity>' + rfile['scope'] + ':' + rfile['name'] + '</identity>\n'
+            if rfile['adler32'] is not None:
+                data += '  <hash type="adler32">' + rfile['adler32'] + '</hash>\n'
+            if rfile['md5'] is not None:
+                data += '  <hash type="md5">' + rfile['md5'] + '</hash>\n'
+            data += '  <size>' + str(rfile['bytes']) + '</size>\n'
+
+            data += '  <glfn name="/atlas/rucio/%s:%s">' % (rfile['scope'], rfile['name'])
+            data += '</glfn>\n'
+
+            if select == 'geoip':
+                replicas = sort_geoip(dictreplica, client_location['ip'])
+            elif select == 'closeness':
+                replicas = sort_closeness(dictreplica, client_location)
+            elif select == 'dynamic':
+                replicas = sort_dynamic(dictreplica, client_location)
+            elif select == 'ranking':
+                replicas = sort_ranking(dictreplica, client_location)
+            else:
+                replicas = sort_random(dictreplica)
+
+            idx = 0
+            for replica in replicas:
+                data += '   <url location="' + str(dictreplica[replica]) + '" priority="' + str(idx + 1) + '">' + escape(replica) + '</url>\n'
+                idx += 1
+                if limit and limit == idx:
+                    break
+            data += ' </file>\n'
+            return data
+
         try:
-            # first, set the appropriate content type, and stream the header
-            if metalink:
-                content_type = 'application/metalink4+xml'
-                data += '<?xml version="1.0" encoding="UTF-8"?>\n<metalink xmlns="urn:ietf:params:xml:ns:metalink">\n'
-
-            # then, stream the replica information
-            for rfile in list_replicas(dids=dids, schemes=schemes,
-                                       unavailable=unavailable,
-                                       request_id=request.environ.get('request_id'),
-                                       ignore_availability=ignore_availability,
-                                       all_states=all_states,
-                                       rse_expression=rse_expression,
-                                       client_location=client_location,
-                                       domain=domain):
-                replicas = []
-                dictreplica = {}
-                for rse in rfile['rses']:
-                    for replica in rfile['rses'][rse]:
-                        replicas.append(replica)
-                        dictreplica[replica] = rse
-
-                if not metalink:
-                    data += dumps(rfile, cls=APIEncoder) + '\n'
-                else:
-                    data += ' <file name="' + rfile['name'] + '">\n'
-                    data += '  <identity>' + rfile['scope'] + ':' + rfile['name'] + '</identity>\n'
-                    if rfile['adler32'] is not None:
-                        data += '  <hash type="adler32">' + rfile['adler32'] + '</hash>\n'
-                    if rfile['md5'] is not None:
-                        data += '  <hash type="md5">' + rfile['md5'] + '</hash>\n'
-                    data += '  <size>' + str(rfile['bytes']) + '</size>\n'
-
-                    data += '  <glfn name="/atlas/rucio/%s:%s">' % (rfile['scope'], rfile['name'])
-                    data += '</glfn>\n'
-
-                    if select == 'geoip':
-                        replicas = sort_geoip(dictreplica, client_location['ip'])
-                    elif select == 'closeness':
-                        replicas = sort_closeness(dictreplica, client_location)
-                    elif select == 'dynamic':
-                        replicas = sort_dynamic(dictreplica, client_location)
-                    elif select == 'ranking':
-                        replicas = sort_ranking(dictreplica, client_location)
-                    else:
-                        replicas = sort_random(dictreplica)
-
-                    idx = 0
-                    for replica in replicas:
-                        data += '   <url location="' + str(dictreplica[replica]) + '" priority="' + str(idx + 1) + '">' + escape(replica) + '</url>\n'
-                        idx += 1
-                        if limit and limit == idx:
-                            break
-                    data += ' </file>\n'
-
-            # don't forget to send the metalink footer
+            rfiles = list_replicas(dids=dids, schemes=schemes,
+                                   unavailable=unavailable,
+                                   request_id=request.environ.get('request_id'),
+                                   ignore_availability=ignore_availability,
+                                   all_states=all_states,
+                                   rse_expression=rse_expression,
+                                   client_location=client_location,
+                                   domain=domain)
             if metalink:
-                data += '</metalink>\n'
-
-            return Response(data, content_type=content_type)
+                return stream_response(rfiles, serializer=replica_metalink, content_type='application/metalink4+xml',
+                                       header='<?xml version="1.0" encoding="UTF-8"?>\n<metalink xmlns="urn:ietf:params:xml:ns:metalink">\n',
+                                       footer='</metalink>\n')
+            return stream_response(rfiles)
         except DataIdentifierNotFound as error:
             return generate_http_error_flask(404, 'DataIdentifierNotFound', error.args[0])
         except RucioException as error:
@@ -449,10 +428,7 @@ class ReplicasDIDs(MethodView):
             return generate_http_error_flask(400, 'ValueError', 'Cannot decode json parameter list')
 
         try:
-            data = ""
-            for pfn in get_did_from_pfns(pfns, rse):
-                data += dumps(pfn) + '\n'
-            return Response(data, content_type='application/x-json-string')
+            return stream_response(get_did_from_pfns(pfns, rse), content_type='application/x-json-string')
         except RucioException as error:
             return generate_http_error_flask(500, error.__class__.__name__, error.args[0])
         except Exception as error:
@@ -622,11 +598,7 @@ class BadReplicasStates(MethodView):
         except Exception as error:
             print(format_exc())
             return error, 500
-        data = ""
-        for row in result:
-            data += dumps(row, cls=APIEncoder) + '\n'
-
-        return Response(data, content_type='application/x-json-stream')
+        return stream_response(result)
 
 
 class BadReplicasSummary(MethodView):
@@ -665,11 +637,7 @@ class BadReplicasSummary(MethodView):
         except Exception as error:
             print(format_exc())
             return error, 500
-        data = ""
-        for row in result:
-            data += dumps(row, cls=APIEncoder) + '\n'
-
-        return Response(data, content_type='application/x-json-stream')
+        return stream_response(result)
 
 
 class DatasetReplicas(MethodView):
@@ -691,10 +659,7 @@ class DatasetReplicas(MethodView):
         """
         deep = request.args.get('deep', False)
         try:
-            data = ""
-            for row in list_dataset_replicas(scope=scope, name=name, deep=deep):
-                data += dumps(row, cls=APIEncoder) + '\n'
-            return Response(data, content_type='application/x-json-stream')
+            return stream_response(list_dataset_replicas(scope=scope, name=name, deep=deep))
         except RucioException as error:
             return generate_http_error_flask(500, error.__class__.__name__, error.args[0])
         except Exception as error:
@@ -719,10 +684,7 @@ class ReplicasRSE(MethodView):
         :returns: A dictionary containing all replicas on the RSE.
         """
         try:
-            data = ""
-            for row in list_datasets_per_rse(rse=rse):
-                data += dumps(row, cls=APIEncoder) + '\n'
-            return Response(data, content_type='application/x-json-stream')
+            return stream_response(list_datasets_per_rse(rse=rse))
         except RucioException as error:
             return generate_http_error_flask(500, error.__class__.__name__, error.args[0])
         except Exception as error:
@@ -44,7 +44,7 @@ from rucio.common.exception import (Duplicate, AccessDenied, RSENotFound, RucioE
                                     RSEProtocolPriorityError, InvalidRSEExpression,
                                     RSEAttributeNotFound, CounterNotFound)
 from rucio.common.utils import generate_http_error_flask, render_json, APIEncoder
-from rucio.web.rest.flaskapi.v1.common import before_request, after_request, check_accept_header_wrapper_flask
+from rucio.web.rest.flaskapi.v1.common import before_request, after_request, check_accept_header_wrapper_flask, stream_response
 from rucio.rse import rsemanager
 
 
@@ -70,11 +70,7 @@ class RSEs(MethodView):
         expression = request.args.get('name', None)
         if expression:
             try:
-                data = ""
-                for rse in parse_rse_expression(expression):
-                    item = {'rse': rse}
-                    data += render_json(**item) + '\n'
-                return Response(data, content_type="application/x-json-stream")
+                return stream_response({'rse': rse} for rse in parse_rse_expression(expression))
             except InvalidRSEExpression as error:
                 return generate_http_error_flask(400, 'InvalidRSEExpression', error.args[0])
             except InvalidObject as error:
@@ -82,10 +78,7 @@ class RSEs(MethodView):
             except RucioException as error:
                 return generate_http_error_flask(500, error.__class__.__name__, error.args[0])
         else:
-            data = ""
-            for rse in list_rses():
-                data += render_json(**rse) + '\n'
-            return Response(data, content_type="application/x-json-stream")
+            return stream_response(list_rses())
 
 
 class RSE(MethodView):
@@ -644,10 +637,7 @@ class Usage(MethodView):
             print(format_exc())
             return error, 500
 
-        data = ""
-        for u in usage:
-            data = render_json(**u) + '\n'
-        return Response(data, content_type="application/x-json-stream")
+        return stream_response(usage)
 
     def put(self, rse):
         """ Update RSE usage information.
@@ -707,10 +697,7 @@ class UsageHistory(MethodView):
         source = request.args.get('source', None)
 
         try:
-            data = ""
-            for usage in list_rse_usage_history(rse=rse, issuer=request.environ.get('issuer'), source=source):
-                data = render_json(**usage) + '\n'
-            return Response(data, content_type="application/x-json-stream")
+            return stream_response(list_rse_usage_history(rse=rse, issuer=request.environ.get('issuer'), source=source))
         except RSENotFound as error:
             return generate_http_error_flask(404, 'RSENotFound', error.args[0])
         except RucioException as error:
@@ -806,10 +793,7 @@ class RSEAccountUsageLimit(MethodView):
         """
         try:
             usage = get_rse_account_usage(rse=rse)
-            data = ""
-            for row in usage:
-                data = dumps(row, cls=APIEncoder) + '\n'
-            return Response(data, content_type="application/json")
+            return stream_response(usage, content_type='application/json')
         except RSENotFound as error:
             return generate_http_error_flask(404, 'RSENotFound', error.args[0])
         except RucioException as error:
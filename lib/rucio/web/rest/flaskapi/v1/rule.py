@@ -41,8 +41,8 @@ from rucio.common.exception import (InsufficientAccountLimit, RuleNotFound, Acce
                                     ReplicationRuleCreationTemporaryFailed, InvalidRuleWeight, StagingAreaRuleRequiresLifetime,
                                     DuplicateRule, InvalidObject, AccountNotFound, RuleReplaceFailed, ScratchDiskLifetimeConflict,
                                     ManualRuleApprovalBlocked, UnsupportedOperation)
-from rucio.common.utils import generate_http_error_flask, render_json, APIEncoder
-from rucio.web.rest.flaskapi.v1.common import before_request, after_request, check_accept_header_wrapper_flask
+from rucio.common.utils import generate_http_error_flask, render_json
+from rucio.web.rest.flaskapi.v1.common import before_request, after_request, check_accept_header_wrapper_flask, stream_response
 
 LOGGER = getLogger("rucio.rule")
 SH = StreamHandler()
@@ -170,10 +170,7 @@ class AllRule(MethodView):
             filters.update(params)
 
         try:
-            data = ""
-            for rule in list_replication_rules(filters=filters):
-                data += dumps(rule, cls=APIEncoder) + '\n'
-            return Response(data, content_type="application/x-json-stream")
+            return stream_response(list_replication_rules(filters=filters))
         except RuleNotFound as error:
             return generate_http_error_flask(404, 'RuleNotFound', error.args[0])
         except Exception as error:
@@ -350,11 +347,7 @@ class ReplicaLocks(MethodView):
         except Exception as error:
             return error, 500
 
-        data = ""
-        for lock in locks:
-            data += dumps(lock, cls=APIEncoder) + '\n'
-
-        return Response(data, content_type="application/x-json-stream")
+        return stream_response(locks)
 
 
 class ReduceRule(MethodView):
@@ -466,10 +459,7 @@ class RuleHistory(MethodView):
         except Exception as error:
             return error, 500
 
-        data = ""
-        for hist in history:
-            data += dumps(hist, cls=APIEncoder) + '\n'
-        return Response(data, content_type="application/x-json-stream")
+        return stream_response(history)
 
 
 class RuleHistoryFull(MethodView):
@@ -494,10 +484,7 @@ class RuleHistoryFull(MethodView):
         except Exception as error:
             return error, 500
 
-        data = ""
-        for hist in history:
-            data += dumps(hist, cls=APIEncoder) + '\n'
-        return Response(data, content_type="application/x-json-stream")
+        return stream_response(history)
 
 
 class RuleAnalysis(MethodView):
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# Copyright 2019 CERN for the benefit of the ATLAS collaboration.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# PY3K COMPATIBLE
+
+import json
+
+from flask import Flask, Blueprint, Response, request
+from flask.views import MethodView
+
+from rucio.api.sql_profile import get_sql_profile
+from rucio.common.exception import AccessDenied, ConfigNotFound
+from rucio.common.utils import APIEncoder, generate_http_error_flask
+from rucio.web.rest.flaskapi.v1.common import before_request, after_request, check_accept_header_wrapper_flask
+
+
+class SQLProfile(MethodView):
+    """ REST API for the SQL profile. """
+
+    @check_accept_header_wrapper_flask(['application/json'])
+    def get(self):
+        """
+        Dump the SQL profile of the server process: the statistics of the statements by session function
+        and by endpoint, the slowest statements and the N+1 patterns.
+
+        .. :quickref: SQLProfile; Dump the SQL profile.
+
+        :resheader Content-Type: application/json
+        :status 200: OK.
+        :status 401: Invalid Auth Token.
+        :status 404: SQL profiling not enabled.
+        :status 406: Not Acceptable.
+        :returns: The SQL profile.
+        """
+        try:
+            return Response(json.dumps(get_sql_profile(issuer=request.environ.get('issuer')), cls=APIEncoder), content_type="application/json")
+        except AccessDenied as error:
+            return generate_http_error_flask(401, 'AccessDenied', error.args[0])
+        except ConfigNotFound as error:
+            return generate_http_error_flask(404, 'ConfigNotFound', error.args[0])
+
+
+"""----------------------
+   Web service startup
+----------------------"""
+bp = Blueprint('sql_profile', __name__)
+
+sql_profile_view = SQLProfile.as_view('sql_profile')
+bp.add_url_rule('/', view_func=sql_profile_view, methods=['get', ])
+
+application = Flask(__name__)
+application.register_blueprint(bp)
+application.before_request(before_request)
+application.after_request(after_request)
+
+
+def make_doc():
+    """ Only used for sphinx documentation to add the prefix """
+    doc_app = Flask(__name__)
+    doc_app.register_blueprint(bp, url_prefix='/sql_profile')
+    return doc_app
+
+
+if __name__ == "__main__":
+    application.run()
@@ -21,7 +21,7 @@
 #
 # PY3K COMPATIBLE
 
-from json import dumps, loads
+from json import loads
 
 from flask import Flask, Blueprint, Response, request
 from flask.views import MethodView
@@ -29,8 +29,8 @@ from flask.views import MethodView
 from rucio.api.rule import list_replication_rules
 from rucio.api.subscription import list_subscriptions, add_subscription, update_subscription, list_subscription_rule_states, get_subscription_by_id
 from rucio.common.exception import InvalidObject, RucioException, SubscriptionDuplicate, SubscriptionNotFound, RuleNotFound, AccessDenied
-from rucio.common.utils import generate_http_error_flask, APIEncoder, render_json
-from rucio.web.rest.flaskapi.v1.common import before_request, after_request, check_accept_header_wrapper_flask
+from rucio.common.utils import generate_http_error_flask, render_json
+from rucio.web.rest.flaskapi.v1.common import before_request, after_request, check_accept_header_wrapper_flask, stream_response
 
 
 class Subscription(MethodView):
@@ -54,10 +54,7 @@ class Subscription(MethodView):
         :returns: Line separated list of dictionaries with subscription information.
         """
         try:
-            data = ""
-            for subscription in list_subscriptions(name=name, account=account):
-                data += dumps(subscription, cls=APIEncoder) + '\n'
-            return Response(data, content_type="application/x-json-stream")
+            return stream_response(list_subscriptions(name=name, account=account))
         except SubscriptionNotFound as error:
             return generate_http_error_flask(404, 'SubscriptionNotFound', error.args[0])
         except Exception as error:
@@ -176,15 +173,13 @@ class Rules(MethodView):
         state = request.args.get('state', None)
         try:
             subscriptions = [subscription['id'] for subscription in list_subscriptions(name=name, account=account)]
-            data = ""
+            rules = []
             if len(subscriptions) > 0:
                 if state:
-                    for rule in list_replication_rules({'subscription_id': subscriptions[0], 'state': state}):
-                        data += dumps(rule, cls=APIEncoder) + '\n'
+                    rules = list_replication_rules({'subscription_id': subscriptions[0], 'state': state})
                 else:
-                    for rule in list_replication_rules({'subscription_id': subscriptions[0]}):
-                        data += dumps(rule, cls=APIEncoder) + '\n'
-            return Response(data, content_type='application/x-json-stream')
+                    rules = list_replication_rules({'subscription_id': subscriptions[0]})
+            return stream_response(rules)
         except RuleNotFound as error:
             return generate_http_error_flask(404, 'RuleNotFound', error.args[0])
         except SubscriptionNotFound as error:
@@ -214,10 +209,7 @@ class States(MethodView):
         :returns: Line separated list of dictionaries with rule information.
         """
         try:
-            data = ""
-            for row in list_subscription_rule_states(account=account):
-                data += dumps(row, cls=APIEncoder) + '\n'
-            return Response(data, content_type='application/x-json-stream')
+            return stream_response(list_subscription_rule_states(account=account))
         except RucioException as error:
             return generate_http_error_flask(500, error.__class__.__name__, error.args[0])
         except Exception as error:
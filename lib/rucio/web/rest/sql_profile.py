@@ -0,0 +1 @@
+webpy/v1/sql_profile.py
\ No newline at end of file
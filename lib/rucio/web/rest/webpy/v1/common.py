@@ -30,7 +30,8 @@ from web.webapi import Created, HTTPError, OK, seeother
 from rucio.api.authentication import validate_auth_token
 from rucio.common.exception import RucioException
 from rucio.common.utils import generate_http_error, generate_uuid
-from rucio.core.monitor import record_timer
+from rucio.core.monitor import record_timer, start_prometheus_server
+from rucio.db.sqla.session import PROFILER
 
 
 def rucio_loadhook():
@@ -45,6 +46,12 @@ def rucio_loadhook():
     if ctx.env.get('REQUEST_METHOD') == 'OPTIONS':
         raise OK
 
+    # Expose the metrics of the process once it serves requests
+    start_prometheus_server()
+
+    if PROFILER:
+        PROFILER.begin_request('%s %s' % (ctx.env.get('REQUEST_METHOD'), ctx.env.get('SCRIPT_NAME')))
+
     if ctx.env.get('REQUEST_METHOD') == 'GET':
         header('Cache-Control', 'no-cache, no-store, max-age=0, must-revalidate')
         header('Cache-Control', 'post-check=0, pre-check=0', False)
@@ -85,6 +92,8 @@ def rucio_unloadhook():
         time_serie_name += '.list'
     time_serie_name = time_serie_name.replace('..', '.').lower()
     record_timer(time_serie_name, duration * 1000)
+    if PROFILER:
+        PROFILER.end_request()
 
 
 def load_json_data():
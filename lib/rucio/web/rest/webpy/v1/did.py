@@ -39,7 +39,7 @@ from rucio.api.did import (add_did, add_dids, list_content, list_content_history
                            get_metadata, set_status, attach_dids, detach_dids,
                            attach_dids_to_dids, get_dataset_by_guid, list_parent_dids,
                            create_did_sample, list_new_dids, resurrect, get_did_meta,
-                           add_did_meta, list_dids_by_meta, delete_did_meta)
+                           add_did_meta, list_dids_by_meta, delete_did_meta, get_metadata_bulk)
 from rucio.api.rule import list_replication_rules, list_associated_replication_rules_for_file
 from rucio.common.exception import (ScopeNotFound, DataIdentifierNotFound,
                                     DataIdentifierAlreadyExists, DuplicateContent,
@@ -72,6 +72,7 @@ URLS = (
     '/attachments', 'Attachments',
     '/new', 'NewDIDs',
     '/resurrect', 'Resurrect',
+    '/bulkmeta', 'BulkMeta',
     '/list_dids_by_meta', 'ListByMeta',
 )
 
@@ -136,6 +137,8 @@ class Search(RucioController):
         filters = {}
         long = False
         recursive = False
+        limit = None
+        marker = None
         if ctx.query:
             params = parse_qs(ctx.query[1:])
             for k, v in params.items():
@@ -145,11 +148,15 @@ class Search(RucioController):
                     long = v[0] == '1'
                 elif k == 'recursive':
                     recursive = v[0] == 'True'
+                elif k == 'limit':
+                    limit = int(v[0])
+                elif k == 'marker':
+                    marker = v[0]
                 else:
                     filters[k] = v[0]
 
         try:
-            for did in list_dids(scope=scope, filters=filters, type=type, long=long, recursive=recursive):
+            for did in list_dids(scope=scope, filters=filters, type=type, long=long, recursive=recursive, limit=limit, marker=marker):
                 yield dumps(did) + '\n'
         except UnsupportedOperation as error:
             raise generate_http_error(409, 'UnsupportedOperation', error.args[0])
@@ -650,6 +657,40 @@ class Meta(RucioController):
         raise Created()
 
 
+class BulkMeta(RucioController):
+
+    @check_accept_header_wrapper(['application/x-json-stream'])
+    def POST(self):
+        """
+        List the meta of a list of data identifiers.
+
+        HTTP Success:
+            200 OK
+
+        HTTP Error:
+            400 Bad Request
+            401 Unauthorized
+            406 Not Acceptable
+            500 InternalError
+
+        :returns: A dictionary containing all meta, for each existing data identifier.
+        """
+        header('Content-Type', 'application/x-json-stream')
+        json_data = data()
+        try:
+            dids = loads(json_data)['dids']
+        except (ValueError, KeyError):
+            raise generate_http_error(400, 'ValueError', 'Cannot decode json parameter list')
+        try:
+            for meta in get_metadata_bulk(dids):
+                yield dumps(meta, cls=APIEncoder) + '\n'
+        except RucioException as error:
+            raise generate_http_error(500, error.__class__.__name__, error.args[0])
+        except Exception as error:
+            print(format_exc())
+            raise InternalError(error)
+
+
 class Rules(RucioController):
 
     @check_accept_header_wrapper(['application/x-json-stream'])
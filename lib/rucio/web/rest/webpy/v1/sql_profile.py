@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# Copyright 2019 CERN for the benefit of the ATLAS collaboration.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# PY3K COMPATIBLE
+
+import json
+
+from web import application, ctx, loadhook, header
+
+from rucio.api.sql_profile import get_sql_profile
+from rucio.common.exception import AccessDenied, ConfigNotFound
+from rucio.common.utils import APIEncoder, generate_http_error
+from rucio.web.rest.common import rucio_loadhook, RucioController, exception_wrapper, check_accept_header_wrapper
+
+
+URLS = ('/?$', 'SQLProfile')
+
+
+class SQLProfile(RucioController):
+    """ REST API for the SQL profile. """
+
+    @exception_wrapper
+    @check_accept_header_wrapper(['application/json'])
+    def GET(self):
+        """
+        Dump the SQL profile of the server process: the statistics of the statements by session function
+        and by endpoint, the slowest statements and the N+1 patterns.
+
+        HTTP Success:
+            200 OK
+
+        HTTP Error:
+            401 Unauthorized
+            404 Not Found
+            406 Not Acceptable
+        """
+
+        header('Content-Type', 'application/json')
+        try:
+            return json.dumps(get_sql_profile(issuer=ctx.env.get('issuer')), cls=APIEncoder)
+        except AccessDenied as error:
+            raise generate_http_error(401, 'AccessDenied', error.args[0])
+        except ConfigNotFound as error:
+            raise generate_http_error(404, 'ConfigNotFound', error.args[0])
+
+
+"""----------------------
+   Web service startup
+----------------------"""
+
+APP = application(URLS, globals())
+APP.add_processor(loadhook(rucio_loadhook))
+application = APP.wsgifunc()
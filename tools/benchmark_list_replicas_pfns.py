@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#                       http://www.apache.org/licenses/LICENSE-2.0
+#
+# PY3K COMPATIBLE
+
+"""
+Benchmark of the PFN construction of list_replicas on synthetic replicas.
+
+Compares the former row by row construction (one lfns2pfns call and the RSE settings
+evaluation per replica) with the bulk construction per RSE of rucio.core.replica.
+No database access is done: the RSE settings are synthetic and the per RSE context
+is resolved upfront, so only the in-process cost is measured.
+
+Usage: benchmark_list_replicas_pfns.py [--replicas 1000000] [--rses 100]
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+
+from copy import deepcopy
+
+from rucio.core.replica import LIST_REPLICAS_CHUNK_SIZE, _iter_replicas_with_pfns
+from rucio.rse import rsemanager as rsemgr
+
+
+def rse_settings(index):
+    protocol = {'scheme': 'root', 'hostname': 'door%03d.example.org' % index, 'port': 1094,
+                'prefix': '/atlas/rucio', 'impl': 'rucio.rse.protocols.protocol.RSEProtocol',
+                'extended_attributes': None,
+                'domains': {'lan': {'read': 1, 'write': 1, 'delete': 1},
+                            'wan': {'read': 1, 'write': 1, 'delete': 1, 'third_party_copy': 1}}}
+    return {'id': '%032x' % index, 'rse': 'MOCK_%03d' % index, 'rse_type': 'DISK', 'deterministic': True,
+            'volatile': False, 'staging_area': False, 'domain': ['lan', 'wan'], 'lfn2pfn_algorithm': 'hash',
+            'availability_read': True, 'availability_write': True, 'availability_delete': True,
+            'credentials': None, 'protocols': [protocol]}
+
+
+def synthetic_replicas(nb_replicas, nb_rses):
+    for index in range(nb_replicas):
+        yield ('user.jdoe', 'file.%09d' % (index // 2), 1024, None, 'deadbeef', None, 'AVAILABLE',
+               'MOCK_%03d' % (index % nb_rses), 'DISK', False)
+
+
+def per_row(settings, nb_replicas, nb_rses):
+    protocols = {}
+    count = 0
+    for scope, name, bytes, md5, adler32, path, state, rse, rse_type, volatile in synthetic_replicas(nb_replicas, nb_rses):
+        domain = deepcopy(None)
+        rse_info = settings[rse]
+        rse_info['priority_wan'] = {p['scheme']: p['domains']['wan']['read'] for p in rse_info['protocols'] if p['domains']['wan']['read'] > 0}
+        rse_info['priority_lan'] = {p['scheme']: p['domains']['lan']['read'] for p in rse_info['protocols'] if p['domains']['lan']['read'] > 0}
+        domain = 'wan' if domain is None else domain
+        if rse not in protocols:
+            protocols[rse] = [(domain, rsemgr.create_protocol(rse_settings=rse_info, operation='read', scheme='root', domain=domain), 1)]
+        for tmp_domain, protocol, priority in protocols[rse]:
+            path = protocol._get_path(scope, name)
+            list(protocol.lfns2pfns(lfns={'scope': scope, 'name': name, 'path': path}).values())[0]
+            count += 1
+    return count
+
+
+def bulk(settings, nb_replicas, nb_rses):
+    rse_context = {}
+    for rse, rse_info in settings.items():
+        rse_context[rse] = {'protocols': [('wan', rsemgr.create_protocol(rse_settings=rse_info, operation='read', scheme='root', domain='wan'), 1)],
+                            'root_proxy_internal': None, 'sign_url': None}
+    count = 0
+    for replica, pfns in _iter_replicas_with_pfns(replicas=synthetic_replicas(nb_replicas, nb_rses), show_pfns=True,
+                                                  rse_domain=lambda rse: 'wan', schemes=None, client_location=None,
+                                                  sign_urls=False, signature_lifetime=None, rse_context=rse_context,
+                                                  pfns_cache={}, session=None):
+        count += len(pfns)
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the PFN construction of list_replicas.')
+    parser.add_argument('--replicas', type=int, default=1000000, help='Number of synthetic replicas')
+    parser.add_argument('--rses', type=int, default=100, help='Number of synthetic RSEs')
+    args = parser.parse_args()
+
+    settings = dict(('MOCK_%03d' % index, rse_settings(index)) for index in range(args.rses))
+    print('%d replicas over %d RSEs, chunks of %d rows' % (args.replicas, args.rses, LIST_REPLICAS_CHUNK_SIZE))
+    for label, function in (('per row', per_row), ('bulk', bulk)):
+        start = time.time()
+        count = function(settings, args.replicas, args.rses)
+        duration = time.time() - start
+        print('%-8s %d PFNs in %.2fs: %d rows/s' % (label, count, duration, args.replicas / duration))
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# Copyright European Organization for Nuclear Research (CERN)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# You may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#                       http://www.apache.org/licenses/LICENSE-2.0
+#
+# PY3K COMPATIBLE
+
+"""
+Benchmark of rucio.core.request.queue_requests on synthetic transfer requests.
+
+The files and their replicas, used as sources, are created in the configured database.
+A part of the requests is queued upfront so that the duplicate detection has work to do,
+then all the requests are queued in one call. Everything is done in one transaction
+which is rolled back at the end, so the database is left unchanged.
+
+Usage: benchmark_queue_requests.py [--requests 100000] [--existing 10000] [--rse MOCK]
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+
+from rucio.common.utils import chunks, generate_uuid
+from rucio.core.request import queue_requests
+from rucio.core.rse import get_rse_id
+from rucio.db.sqla import models
+from rucio.db.sqla.constants import DIDType, ReplicaState, RequestType
+from rucio.db.sqla.session import get_session
+
+
+def synthetic_requests(names, rse_id, activity):
+    return [{'dest_rse_id': rse_id,
+             'request_type': RequestType.TRANSFER,
+             'scope': 'mock',
+             'name': name,
+             'rule_id': generate_uuid(),
+             'retry_count': 0,
+             'attributes': {'activity': activity, 'bytes': 1024, 'md5': None, 'adler32': 'deadbeef'},
+             'sources': [{'rse_id': rse_id, 'ranking': 0, 'bytes': 1024, 'url': 'root://door.example.org/%s' % name, 'is_using': False}]}
+            for name in names]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of queue_requests.')
+    parser.add_argument('--requests', type=int, default=100000, help='Number of requests to queue')
+    parser.add_argument('--existing', type=int, default=10000, help='Number of requests already queued before the benchmark')
+    parser.add_argument('--rse', default='MOCK', help='Destination RSE')
+    parser.add_argument('--activity', default='User Subscription', help='Activity of the requests')
+    args = parser.parse_args()
+
+    session = get_session()
+    rse_id = get_rse_id(args.rse, session=session)
+    names = ['benchmark_%s' % generate_uuid() for _ in range(args.requests)]
+    try:
+        for names_chunk in chunks(names, 1000):
+            session.bulk_insert_mappings(models.DataIdentifier, [{'scope': 'mock', 'name': name, 'account': 'root', 'did_type': DIDType.FILE,
+                                                                  'bytes': 1024, 'adler32': 'deadbeef'} for name in names_chunk])
+            session.bulk_insert_mappings(models.RSEFileAssociation, [{'rse_id': rse_id, 'scope': 'mock', 'name': name, 'bytes': 1024, 'adler32': 'deadbeef',
+                                                                      'state': ReplicaState.AVAILABLE} for name in names_chunk])
+        queue_requests(synthetic_requests(names[:args.existing], rse_id, args.activity), session=session)
+
+        start = time.time()
+        request_ids = queue_requests(synthetic_requests(names, rse_id, args.activity), session=session)
+        duration = time.time() - start
+        print('%d requests (%d already queued) in %.2fs: %d requests/s, %d queued' % (args.requests, args.existing, duration, args.requests / duration, len(request_ids)))
+    finally:
+        session.rollback()